@@ -0,0 +1,115 @@
+# File: /opt/access_control/bench/check_relock.py
+# Verifiche di sicurezza sui relè tramite RelaySession: riblocco e spegnimento degli impulsi
+#
+# Uso (dalla radice del progetto):
+#   python -m bench.check_relock
+#
+# Con la scheda relè simulata apre il cancello come fanno main.actuate_access e
+# gli endpoint web (comando in coda alla sessione, scritto in batch) e controlla
+# che il riblocco sia in attesa sullo scheduler e che il relè del blocco
+# magnetico torni acceso. Poi accende relè a impulso (apply_relays) con la
+# coda della sessione occupata più a lungo dell'impulso e controlla che si
+# spengano. Esce con codice 1 se un relè resta nello stato sbagliato.
+
+import os
+import sys
+import time
+import logging
+from typing import List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(PROJECT_ROOT, 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from bench.fake_rly08 import FakeUSBRLY08
+
+logger = logging.getLogger('bench')
+
+DURATA_APERTURA = 0.3
+DURATA_IMPULSO = 0.1
+COMANDI_IN_CODA = 3
+RIPETIZIONI_IMPULSO = 10
+
+
+def verifica_riblocco(durata: float = DURATA_APERTURA) -> List[str]:
+    """Errori riscontrati (lista vuota se il blocco viene riattivato)"""
+    from hardware.relay_session import RelaySession
+    from hardware.usb_rly08_controller import RelayChannel
+
+    errori = []
+    bit_blocco = 1 << (RelayChannel.MAGNETIC_LOCK.value - 1)
+    fake_relay = FakeUSBRLY08().start()
+    session = RelaySession(fake_relay.path)
+    session.start()
+    try:
+        if not session.ensure_connected():
+            return ["impossibile connettersi al USB-RLY08 simulato"]
+
+        # Blocco inserito, come a riposo
+        session.call(lambda c: c.apply_states({RelayChannel.MAGNETIC_LOCK: True}, auto_off=False))
+        session.open_gate(durata).result(5.0)
+
+        if fake_relay.stato & bit_blocco:
+            errori.append("blocco magnetico non disattivato dall'apertura")
+        in_attesa = [a['descrizione'] for a in session.controller.scheduler.pending()
+                     if a['canale'] == session.controller._channel_key(RelayChannel.MAGNETIC_LOCK)]
+        if "MAGNETIC_LOCK riblocco" not in in_attesa:
+            errori.append(f"riblocco non in attesa dopo open_gate (in attesa: {in_attesa})")
+
+        # Riblocco a durata + 1s di sicurezza, poi un tick dello scheduler
+        time.sleep(durata + 1.5)
+        if not fake_relay.stato & bit_blocco:
+            errori.append(f"blocco magnetico non riattivato (stato {fake_relay.stato:08b}, "
+                          f"comandi {[c for _, c, _ in fake_relay.comandi]})")
+    finally:
+        session.close()
+        fake_relay.stop()
+    return errori
+
+
+def verifica_impulso(durata: float = DURATA_IMPULSO, ripetizioni: int = RIPETIZIONI_IMPULSO) -> List[str]:
+    """Errori riscontrati (lista vuota se ogni impulso si spegne anche con la coda occupata)"""
+    from hardware.relay_session import RelaySession
+    from hardware.usb_rly08_controller import RelayChannel
+
+    errori = []
+    canale = RelayChannel.BUZZER.value
+    bit = 1 << (canale - 1)
+    fake_relay = FakeUSBRLY08().start()
+    session = RelaySession(fake_relay.path)
+    session.start()
+    try:
+        if not session.ensure_connected():
+            return ["impossibile connettersi al USB-RLY08 simulato"]
+
+        for prova in range(ripetizioni):
+            # Comandi lenti davanti all'accensione: la coda resta occupata più dell'impulso
+            for _ in range(COMANDI_IN_CODA):
+                session.submit(lambda c: time.sleep(0.05))
+            session.apply_relays({canale: durata}).result(5.0)
+            time.sleep(durata + 0.5)
+            if fake_relay.stato & bit:
+                errori.append(f"prova {prova + 1}: relè {canale} rimasto acceso dopo l'impulso di {durata}s")
+    finally:
+        session.close()
+        fake_relay.stop()
+    return errori
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    errori = verifica_riblocco() + verifica_impulso()
+    for errore in errori:
+        print(f"❌ {errore}")
+    if errori:
+        return 1
+    print("✅ Riblocco del blocco magnetico dopo open_gate e spegnimento degli impulsi verificati")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# File: /opt/access_control/bench/fake_reader.py
+# Lettore tessere simulato che inietta CF a frequenza configurabile
+
+import time
+import logging
+import threading
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FakeCardReader:
+    """Stessa interfaccia di CardReader per start_continuous_reading/stop.
+
+    Inietta i CF in sequenza a `frequenza` letture al secondo; prima di ogni
+    callback attende `durata_lettura` secondi (tempo di lettura APDU simulato)
+    e la espone in last_read_duration come il lettore reale. Gli istanti di
+    iniezione (time.perf_counter, presa tessera) sono in self.iniezioni.
+    """
+
+    def __init__(self, cfs: List[str], frequenza: float = 10.0, durata_lettura: float = 0.0):
+        self.cfs = list(cfs)
+        self.frequenza = frequenza
+        self.durata_lettura = durata_lettura
+        self.last_read_duration: Optional[float] = None
+        self.iniezioni: List[float] = []
+        self.is_running = False
+        self._stop_event = threading.Event()
+
+    def start_continuous_reading(self, callback: Callable[[str], None]):
+        """Chiama callback per ogni CF, in questo thread, rispettando la frequenza"""
+        self.is_running = True
+        intervallo = 1.0 / self.frequenza if self.frequenza > 0 else 0.0
+        prossima = time.perf_counter()
+        for cf in self.cfs:
+            if self._stop_event.is_set():
+                break
+            attesa = prossima - time.perf_counter()
+            if attesa > 0:
+                time.sleep(attesa)
+            prossima += intervallo
+
+            self.iniezioni.append(time.perf_counter())
+            if self.durata_lettura:
+                time.sleep(self.durata_lettura)
+            self.last_read_duration = self.durata_lettura or None
+            try:
+                callback(cf)
+            except Exception as e:
+                logger.error(f"❌ Errore callback lettura simulata: {e}")
+        self.is_running = False
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,100 @@
+# File: /opt/access_control/bench/fake_rly08.py
+# USB-RLY08 simulato su pseudo-terminale per benchmark senza scheda relè
+
+import os
+import tty
+import time
+import select
+import logging
+import threading
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODULE_ID = 8
+SW_VERSION = 4
+
+
+class FakeUSBRLY08:
+    """Risponde sul lato master di un pty come la scheda USB-RLY08.
+
+    Il controller reale apre il lato slave (self.path) con pyserial: versione
+    (90), lettura stato (91), stato completo (92 + byte), singoli relè
+    (100-108 / 110-118). Ogni comando ricevuto viene registrato con il suo
+    istante (time.perf_counter) per misurare la latenza tessera → relè.
+    """
+
+    def __init__(self, latenza_risposta: float = 0.0):
+        self.latenza_risposta = latenza_risposta
+        self.stato = 0
+        self.comandi: List[Tuple[float, int, int]] = []  # (istante, comando, stato dopo)
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'FakeUSBRLY08':
+        self._thread = threading.Thread(target=self._run, name='fake-usb-rly08', daemon=True)
+        self._thread.start()
+        logger.info(f"🧪 USB-RLY08 simulato su {self.path}")
+        return self
+
+    def _reply(self, data: bytes):
+        if self.latenza_risposta:
+            time.sleep(self.latenza_risposta)
+        os.write(self._master, data)
+
+    def _run(self):
+        attende_stato = False
+        while not self._stop_event.is_set():
+            pronti, _, _ = select.select([self._master], [], [], 0.1)
+            if not pronti:
+                continue
+            try:
+                data = os.read(self._master, 64)
+            except OSError:
+                break
+            istante = time.perf_counter()
+            for byte in data:
+                if attende_stato:
+                    attende_stato = False
+                    self._set(istante, 92, byte)
+                elif byte == 90:
+                    self._reply(bytes([MODULE_ID, SW_VERSION]))
+                elif byte == 91:
+                    self._reply(bytes([self.stato]))
+                elif byte == 92:
+                    attende_stato = True
+                elif byte == 100:
+                    self._set(istante, byte, 0xFF)
+                elif 101 <= byte <= 108:
+                    self._set(istante, byte, self.stato | (1 << (byte - 101)))
+                elif byte == 110:
+                    self._set(istante, byte, 0)
+                elif 111 <= byte <= 118:
+                    self._set(istante, byte, self.stato & ~(1 << (byte - 111)))
+
+    def _set(self, istante: float, comando: int, stato: int):
+        with self._lock:
+            self.stato = stato & 0xFF
+            self.comandi.append((istante, comando, self.stato))
+
+    def primo_comando_dopo(self, istante: float) -> float:
+        """Istante del primo comando relè ricevuto dopo istante (None se nessuno)"""
+        with self._lock:
+            for t, _, _ in self.comandi:
+                if t >= istante:
+                    return t
+        return None
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -0,0 +1,414 @@
+# File: /opt/access_control/bench/run_bench.py
+# Benchmark latenza tessera → cancello con lettore, scheda relè e database simulati
+#
+# Uso (dalla radice del progetto):
+#   python -m bench.run_bench --output risultati.json
+#   python -m bench.run_bench --scenari web --letture 500 --frequenza 20 --confronta baseline.json
+#
+# Il database di produzione simulato (50k utenti, 1M righe log) viene creato una
+# volta in --db e copiato in una directory temporanea ad ogni esecuzione, così
+# contatori e log del benchmark non si accumulano tra una release e l'altra.
+
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import logging
+import platform
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(PROJECT_ROOT, 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from bench.fake_reader import FakeCardReader
+from bench.fake_rly08 import FakeUSBRLY08
+
+logger = logging.getLogger('bench')
+
+FORMATO_RISULTATI = 1
+STADI_PIPELINE = ('lettura', 'decisione', 'attuazione', 'persistenza', 'notifica')
+PERCENTILI = (50, 95, 99)
+
+
+# ===== STATISTICHE =====
+
+def riepilogo(valori: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 (nearest-rank), media e massimo in millisecondi"""
+    if not valori:
+        return {'n': 0}
+    ordinati = sorted(valori)
+    n = len(ordinati)
+    risultato = {'n': n}
+    for p in PERCENTILI:
+        risultato[f'p{p}_ms'] = round(ordinati[max(0, math.ceil(p / 100 * n) - 1)] * 1000, 3)
+    risultato['media_ms'] = round(sum(ordinati) / n * 1000, 3)
+    risultato['max_ms'] = round(ordinati[-1] * 1000, 3)
+    return risultato
+
+
+class Misure:
+    """Durate per stadio di uno scenario, indicizzate per CF"""
+
+    def __init__(self, fake_relay: FakeUSBRLY08):
+        self.fake_relay = fake_relay
+        self.stadi: Dict[str, List[float]] = {}
+        self.esiti: Counter = Counter()
+        self.iniezione: Dict[str, float] = {}
+        self.inizio_attuazione: Dict[str, float] = {}
+
+    def aggiungi(self, stadio: str, durata: Optional[float]):
+        if durata is not None:
+            self.stadi.setdefault(stadio, []).append(durata)
+
+    def attuatore(self, attuatore: Callable) -> Callable:
+        """Avvolge lo stadio attuazione per marcare l'istante del comando relè"""
+        def wrapped(decision):
+            self.inizio_attuazione[decision.codice_fiscale] = time.perf_counter()
+            return attuatore(decision)
+        return wrapped
+
+    def osservatore(self, decision, timings):
+        """Registrato su TapPipeline.osservatori: riceve gli stadi completi"""
+        self.esiti[decision.tipo_accesso] += 1
+        for stadio in STADI_PIPELINE:
+            self.aggiungi(stadio, getattr(timings, stadio))
+        self.aggiungi('fino_al_cancello', timings.fino_al_cancello)
+        iniezione = self.iniezione.get(decision.codice_fiscale)
+        if iniezione is not None:
+            self.aggiungi('totale', time.perf_counter() - iniezione)
+
+    def calcola_seriale(self):
+        """Latenze misurate sul lato pty: primo comando ricevuto dopo l'attuazione"""
+        for cf, inizio in self.inizio_attuazione.items():
+            ricevuto = self.fake_relay.primo_comando_dopo(inizio)
+            if ricevuto is None:
+                continue
+            self.aggiungi('rele_seriale', ricevuto - inizio)
+            iniezione = self.iniezione.get(cf)
+            if iniezione is not None:
+                self.aggiungi('tessera_rele', ricevuto - iniezione)
+
+    def to_dict(self) -> Dict:
+        return {
+            'letture': sum(self.esiti.values()) or len(next(iter(self.stadi.values()), [])),
+            'esiti': dict(self.esiti),
+            'stadi': {stadio: riepilogo(valori) for stadio, valori in self.stadi.items()}
+        }
+
+
+# ===== PREPARAZIONE =====
+
+def prepara_database(db_seed: str, db_path: str, utenti: int, log: int, rigenera: bool):
+    """Crea (se serve) il database seme e lo copia in db_path"""
+    from database.pool import copy_database
+
+    if rigenera or not os.path.exists(db_seed):
+        logger.info(f"🌱 Creazione database benchmark ({utenti} utenti, {log} righe log)...")
+        # Processo separato: i singleton (indice, contatori) non vedono il DB vuoto.
+        # Creato in una directory temporanea e copiato in un solo file: accanto
+        # al seme non restano -wal/-shm né altri file del processo di seed
+        temporanea = tempfile.mkdtemp(prefix='access_seed_')
+        try:
+            creato = os.path.join(temporanea, 'access.db')
+            subprocess.run(
+                [sys.executable, os.path.join(BENCH_DIR, 'seed_db.py'), creato,
+                 '--utenti', str(utenti), '--log', str(log)],
+                check=True
+            )
+            if os.path.exists(db_seed):
+                os.remove(db_seed)
+            copy_database(creato, db_seed)
+        finally:
+            shutil.rmtree(temporanea, ignore_errors=True)
+    shutil.copy2(db_seed, db_path)
+
+
+def sequenza_cf(utenti: List[str], n: int, quota_sconosciuti: float, rng: random.Random) -> List[str]:
+    """CF distinti (niente debounce/blocco ripetizioni) con una quota di tessere sconosciute"""
+    from bench.seed_db import genera_cf
+
+    noti = set(utenti)
+    sequenza = []
+    for cf in rng.sample(utenti, min(n, len(utenti))):
+        if rng.random() < quota_sconosciuti:
+            sconosciuto = genera_cf(rng)
+            while sconosciuto in noti:
+                sconosciuto = genera_cf(rng)
+            sequenza.append(sconosciuto)
+        else:
+            sequenza.append(cf)
+    return sequenza
+
+
+@contextlib.contextmanager
+def silenzioso(attivo: bool = True):
+    """Sopprime l'output a console di main.py durante le misure"""
+    if not attivo:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# ===== SCENARI =====
+
+def scenario_process_cf(cfs: List[str], fake_relay: FakeUSBRLY08) -> Dict:
+    """web_api.process_codice_fiscale: decisione completa con log, chiamata diretta"""
+    import api.web_api as web_api
+
+    misure = Misure(fake_relay)
+    for cf in cfs:
+        start = time.perf_counter()
+        result = web_api.process_codice_fiscale(cf)
+        misure.aggiungi('process_codice_fiscale', time.perf_counter() - start)
+        misure.esiti[result.get('tipo_accesso')] += 1
+    return misure.to_dict()
+
+
+def scenario_web(cfs: List[str], fake_relay: FakeUSBRLY08, frequenza: float, durata_lettura: float) -> Dict:
+    """web_api.handle_card_read alimentato dal lettore simulato"""
+    import api.web_api as web_api
+    from core.access_engine import get_access_engine
+    from core.tap_pipeline import TapPipeline
+
+    misure = Misure(fake_relay)
+    pipeline = TapPipeline(get_access_engine(web_api.DB_PATH), misure.attuatore(web_api.actuate_card_read))
+    pipeline.osservatori.append(misure.osservatore)
+    web_api.tap_pipeline = pipeline
+
+    reader = FakeCardReader(cfs, frequenza, durata_lettura)
+    web_api.card_reader = reader
+
+    def callback(cf):
+        misure.iniezione[cf] = reader.iniezioni[-1]
+        web_api.handle_card_read(cf)
+
+    reader.start_continuous_reading(callback)
+    pipeline.shutdown(wait=True)
+    time.sleep(0.5)  # ultimi comandi relè in volo
+    misure.calcola_seriale()
+    web_api.tap_pipeline = None
+    return misure.to_dict()
+
+
+def scenario_main(cfs: List[str], fake_relay: FakeUSBRLY08, db_path: str,
+                  frequenza: float, durata_lettura: float, quiet: bool) -> Dict:
+    """AccessControlSystem.handle_cf con sessione relè sul pty"""
+    with silenzioso(quiet):
+        import main as main_module
+        from core.access_engine import get_access_engine
+        from core.tap_pipeline import TapPipeline
+        from database.database_manager import DatabaseManager
+        from hardware.relay_session import get_relay_session
+
+        system = main_module.AccessControlSystem()
+    # Nessun limite di frequenza: il benchmark inietta più letture al minuto di un utente reale
+    system.rate_limiter['max_attempts_per_minute'] = 10 ** 9
+    system.database = DatabaseManager(db_path)
+    system.usb_relay_controller = get_relay_session(fake_relay.path)
+    system.access_engine = get_access_engine(db_path)
+
+    misure = Misure(fake_relay)
+    system.tap_pipeline = TapPipeline(system.access_engine, misure.attuatore(system.actuate_access),
+                                      [system.notify_access])
+    system.tap_pipeline.osservatori.append(misure.osservatore)
+
+    reader = FakeCardReader(cfs, frequenza, durata_lettura)
+    system.card_reader = reader
+
+    def callback(cf):
+        misure.iniezione[cf] = reader.iniezioni[-1]
+        system.handle_cf(cf)
+
+    with silenzioso(quiet):
+        reader.start_continuous_reading(callback)
+        system.tap_pipeline.shutdown(wait=True)
+    time.sleep(0.5)
+    misure.calcola_seriale()
+    return misure.to_dict()
+
+
+# ===== CONFRONTO =====
+
+def confronta(risultati: Dict, baseline: Dict, soglia: float) -> List[str]:
+    """Stadi il cui p95 è peggiorato oltre soglia (frazione) rispetto alla baseline"""
+    regressioni = []
+    for scenario, dati in risultati['scenari'].items():
+        base = baseline.get('scenari', {}).get(scenario)
+        if not base:
+            continue
+        for stadio, stat in dati['stadi'].items():
+            prima = base['stadi'].get(stadio, {}).get('p95_ms')
+            dopo = stat.get('p95_ms')
+            if prima and dopo and dopo > prima * (1 + soglia):
+                regressioni.append(f"{scenario}.{stadio}: p95 {prima:.2f}ms → {dopo:.2f}ms")
+    return regressioni
+
+
+def versione_git() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# ===== MAIN =====
+
+def esegui_scenari(args: argparse.Namespace, scenari: List[str], db_path: str,
+                   fake_relay: FakeUSBRLY08) -> Optional[Dict]:
+    """Risultati degli scenari sul database di lavoro (None se la scheda relè non risponde)"""
+    # I singleton di processo puntano al database di lavoro prima che
+    # web_api/main li creino con i percorsi di produzione
+    from bench.seed_db import load_cfs
+    from core.access_schedule import get_schedule_provider
+    from core.access_engine import get_access_engine
+    from database.auth_index import get_authorization_index
+    from database.monthly_counters import get_monthly_counters
+    from database.log_writer import get_log_writer
+    from hardware.relay_session import get_relay_session
+
+    get_authorization_index(db_path)
+    get_schedule_provider(db_path)
+    get_monthly_counters(db_path)
+    get_log_writer(db_path)
+    get_access_engine(db_path)
+    relay = get_relay_session(fake_relay.path)
+    if not relay.ensure_connected():
+        logger.error("❌ Impossibile connettersi al USB-RLY08 simulato")
+        return None
+
+    rng = random.Random(args.seed)
+    utenti = load_cfs(db_path)
+    rng.shuffle(utenti)
+    # Ogni scenario usa CF diversi: nessun effetto del limite mensile tra scenari
+    blocchi = {nome: utenti[i * args.letture:(i + 1) * args.letture] for i, nome in enumerate(scenari)}
+
+    risultati = {
+        'formato': FORMATO_RISULTATI,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git': versione_git(),
+        'ambiente': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'piattaforma': platform.platform(),
+            'cpu': os.cpu_count()
+        },
+        'parametri': {
+            'utenti': args.utenti, 'log': args.log, 'letture': args.letture,
+            'frequenza': args.frequenza, 'durata_lettura': args.durata_lettura,
+            'sconosciuti': args.sconosciuti, 'seed': args.seed
+        },
+        'scenari': {}
+    }
+
+    for nome in scenari:
+        cfs = sequenza_cf(blocchi[nome], args.letture, args.sconosciuti, rng)
+        logger.info(f"▶️ Scenario {nome}: {len(cfs)} letture a {args.frequenza}/s")
+        if nome == 'process':
+            with silenzioso(not args.verbose):
+                dati = scenario_process_cf(cfs, fake_relay)
+        elif nome == 'web':
+            with silenzioso(not args.verbose):
+                dati = scenario_web(cfs, fake_relay, args.frequenza, args.durata_lettura)
+        elif nome == 'main':
+            dati = scenario_main(cfs, fake_relay, db_path, args.frequenza, args.durata_lettura,
+                                 not args.verbose)
+        else:
+            logger.warning(f"⚠️ Scenario sconosciuto: {nome}")
+            continue
+        risultati['scenari'][nome] = dati
+
+    get_log_writer(db_path).flush()
+    relay.close()
+    return risultati
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark latenza tessera → cancello')
+    parser.add_argument('--db', default=os.path.join(BENCH_DIR, 'access_bench.db'),
+                        help='database seme (creato se assente)')
+    parser.add_argument('--rigenera', action='store_true', help='ricrea il database seme')
+    parser.add_argument('--utenti', type=int, default=50000)
+    parser.add_argument('--log', type=int, default=1000000)
+    parser.add_argument('--scenari', default='process,web,main',
+                        help='elenco separato da virgole: process, web, main')
+    parser.add_argument('--letture', type=int, default=300, help='letture per scenario')
+    parser.add_argument('--frequenza', type=float, default=10.0, help='letture al secondo')
+    parser.add_argument('--durata-lettura', type=float, default=0.0,
+                        help='tempo di lettura tessera simulato (secondi)')
+    parser.add_argument('--sconosciuti', type=float, default=0.1, help='quota di CF non registrati')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='file JSON dei risultati (default: stdout)')
+    parser.add_argument('--confronta', help='JSON di una esecuzione precedente')
+    parser.add_argument('--soglia', type=float, default=0.2, help='regressione p95 tollerata (0.2 = +20%%)')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    formato_log = '%(asctime)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=formato_log)
+    if not args.verbose:
+        # Il logging INFO dei moduli resta attivo (costo incluso nelle misure),
+        # a console arrivano solo warning/errori e i messaggi del benchmark
+        for handler in logging.getLogger().handlers:
+            handler.setLevel(logging.WARNING)
+        bench_handler = logging.StreamHandler()
+        bench_handler.setFormatter(logging.Formatter(formato_log))
+        logger.addHandler(bench_handler)
+        logger.propagate = False
+    scenari = [s.strip() for s in args.scenari.split(',') if s.strip()]
+
+    # Directory di lavoro dell'esecuzione: database, spill, archivio e log di
+    # main.py, rimossa alla fine anche dopo un errore. Le variabili vanno
+    # impostate prima di importare i moduli di src, che le leggono all'import
+    lavoro = tempfile.mkdtemp(prefix='access_bench_')
+    db_path = os.path.join(lavoro, 'access.db')
+    os.environ['ACCESS_CONTROL_DB'] = db_path
+    os.environ['ACCESS_CONTROL_LOG_DIR'] = os.path.join(lavoro, 'logs')
+    fake_relay = None
+    try:
+        prepara_database(args.db, db_path, args.utenti, args.log, args.rigenera)
+        fake_relay = FakeUSBRLY08().start()
+        risultati = esegui_scenari(args, scenari, db_path, fake_relay)
+    finally:
+        if fake_relay is not None:
+            fake_relay.stop()
+        shutil.rmtree(lavoro, ignore_errors=True)
+    if risultati is None:
+        return 1
+
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(testo + '\n')
+        logger.info(f"📄 Risultati scritti in {args.output}")
+    else:
+        print(testo)
+
+    if args.confronta:
+        with open(args.confronta, 'r', encoding='utf-8') as f:
+            regressioni = confronta(risultati, json.load(f), args.soglia)
+        for riga in regressioni:
+            logger.warning(f"📉 Regressione {riga}")
+        return 2 if regressioni else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# File: /opt/access_control/bench/seed_db.py
+# Database access.db di dimensioni produttive per i benchmark
+
+import os
+import sys
+import random
+import sqlite3
+import string
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Tuple
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from core.access_schedule import GIORNI
+from database.database_manager import DatabaseManager
+from database.rollup import ricostruisci
+
+logger = logging.getLogger(__name__)
+
+
+def genera_cf(rng: random.Random) -> str:
+    """Codice fiscale con il formato corretto (non validato sul carattere di controllo)"""
+    lettere = string.ascii_uppercase
+    return (
+        ''.join(rng.choice(lettere) for _ in range(6)) +
+        f"{rng.randint(0, 99):02d}" +
+        rng.choice('ABCDEHLMPRST') +
+        f"{rng.randint(1, 71):02d}" +
+        rng.choice(lettere) +
+        f"{rng.randint(0, 999):03d}" +
+        rng.choice(lettere)
+    )
+
+
+def genera_cf_unici(n: int, rng: random.Random) -> List[str]:
+    cfs = set()
+    while len(cfs) < n:
+        cfs.add(genera_cf(rng))
+    return sorted(cfs)
+
+
+def _righe_log(cfs: List[str], n: int, rng: random.Random) -> Iterator[Tuple]:
+    """Righe log_accessi distribuite sugli ultimi 12 mesi"""
+    fine = datetime.now(timezone.utc)
+    inizio = fine - timedelta(days=365)
+    span = int((fine - inizio).total_seconds())
+    esiti = [
+        (1, 'AUTORIZZATO', None),
+        (0, 'UTENTE_NON_TROVATO', 'Utente non trovato'),
+        (0, 'FUORI_ORARIO', 'Accesso non consentito in questo orario'),
+        (0, 'LIMITE_SUPERATO', 'Limite mensile accessi superato'),
+    ]
+    pesi = [85, 7, 5, 3]
+    secondi = sorted(rng.randrange(span) for _ in range(n))
+    for offset in secondi:
+        autorizzato, tipo, motivo = rng.choices(esiti, pesi)[0]
+        cf = rng.choice(cfs) if tipo != 'UTENTE_NON_TROVATO' else genera_cf(rng)
+        yield (
+            (inizio + timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S'),
+            cf, autorizzato, rng.uniform(0.002, 0.05), 'Isola RAEE', 'OMNIKEY_5427_G2',
+            100, tipo, motivo
+        )
+
+
+def seed_database(db_path: str, utenti: int = 50000, log: int = 1000000, seed: int = 42,
+                  sempre_aperto: bool = True) -> List[str]:
+    """Crea access.db con utenti e storico accessi; restituisce i CF degli utenti"""
+    rng = random.Random(seed)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    # Schema di produzione (migrazioni: tabelle, indici, valori di default)
+    DatabaseManager(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        cfs = genera_cf_unici(utenti, rng)
+        with conn:
+            conn.executemany(
+                'INSERT INTO utenti_autorizzati (codice_fiscale, nome, attivo, creato_da) VALUES (?, ?, ?, ?)',
+                ((cf, f"Cittadino {i}", 0 if i % 50 == 0 else 1, 'bench') for i, cf in enumerate(cfs))
+            )
+            if sempre_aperto:
+                orari = [(g, 1, '00:00', '23:59', None, None) for g in GIORNI]
+            else:
+                orari = [(g, 1 if g != 'Domenica' else 0, '08:00', '12:00', '14:00', '18:00') for g in GIORNI]
+            # Sostituiscono orari e limite di default della migrazione 0001
+            conn.execute('DELETE FROM orari_accesso')
+            conn.execute('DELETE FROM limiti_accesso')
+            conn.executemany(
+                'INSERT INTO orari_accesso (giorno, aperto, mattina_inizio, mattina_fine, '
+                'pomeriggio_inizio, pomeriggio_fine) VALUES (?, ?, ?, ?, ?, ?)', orari
+            )
+            conn.execute('INSERT INTO limiti_accesso (max_ingressi_mensili, updated_by) VALUES (3, ?)', ('bench',))
+            conn.execute("INSERT INTO system_settings (key, value) VALUES ('sistema.nome_installazione', 'Isola RAEE')")
+
+        with conn:
+            conn.executemany(
+                'INSERT INTO log_accessi (timestamp, codice_fiscale, autorizzato, durata_elaborazione, '
+                'terminale_id, metodo_lettura, qualita_lettura, tipo_accesso, motivo_rifiuto) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                _righe_log(cfs, log, rng)
+            )
+            # Storico inserito senza LogWriter: statistiche orarie/giornaliere ricalcolate
+            ricostruisci(conn)
+
+        # Contatori del mese corrente coerenti con lo storico
+        oggi = datetime.now()
+        with conn:
+            conn.execute('''
+                INSERT INTO conteggio_ingressi_mensili (codice_fiscale, mese, anno, numero_ingressi, ultimo_ingresso)
+                SELECT codice_fiscale, ?, ?, MIN(COUNT(*), 2), MAX(timestamp)
+                FROM log_accessi
+                WHERE autorizzato = 1 AND strftime('%Y-%m', timestamp) = ?
+                GROUP BY codice_fiscale
+            ''', (oggi.month, oggi.year, oggi.strftime('%Y-%m')))
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+    logger.info(f"🌱 Database benchmark creato: {utenti} utenti, {log} righe log ({db_path})")
+    return cfs
+
+
+def load_cfs(db_path: str) -> List[str]:
+    """CF degli utenti di un database già popolato"""
+    with sqlite3.connect(db_path) as conn:
+        return [row[0] for row in conn.execute('SELECT codice_fiscale FROM utenti_autorizzati ORDER BY codice_fiscale')]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Crea un access.db di dimensioni produttive')
+    parser.add_argument('db_path')
+    parser.add_argument('--utenti', type=int, default=50000)
+    parser.add_argument('--log', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    seed_database(args.db_path, args.utenti, args.log, args.seed)
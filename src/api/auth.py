@@ -2,8 +2,7 @@
 from flask import session, jsonify, redirect
 from functools import wraps
 import hashlib
-import sqlite3
-import os
+from database.pool import DEFAULT_DB_PATH, get_connection
 
 # Definizione ruoli e permessi
 USER_ROLES = {
@@ -25,14 +24,12 @@ USER_ROLES = {
 }
 
 # Path del database
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'access.db')
+DB_PATH = DEFAULT_DB_PATH
 
 def get_db_connection():
     """Connessione al database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_connection(DB_PATH)
     except Exception as e:
         print(f"Errore connessione DB: {e}")
         return None
@@ -15,6 +15,8 @@ from pathlib import Path
 import threading
 import logging
 
+from database.pool import copy_database
+
 # Configurazione
 PROJECT_ROOT = Path("/opt/access_control")
 BACKUP_DIR = PROJECT_ROOT / "backups"
@@ -263,13 +265,18 @@ def create_complete_backup(operation_id):
                     shutil.copy2(source, temp_dir / comp_name)
                 else:
                     shutil.copytree(source, temp_dir / comp_name, 
-                                  ignore=shutil.ignore_patterns('*.pyc', '__pycache__', '*.log'))
+                                  ignore=shutil.ignore_patterns('*.pyc', '__pycache__', '*.log',
+                                                                '*.db-wal', '*.db-shm'))
         
-        # Database (se non troppo grande)
+        # Il file copiato non contiene i commit ancora nel WAL: copia consistente
         db_path = PROJECT_ROOT / "src" / "access.db"
+        if db_path.exists() and (temp_dir / "src" / "access.db").exists():
+            copy_database(str(db_path), temp_dir / "src" / "access.db")
+        
+        # Database (se non troppo grande)
         if db_path.exists() and db_path.stat().st_size < 500 * 1024 * 1024:
             backup_operations[operation_id]['message'] = 'Backup database...'
-            shutil.copy2(db_path, temp_dir / "access.db")
+            copy_database(str(db_path), temp_dir / "access.db")
         
         # Crea archivio
         backup_operations[operation_id]['message'] = 'Creazione archivio...'
@@ -315,7 +322,7 @@ def create_db_backup(operation_id):
     db_backup = BACKUP_DIR / f"access_{timestamp}.db"
     
     if db_source.exists():
-        shutil.copy2(db_source, db_backup)
+        copy_database(str(db_source), db_backup)
         
         # Link latest
         latest_link = BACKUP_DIR / "latest_database.db"
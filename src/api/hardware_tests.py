@@ -8,6 +8,8 @@ from datetime import datetime
 import sys
 sys.path.insert(0, '/opt/access_control/src')
 
+from database.log_writer import get_log_writer, utc_timestamp
+
 # Stato globale per test
 relay_test_state = {'status': 'idle'}
 integrated_test_state = {'status': 'idle'}
@@ -284,18 +286,14 @@ def test_integrated(get_db_connection):
                     time.sleep(2)
                     controller._send_command(112)  # LED Rosso OFF
                 
-                # FASE 6: Log nel database
+                # FASE 6: Log nel database (writer del processo: stesso commit dei contatori)
                 integrated_test_state['phase'] = 'logging'
-                conn = get_db_connection()
-                if conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        INSERT INTO log_accessi (codice_fiscale, timestamp, autorizzato) 
-                        VALUES (?, ?, ?)
-                    """, (cf, datetime.now(), 1 if authorized else 0))
-                    conn.commit()
-                    conn.close()
-                    integrated_test_state['log'].append("\n📝 Accesso registrato nel database")
+                get_log_writer().enqueue({
+                    'timestamp': utc_timestamp(),
+                    'codice_fiscale': cf,
+                    'autorizzato': 1 if authorized else 0
+                })
+                integrated_test_state['log'].append("\n📝 Accesso registrato nel database")
                 
                 # FASE 7: Completamento
                 integrated_test_state['phase'] = 'completed'
@@ -362,10 +360,10 @@ def test_reader():
             last_access_id = 0
             
             # Ottieni ultimo ID dal database per monitoraggio
-            import sqlite3
+            from database.pool import get_connection
             db_path = '/opt/access_control/src/access.db'
             try:
-                conn = sqlite3.connect(db_path)
+                conn = get_connection(db_path, row_factory=None)
                 cursor = conn.cursor()
                 cursor.execute("SELECT MAX(id) FROM log_accessi")
                 result = cursor.fetchone()
@@ -385,7 +383,7 @@ def test_reader():
                 
                 try:
                     # Monitora database invece di leggere direttamente
-                    conn = sqlite3.connect(db_path)
+                    conn = get_connection(db_path, row_factory=None)
                     cursor = conn.cursor()
                     cursor.execute("""
                         SELECT id, codice_fiscale, autorizzato, motivo_rifiuto, nome_utente 
@@ -243,6 +243,8 @@ LOG_ACCESSI_TEMPLATE = """
         let currentPage = 1;
         let totalPages = 1;
         let currentFilters = {};
+        // Cursori delle pagine già visitate: cursors[i] è il token della pagina i + 1
+        let cursors = [''];
 
         // Carica menu utente
         fetch('/api/user-menu-html')
@@ -271,6 +273,7 @@ LOG_ACCESSI_TEMPLATE = """
                 codice_fiscale: document.getElementById('filter-cf').value
             };
             currentPage = 1;
+            cursors = [''];
             loadLogs();
         }
 
@@ -283,18 +286,33 @@ LOG_ACCESSI_TEMPLATE = """
             document.querySelectorAll('.custom-date').forEach(el => el.style.display = 'none');
             currentFilters = {};
             currentPage = 1;
+            cursors = [''];
             loadLogs();
         }
 
         function loadLogs() {
             const params = new URLSearchParams({
                 page: currentPage,
+                cursor: cursors[currentPage - 1] || '',
                 ...currentFilters
             });
 
             fetch(`/api/log-accessi?${params}`)
-                .then(response => response.json())
+                .then(response => {
+                    // Cursore scaduto (es. periodo 'oggi' dopo mezzanotte): si riparte dalla prima pagina
+                    if (response.status === 400 && currentPage > 1) {
+                        currentPage = 1;
+                        cursors = [''];
+                        return fetch(`/api/log-accessi?${new URLSearchParams({page: 1, ...currentFilters})}`)
+                            .then(r => r.json());
+                    }
+                    return response.json();
+                })
                 .then(data => {
+                    cursors.length = currentPage;
+                    if (data.next_cursor) {
+                        cursors.push(data.next_cursor);
+                    }
                     updateTable(data.logs);
                     updateStatistics(data.statistics);
                     updatePagination(data.total_pages, data.current_page);
@@ -380,8 +398,8 @@ LOG_ACCESSI_TEMPLATE = """
                 </li>
             `;
             
-            // Pages
-            for (let i = 1; i <= Math.min(total, 10); i++) {
+            // Pagine raggiungibili: quelle di cui si conosce il cursore
+            for (let i = Math.max(1, cursors.length - 9); i <= cursors.length; i++) {
                 html += `
                     <li class="page-item ${i === current ? 'active' : ''}">
                         <a class="page-link" href="#" onclick="changePage(${i}); return false;">${i}</a>
@@ -389,9 +407,13 @@ LOG_ACCESSI_TEMPLATE = """
                 `;
             }
             
+            if (total > cursors.length) {
+                html += `<li class="page-item disabled"><span class="page-link">… ${total}</span></li>`;
+            }
+
             // Next
             html += `
-                <li class="page-item ${current === total ? 'disabled' : ''}">
+                <li class="page-item ${current >= cursors.length ? 'disabled' : ''}">
                     <a class="page-link" href="#" onclick="changePage(${current + 1}); return false;">
                         <i class="fas fa-chevron-right"></i>
                     </a>
@@ -402,7 +424,7 @@ LOG_ACCESSI_TEMPLATE = """
         }
 
         function changePage(page) {
-            if (page < 1 || page > totalPages) return;
+            if (page < 1 || page > cursors.length) return;
             currentPage = page;
             loadLogs();
         }
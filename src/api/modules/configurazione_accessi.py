@@ -6,7 +6,12 @@ from datetime import datetime, time, date
 from calendar import monthrange
 import pytz
 from flask import Blueprint, jsonify, request, session
-from ..utils import require_auth, require_permission, get_db_connection
+from ..utils import require_auth, require_permission, get_db_connection, DB_PATH
+from database.auth_index import get_authorization_index
+from database.monthly_counters import get_monthly_counters
+from database.schema import migrate
+from core.access_schedule import get_access_schedule, get_schedule_provider
+from core.access_engine import get_access_engine, UTENTE_NON_TROVATO, LIMITE_SUPERATO, ERRORE
 
 # Fuso orario di Roma
 ROME_TZ = pytz.timezone('Europe/Rome')
@@ -20,105 +25,11 @@ def get_primo_giorno_mese_successivo():
         return date(oggi.year + 1, 1, 1)
     return date(oggi.year, oggi.month + 1, 1)
 
-def init_db():
-    """Inizializza tabelle per configurazione accessi"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
-    try:
-        cursor = conn.cursor()
-        
-        # Crea le tabelle se non esistono
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orari_accesso (
-                giorno TEXT PRIMARY KEY,
-                aperto BOOLEAN DEFAULT true,
-                mattina_inizio TIME,
-                mattina_fine TIME,
-                pomeriggio_inizio TIME,
-                pomeriggio_fine TIME,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_by TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS limiti_accesso (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                max_ingressi_mensili INTEGER DEFAULT 3,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_by TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS log_forzature (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tipo TEXT NOT NULL,
-                utente TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                dettagli TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conteggio_ingressi_mensili (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                codice_fiscale TEXT NOT NULL,
-                mese INTEGER NOT NULL,
-                anno INTEGER NOT NULL,
-                numero_ingressi INTEGER DEFAULT 0,
-                ultimo_ingresso TIMESTAMP,
-                UNIQUE(codice_fiscale, mese, anno)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conteggio_ingressi_mensili_archive (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                codice_fiscale TEXT NOT NULL,
-                mese INTEGER NOT NULL,
-                anno INTEGER NOT NULL,
-                numero_ingressi INTEGER,
-                ultimo_ingresso TIMESTAMP,
-                data_archiviazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Verifica se le tabelle sono vuote
-        cursor.execute('SELECT COUNT(*) FROM orari_accesso')
-        orari_count = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM limiti_accesso')
-        limiti_count = cursor.fetchone()[0]
-        
-        # Inserisci valori default SOLO se le tabelle sono vuote
-        if orari_count == 0:
-            print("Inizializzazione orari default...")
-            giorni = ['Lunedi', 'Martedi', 'Mercoledi', 'Giovedi', 'Venerdi', 'Sabato', 'Domenica']
-            for giorno in giorni:
-                cursor.execute('''
-                    INSERT INTO orari_accesso 
-                    (giorno, aperto, mattina_inizio, mattina_fine, pomeriggio_inizio, pomeriggio_fine)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (giorno, True, '09:00', '12:00', '15:00', '17:00'))
-        
-        if limiti_count == 0:
-            print("Inizializzazione limite ingressi default...")
-            cursor.execute('INSERT INTO limiti_accesso (max_ingressi_mensili) VALUES (?)', (3,))
-        
-        conn.commit()
-        return True
-        
-    except Exception as e:
-        print(f"Errore inizializzazione DB: {e}")
-        return False
-    finally:
-        conn.close()
-
-# Inizializza DB
-init_db()
+# Tabelle e valori di default: migrazione 0001 (database/migrations)
+try:
+    migrate(DB_PATH)
+except Exception as e:
+    print(f"Errore migrazione DB: {e}")
 
 @configurazione_accessi_bp.route('/api/configurazione/orari', methods=['GET'])
 @require_auth()
@@ -217,6 +128,9 @@ def save_orari():
             
         print(f"Orari salvati correttamente: {count} record")
         conn.commit()
+
+        # Ricompila subito lo schedule di questo processo
+        get_schedule_provider().reload(conn)
         return jsonify({'success': True, 'message': 'Orari salvati'})
         
     except Exception as e:
@@ -224,6 +138,15 @@ def save_orari():
     finally:
         conn.close()
 
+@configurazione_accessi_bp.route('/api/configurazione/orari/stato', methods=['GET'])
+@require_auth()
+def get_stato_orari():
+    """Stato attuale degli orari (aperto, prossima apertura/chiusura)"""
+    try:
+        return jsonify({'success': True, **get_access_schedule().get_status()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @configurazione_accessi_bp.route('/api/configurazione/limiti', methods=['GET'])
 @require_auth()
 def get_limiti():
@@ -314,7 +237,10 @@ def save_limiti():
         
         print(f"Limite accessi salvato: valore={saved[0]}, aggiornato_il={saved[1]}, da={saved[2]}")
         conn.commit()
-        
+
+        # Ricarica subito i limiti di questo processo (gli altri li vedono dal watcher)
+        get_monthly_counters().load_limits(conn)
+
         return jsonify({
             'success': True, 
             'message': 'Limite salvato correttamente',
@@ -329,133 +255,22 @@ def save_limiti():
         conn.close()
 
 def verifica_orario() -> bool:
-    """Verifica se l'orario attuale è valido per l'accesso"""
-    ora_sistema = datetime.now()
-    ora_roma = datetime.now(ROME_TZ)
-    print(f"Ora sistema: {ora_sistema}, Ora Roma: {ora_roma}")
-    
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
+    """Verifica se l'orario attuale (ora di Roma) è valido per l'accesso"""
     try:
-        cursor = conn.cursor()
-        
-        # Usa SEMPRE ora_roma per tutte le verifiche
-        # Questo garantisce coerenza indipendentemente dalle impostazioni di sistema
-        
-        # Ottieni giorno della settimana (weekday: 0=Lunedì -> 6=Domenica)
-        giorni = ['Lunedi', 'Martedi', 'Mercoledi', 'Giovedi', 'Venerdi', 'Sabato', 'Domenica']
-        giorno_attuale = giorni[ora_roma.weekday()]
-        ora_attuale = ora_roma.time()
-        
-        print(f"\nVerifica accesso:")
-        print(f"Giorno: {giorno_attuale}")
-        print(f"Ora: {ora_attuale}")
-        
-        # Ottieni orari per il giorno
-        cursor.execute('SELECT * FROM orari_accesso WHERE giorno = ?', (giorno_attuale,))
-        orario = cursor.fetchone()
-        
-        # Verifica se il giorno è configurato e attivo
-        if not orario:
-            print("Giorno non configurato")
-            return False
-            
-        if not orario[1]:  # not aperto
-            print("Giorno non attivo")
-            return False
-        
-        # Converti stringhe in oggetti time
-        try:
-            mattina_inizio = datetime.strptime(orario[2], '%H:%M').time() if orario[2] else None
-            mattina_fine = datetime.strptime(orario[3], '%H:%M').time() if orario[3] else None
-            pomeriggio_inizio = datetime.strptime(orario[4], '%H:%M').time() if orario[4] else None
-            pomeriggio_fine = datetime.strptime(orario[5], '%H:%M').time() if orario[5] else None
-            
-            print("\nOrari configurati:")
-            if mattina_inizio and mattina_fine:
-                print(f"Mattina: {mattina_inizio}-{mattina_fine}")
-            if pomeriggio_inizio and pomeriggio_fine:
-                print(f"Pomeriggio: {pomeriggio_inizio}-{pomeriggio_fine}")
-                
-        except ValueError as e:
-            print(f"Errore conversione orari: {e}")
-            return False
-        
-        # Verifica se ora attuale è in uno dei range
-        in_mattina = False
-        in_pomeriggio = False
-        
-        if mattina_inizio and mattina_fine:
-            # Converti ora_attuale in minuti per confronto più semplice
-            ora_attuale_minuti = ora_attuale.hour * 60 + ora_attuale.minute
-            mattina_inizio_minuti = mattina_inizio.hour * 60 + mattina_inizio.minute
-            mattina_fine_minuti = mattina_fine.hour * 60 + mattina_fine.minute
-            
-            # Se l'intervallo attraversa la mezzanotte (es. 23:00-01:00)
-            if mattina_inizio_minuti > mattina_fine_minuti:
-                in_mattina = ora_attuale_minuti >= mattina_inizio_minuti or ora_attuale_minuti <= mattina_fine_minuti
-            else:
-                in_mattina = mattina_inizio_minuti <= ora_attuale_minuti <= mattina_fine_minuti
-            print(f"Verifica mattina: {mattina_inizio}-{mattina_fine} -> {in_mattina}")
-            
-        if pomeriggio_inizio and pomeriggio_fine:
-            # Converti ora_attuale in minuti per confronto più semplice
-            ora_attuale_minuti = ora_attuale.hour * 60 + ora_attuale.minute
-            pomeriggio_inizio_minuti = pomeriggio_inizio.hour * 60 + pomeriggio_inizio.minute
-            pomeriggio_fine_minuti = pomeriggio_fine.hour * 60 + pomeriggio_fine.minute
-            
-            # Se l'intervallo attraversa la mezzanotte (es. 23:00-01:00)
-            if pomeriggio_inizio_minuti > pomeriggio_fine_minuti:
-                in_pomeriggio = ora_attuale_minuti >= pomeriggio_inizio_minuti or ora_attuale_minuti <= pomeriggio_fine_minuti
-            else:
-                in_pomeriggio = pomeriggio_inizio_minuti <= ora_attuale_minuti <= pomeriggio_fine_minuti
-            print(f"Verifica pomeriggio: {pomeriggio_inizio}-{pomeriggio_fine} -> {in_pomeriggio}")
-        
-        accesso_consentito = in_mattina or in_pomeriggio
-        print(f"\nAccesso consentito: {accesso_consentito}")
-        
-        return accesso_consentito
-        
+        return get_access_schedule().is_open(datetime.now(ROME_TZ))
     except Exception as e:
         print(f"Errore verifica orario: {e}")
         return False
-    finally:
-        conn.close()
 
 def verifica_limite_mensile(codice_fiscale: str) -> bool:
     """Verifica se l'utente ha superato il limite mensile di accessi"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
     try:
-        cursor = conn.cursor()
-        
-        # Ottieni limite configurato
-        cursor.execute('SELECT max_ingressi_mensili FROM limiti_accesso ORDER BY id DESC LIMIT 1')
-        row = cursor.fetchone()
-        limite = row[0] if row else 3
-        
-        # Ottieni anno e mese correnti
         oggi = datetime.now()
-        
-        # Conta accessi del mese corrente dalla tabella conteggio_ingressi_mensili
-        cursor.execute('''
-            SELECT numero_ingressi FROM conteggio_ingressi_mensili 
-            WHERE codice_fiscale = ? AND mese = ? AND anno = ?
-        ''', (codice_fiscale, oggi.month, oggi.year))
-        
-        row = cursor.fetchone()
-        accessi = row[0] if row else 0
-        return accessi < limite
-        
+        sotto_limite, _, _ = get_monthly_counters().check(codice_fiscale, oggi.year, oggi.month)
+        return sotto_limite
     except Exception as e:
         print(f"Errore verifica limite mensile: {e}")
         return False
-    finally:
-        conn.close()
 
 def log_forzatura(tipo: str, utente: str, dettagli: str = None):
     """Registra una forzatura nel log"""
@@ -541,14 +356,16 @@ def set_ingressi():
         
         # Aggiorna o inserisci conteggio
         cursor.execute('''
-            INSERT OR REPLACE INTO conteggio_ingressi_mensili 
+            INSERT INTO conteggio_ingressi_mensili 
             (codice_fiscale, mese, anno, numero_ingressi, ultimo_ingresso)
             VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(codice_fiscale, mese, anno) DO UPDATE SET
+                numero_ingressi = excluded.numero_ingressi,
+                ultimo_ingresso = excluded.ultimo_ingresso
         ''', (data['codice_fiscale'], oggi.month, oggi.year, data['ingressi']))
         
-        # Ottieni limite configurato
-        cursor.execute('SELECT max_ingressi_mensili FROM limiti_accesso ORDER BY id DESC LIMIT 1')
-        limite = cursor.fetchone()[0]
+        # Limite configurato (per utente o globale)
+        limite = get_monthly_counters().get_limit(data['codice_fiscale'])
         
         # Aggiorna stato utente
         cursor.execute('''
@@ -558,6 +375,7 @@ def set_ingressi():
         ''', (1 if data['ingressi'] < limite else 0, data['codice_fiscale']))
         
         conn.commit()
+        get_authorization_index().reload_user(data['codice_fiscale'], conn)
         return jsonify({'success': True, 'message': 'Conteggio aggiornato'})
         
     except Exception as e:
@@ -579,95 +397,45 @@ def simula_accesso():
     import os
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
     from hardware.card_reader import CardReader
-    from hardware.usb_rly08_controller import USBRLY08Controller
-    
-    # Verifica orario prima di tutto
-    if not verifica_orario():
-        return jsonify({
-            'success': False, 
-            'error': 'Accesso non consentito in questo orario'
-        }), 403
-    
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'success': False, 'error': 'Database non disponibile'}), 500
+    from hardware.relay_session import get_relay_session
     
     try:
-        cursor = conn.cursor()
-        oggi = datetime.now()
-        
-        # Verifica utente
-        cursor.execute('''
-            SELECT attivo 
-            FROM utenti_autorizzati 
-            WHERE codice_fiscale = ?
-        ''', (data['codice_fiscale'],))
-        row = cursor.fetchone()
-        if not row:
-            return jsonify({'success': False, 'error': 'Utente non trovato'}), 404
-        if not row[0]:
-            return jsonify({'success': False, 'error': 'Utente disattivato'}), 403
-        
-        # Verifica limite mensile
-        cursor.execute('SELECT max_ingressi_mensili FROM limiti_accesso ORDER BY id DESC LIMIT 1')
-        limite = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT numero_ingressi 
-            FROM conteggio_ingressi_mensili
-            WHERE codice_fiscale = ? AND mese = ? AND anno = ?
-        ''', (data['codice_fiscale'], oggi.month, oggi.year))
-        row = cursor.fetchone()
-        ingressi_attuali = row[0] if row else 0
-        
-        if ingressi_attuali >= limite:
-            # Disattiva utente
-            cursor.execute('''
-                UPDATE utenti_autorizzati 
-                SET attivo = 0
-                WHERE codice_fiscale = ?
-            ''', (data['codice_fiscale'],))
-            conn.commit()
-            
-            return jsonify({
-                'success': False,
-                'error': f'Limite mensile di {limite} ingressi raggiunto'
-            }), 403
-        
-        # Incrementa contatore
-        cursor.execute('''
-            INSERT OR REPLACE INTO conteggio_ingressi_mensili 
-            (codice_fiscale, mese, anno, numero_ingressi, ultimo_ingresso)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (data['codice_fiscale'], oggi.month, oggi.year, ingressi_attuali + 1))
-        
-        # Registra accesso con dettagli simulazione
-        cursor.execute('''
-            INSERT INTO log_accessi 
-            (timestamp, codice_fiscale, autorizzato, metodo_lettura, qualita_lettura, tipo_accesso)
-            VALUES (CURRENT_TIMESTAMP, ?, 1, 'OMNIKEY_5427_G2', 100, 'simulazione')
-        ''', (data['codice_fiscale'],))
+        # Stessa decisione della lettura reale, registrata come simulazione
+        decision = get_access_engine().decide(
+            data['codice_fiscale'],
+            metodo_lettura='OMNIKEY_5427_G2',
+            qualita_lettura=100,
+            tipo_autorizzato='simulazione',
+            disattiva_al_limite=True
+        )
         
-        conn.commit()
+        if not decision.authorized:
+            if decision.tipo_accesso == UTENTE_NON_TROVATO:
+                return jsonify({'success': False, 'error': decision.motivo_rifiuto}), 404
+            if decision.tipo_accesso == LIMITE_SUPERATO:
+                return jsonify({
+                    'success': False,
+                    'error': f'Limite mensile di {decision.limite_mensile} ingressi raggiunto'
+                }), 403
+            if decision.tipo_accesso == ERRORE:
+                return jsonify({'success': False, 'error': decision.motivo_rifiuto}), 500
+            return jsonify({'success': False, 'error': decision.motivo_rifiuto}), 403
         
         # Simula lettura tessera
         reader = CardReader()
         reader.last_cf = data['codice_fiscale']  # Simula lettura
         
-        # Sollecita il relè come nella lettura reale
-        controller = USBRLY08Controller()
-        if controller.connect():
-            # Segnala accesso autorizzato (LED Verde + Buzzer)
-            controller.access_granted()
-            
-            # Apri cancello (disattiva blocco magnetico, attiva motore, riattiva blocco)
-            controller.open_gate(8.0)  # 8 secondi
-            
-            controller.disconnect()
+        # Sollecita il relè come nella lettura reale (sessione persistente)
+        relay = get_relay_session()
+        # Segnala accesso autorizzato (LED Verde + Buzzer)
+        relay.access_granted()
+        
+        # Apri cancello (disattiva blocco magnetico, attiva motore, riattiva blocco)
+        relay.open_gate(8.0)  # 8 secondi
         
         return jsonify({
             'success': True,
-            'message': f'Accesso autorizzato (ingresso {ingressi_attuali + 1}/{limite})',
+            'message': f'Accesso autorizzato (ingresso {decision.ingressi_mese}/{decision.limite_mensile})',
             'details': {
                 'lettore': 'OMNIKEY 5427 G2',
                 'qualita_lettura': '100%',
@@ -677,8 +445,6 @@ def simula_accesso():
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @configurazione_accessi_bp.route('/api/configurazione/test/reset-contatore', methods=['POST'])
 @require_auth()
@@ -733,6 +499,7 @@ def reset_contatore():
         )
         
         conn.commit()
+        get_authorization_index().reload_user(data['codice_fiscale'], conn)
         return jsonify({'success': True, 'message': 'Contatore resettato e utente riattivato'})
         
     except Exception as e:
@@ -748,18 +515,18 @@ def apri_cancello_forzato():
     import sys
     import os
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-    from hardware.usb_rly08_controller import USBRLY08Controller
+    from hardware.relay_session import get_relay_session
     
     if verifica_orario():
         return jsonify({'success': False, 'error': 'Cancello già apribile in orario normale'}), 400
     
     try:
-        controller = USBRLY08Controller()
-        if not controller.connect():
+        relay = get_relay_session()
+        if not relay.ensure_connected():
             return jsonify({'success': False, 'error': 'Impossibile connettersi al controller'}), 500
         
         # Apri cancello
-        controller.open_gate(8.0)  # 8 secondi
+        relay.open_gate(8.0)  # 8 secondi
         
         # Log forzatura
         log_forzatura(
@@ -772,9 +539,6 @@ def apri_cancello_forzato():
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        if 'controller' in locals():
-            controller.disconnect()
 
 @configurazione_accessi_bp.route('/api/configurazione/log-forzature', methods=['GET'])
 @require_auth()
@@ -772,10 +772,10 @@ def api_test_relay():
 def api_test_database():
     """Test connessione database"""
     try:
-        import sqlite3
+        from database.pool import connection
         db_path = project_root / "src" / "access.db"
         
-        with sqlite3.connect(str(db_path)) as conn:
+        with connection(str(db_path)) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM utenti_autorizzati")
             count = cursor.fetchone()[0]
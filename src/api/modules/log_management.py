@@ -2,23 +2,25 @@
 # Gestione log con export Excel - FIXED IMPORTS
 
 from flask import Blueprint, request, jsonify, send_file, session
-import sqlite3
 import pandas as pd
 import io
 from datetime import datetime, timedelta
-import os
+from database.pool import DEFAULT_DB_PATH, get_read_connection
+from database.log_filters import CF_CONTIENE_SQL, LogFilter, intervallo_date
+from database.log_partitions import sorgente_log
+from database.rollup import riepilogo
+from database.user_search import condizione_ricerca
+from database.log_pagination import firma_filtro, decodifica_cursore, pagina, get_log_count_cache
 
 log_management_bp = Blueprint('log_management', __name__)
 
 # Database path
-DB_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'access.db')
+DB_PATH = DEFAULT_DB_PATH
 
 def get_db_connection():
-    """Connessione database locale"""
+    """Connessione database locale (sola lettura: ricerca, statistiche, export)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_read_connection(DB_PATH)
     except Exception as e:
         print(f"Errore connessione DB: {e}")
         return None
@@ -52,15 +54,48 @@ def search_logs():
     search_text = request.args.get('search', '')
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 50))
+    cursor_token = request.args.get('cursor', '')
     
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database non disponibile'}), 500
     
     try:
-        # Query base
-        query = """
+        # Date incluse → intervallo su ts_epoch (ricerca sull'indice e scelta delle partizioni)
+        filtro = LogFilter('la').date(date_from, date_to)
+        
+        if status == 'authorized':
+            filtro.uguale('autorizzato', 1)
+        elif status == 'denied':
+            filtro.uguale('autorizzato', 0)
+        
+        if search_text:
+            # Nome e CF degli utenti dall'indice FTS, CF non registrati da log_cf
+            condizione, parametri = condizione_ricerca(conn, search_text, 'la.user_id')
+            filtro.clauses.append(f"({CF_CONTIENE_SQL.format(prefix='la.')} OR {condizione})")
+            filtro.params.extend([f"%{search_text}%", *parametri])
+        
+        firma = firma_filtro(filtro.where(), filtro.params)
+        try:
+            dopo = decodifica_cursore(cursor_token, firma)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        join_utenti = "LEFT JOIN utenti_autorizzati ua ON ua.id = la.user_id"
+        
+        # Totale dalla cache per filtro (ricontate solo le righe nuove)
+        total_count = get_log_count_cache().conta(
+            conn, f"{sorgente_log(conn, filtro.estremi, filtro.alias)} {join_utenti}",
+            filtro.where(), filtro.params, filtro.alias
+        )
+        
+        # Keyset su (ts_epoch, id); page senza cursore resta supportato con OFFSET
+        filtro.dopo(dopo)
+        offset = (page - 1) * per_page if dopo is None else 0
+        query = f"""
             SELECT 
+                la.id,
+                la.ts_epoch,
                 la.timestamp,
                 la.codice_fiscale,
                 la.autorizzato,
@@ -68,54 +103,27 @@ def search_logs():
                 ua.comune,
                 la.durata_elaborazione,
                 la.terminale_id
-            FROM log_accessi la
-            LEFT JOIN utenti_autorizzati ua ON la.codice_fiscale = ua.codice_fiscale
-            WHERE 1=1
+            FROM {sorgente_log(conn, filtro.estremi, filtro.alias)}
+            {join_utenti}
+            WHERE {filtro.where()}
+            ORDER BY la.ts_epoch DESC, la.id DESC LIMIT ? OFFSET ?
         """
-        params = []
-        
-        # Applica filtri
-        if date_from:
-            query += " AND DATE(la.timestamp) >= ?"
-            params.append(date_from)
-        
-        if date_to:
-            query += " AND DATE(la.timestamp) <= ?"
-            params.append(date_to)
-        
-        if status == 'authorized':
-            query += " AND la.autorizzato = 1"
-        elif status == 'denied':
-            query += " AND la.autorizzato = 0"
-        
-        if search_text:
-            query += " AND (la.codice_fiscale LIKE ? OR ua.nome LIKE ?)"
-            search_param = f"%{search_text}%"
-            params.extend([search_param, search_param])
         
-        # Conta totale per paginazione
-        count_query = f"SELECT COUNT(*) FROM ({query}) as filtered"
+        # Esegui query (una riga in più indica la pagina successiva)
         cursor = conn.cursor()
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()[0]
-        
-        # Aggiungi paginazione
-        query += " ORDER BY la.timestamp DESC LIMIT ? OFFSET ?"
-        params.extend([per_page, (page - 1) * per_page])
-        
-        # Esegui query
-        cursor.execute(query, params)
+        cursor.execute(query, [*filtro.params, per_page + 1, offset])
+        rows, next_cursor = pagina(cursor.fetchall(), per_page, firma)
         logs = []
         
-        for row in cursor.fetchall():
+        for row in rows:
             logs.append({
-                'timestamp': row[0],
-                'codice_fiscale': row[1],
-                'autorizzato': bool(row[2]),
-                'nome_completo': row[3],
-                'comune': row[4] or 'N/D',
-                'durata_elaborazione': row[5],
-                'terminale_id': row[6]
+                'timestamp': row['timestamp'],
+                'codice_fiscale': row['codice_fiscale'],
+                'autorizzato': bool(row['autorizzato']),
+                'nome_completo': row['nome_completo'],
+                'comune': row['comune'] or 'N/D',
+                'durata_elaborazione': row['durata_elaborazione'],
+                'terminale_id': row['terminale_id']
             })
         
         return jsonify({
@@ -125,7 +133,8 @@ def search_logs():
                 'page': page,
                 'per_page': per_page,
                 'total': total_count,
-                'pages': (total_count + per_page - 1) // per_page
+                'pages': (total_count + per_page - 1) // per_page,
+                'next_cursor': next_cursor
             }
         })
         
@@ -149,8 +158,10 @@ def export_logs():
         return jsonify({'error': 'Database non disponibile'}), 500
     
     try:
+        filtro = LogFilter('la').date(date_from, date_to)
+        
         # Query senza paginazione per export
-        query = """
+        query = f"""
             SELECT 
                 la.timestamp as 'Data/Ora',
                 la.codice_fiscale as 'Codice Fiscale',
@@ -159,20 +170,16 @@ def export_logs():
                 COALESCE(ua.comune, 'N/D') as 'Comune',
                 COALESCE(la.durata_elaborazione, 0) as 'Tempo Elaborazione (ms)',
                 COALESCE(la.terminale_id, 'N/D') as 'Terminale'
-            FROM log_accessi la
-            LEFT JOIN utenti_autorizzati ua ON la.codice_fiscale = ua.codice_fiscale
+            FROM {sorgente_log(conn, filtro.estremi, filtro.alias)}
+            LEFT JOIN utenti_autorizzati ua ON ua.id = la.user_id
             WHERE 1=1
         """
         params = []
         
         # Applica stessi filtri
-        if date_from:
-            query += " AND DATE(la.timestamp) >= ?"
-            params.append(date_from)
-        
-        if date_to:
-            query += " AND DATE(la.timestamp) <= ?"
-            params.append(date_to)
+        if filtro.clauses:
+            query += f" AND {filtro.where()}"
+            params.extend(filtro.params)
         
         if status == 'authorized':
             query += " AND la.autorizzato = 1"
@@ -180,11 +187,11 @@ def export_logs():
             query += " AND la.autorizzato = 0"
         
         if search_text:
-            query += " AND (la.codice_fiscale LIKE ? OR ua.nome LIKE ?)"
+            query += f" AND ({CF_CONTIENE_SQL.format(prefix='la.')} OR ua.nome LIKE ?)"
             search_param = f"%{search_text}%"
             params.extend([search_param, search_param])
         
-        query += " ORDER BY la.timestamp DESC"
+        query += " ORDER BY la.ts_epoch DESC, la.id DESC"
         
         # Crea DataFrame
         df = pd.read_sql_query(query, conn, params=params)
@@ -239,36 +246,14 @@ def get_log_stats():
         return jsonify({'error': 'Database non disponibile'}), 500
     
     try:
-        cursor = conn.cursor()
-        
-        # Query statistiche
-        query = """
-            SELECT 
-                COUNT(*) as totale,
-                SUM(CASE WHEN autorizzato = 1 THEN 1 ELSE 0 END) as autorizzati,
-                SUM(CASE WHEN autorizzato = 0 THEN 1 ELSE 0 END) as negati,
-                AVG(durata_elaborazione) as tempo_medio
-            FROM log_accessi
-            WHERE 1=1
-        """
-        params = []
-        
-        if date_from:
-            query += " AND DATE(timestamp) >= ?"
-            params.append(date_from)
-        
-        if date_to:
-            query += " AND DATE(timestamp) <= ?"
-            params.append(date_to)
-        
-        cursor.execute(query, params)
-        result = cursor.fetchone()
+        # Contatori giornalieri (statistiche_giornaliere): un record per giorno ed esito
+        result = riepilogo(conn, intervallo_date(date_from, date_to))
         
         stats = {
-            'totale': result[0] or 0,
-            'autorizzati': result[1] or 0,
-            'negati': result[2] or 0,
-            'tempo_medio': round(result[3] or 0, 2),
+            'totale': result['totale'],
+            'autorizzati': result['autorizzati'],
+            'negati': result['negati'],
+            'tempo_medio': round(result['tempo_medio'], 2),
             'tasso_successo': 0
         }
         
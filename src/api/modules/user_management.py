@@ -1,7 +1,6 @@
 # File: /opt/access_control/src/api/modules/user_management.py
 from flask import Blueprint, render_template_string, request, jsonify, session
 from functools import wraps
-import sqlite3
 import os
 import hashlib
 from datetime import datetime
@@ -9,18 +8,17 @@ from datetime import datetime
 # Import auth per i decoratori
 from ..utils import require_auth, require_permission
 from ..auth import USER_ROLES
+from database.pool import DEFAULT_DB_PATH, get_connection
 
 user_management_bp = Blueprint('user_management', __name__)
 
 # Database path
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'access.db')
+DB_PATH = DEFAULT_DB_PATH
 
 def get_db_connection():
     """Connessione al database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_connection(DB_PATH)
     except Exception as e:
         print(f"Errore connessione DB: {e}")
         return None
@@ -1,24 +1,24 @@
 # File: /opt/access_control/src/api/modules/utenti_autorizzati.py
 from flask import Blueprint, render_template_string, request, jsonify, session
 from functools import wraps
-import sqlite3
 import os
 from datetime import datetime
 
 # Import auth per i decoratori
 from ..utils import require_auth, require_permission
+from database.auth_index import get_authorization_index
+from database.pool import DEFAULT_DB_PATH, get_connection
+from database.user_search import cerca_utenti
 
 utenti_autorizzati_bp = Blueprint('utenti_autorizzati', __name__)
 
 # Database path
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'access.db')
+DB_PATH = DEFAULT_DB_PATH
 
 def get_db_connection():
     """Connessione al database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_connection(DB_PATH)
     except Exception as e:
         print(f"Errore connessione DB: {e}")
         return None
@@ -35,8 +35,10 @@ def utenti_autorizzati_page():
 @utenti_autorizzati_bp.route('/api/utenti-autorizzati/list')
 @require_auth()
 def api_list_utenti_autorizzati():
-    """Lista utenti autorizzati con filtro"""
-    search = request.args.get('search', '').strip().upper()
+    """Lista utenti autorizzati con filtro, a pagine"""
+    search = request.args.get('search', '').strip()
+    page = max(int(request.args.get('page', 1)), 1)
+    per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
     
     conn = get_db_connection()
     if not conn:
@@ -44,33 +46,27 @@ def api_list_utenti_autorizzati():
     
     try:
         cursor = conn.cursor()
-        
-        # Query base
-        query = """
-            SELECT codice_fiscale, nome, data_inserimento,
-                   data_aggiornamento, attivo, note,
-                   creato_da, modificato_da
-            FROM utenti_autorizzati
-            WHERE 1=1
+        colonne = """
+            u.codice_fiscale, u.nome, u.data_inserimento,
+            u.data_aggiornamento, u.attivo, u.note,
+            u.creato_da, u.modificato_da
         """
-        params = []
+        offset = (page - 1) * per_page
         
-        # Aggiungi filtro di ricerca se presente
         if search:
-            query += """
-                AND (
-                    UPPER(codice_fiscale) LIKE ? OR
-                    UPPER(nome) LIKE ?
-                )
-            """
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param])
-        
-        # Ordina per nome
-        query += " ORDER BY nome"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+            # Indice FTS5 trigram su CF e nome, risultati per rilevanza
+            results, total = cerca_utenti(conn, search, colonne, per_page, offset)
+        else:
+            # Ordina per nome (indice idx_utenti_nome)
+            cursor.execute('SELECT COUNT(*) FROM utenti_autorizzati')
+            total = cursor.fetchone()[0]
+            cursor.execute(f"""
+                SELECT {colonne}
+                FROM utenti_autorizzati u
+                ORDER BY u.nome
+                LIMIT ? OFFSET ?
+            """, (per_page, offset))
+            results = cursor.fetchall()
         
         utenti = []
         for row in results:
@@ -88,7 +84,10 @@ def api_list_utenti_autorizzati():
         return jsonify({
             'success': True,
             'utenti': utenti,
-            'total': len(utenti)
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': (total + per_page - 1) // per_page
         })
         
     except Exception as e:
@@ -138,6 +137,7 @@ def api_toggle_active():
         """, (int(new_state), session.get('username'), codice_fiscale))
         
         conn.commit()
+        get_authorization_index().reload_user(codice_fiscale, conn)
         
         status = "attivato" if new_state else "disattivato"
         return jsonify({
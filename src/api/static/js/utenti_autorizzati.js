@@ -6,6 +6,9 @@ const searchClear = document.getElementById('search-clear');
 const tableBody = document.getElementById('users-table-body');
 const loadingSpinner = document.getElementById('loading-spinner');
 const noResults = document.getElementById('no-results');
+const loadMore = document.getElementById('load-more');
+const loadMoreBtn = document.getElementById('load-more-btn');
+const resultsCount = document.getElementById('results-count');
 
 // Statistiche
 const statTotale = document.getElementById('stat-totale');
@@ -15,6 +18,13 @@ const statNuovi = document.getElementById('stat-nuovi');
 // Debounce per la ricerca
 let searchTimeout = null;
 
+// Paginazione lato server
+const PER_PAGE = 50;
+let currentPage = 1;
+let loadedUsers = 0;
+// Scarta le risposte di ricerche superate da una digitazione successiva
+let requestSeq = 0;
+
 // Carica dati iniziali
 document.addEventListener('DOMContentLoaded', () => {
     loadUsers();
@@ -35,6 +45,11 @@ searchClear.addEventListener('click', () => {
     loadUsers();
 });
 
+// Pagina successiva accodata alla tabella
+loadMoreBtn.addEventListener('click', () => {
+    loadUsers(searchInput.value, currentPage + 1);
+});
+
 // Carica statistiche
 async function loadStats() {
     try {
@@ -51,18 +66,32 @@ async function loadStats() {
     }
 }
 
-// Carica utenti con filtro opzionale
-async function loadUsers(search = '') {
-    showLoading(true);
+// Carica una pagina di utenti con filtro opzionale (page > 1 accoda)
+async function loadUsers(search = '', page = 1) {
+    const seq = ++requestSeq;
+    const append = page > 1;
+    if (!append) {
+        showLoading(true);
+    }
     
     try {
-        const url = `/api/utenti-autorizzati/list${search ? `?search=${encodeURIComponent(search)}` : ''}`;
-        const response = await fetch(url);
+        const params = new URLSearchParams({ page: page, per_page: PER_PAGE });
+        if (search) {
+            params.set('search', search);
+        }
+        const response = await fetch(`/api/utenti-autorizzati/list?${params}`);
         const data = await response.json();
+        if (seq !== requestSeq) {
+            return;
+        }
         
         if (data.success) {
-            renderUsers(data.utenti);
-            noResults.classList.toggle('d-none', data.utenti.length > 0);
+            currentPage = data.page;
+            loadedUsers = append ? loadedUsers + data.utenti.length : data.utenti.length;
+            renderUsers(data.utenti, append);
+            noResults.classList.toggle('d-none', data.total > 0);
+            resultsCount.textContent = `${loadedUsers} di ${data.total} utenti`;
+            loadMore.classList.toggle('d-none', loadedUsers >= data.total);
         } else {
             showError('Errore caricamento utenti');
         }
@@ -70,13 +99,17 @@ async function loadUsers(search = '') {
         console.error('Errore caricamento utenti:', error);
         showError('Errore di rete');
     } finally {
-        showLoading(false);
+        if (seq === requestSeq) {
+            showLoading(false);
+        }
     }
 }
 
 // Renderizza tabella utenti
-function renderUsers(users) {
-    tableBody.innerHTML = '';
+function renderUsers(users, append = false) {
+    if (!append) {
+        tableBody.innerHTML = '';
+    }
     
     users.forEach(user => {
         const row = document.createElement('tr');
@@ -1,16 +1,13 @@
 from flask import jsonify, session, redirect, request
-import sqlite3
-import os
+from database.pool import DEFAULT_DB_PATH, get_connection
 
-# Database path
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'access.db')
+# Database path (ACCESS_CONTROL_DB per istanze di test/benchmark, come database.pool)
+DB_PATH = DEFAULT_DB_PATH
 
 def get_db_connection():
     """Connessione database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_connection(DB_PATH)
     except Exception as e:
         print(f"Errore connessione DB: {e}")
         return None
@@ -4,9 +4,7 @@
 import os
 import sys
 import json
-import sqlite3
 import logging
-import shutil
 import subprocess
 import psutil
 import threading
@@ -39,12 +37,28 @@ import api.hardware_tests as hardware_tests
 import api.backup_module as backup_module
 import api.hardware_detection as hardware_detection
 from core.config import get_config_manager
+from database.auth_index import get_authorization_index
+from core.access_schedule import get_schedule_provider
+from core.access_engine import get_access_engine
+from core.tap_pipeline import TapPipeline
+from database.monthly_counters import get_monthly_counters
+from database.log_writer import get_log_writer
+from database.pool import (get_connection, get_read_connection, get_pool, get_writer,
+                           copy_database, release_thread_connections)
+from database.checkpoint import get_checkpoint_manager
+from database.log_filters import LogFilter, intervallo_periodo
+from database.log_partitions import sorgente_log, elenco_partizioni
+from database.schema import migrate, get_status as get_schema_status
+from database.database_manager import DatabaseManager
+from database.rollup import riepilogo
+from database.log_pagination import firma_filtro, decodifica_cursore, pagina, get_log_count_cache
 from api.dashboard_templates import LOGIN_TEMPLATE, get_dashboard_template, ADMIN_CONFIG_TEMPLATE, ADMIN_BACKUP_TEMPLATE
 
 # Importazioni hardware
 # CardReader importato dinamicamente per supportare sia CRT-285 che Omnikey
-from hardware.usb_rly08_controller import USBRLY08Controller
+from hardware.relay_session import get_relay_session
 from external.odoo_partner_connector import OdooPartnerConnector
+from external.sync_worker import get_sync_worker, STATI_FINALI
 
 # Importazioni dei moduli
 from api.modules.profilo import profilo_bp
@@ -53,7 +67,7 @@ from api.modules.log_management import log_management_bp
 from api.modules.utenti_autorizzati import utenti_autorizzati_bp
 from api.modules.system_users import system_users_bp
 from api.modules.activities import activities_bp
-from api.modules.configurazione_accessi import configurazione_accessi_bp, verifica_orario, verifica_limite_mensile
+from api.modules.configurazione_accessi import configurazione_accessi_bp
 from api.backup_module import backup_bp
 
 # Definizione dei tipi personalizzati
@@ -112,11 +126,26 @@ app.config.update(
     SESSION_COOKIE_SAMESITE='Lax'
 )
 
+@app.teardown_request
+def release_db_connections(exc=None):
+    """Restituisce al pool le connessioni non chiuse dalla richiesta"""
+    release_thread_connections()
+
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-# Database path persistente
-DB_PATH = '/opt/access_control/src/access.db'
+# Database path persistente (ACCESS_CONTROL_DB per istanze di test/benchmark)
+DB_PATH = os.getenv('ACCESS_CONTROL_DB', '/opt/access_control/src/access.db')
+
+# Colonne di log_accessi per lista ed export, lette per nome (row['...']);
+# {sorgente} è log_accessi o l'unione con i mesi archiviati (sorgente_log)
+SQL_LOG_ACCESSI_VISTA = '''
+    SELECT l.id, l.ts_epoch, l.timestamp, l.codice_fiscale, l.autorizzato, l.durata_elaborazione,
+           l.terminale_id, l.tipo_accesso, l.motivo_rifiuto, l.nome_utente,
+           u.nome AS nome_from_users
+    FROM {sorgente}
+    LEFT JOIN utenti_autorizzati u ON u.id = l.user_id
+'''
 
 # IMPORTA I MODULI DOPO aver definito le funzioni condivise
 from api.modules.profilo import profilo_bp
@@ -437,194 +466,26 @@ def authorize():
         logger.error(f"Errore generico autorizzazione: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def get_nome_installazione():
-    """Recupera il nome installazione dal database"""
-    try:
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT value FROM system_settings WHERE key = 'sistema.nome_installazione'")
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                return result[0]
-    except Exception as e:
-        logger.error(f"Errore recupero nome installazione: {e}")
-    return "Terminale"  # Default fallback
-
 def process_codice_fiscale(codice_fiscale):
     """
     Processa un codice fiscale per autorizzazione accesso.
     Questa funzione è usata sia dall'endpoint API che dal lettore Omnikey.
     """
-    start_time = time.time()
-    result = {
-        'authorized': False,
-        'user_name': None,
-        'error_message': None,
-        'tipo_accesso': 'NEGATO'  # AUTORIZZATO, NEGATO, FUORI_ORARIO, LIMITE_SUPERATO, UTENTE_DISATTIVATO
-    }
-    
-    # Maschera il CF per i log
     masked_cf = f"{codice_fiscale[:4]}***{codice_fiscale[-4:]}"
     logger.info(f"Elaborazione CF: {masked_cf}")
-    
-    # Variabili per il logging
-    processing_time = time.time() - start_time
-    tipo_accesso = 'NEGATO'
-    nome_utente = None
-    
-    # Recupera il nome dell'installazione
-    nome_terminale = get_nome_installazione()
-    
-    try:
-        # Connessione al database per registrare TUTTI gli accessi
-        conn = get_db_connection()
-        if not conn:
-            result['error_message'] = 'Database non disponibile'
-            return result
-        
-        cursor = conn.cursor()
-        
-        # 1. Prima verifica se l'utente esiste nel database
-        try:
-            cursor.execute('''
-                SELECT id, codice_fiscale, nome, attivo
-                FROM utenti_autorizzati 
-                WHERE codice_fiscale = ?
-            ''', (codice_fiscale,))
-            
-            user = cursor.fetchone()
-            if not user:
-                error_msg = 'Utente non trovato'
-                logger.warning(f"Accesso negato per CF {masked_cf}: utente non trovato")
-                result['error_message'] = error_msg
-                result['tipo_accesso'] = 'UTENTE_NON_TROVATO'
-                
-                # Registra accesso NEGATO per utente non trovato
-                cursor.execute('''
-                    INSERT INTO log_accessi 
-                    (timestamp, codice_fiscale, autorizzato, durata_elaborazione, terminale_id, motivo_rifiuto, tipo_accesso)
-                    VALUES (CURRENT_TIMESTAMP, ?, 0, ?, ?, ?, ?)
-                ''', (codice_fiscale, processing_time, nome_terminale, error_msg, 'UTENTE_NON_TROVATO'))
-                conn.commit()
-                conn.close()
-                return result
-            
-            nome_utente = user[2]
-            
-            if not user[3]:  # not attivo
-                error_msg = 'Utente disattivato'
-                logger.warning(f"Accesso negato per CF {masked_cf}: utente disattivato")
-                result['error_message'] = error_msg
-                result['tipo_accesso'] = 'UTENTE_DISATTIVATO'
-                
-                # Registra accesso NEGATO per utente disattivato
-                cursor.execute('''
-                    INSERT INTO log_accessi 
-                    (timestamp, codice_fiscale, autorizzato, durata_elaborazione, terminale_id, motivo_rifiuto, nome_utente, tipo_accesso)
-                    VALUES (CURRENT_TIMESTAMP, ?, 0, ?, ?, ?, ?, ?)
-                ''', (codice_fiscale, processing_time, nome_terminale, error_msg, nome_utente, 'UTENTE_DISATTIVATO'))
-                conn.commit()
-                conn.close()
-                return result
-
-            # 2. Solo se l'utente esiste ed è attivo, verifica l'orario
-            if not verifica_orario():
-                error_msg = 'Accesso non consentito in questo orario'
-                logger.warning(f"Accesso negato per CF {masked_cf}: fuori orario")
-                result['error_message'] = error_msg
-                result['tipo_accesso'] = 'FUORI_ORARIO'
-                
-                # Registra accesso NEGATO per fuori orario CON il nome utente
-                cursor.execute('''
-                    INSERT INTO log_accessi 
-                    (timestamp, codice_fiscale, autorizzato, durata_elaborazione, terminale_id, motivo_rifiuto, nome_utente, tipo_accesso)
-                    VALUES (CURRENT_TIMESTAMP, ?, 0, ?, ?, ?, ?, ?)
-                ''', (codice_fiscale, processing_time, nome_terminale, error_msg, nome_utente, 'FUORI_ORARIO'))
-                conn.commit()
-                conn.close()
-                return result
-
-            # 3. Verifica limite mensile
-            if not verifica_limite_mensile(codice_fiscale):
-                error_msg = 'Limite mensile accessi superato'
-                logger.warning(f"Accesso negato per CF {masked_cf}: limite mensile superato")
-                result['error_message'] = error_msg
-                result['tipo_accesso'] = 'LIMITE_SUPERATO'
-                
-                # Registra accesso NEGATO per limite superato
-                cursor.execute('''
-                    INSERT INTO log_accessi 
-                    (timestamp, codice_fiscale, autorizzato, durata_elaborazione, terminale_id, motivo_rifiuto, nome_utente, tipo_accesso)
-                    VALUES (CURRENT_TIMESTAMP, ?, 0, ?, ?, ?, ?, ?)
-                ''', (codice_fiscale, processing_time, nome_terminale, error_msg, nome_utente, 'LIMITE_SUPERATO'))
-                conn.commit()
-                conn.close()
-                return result
-
-            # 4. ACCESSO AUTORIZZATO - Incrementa contatore accessi
-            oggi = datetime.now()
-            cursor.execute('''
-                INSERT OR REPLACE INTO conteggio_ingressi_mensili 
-                (codice_fiscale, mese, anno, numero_ingressi, ultimo_ingresso)
-                VALUES (
-                    ?,
-                    ?,
-                    ?,
-                    COALESCE(
-                        (SELECT numero_ingressi + 1 
-                         FROM conteggio_ingressi_mensili 
-                         WHERE codice_fiscale = ? AND mese = ? AND anno = ?),
-                        1
-                    ),
-                    CURRENT_TIMESTAMP
-                )
-            ''', (codice_fiscale, oggi.month, oggi.year, codice_fiscale, oggi.month, oggi.year))
-
-            # 5. Log accesso AUTORIZZATO
-            cursor.execute('''
-                INSERT INTO log_accessi 
-                (timestamp, codice_fiscale, autorizzato, durata_elaborazione, terminale_id, nome_utente, tipo_accesso)
-                VALUES (CURRENT_TIMESTAMP, ?, 1, ?, ?, ?, ?)
-            ''', (codice_fiscale, processing_time, nome_terminale, nome_utente, 'AUTORIZZATO'))
-
-            conn.commit()
-            conn.close()
-
-            # 6. Imposta risultato positivo
-            result['authorized'] = True
-            result['user_name'] = nome_utente
-            result['tipo_accesso'] = 'AUTORIZZATO'
-            logger.info(f"Accesso autorizzato per {result['user_name']} (CF: {masked_cf})")
-            
-            return result
-
-        except Exception as e:
-            logger.error(f"Errore durante autorizzazione per CF {masked_cf}: {str(e)}")
-            result['error_message'] = str(e)
-            
-            # Registra anche gli errori
-            try:
-                cursor.execute('''
-                    INSERT INTO log_accessi 
-                    (timestamp, codice_fiscale, autorizzato, durata_elaborazione, terminale_id, motivo_rifiuto, tipo_accesso)
-                    VALUES (CURRENT_TIMESTAMP, ?, 0, ?, ?, ?, ?)
-                ''', (codice_fiscale, processing_time, nome_terminale, str(e), 'ERRORE'))
-                conn.commit()
-            except:
-                pass
-            
-            if conn:
-                conn.close()
-            return result
-        finally:
-            conn.close()
 
+    try:
+        # Utente, orario, limite, contatore e log in un'unica transazione
+        decision = get_access_engine(DB_PATH).decide(codice_fiscale)
+        return decision.to_result()
     except Exception as e:
         logger.error(f"Errore generico autorizzazione: {str(e)}")
-        result['error_message'] = str(e)
-        return result
+        return {
+            'authorized': False,
+            'user_name': None,
+            'error_message': str(e),
+            'tipo_accesso': 'ERRORE'
+        }
 
 # ===============================
 # API ENDPOINTS - DATI
@@ -634,31 +495,15 @@ def process_codice_fiscale(codice_fiscale):
 @require_auth()
 def api_stats():
     """Statistiche usando schema database_manager.py"""
-    conn = get_db_connection()
+    conn = get_db_read_connection()
     if not conn:
         return jsonify({'error': 'Database non disponibile'}), 500
     
     try:
-        cursor = conn.cursor()
-        
-        # Oggi
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        # Accessi oggi
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM log_accessi 
-            WHERE DATE(timestamp) = ?
-        """, (today,))
-        accessi_oggi = cursor.fetchone()[0]
-        
-        # Accessi autorizzati oggi
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM log_accessi 
-            WHERE DATE(timestamp) = ? AND autorizzato = 1
-        """, (today,))
-        autorizzati_oggi = cursor.fetchone()[0]
+        # Oggi (mezzanotte locale → mezzanotte successiva) dai contatori orari
+        oggi = riepilogo(conn, intervallo_periodo('oggi'))
+        accessi_oggi = oggi['totale']
+        autorizzati_oggi = oggi['autorizzati']
         
         return jsonify({
             'accessi_oggi': accessi_oggi,
@@ -709,8 +554,8 @@ def api_recent_accesses():
                 la.autorizzato,
                 COALESCE(ua.nome, 'Utente sconosciuto') as nome_completo
             FROM log_accessi la
-            LEFT JOIN utenti_autorizzati ua ON la.codice_fiscale = ua.codice_fiscale
-            ORDER BY la.timestamp DESC
+            LEFT JOIN utenti_autorizzati ua ON ua.id = la.user_id
+            ORDER BY la.ts_epoch DESC, la.id DESC
             LIMIT ?
         """, (limit,))
         
@@ -775,22 +620,22 @@ def api_hardware_stop_reader():
 @require_auth()
 @require_permission('all')
 def api_odoo_sync():
-    """Forza la sincronizzazione con Odoo"""
+    """Accoda una sincronizzazione con Odoo (eseguita in background dal worker)"""
     try:
-        success, stats = perform_odoo_sync()
+        job = perform_odoo_sync()
         
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f"Sincronizzazione completata: {stats['added']} cittadini aggiunti",
-                'stats': stats
-            })
-        else:
+        if not job:
             return jsonify({
                 'success': False,
-                'error': "Sincronizzazione fallita",
-                'stats': stats
-            }), 500
+                'error': "Connettore Odoo non configurato"
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'message': f"Sincronizzazione accodata (job #{job['id']})",
+            'job': job,
+            'progress_url': f"/api/odoo/sync/progress?job={job['id']}"
+        }), 202
             
     except Exception as e:
         logger.error(f"Errore API sync Odoo: {e}")
@@ -799,6 +644,42 @@ def api_odoo_sync():
             'error': str(e)
         }), 500
 
+@app.route('/api/odoo/sync/progress')
+@require_auth()
+def api_odoo_sync_progress():
+    """Avanzamento di un job di sync (ultimo se manca ?job=) in streaming Server-Sent Events"""
+    worker = get_sync_worker()
+    if not worker:
+        return jsonify({
+            'success': False,
+            'error': "Connettore Odoo non configurato"
+        }), 404
+    
+    job = worker.job(request.args.get('job', type=int))
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': "Job di sincronizzazione non trovato"
+        }), 404
+    
+    def eventi():
+        # Un evento a ogni cambiamento del job, fino alla sua conclusione
+        versione = -1
+        while True:
+            corrente = worker.attendi(job['id'], versione, timeout=15.0)
+            if corrente is None:
+                return
+            if corrente['versione'] == versione:
+                yield ": keep-alive\n\n"
+                continue
+            versione = corrente['versione']
+            yield f"data: {json.dumps(corrente)}\n\n"
+            if corrente['stato'] in STATI_FINALI:
+                return
+    
+    return Response(eventi(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/odoo/status')
 @require_auth()
 def api_odoo_status():
@@ -811,6 +692,8 @@ def api_odoo_status():
             }), 404
         
         status = odoo_connector.get_sync_status()
+        worker = get_sync_worker()
+        status['worker'] = worker.get_status() if worker else None
         
         return jsonify({
             'success': True,
@@ -847,6 +730,36 @@ def api_hardware_status():
     test_id = request.args.get('test_id')
     return hardware_tests.get_hardware_status(test_id)
 
+@app.route('/api/hardware/relay-session')
+@require_auth()
+def api_relay_session_status():
+    """Stato sessione USB-RLY08 e azioni relè programmate"""
+    return jsonify({'success': True, 'sessione': get_relay_session().get_status()})
+
+@app.route('/api/database/status')
+@require_auth()
+def api_database_status():
+    """Versione schema, WAL, checkpoint, connessioni del processo web e partizioni log"""
+    return jsonify({
+        'success': True,
+        'schema': get_schema_status(DB_PATH),
+        'checkpoint': get_checkpoint_manager(DB_PATH).get_status(),
+        'writer': get_writer(DB_PATH).get_status(),
+        'pool': get_pool(DB_PATH).get_status(),
+        'pool_lettura': get_pool(DB_PATH, query_only=True).get_status(),
+        'partizioni_log': _partizioni_log()
+    })
+
+def _partizioni_log():
+    """Mesi di log_accessi sigillati nell'archivio o compressi"""
+    conn = get_db_read_connection()
+    if not conn:
+        return []
+    try:
+        return elenco_partizioni(conn)
+    finally:
+        conn.close()
+
 # ===============================
 # API ENDPOINTS - RILEVAMENTO HARDWARE
 # ===============================
@@ -1821,7 +1734,7 @@ def api_get_log_accessi():
         # Recupera timezone configurato
         timezone_name = 'Europe/Rome'  # Default
         try:
-            conn_tz = get_db_connection()
+            conn_tz = get_db_read_connection()
             if conn_tz:
                 cursor_tz = conn_tz.cursor()
                 cursor_tz.execute("SELECT value FROM system_settings WHERE key = 'sistema.timezone'")
@@ -1835,8 +1748,9 @@ def api_get_log_accessi():
         tz = pytz.timezone(timezone_name)
         utc = pytz.utc
         
-        # Parametri filtri
+        # Parametri filtri; cursor è il token della pagina restituito dalla richiesta precedente
         page = int(request.args.get('page', 1))
+        cursor_token = request.args.get('cursor', '')
         periodo = request.args.get('periodo', 'mese')
         data_inizio = request.args.get('data_inizio', '')
         data_fine = request.args.get('data_fine', '')
@@ -1845,59 +1759,50 @@ def api_get_log_accessi():
         
         # Configurazione paginazione
         records_per_page = 50
-        offset = (page - 1) * records_per_page
         
-        conn = get_db_connection()
+        conn = get_db_read_connection()
         if not conn:
             return jsonify({'error': 'Database non disponibile'}), 500
         
         cursor = conn.cursor()
         
-        # Costruisci query con filtri - join con utenti_autorizzati per il nome
-        query = """
-            SELECT l.*, u.nome as nome_from_users 
-            FROM log_accessi l
-            LEFT JOIN utenti_autorizzati u ON l.codice_fiscale = u.codice_fiscale
-            WHERE 1=1
-        """
-        params = []
-        
-        # Filtro periodo
-        if periodo == 'oggi':
-            query += " AND DATE(timestamp) = DATE('now')"
-        elif periodo == 'settimana':
-            query += " AND DATE(timestamp) >= DATE('now', '-7 days')"
-        elif periodo == 'mese':
-            query += " AND strftime('%Y-%m', timestamp) = strftime('%Y-%m', 'now')"
-        elif periodo == 'custom' and data_inizio and data_fine:
-            query += " AND DATE(timestamp) BETWEEN ? AND ?"
-            params.extend([data_inizio, data_fine])
-        
-        # Filtro tipo accesso
-        if tipo_accesso:
-            query += " AND tipo_accesso = ?"
-            params.append(tipo_accesso)
-        
-        # Filtro codice fiscale
-        if codice_fiscale:
-            query += " AND codice_fiscale LIKE ?"
-            params.append(f'%{codice_fiscale}%')
-        
-        # Conta totale record con filtri
-        count_query = query.replace("SELECT l.*, u.nome as nome_from_users", "SELECT COUNT(*)")
-        cursor.execute(count_query, params)
-        total_records = cursor.fetchone()[0]
+        # Filtri: il periodo diventa un intervallo su ts_epoch (ricerca sull'indice)
+        filtro = (LogFilter('l')
+                  .periodo(periodo, data_inizio, data_fine, tz)
+                  .uguale('tipo_accesso', tipo_accesso)
+                  .contiene_cf(codice_fiscale))
+        firma = firma_filtro(filtro.where(), filtro.params)
+        try:
+            dopo = decodifica_cursore(cursor_token, firma)
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
+        
+        # Totale dalla cache per filtro: ricontate solo le righe arrivate dopo l'ultima richiesta
+        total_records = get_log_count_cache().conta(
+            conn, sorgente_log(conn, filtro.estremi, filtro.alias), filtro.where(), filtro.params, filtro.alias
+        )
         total_pages = (total_records + records_per_page - 1) // records_per_page
         
-        # Query con paginazione
-        query += " ORDER BY timestamp DESC LIMIT ? OFFSET ?"
-        params.extend([records_per_page, offset])
+        # Keyset su (ts_epoch, id): ogni pagina parte dall'indice, come la prima
+        filtro.dopo(dopo)
+        offset = (page - 1) * records_per_page if dopo is None else 0  # client senza cursore
+        # Solo log_accessi per il mese corrente, unione con l'archivio per i mesi sigillati
+        sorgente = sorgente_log(conn, filtro.estremi, filtro.alias)
+        
+        # Join con utenti_autorizzati per il nome; una riga in più segnala la pagina successiva
+        query = f"""
+            {SQL_LOG_ACCESSI_VISTA.format(sorgente=sorgente)}
+            WHERE {filtro.where()}
+            ORDER BY l.ts_epoch DESC, l.id DESC LIMIT ? OFFSET ?
+        """
+        cursor.execute(query, [*filtro.params, records_per_page + 1, offset])
+        rows, next_cursor = pagina(cursor.fetchall(), records_per_page, firma)
         
-        cursor.execute(query, params)
         logs = []
-        for row in cursor.fetchall():
+        for row in rows:
             # Converti timestamp da UTC a timezone configurato
-            timestamp_str = row[1]
+            timestamp_str = row['timestamp']
             try:
                 # Parse timestamp from database (assumed to be UTC)
                 dt_utc = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
@@ -1909,23 +1814,19 @@ def api_get_log_accessi():
                 logger.error(f"Errore conversione timestamp: {e}")
                 timestamp_converted = timestamp_str
             
-            # Map columns correctly
             log_entry = {
-                'id': row[0],
+                'id': row['id'],
                 'timestamp': timestamp_converted,
-                'codice_fiscale': row[2],
-                'autorizzato': row[3],
-                'durata_elaborazione': float(row[4]) if row[4] else 0.0,
-                'terminale_id': row[7] if len(row) > 7 else None,
-                'tipo_accesso': row[14] if len(row) > 14 else None,
-                'motivo_rifiuto': row[15] if len(row) > 15 else None,
-                'nome_utente': row[16] if len(row) > 16 else None
+                'codice_fiscale': row['codice_fiscale'],
+                'autorizzato': row['autorizzato'],
+                'durata_elaborazione': float(row['durata_elaborazione']) if row['durata_elaborazione'] else 0.0,
+                'terminale_id': row['terminale_id'],
+                'tipo_accesso': row['tipo_accesso'],
+                'motivo_rifiuto': row['motivo_rifiuto'],
+                # Nome attuale da utenti_autorizzati, altrimenti quello registrato nel log
+                'nome_utente': row['nome_from_users'] or row['nome_utente']
             }
             
-            # Use joined nome_utente from utenti_autorizzati if available
-            if len(row) > 17 and row[17]:
-                log_entry['nome_utente'] = row[17]
-            
             # Se nome_utente ancora vuoto, mostra '-'
             if not log_entry['nome_utente']:
                 log_entry['nome_utente'] = '-'
@@ -1955,17 +1856,12 @@ def api_get_log_accessi():
             
             logs.append(log_entry)
         
-        # Calcola statistiche
-        stats_query = """
-            SELECT 
-                SUM(CASE WHEN autorizzato = 1 THEN 1 ELSE 0 END) as autorizzati,
-                SUM(CASE WHEN autorizzato = 0 THEN 1 ELSE 0 END) as negati,
-                SUM(CASE WHEN tipo_accesso = 'FUORI_ORARIO' THEN 1 ELSE 0 END) as fuori_orario,
-                SUM(CASE WHEN DATE(timestamp) = DATE('now') THEN 1 ELSE 0 END) as oggi
-            FROM log_accessi
-        """
-        cursor.execute(stats_query)
-        stats = cursor.fetchone()
+        # Statistiche sul periodo selezionato dai contatori giornalieri/orari
+        periodo_filtro = LogFilter('l').periodo(periodo, data_inizio, data_fine, tz)
+        stats = riepilogo(conn, periodo_filtro.estremi, tz)
+        # 'oggi' conta gli accessi di oggi che ricadono nel periodo
+        oggi = LogFilter().intervallo(periodo_filtro.estremi).intervallo(intervallo_periodo('oggi', tz=tz)).estremi
+        stats_oggi = riepilogo(conn, oggi, tz) if oggi[0] < oggi[1] else {'totale': 0}
         
         conn.close()
         
@@ -1974,11 +1870,12 @@ def api_get_log_accessi():
             'total_records': total_records,
             'total_pages': total_pages,
             'current_page': page,
+            'next_cursor': next_cursor,
             'statistics': {
-                'autorizzati': stats[0] or 0,
-                'negati': stats[1] or 0,
-                'fuori_orario': stats[2] or 0,
-                'oggi': stats[3] or 0
+                'autorizzati': stats['autorizzati'],
+                'negati': stats['negati'],
+                'fuori_orario': stats['per_tipo'].get('FUORI_ORARIO', 0),
+                'oggi': stats_oggi['totale']
             }
         })
     except Exception as e:
@@ -2000,7 +1897,7 @@ def api_export_log_accessi():
         # Recupera timezone configurato
         timezone_name = 'Europe/Rome'  # Default
         try:
-            conn_tz = get_db_connection()
+            conn_tz = get_db_read_connection()
             if conn_tz:
                 cursor_tz = conn_tz.cursor()
                 cursor_tz.execute("SELECT value FROM system_settings WHERE key = 'sistema.timezone'")
@@ -2021,40 +1918,25 @@ def api_export_log_accessi():
         tipo_accesso = request.args.get('tipo', '')
         codice_fiscale = request.args.get('codice_fiscale', '')
         
-        conn = get_db_connection()
+        conn = get_db_read_connection()
         if not conn:
             return jsonify({'error': 'Database non disponibile'}), 500
         
         cursor = conn.cursor()
         
         # Costruisci query con filtri (come sopra)
-        query = """
-            SELECT l.*, u.nome as nome_from_users 
-            FROM log_accessi l
-            LEFT JOIN utenti_autorizzati u ON l.codice_fiscale = u.codice_fiscale
-            WHERE 1=1
+        filtro = (LogFilter('l')
+                  .periodo(periodo, data_inizio, data_fine, tz)
+                  .uguale('tipo_accesso', tipo_accesso)
+                  .contiene_cf(codice_fiscale))
+        sorgente = sorgente_log(conn, filtro.estremi, filtro.alias)
+        query = f"""
+            {SQL_LOG_ACCESSI_VISTA.format(sorgente=sorgente)}
+            WHERE {filtro.where()}
         """
-        params = []
+        params = list(filtro.params)
         
-        if periodo == 'oggi':
-            query += " AND DATE(timestamp) = DATE('now')"
-        elif periodo == 'settimana':
-            query += " AND DATE(timestamp) >= DATE('now', '-7 days')"
-        elif periodo == 'mese':
-            query += " AND strftime('%Y-%m', timestamp) = strftime('%Y-%m', 'now')"
-        elif periodo == 'custom' and data_inizio and data_fine:
-            query += " AND DATE(timestamp) BETWEEN ? AND ?"
-            params.extend([data_inizio, data_fine])
-        
-        if tipo_accesso:
-            query += " AND tipo_accesso = ?"
-            params.append(tipo_accesso)
-        
-        if codice_fiscale:
-            query += " AND codice_fiscale LIKE ?"
-            params.append(f'%{codice_fiscale}%')
-        
-        query += " ORDER BY timestamp DESC"
+        query += " ORDER BY l.ts_epoch DESC, l.id DESC"
         
         if format_type == 'csv':
             cursor.execute(query, params)
@@ -2065,7 +1947,7 @@ def api_export_log_accessi():
             
             for row in cursor.fetchall():
                 # Converti timestamp da UTC a timezone configurato
-                timestamp_str = row[1]
+                timestamp_str = row['timestamp']
                 try:
                     dt_utc = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
                     dt_utc = utc.localize(dt_utc)
@@ -2076,13 +1958,13 @@ def api_export_log_accessi():
                 
                 writer.writerow([
                     timestamp_converted,  # timestamp convertito
-                    row[2],  # codice_fiscale  
-                    row[17] if len(row) > 17 else row[16] if len(row) > 16 else '-',  # nome_utente dalla join
-                    'Si' if row[3] else 'No',  # autorizzato
-                    row[14] if len(row) > 14 else '',  # tipo_accesso
-                    row[15] if len(row) > 15 else '',  # motivo_rifiuto
-                    row[7] or '',  # terminale_id
-                    f"{float(row[4]):.2f}" if row[4] else '0.00'  # durata_elaborazione
+                    row['codice_fiscale'],
+                    row['nome_from_users'] or row['nome_utente'] or '-',
+                    'Si' if row['autorizzato'] else 'No',
+                    row['tipo_accesso'] or '',
+                    row['motivo_rifiuto'] or '',
+                    row['terminale_id'] or '',
+                    f"{float(row['durata_elaborazione']):.2f}" if row['durata_elaborazione'] else '0.00'
                 ])
             
             conn.close()
@@ -2117,7 +1999,7 @@ def api_export_log_accessi():
                 # Dati
                 for row in cursor.fetchall():
                     # Converti timestamp da UTC a timezone configurato
-                    timestamp_str = row[1]
+                    timestamp_str = row['timestamp']
                     try:
                         dt_utc = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
                         dt_utc = utc.localize(dt_utc)
@@ -2128,13 +2010,13 @@ def api_export_log_accessi():
                     
                     ws.append([
                         timestamp_converted,
-                        row[2],
-                        row[17] if len(row) > 17 else row[16] if len(row) > 16 else '-',
-                        'Si' if row[3] else 'No',
-                        row[14] if len(row) > 14 else '',
-                        row[15] if len(row) > 15 else '',
-                        row[7] or '',
-                        f"{float(row[4]):.2f}" if row[4] else '0.00'
+                        row['codice_fiscale'],
+                        row['nome_from_users'] or row['nome_utente'] or '-',
+                        'Si' if row['autorizzato'] else 'No',
+                        row['tipo_accesso'] or '',
+                        row['motivo_rifiuto'] or '',
+                        row['terminale_id'] or '',
+                        f"{float(row['durata_elaborazione']):.2f}" if row['durata_elaborazione'] else '0.00'
                     ])
                 
                 conn.close()
@@ -2194,7 +2076,7 @@ def api_export_log_accessi():
                 else:
                     for row in rows:
                         # Converti timestamp da UTC a timezone configurato
-                        timestamp_str = row[1] if row[1] else ''
+                        timestamp_str = row['timestamp'] or ''
                         try:
                             if timestamp_str:
                                 dt_utc = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
@@ -2206,19 +2088,15 @@ def api_export_log_accessi():
                         except:
                             timestamp_converted = timestamp_str
                         
-                        nome_utente = '-'
-                        if len(row) > 17 and row[17]:
-                            nome_utente = str(row[17])[:20]
-                        elif len(row) > 16 and row[16]:
-                            nome_utente = str(row[16])[:20]
+                        nome_utente = str(row['nome_from_users'] or row['nome_utente'] or '-')[:20]
                         
                         data.append([
                             timestamp_converted,
-                            str(row[2])[:16] if row[2] else '',  # codice fiscale
-                            nome_utente,  # nome utente
-                            'Si' if row[3] else 'No',
-                            str(row[14])[:15] if len(row) > 14 and row[14] else '',  # tipo_accesso
-                            str(row[7])[:15] if row[7] else ''  # terminale
+                            str(row['codice_fiscale'] or '')[:16],
+                            nome_utente,
+                            'Si' if row['autorizzato'] else 'No',
+                            str(row['tipo_accesso'] or '')[:15],
+                            str(row['terminale_id'] or '')[:15]
                         ])
                 
                 # Crea tabella
@@ -2272,58 +2150,42 @@ def api_export_log_accessi():
 def test_relay_config():
     """Testa la configurazione dei relè (simula tessera valida)"""
     try:
-        # Crea una nuova connessione al controller (come fa test_gate)
-        from hardware.usb_rly08_controller import USBRLY08Controller
-        controller = USBRLY08Controller()
-        
-        if not controller.connect():
+        relay = get_relay_session()
+        if not relay.ensure_connected():
             return jsonify({'success': False, 'error': 'Impossibile connettersi al controller relè'}), 500
         
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database non disponibile'}), 500
+        
         try:
-            conn = get_db_connection()
-            if not conn:
-                controller.disconnect()
-                return jsonify({'success': False, 'error': 'Database non disponibile'}), 500
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT relay_number, description, valid_action, valid_duration 
+                FROM relay_config
+                WHERE valid_action != 'OFF'
+                ORDER BY relay_number
+            """)
+            configs = cursor.fetchall()
             
-            try:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT relay_number, description, valid_action, valid_duration 
-                    FROM relay_config
-                    WHERE valid_action != 'OFF'
-                    ORDER BY relay_number
-                """)
-                configs = cursor.fetchall()
+            # Applica configurazione per tessera valida (una sola scrittura, con verifica)
+            accensioni = {}
+            for relay_num, description, action, duration in configs:
+                logger.info(f"Test relè {relay_num} ({description}): {action} per {duration}s")
                 
-                # Applica configurazione per tessera valida
-                for relay_num, description, action, duration in configs:
-                    logger.info(f"Test relè {relay_num} ({description}): {action} per {duration}s")
-                    
-                    if action == 'ON':
-                        # Accendi relè
-                        controller._send_command(100 + relay_num)
-                        if duration > 0:
-                            # Programma spegnimento
-                            threading.Timer(duration, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                            
-                    elif action == 'PULSE':
-                        # Impulso: accendi e spegni dopo durata
-                        controller._send_command(100 + relay_num)
-                        if duration > 0:
-                            threading.Timer(duration, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                        else:
-                            # Impulso breve default 500ms
-                            threading.Timer(0.5, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                
-                # Disconnetti dopo un delay per permettere ai timer di eseguire
-                threading.Timer(10.0, controller.disconnect).start()
-                
-                return jsonify({'success': True, 'message': 'Test configurazione avviato'})
-            finally:
-                conn.close()
-        except Exception as e:
-            controller.disconnect()
-            raise e
+                if action == 'ON':
+                    # Accendi relè (spegnimento programmato se ha una durata)
+                    accensioni[relay_num] = duration if duration > 0 else None
+                        
+                elif action == 'PULSE':
+                    # Impulso: accendi e spegni dopo durata (default 500ms)
+                    accensioni[relay_num] = duration if duration > 0 else 0.5
+            if accensioni:
+                relay.apply_relays(accensioni, verify=True)
+            
+            return jsonify({'success': True, 'message': 'Test configurazione avviato'})
+        finally:
+            conn.close()
             
     except Exception as e:
         logger.error(f"Errore test configurazione relè: {e}")
@@ -2343,57 +2205,32 @@ def get_db_connection():
             
         # Crea il database se non esiste
         if not os.path.exists(DB_PATH):
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
             print(f"Database creato in: {DB_PATH}")
-            return conn
             
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_connection(DB_PATH)
     except Exception as e:
         print(f"Errore connessione DB: {e}")
         return None
 
-def ensure_system_settings_table():
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS system_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            conn.commit()
-        finally:
-            conn.close()
-
-def ensure_eventi_sistema_table():
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS eventi_sistema (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tipo_evento TEXT,
-                    livello TEXT,
-                    messaggio TEXT,
-                    componente TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            conn.commit()
-        finally:
-            conn.close()
+def get_db_read_connection():
+    """Connessione in sola lettura per dashboard ed export (non blocca le scritture)"""
+    try:
+        return get_read_connection(DB_PATH)
+    except Exception as e:
+        print(f"Errore connessione DB: {e}")
+        return None
 
 # Ora puoi chiamarla!
 config_manager = get_config_manager()
-ensure_system_settings_table()
-ensure_eventi_sistema_table()
+migrate(DB_PATH)
+
+# Carica indice autorizzazioni in memoria (percorso tessera senza query utenti)
+get_authorization_index(DB_PATH)
+get_schedule_provider(DB_PATH)
+get_monthly_counters(DB_PATH)
+get_log_writer(DB_PATH)
+get_access_engine(DB_PATH)
+get_checkpoint_manager(DB_PATH)
 
 def check_main_process():
     """Controlla se il processo main.py è in esecuzione"""
@@ -2429,96 +2266,82 @@ card_reader = None
 card_reader_thread = None
 card_reader_running = False
 odoo_connector = None
-odoo_sync_thread = None
-odoo_sync_running = False
+
+tap_pipeline = None
 
 def handle_card_read(codice_fiscale):
     """
     Gestisce la lettura di una tessera dal lettore Omnikey.
     Questa funzione viene chiamata dal CardReader quando viene letta una tessera.
+    Decisione e relè avvengono subito; log_accessi viene scritto in background.
     """
+    global tap_pipeline
     logger.info(f"Tessera letta dal lettore Omnikey: {codice_fiscale[:4]}***{codice_fiscale[-4:]}")
     
-    # Processa il codice fiscale
-    result = process_codice_fiscale(codice_fiscale)
+    if tap_pipeline is None:
+        tap_pipeline = TapPipeline(get_access_engine(DB_PATH), actuate_card_read)
+    
+    durata_lettura = getattr(card_reader, 'last_read_duration', None)
+    decision, timings = tap_pipeline.process(codice_fiscale, durata_lettura=durata_lettura)
+    logger.info(f"⏱️ Tessera → relè in {timings.fino_al_cancello * 1000:.0f}ms "
+                f"(decisione {timings.decisione * 1000:.1f}ms, relè {timings.attuazione * 1000:.1f}ms)")
+
+def actuate_card_read(decision):
+    """Stadio attuazione: aziona i relè secondo relay_config in base alla decisione"""
+    result = decision.to_result()
     
     # Gestisci l'hardware usando la configurazione dinamica del database
+    # (sessione USB-RLY08 persistente: nessuna connessione per tessera)
     try:
-        controller = USBRLY08Controller()
-        if controller.connect():
+        relay = get_relay_session()
+        # Recupera configurazione relè dal database
+        conn = get_db_connection()
+        if conn:
             try:
-                # Recupera configurazione relè dal database
-                conn = get_db_connection()
-                if conn:
-                    try:
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            SELECT relay_number, description, valid_action, valid_duration, 
-                                   invalid_action, invalid_duration 
-                            FROM relay_config
-                            ORDER BY relay_number
-                        """)
-                        configs = cursor.fetchall()
-                        
-                        # Applica configurazione in base al risultato
-                        for relay_num, description, valid_action, valid_duration, invalid_action, invalid_duration in configs:
-                            if result['authorized']:
-                                # Applica azione per CF valido
-                                if valid_action != 'OFF':
-                                    logger.info(f"CF valido - Relè {relay_num} ({description}): {valid_action} per {valid_duration}s")
-                                    
-                                    if valid_action == 'ON':
-                                        controller._send_command(100 + relay_num)  # Accendi
-                                        if valid_duration > 0:
-                                            threading.Timer(valid_duration, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                                    elif valid_action == 'PULSE':
-                                        controller._send_command(100 + relay_num)  # Accendi
-                                        duration = valid_duration if valid_duration > 0 else 0.5
-                                        threading.Timer(duration, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                            else:
-                                # Applica azione per CF non valido
-                                if invalid_action != 'OFF':
-                                    logger.info(f"CF non valido - Relè {relay_num} ({description}): {invalid_action} per {invalid_duration}s")
-                                    
-                                    if invalid_action == 'ON':
-                                        controller._send_command(100 + relay_num)  # Accendi
-                                        if invalid_duration > 0:
-                                            threading.Timer(invalid_duration, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                                    elif invalid_action == 'PULSE':
-                                        controller._send_command(100 + relay_num)  # Accendi
-                                        duration = invalid_duration if invalid_duration > 0 else 0.5
-                                        threading.Timer(duration, lambda rn=relay_num, ctrl=controller: ctrl._send_command(110 + rn)).start()
-                        
-                        # Mantieni la connessione aperta per permettere ai timer di eseguire
-                        # Si disconnetterà automaticamente dopo il tempo più lungo configurato
-                        max_duration = max([cfg[3] if result['authorized'] else cfg[5] for cfg in configs], default=0)
-                        if max_duration > 0:
-                            threading.Timer(max_duration + 1.0, controller.disconnect).start()
-                        else:
-                            threading.Timer(5.0, controller.disconnect).start()
-                        
-                        if result['authorized']:
-                            logger.info(f"Accesso autorizzato - Azioni relè eseguite")
-                        else:
-                            logger.warning(f"Accesso negato: {result['error_message']}")
-                            
-                    finally:
-                        conn.close()
-                else:
-                    # Fallback alla configurazione di default se DB non disponibile
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT relay_number, description, valid_action, valid_duration, 
+                           invalid_action, invalid_duration 
+                    FROM relay_config
+                    ORDER BY relay_number
+                """)
+                configs = cursor.fetchall()
+                
+                # Applica configurazione in base al risultato: tutte le accensioni
+                # escono con una sola scrittura del byte di stato
+                accensioni = {}
+                for relay_num, description, valid_action, valid_duration, invalid_action, invalid_duration in configs:
                     if result['authorized']:
-                        controller.access_granted()
-                        controller.open_gate(8.0)
-                        logger.info(f"Cancello aperto per accesso autorizzato (config default)")
+                        action, duration, etichetta = valid_action, valid_duration, "CF valido"
                     else:
-                        controller.access_denied()
-                        logger.warning(f"Accesso negato (config default): {result['error_message']}")
-                    threading.Timer(10.0, controller.disconnect).start()
-            except Exception as e:
-                controller.disconnect()
-                raise e
+                        action, duration, etichetta = invalid_action, invalid_duration, "CF non valido"
+                    if action == 'OFF':
+                        continue
+                    logger.info(f"{etichetta} - Relè {relay_num} ({description}): {action} per {duration}s")
+                    
+                    if action == 'ON':
+                        accensioni[relay_num] = duration if duration > 0 else None
+                    elif action == 'PULSE':
+                        accensioni[relay_num] = duration if duration > 0 else 0.5
+                if accensioni:
+                    relay.apply_relays(accensioni)
+                
+                if result['authorized']:
+                    logger.info(f"Accesso autorizzato - Azioni relè eseguite")
+                else:
+                    logger.warning(f"Accesso negato: {result['error_message']}")
+                    
+            finally:
+                conn.close()
         else:
-            logger.error("Errore connessione controller USB-RLY08")
+            # Fallback alla configurazione di default se DB non disponibile
+            if result['authorized']:
+                relay.access_granted()
+                relay.open_gate(8.0)
+                logger.info(f"Cancello aperto per accesso autorizzato (config default)")
+            else:
+                relay.access_denied()
+                logger.warning(f"Accesso negato (config default): {result['error_message']}")
     except Exception as e:
         logger.error(f"Errore hardware durante gestione tessera: {str(e)}")
 
@@ -2575,13 +2398,16 @@ def stop_card_reader():
         if card_reader:
             card_reader.stop()
         card_reader_running = False
+        # Completa le registrazioni delle ultime letture
+        if tap_pipeline:
+            tap_pipeline.shutdown()
         logger.info("Lettore tessere arrestato")
     except Exception as e:
         logger.error(f"Errore arresto lettore tessere: {str(e)}")
 
 # Funzioni per la sincronizzazione con Odoo
 def configure_odoo_connector():
-    """Configura il connettore Odoo"""
+    """Configura il connettore Odoo e avvia il worker di sincronizzazione"""
     global odoo_connector
     
     try:
@@ -2611,136 +2437,57 @@ def configure_odoo_connector():
         # Inizializza il connettore
         mock_config_manager = MockConfigManager()
         odoo_connector = OdooPartnerConnector(mock_config_manager)
+        odoo_connector.configure_connection(
+            url=odoo_config['url'],
+            database=odoo_config['database'],
+            username=odoo_config['username'],
+            password=odoo_config['password'],
+            comune=odoo_config['comune'],
+            sync_interval=odoo_config['sync_interval_hours'] * 3600
+        )
         
-        # Configura le credenziali
-        odoo_connector.url = odoo_config['url']
-        odoo_connector.db = odoo_config['database']
-        odoo_connector.username = odoo_config['username']
-        odoo_connector.password = odoo_config['password']
-        
-        # Cerca di autenticarsi
-        if odoo_connector.authenticate():
-            logger.info("✅ Connessione Odoo stabilita")
-            # Avvia sync automatico in thread
-            start_odoo_sync(odoo_config['sync_interval_hours'])
-        else:
-            logger.warning("⚠️ Impossibile connettersi a Odoo - sync disabilitato")
+        # Nessun test bloccante: la connessione avviene nel job di sync
+        start_odoo_sync(odoo_config['sync_interval_hours'])
+        return True
             
     except Exception as e:
         logger.error(f"Errore configurazione Odoo: {e}")
         logger.warning("Sync Odoo disabilitato")
+        return False
 
 def start_odoo_sync(interval_hours=12):
-    """Avvia la sincronizzazione periodica con Odoo"""
-    global odoo_sync_thread, odoo_sync_running
-    
-    if odoo_sync_running:
-        logger.warning("Sync Odoo già in esecuzione")
-        return
-    
-    def sync_loop():
-        while odoo_sync_running:
-            try:
-                logger.info("🔄 Avvio sincronizzazione con Odoo...")
-                success, stats = perform_odoo_sync()
-                if success:
-                    logger.info(f"✅ Sync completato: {stats}")
-                else:
-                    logger.error(f"❌ Sync fallito: {stats}")
-            except Exception as e:
-                logger.error(f"Errore durante sync: {e}")
-            
-            # Attendi il prossimo sync
-            for i in range(interval_hours * 3600):
-                if not odoo_sync_running:
-                    break
-                time.sleep(1)
+    """Avvia il worker di sincronizzazione Odoo e accoda la sync iniziale"""
+    if not odoo_connector:
+        logger.warning("Connettore Odoo non configurato")
+        return None
     
-    odoo_sync_running = True
-    odoo_sync_thread = threading.Thread(target=sync_loop, daemon=True)
-    odoo_sync_thread.start()
-    logger.info(f"Sync Odoo avviato (ogni {interval_hours} ore)")
+    worker = get_sync_worker(odoo_connector, DatabaseManager(DB_PATH), intervallo=interval_hours * 3600)
+    job = worker.submit('avvio')
+    logger.info(f"Sync Odoo avviata in background (job #{job['id']}, poi ogni {interval_hours} ore)")
+    return job
 
 def stop_odoo_sync():
-    """Ferma la sincronizzazione con Odoo"""
-    global odoo_sync_running
-    odoo_sync_running = False
-    logger.info("Sync Odoo fermato")
+    """Ferma il worker di sincronizzazione (la sync in corso riprenderà dal checkpoint)"""
+    try:
+        worker = get_sync_worker()
+        if worker:
+            worker.stop()
+        if odoo_connector:
+            odoo_connector.disconnect()
+        logger.info("Sync Odoo fermato")
+    except Exception as e:
+        logger.error(f"Errore arresto sync Odoo: {e}")
 
-def perform_odoo_sync():
-    """Esegue la sincronizzazione con Odoo"""
-    global odoo_connector
-    
-    if not odoo_connector:
+def perform_odoo_sync(motivo='manuale'):
+    """Accoda una sincronizzazione con Odoo; restituisce il job (None se non configurato)"""
+    worker = get_sync_worker()
+    if not worker:
         logger.warning("Connettore Odoo non configurato")
-        return False, {"error": "Connettore Odoo non configurato"}
+        return None
     
-    try:
-        logger.info("Esecuzione sincronizzazione Odoo...")
-        
-        # Ottieni connessione database
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Database non disponibile per sync Odoo")
-            return False, {"error": "Database non disponibile"}
-        
-        # Crea un wrapper per DatabaseManager
-        class DatabaseWrapper:
-            def __init__(self, conn):
-                self.conn = conn
-            
-            def verify_access(self, codice_fiscale):
-                try:
-                    cursor = self.conn.cursor()
-                    cursor.execute('''
-                        SELECT id, nome, note
-                        FROM utenti_autorizzati 
-                        WHERE codice_fiscale = ? AND attivo = 1
-                    ''', (codice_fiscale.upper(),))
-                    
-                    result = cursor.fetchone()
-                    
-                    if result:
-                        user_data = {
-                            'id': result[0],
-                            'nome': result[1],
-                            'note': result[2]
-                        }
-                        return True, user_data
-                    else:
-                        return False, None
-                except Exception as e:
-                    logger.error(f"Errore verifica accesso: {e}")
-                    return False, None
-            
-            def add_user(self, codice_fiscale, nome, note=None, creato_da=None, modificato_da=None):
-                try:
-                    cursor = self.conn.cursor()
-                    cursor.execute('''
-                        INSERT INTO utenti_autorizzati
-                        (codice_fiscale, nome, note, attivo, creato_da, modificato_da)
-                        VALUES (?, ?, ?, 1, ?, ?)
-                    ''', (codice_fiscale.upper(), nome, note, creato_da or 'ODOO_SYNC', modificato_da or 'ODOO_SYNC'))
-                    
-                    self.conn.commit()
-                    return True
-                except Exception as e:
-                    logger.error(f"Errore aggiunta utente: {e}")
-                    return False
-        
-        db_wrapper = DatabaseWrapper(conn)
-        
-        # Esegui sync
-        stats = odoo_connector.sync_citizens(db_wrapper, "Rende", test_mode=False)
-        
-        conn.close()
-        
-        logger.info(f"Sync completato: {stats}")
-        return True, stats
-        
-    except Exception as e:
-        logger.error(f"Errore sync Odoo: {e}")
-        return False, {"error": str(e)}
+    # Upsert a batch dei cittadini cambiati (DatabaseManager.bulk_upsert_users) nel
+    # thread del worker: le modifiche sono già applicate all'indice autorizzazioni del processo
+    return worker.submit(motivo)
 
 # ===============================
 # MAIN
@@ -2787,209 +2534,6 @@ for rule in app.url_map.iter_rules():
     print(rule)
 print("============================")
 
-# Funzioni per la sincronizzazione con Odoo
-def configure_odoo_connector():
-    """Configura il connettore Odoo"""
-    global odoo_connector
-    
-    try:
-        logger.info("Configurazione connettore Odoo...")
-        
-        # Crea un mock config manager per OdooPartnerConnector
-        class MockConfigManager:
-            def __init__(self):
-                self.config = MockConfig()
-            def get_config(self):
-                return self.config
-        
-        class MockConfig:
-            def __init__(self):
-                self.odoo = None
-        
-        # Configurazione Odoo
-        odoo_config = {
-            'url': 'https://app.calabramaceri.it',
-            'database': 'cmapp',
-            'username': 'controllo-accessi@calabramaceri.it',
-            'password': 'AcC3ss0C0ntr0l!2025#Rnd',
-            'comune': 'Rende',
-            'sync_interval_hours': 12
-        }
-        
-        # Inizializza il connettore
-        mock_config_manager = MockConfigManager()
-        odoo_connector = OdooPartnerConnector(mock_config_manager)
-        odoo_connector.configure_connection(
-            url=odoo_config['url'],
-            database=odoo_config['database'],
-            username=odoo_config['username'],
-            password=odoo_config['password'],
-            comune=odoo_config['comune'],
-            sync_interval=odoo_config['sync_interval_hours'] * 3600
-        )
-        
-        # Test connessione
-        success, message = odoo_connector.test_connection()
-        if success:
-            logger.info(f"Connessione Odoo stabilita: {message}")
-            
-            # Avvia sync automatica
-            start_odoo_sync()
-            return True
-        else:
-            logger.warning(f"Test connessione Odoo fallito: {message}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"Errore configurazione Odoo: {e}")
-        return False
-
-def start_odoo_sync():
-    """Avvia la sincronizzazione automatica con Odoo"""
-    global odoo_connector, odoo_sync_thread, odoo_sync_running
-    
-    if odoo_sync_running:
-        logger.warning("Sincronizzazione Odoo già in esecuzione")
-        return
-    
-    try:
-        logger.info("Avvio sincronizzazione automatica Odoo...")
-        odoo_sync_running = True
-        
-        # Esegui sync iniziale
-        perform_odoo_sync()
-        
-        # Avvia thread per sync periodica
-        def sync_worker():
-            while odoo_sync_running:
-                try:
-                    # Attendi intervallo configurato (default 12 ore)
-                    sleep_hours = 12
-                    logger.info(f"Prossima sync Odoo in {sleep_hours} ore")
-                    time.sleep(sleep_hours * 3600)
-                    
-                    if odoo_sync_running:
-                        perform_odoo_sync()
-                        
-                except Exception as e:
-                    logger.error(f"Errore sync worker Odoo: {e}")
-                    time.sleep(3600)  # Riprova tra un'ora in caso di errore
-        
-        odoo_sync_thread = threading.Thread(target=sync_worker, daemon=True)
-        odoo_sync_thread.start()
-        
-        logger.info("Sincronizzazione automatica Odoo avviata")
-        
-    except Exception as e:
-        logger.error(f"Errore avvio sync Odoo: {e}")
-        odoo_sync_running = False
-
-def stop_odoo_sync():
-    """Ferma la sincronizzazione automatica con Odoo"""
-    global odoo_sync_running
-    
-    if not odoo_sync_running:
-        return
-    
-    try:
-        logger.info("Arresto sincronizzazione Odoo...")
-        odoo_sync_running = False
-        
-        if odoo_connector:
-            odoo_connector.disconnect()
-            
-        logger.info("Sincronizzazione Odoo arrestata")
-        
-    except Exception as e:
-        logger.error(f"Errore arresto sync Odoo: {e}")
-
-def perform_odoo_sync():
-    """Esegue la sincronizzazione con Odoo"""
-    global odoo_connector
-    
-    if not odoo_connector:
-        logger.warning("Connettore Odoo non configurato")
-        return False, {"error": "Connettore Odoo non configurato"}
-    
-    try:
-        logger.info("Esecuzione sincronizzazione Odoo...")
-        
-        # Ottieni connessione database
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Database non disponibile per sync Odoo")
-            return False, {"error": "Database non disponibile"}
-        
-        # Crea un wrapper per DatabaseManager
-        class DatabaseWrapper:
-            def __init__(self, conn):
-                self.conn = conn
-            
-            def verify_access(self, codice_fiscale):
-                try:
-                    cursor = self.conn.cursor()
-                    cursor.execute('''
-                        SELECT id, nome, note
-                        FROM utenti_autorizzati 
-                        WHERE codice_fiscale = ? AND attivo = 1
-                    ''', (codice_fiscale.upper(),))
-                    
-                    result = cursor.fetchone()
-                    
-                    if result:
-                        user_data = {
-                            'id': result[0],
-                            'nome': result[1],
-                            'note': result[2]
-                        }
-                        return True, user_data
-                    else:
-                        return False, None
-                except Exception as e:
-                    logger.error(f"Errore verifica accesso: {e}")
-                    return False, None
-            
-            def add_user(self, codice_fiscale, nome, note=None, creato_da=None, modificato_da=None):
-                try:
-                    cursor = self.conn.cursor()
-                    cursor.execute('''
-                        INSERT INTO utenti_autorizzati 
-                        (codice_fiscale, nome, note, creato_da, modificato_da)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (
-                        codice_fiscale.upper(),
-                        nome,
-                        note,
-                        creato_da,
-                        modificato_da
-                    ))
-                    self.conn.commit()
-                    
-                    logger.info(f"Utente aggiunto: {nome} ({codice_fiscale})")
-                    return True
-                    
-                except sqlite3.IntegrityError:
-                    logger.warning(f"Utente già esistente: {codice_fiscale}")
-                    return False
-                except Exception as e:
-                    logger.error(f"Errore aggiunta utente: {e}")
-                    return False
-        
-        # Esegui sincronizzazione
-        db_wrapper = DatabaseWrapper(conn)
-        success, stats = odoo_connector.sync_to_database(db_wrapper)
-        
-        if success:
-            logger.info(f"Sync Odoo completata: {stats['added']} cittadini aggiunti")
-            return True, stats
-        else:
-            logger.warning("Sync Odoo fallita")
-            return False, stats
-            
-    except Exception as e:
-        logger.error(f"Errore sync Odoo: {e}")
-        return False, {"error": str(e)}
-
 # Registra funzione di pulizia all'uscita
 import atexit
 try:
@@ -3006,7 +2550,7 @@ def scheduled_backup():
     backup_filename = f'access_{timestamp}.db'
     src = DB_PATH
     dst = os.path.join(BACKUP_DIR, backup_filename)
-    shutil.copy2(src, dst)
+    copy_database(src, dst)
     print(f"[SCHEDULER] Backup creato: {backup_filename}")
 
     # Retention
@@ -0,0 +1,239 @@
+# File: /opt/access_control/src/core/access_engine.py
+# Motore decisionale accessi: connessione di scrittura del processo, al più una transazione per tessera
+
+import sqlite3
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from core.access_schedule import get_schedule_provider, ROME_TZ
+from database.auth_index import get_authorization_index
+from database.monthly_counters import get_monthly_counters
+from database.log_writer import get_log_writer
+from database.pool import DEFAULT_DB_PATH, connection, get_writer
+from database.schema import migrate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TERMINALE = "Terminale"
+NOME_TERMINALE_TTL = 60.0
+
+# Esiti (valori di log_accessi.tipo_accesso)
+AUTORIZZATO = 'AUTORIZZATO'
+UTENTE_NON_TROVATO = 'UTENTE_NON_TROVATO'
+UTENTE_DISATTIVATO = 'UTENTE_DISATTIVATO'
+FUORI_ORARIO = 'FUORI_ORARIO'
+LIMITE_SUPERATO = 'LIMITE_SUPERATO'
+ERRORE = 'ERRORE'
+
+MESSAGGI_RIFIUTO = {
+    UTENTE_NON_TROVATO: 'Utente non trovato',
+    UTENTE_DISATTIVATO: 'Utente disattivato',
+    FUORI_ORARIO: 'Accesso non consentito in questo orario',
+    LIMITE_SUPERATO: 'Limite mensile accessi superato',
+}
+
+# Statement fissi: con la connessione persistente restano nella cache
+# dei prepared statement di sqlite3 e non vengono ricompilati ad ogni tessera
+SQL_NOME_INSTALLAZIONE = "SELECT value FROM system_settings WHERE key = 'sistema.nome_installazione'"
+SQL_DISATTIVA = 'UPDATE utenti_autorizzati SET attivo = 0 WHERE codice_fiscale = ?'
+
+
+@dataclass
+class AccessDecision:
+    """Esito di una decisione di accesso"""
+    codice_fiscale: str
+    authorized: bool
+    tipo_accesso: str
+    nome_utente: Optional[str] = None
+    user_id: Optional[int] = None
+    motivo_rifiuto: Optional[str] = None
+    ingressi_mese: Optional[int] = None
+    limite_mensile: Optional[int] = None
+    terminale_id: Optional[str] = None
+    durata_elaborazione: float = 0.0
+    timestamp: datetime = field(default_factory=lambda: datetime.now(ROME_TZ))
+
+    @property
+    def masked_cf(self) -> str:
+        return f"{self.codice_fiscale[:4]}***{self.codice_fiscale[-4:]}"
+
+    def to_result(self) -> Dict[str, Any]:
+        """Formato dict storico di process_codice_fiscale"""
+        return {
+            'authorized': self.authorized,
+            'user_name': self.nome_utente if self.authorized else None,
+            'error_message': self.motivo_rifiuto,
+            'tipo_accesso': self.tipo_accesso
+        }
+
+    def to_user_data(self) -> Optional[Dict[str, Any]]:
+        """Formato user_data storico di DatabaseManager.verify_access"""
+        if self.user_id is None:
+            return None
+        return {'id': self.user_id, 'nome': self.nome_utente}
+
+
+class AccessDecisionEngine:
+    """Valuta utente, orario, limite mensile e contatore, poi accoda il log.
+
+    Utente, orario e limite mensile vengono letti dalle strutture in memoria
+    (indice autorizzazioni, schedule compilato, cache contatori); l'incremento
+    del contatore passa dalla connessione di scrittura del processo (vedi
+    database.pool.WriterConnection) in una transazione BEGIN IMMEDIATE: due
+    letture simultanee dello stesso CF non possono superare entrambe il
+    controllo del limite. In WAL le letture della dashboard non la bloccano.
+    La riga di log_accessi è scritta dal LogWriter con commit di gruppo.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, terminale_id: str = None):
+        self.db_path = db_path
+        self.terminale_id = terminale_id
+        self._schema_checked = False
+        self._nome_terminale_cache = None
+
+    # ===== CONNESSIONE =====
+
+    def _get_writer(self):
+        if not self._schema_checked:
+            # Colonne estese di log_accessi: migrazione 0002
+            migrate(self.db_path)
+            self._schema_checked = True
+        return get_writer(self.db_path)
+
+    def close(self):
+        """Chiude la connessione di scrittura (riaperta al primo uso)"""
+        get_writer(self.db_path).reset()
+
+    # ===== DECISIONE =====
+
+    def _nome_terminale(self) -> str:
+        if self.terminale_id:
+            return self.terminale_id
+        # Nome installazione in cache: cambia solo dalle impostazioni
+        now = time.monotonic()
+        if self._nome_terminale_cache and now < self._nome_terminale_cache[1]:
+            return self._nome_terminale_cache[0]
+        try:
+            with connection(self.db_path, row_factory=None) as conn:
+                row = conn.execute(SQL_NOME_INSTALLAZIONE).fetchone()
+            nome = row[0] if row and row[0] else DEFAULT_TERMINALE
+        except sqlite3.OperationalError:
+            nome = DEFAULT_TERMINALE
+        self._nome_terminale_cache = (nome, now + NOME_TERMINALE_TTL)
+        return nome
+
+    def decide(self, codice_fiscale: str, metodo_lettura: str = None, qualita_lettura: int = None,
+               tipo_autorizzato: str = AUTORIZZATO, disattiva_al_limite: bool = False,
+               now: datetime = None, registra: bool = True) -> AccessDecision:
+        """Decide l'accesso per un CF e aggiorna il contatore.
+
+        Con registra=False il log del tentativo è a carico del chiamante
+        (vedi registra()), ad esempio dopo aver già azionato i relè.
+        """
+        start = time.perf_counter()
+        cf = (codice_fiscale or '').strip().upper()
+        now = now or datetime.now(ROME_TZ)
+
+        # Controlli in memoria (nessuna query per CF noti e per l'orario)
+        entry = get_authorization_index(self.db_path).lookup(cf)
+        decision = AccessDecision(codice_fiscale=cf, authorized=False, tipo_accesso=UTENTE_NON_TROVATO,
+                                  timestamp=now)
+        if entry is not None:
+            decision.user_id = entry.id
+            decision.nome_utente = entry.nome
+            if not entry.attivo:
+                decision.tipo_accesso = UTENTE_DISATTIVATO
+            elif not get_schedule_provider(self.db_path).get().is_open(now):
+                decision.tipo_accesso = FUORI_ORARIO
+            else:
+                decision.tipo_accesso = None  # da decidere sul limite
+
+        counters = get_monthly_counters(self.db_path)
+        try:
+            writer = self._get_writer()
+            decision.terminale_id = self._nome_terminale()
+
+            # Solo il controllo del limite scrive: gli altri esiti non aprono transazioni
+            if decision.tipo_accesso is None:
+                try:
+                    with writer.transaction() as conn:
+                        # Limite mensile: lettura dalla cache contatori, riallineata se
+                        # un altro processo ha scritto dall'ultima decisione
+                        counters.sync(conn)
+                        sotto_limite, ingressi, limite = counters.check(cf, now.year, now.month, conn)
+                        decision.limite_mensile = limite
+
+                        if not sotto_limite:
+                            decision.tipo_accesso = LIMITE_SUPERATO
+                            decision.ingressi_mese = ingressi
+                            if disattiva_al_limite:
+                                conn.execute(SQL_DISATTIVA, (cf,))
+                        else:
+                            decision.ingressi_mese = counters.increment(conn, cf, now.year, now.month)
+                            decision.authorized = True
+                            decision.tipo_accesso = tipo_autorizzato
+                except Exception:
+                    counters.invalidate()
+                    raise
+        except Exception as e:
+            logger.error(f"❌ Errore decisione accesso per CF {decision.masked_cf}: {e}")
+            get_writer(self.db_path).reset()
+            decision.authorized = False
+            decision.tipo_accesso = ERRORE
+            decision.motivo_rifiuto = str(e)
+
+        if not decision.authorized and decision.motivo_rifiuto is None:
+            decision.motivo_rifiuto = MESSAGGI_RIFIUTO[decision.tipo_accesso]
+        decision.durata_elaborazione = time.perf_counter() - start
+        if registra:
+            self.registra(decision, metodo_lettura, qualita_lettura)
+
+        if decision.tipo_accesso == LIMITE_SUPERATO and disattiva_al_limite:
+            get_authorization_index(self.db_path).reload_user(cf)
+
+        if decision.authorized:
+            logger.info(f"✅ Accesso autorizzato per {decision.nome_utente} (CF: {decision.masked_cf})")
+        else:
+            logger.warning(f"⛔ Accesso negato per CF {decision.masked_cf}: {decision.motivo_rifiuto}")
+        return decision
+
+    def registra(self, decision: AccessDecision, metodo_lettura: str = None,
+                 qualita_lettura: int = None, timings=None):
+        """Accoda il tentativo al writer di log_accessi (commit di gruppo)"""
+        row = {
+            'codice_fiscale': decision.codice_fiscale,
+            'autorizzato': 1 if decision.authorized else 0,
+            'durata_elaborazione': decision.durata_elaborazione,
+            'terminale_id': decision.terminale_id or self.terminale_id or DEFAULT_TERMINALE,
+            'metodo_lettura': metodo_lettura,
+            'qualita_lettura': qualita_lettura,
+            'motivo_rifiuto': decision.motivo_rifiuto,
+            'nome_utente': decision.nome_utente,
+            'tipo_accesso': decision.tipo_accesso
+        }
+        if timings is not None:
+            row.update({
+                'durata_lettura': timings.lettura,
+                'durata_decisione': timings.decisione,
+                'durata_attuazione': timings.attuazione
+            })
+        get_log_writer(self.db_path).enqueue(row)
+
+
+# Singleton per processo
+_access_engine = None
+_access_engine_lock = threading.Lock()
+
+
+def get_access_engine(db_path: str = None, terminale_id: str = None) -> AccessDecisionEngine:
+    """Restituisce il motore decisionale del processo"""
+    global _access_engine
+    if _access_engine is None:
+        with _access_engine_lock:
+            if _access_engine is None:
+                _access_engine = AccessDecisionEngine(db_path or DEFAULT_DB_PATH, terminale_id)
+    return _access_engine
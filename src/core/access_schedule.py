@@ -0,0 +1,249 @@
+# File: /opt/access_control/src/core/access_schedule.py
+# Orari di accesso compilati in bitmap minuto-della-settimana
+
+import sqlite3
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+from database.cache_versions import ensure_version_tracking, read_version
+from database.pool import DEFAULT_DB_PATH, get_connection, connection
+
+logger = logging.getLogger(__name__)
+
+# Fuso orario di Roma (stesso di configurazione_accessi)
+ROME_TZ = pytz.timezone('Europe/Rome')
+
+GIORNI = ['Lunedi', 'Martedi', 'Mercoledi', 'Giovedi', 'Venerdi', 'Sabato', 'Domenica']
+MINUTI_GIORNO = 1440
+MINUTI_SETTIMANA = 7 * MINUTI_GIORNO
+
+
+def _to_minutes(value) -> Optional[int]:
+    """Converte 'HH:MM' in minuti dalla mezzanotte (stesso formato di verifica_orario)"""
+    if not value:
+        return None
+    parsed = datetime.strptime(value, '%H:%M')
+    return parsed.hour * 60 + parsed.minute
+
+
+class CompiledSchedule:
+    """Bitmap 7×1440 bit degli orari di apertura con lookup O(1).
+
+    Le fasce mantengono la semantica di verifica_orario: estremi inclusi
+    al minuto e fasce "a cavallo della mezzanotte" (inizio > fine) che
+    si avvolgono all'interno dello stesso giorno configurato.
+    """
+
+    def __init__(self, rows: List[Tuple] = None):
+        self.bits = bytearray(MINUTI_SETTIMANA // 8)
+        self._opens: List[int] = []   # minuti-settimana in cui si apre
+        self._closes: List[int] = []  # minuti-settimana in cui si chiude
+        self.compiled_at = datetime.now(ROME_TZ)
+        if rows:
+            self.compile(rows)
+
+    # ===== COMPILAZIONE =====
+
+    def _set_range(self, giorno: int, inizio: int, fine: int):
+        base = giorno * MINUTI_GIORNO
+        for minuto in range(inizio, fine + 1):
+            idx = base + minuto
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+
+    def _add_fascia(self, giorno: int, inizio: Optional[int], fine: Optional[int]):
+        if inizio is None or fine is None:
+            return
+        if inizio > fine:
+            self._set_range(giorno, inizio, MINUTI_GIORNO - 1)
+            self._set_range(giorno, 0, fine)
+        else:
+            self._set_range(giorno, inizio, fine)
+
+    def compile(self, rows: List[Tuple]):
+        """Compila le righe di orari_accesso
+        (giorno, aperto, mattina_inizio, mattina_fine, pomeriggio_inizio, pomeriggio_fine)"""
+        self.bits = bytearray(MINUTI_SETTIMANA // 8)
+        visti = set()
+        for row in rows:
+            giorno_nome, aperto = row[0], row[1]
+            # Solo la prima riga per giorno conta (come il fetchone originale)
+            if giorno_nome not in GIORNI or giorno_nome in visti:
+                continue
+            visti.add(giorno_nome)
+            if not aperto:
+                continue
+            giorno = GIORNI.index(giorno_nome)
+            try:
+                self._add_fascia(giorno, _to_minutes(row[2]), _to_minutes(row[3]))
+                self._add_fascia(giorno, _to_minutes(row[4]), _to_minutes(row[5]))
+            except (ValueError, TypeError, IndexError) as e:
+                # Come verifica_orario: giorno con orari non validi = chiuso
+                logger.error(f"❌ Orari non validi per {giorno_nome}: {e}")
+                base = giorno * MINUTI_GIORNO
+                for minuto in range(base, base + MINUTI_GIORNO):
+                    self.bits[minuto >> 3] &= ~(1 << (minuto & 7))
+
+        # Transizioni per next_open/next_close
+        self._opens, self._closes = [], []
+        for idx in range(MINUTI_SETTIMANA):
+            current = self.is_open_at_minute(idx)
+            previous = self.is_open_at_minute(idx - 1)
+            if current and not previous:
+                self._opens.append(idx)
+            elif previous and not current:
+                self._closes.append(idx)
+        self.compiled_at = datetime.now(ROME_TZ)
+
+    # ===== LOOKUP =====
+
+    def is_open_at_minute(self, minute_of_week: int) -> bool:
+        idx = minute_of_week % MINUTI_SETTIMANA
+        return bool(self.bits[idx >> 3] >> (idx & 7) & 1)
+
+    @staticmethod
+    def minute_of_week(when: datetime) -> int:
+        return when.weekday() * MINUTI_GIORNO + when.hour * 60 + when.minute
+
+    def is_open(self, when: datetime = None) -> bool:
+        """True se l'accesso è consentito all'istante indicato (default: ora di Roma)"""
+        when = when or datetime.now(ROME_TZ)
+        return self.is_open_at_minute(self.minute_of_week(when))
+
+    def _next_transition(self, transitions: List[int], when: datetime) -> Optional[datetime]:
+        if not transitions:
+            return None
+        current = self.minute_of_week(when)
+        pos = bisect_right(transitions, current)
+        target = transitions[pos] if pos < len(transitions) else transitions[0] + MINUTI_SETTIMANA
+        delta = target - current
+        base = when.replace(second=0, microsecond=0)
+        result = base + timedelta(minutes=delta)
+        # Normalizza eventuali cambi ora legale
+        if result.tzinfo is not None and hasattr(result.tzinfo, 'normalize'):
+            result = result.tzinfo.normalize(result)
+        return result
+
+    def next_open(self, when: datetime = None) -> Optional[datetime]:
+        """Prossimo istante di apertura dopo 'when' (None se mai aperto)"""
+        return self._next_transition(self._opens, when or datetime.now(ROME_TZ))
+
+    def next_close(self, when: datetime = None) -> Optional[datetime]:
+        """Prossimo istante di chiusura dopo 'when' (None se sempre aperto o mai aperto)"""
+        return self._next_transition(self._closes, when or datetime.now(ROME_TZ))
+
+    def get_status(self, when: datetime = None) -> Dict:
+        """Stato orari per diagnostica/dashboard"""
+        when = when or datetime.now(ROME_TZ)
+        next_open = self.next_open(when)
+        next_close = self.next_close(when)
+        return {
+            'aperto': self.is_open(when),
+            'next_open': next_open.isoformat() if next_open else None,
+            'next_close': next_close.isoformat() if next_close else None,
+            'compilato_il': self.compiled_at.isoformat()
+        }
+
+
+class AccessScheduleProvider:
+    """Mantiene lo schedule compilato del processo.
+
+    Ricompila quando save_orari esegue il commit (reload esplicito) e, per
+    gli altri processi, quando il contatore di versione di orari_accesso cambia.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, refresh_interval: float = 5.0):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.schedule = CompiledSchedule()
+        self._version = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher = None
+
+    def reload(self, conn: sqlite3.Connection = None) -> CompiledSchedule:
+        """Rilegge orari_accesso e sostituisce lo schedule compilato"""
+        own_conn = conn is None
+        try:
+            if own_conn:
+                conn = get_connection(self.db_path, row_factory=None)
+            ensure_version_tracking(conn, 'orari_accesso')
+            version = read_version(conn, 'orari_accesso')
+            rows = conn.execute('''
+                SELECT giorno, aperto, mattina_inizio, mattina_fine, pomeriggio_inizio, pomeriggio_fine
+                FROM orari_accesso
+            ''').fetchall()
+        except Exception as e:
+            logger.error(f"❌ Errore caricamento orari accesso: {e}")
+            return self.schedule
+        finally:
+            if own_conn and conn is not None:
+                conn.close()
+
+        compiled = CompiledSchedule([tuple(row) for row in rows])
+        with self._lock:
+            self.schedule = compiled
+            self._version = version
+            self._loaded = True
+        logger.info(f"🕐 Orari accesso compilati ({len(rows)} giorni configurati)")
+        return compiled
+
+    def get(self) -> CompiledSchedule:
+        if not self._loaded:
+            self.reload()
+        return self.schedule
+
+    def check_version(self) -> bool:
+        try:
+            with connection(self.db_path, row_factory=None) as conn:
+                version = read_version(conn, 'orari_accesso')
+        except Exception as e:
+            logger.debug(f"Verifica versione orari fallita: {e}")
+            return False
+        if version != self._version:
+            self.reload()
+            return True
+        return False
+
+    def start_watcher(self):
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        def watch():
+            while not self._stop_event.wait(self.refresh_interval):
+                self.check_version()
+
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=watch, name='access-schedule-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop_event.set()
+
+
+# Singleton per processo
+_schedule_provider = None
+_schedule_provider_lock = threading.Lock()
+
+
+def get_schedule_provider(db_path: str = None) -> AccessScheduleProvider:
+    """Restituisce il provider orari del processo (compilato e sorvegliato)"""
+    global _schedule_provider
+    if _schedule_provider is None:
+        with _schedule_provider_lock:
+            if _schedule_provider is None:
+                provider = AccessScheduleProvider(db_path or DEFAULT_DB_PATH)
+                provider.reload()
+                provider.start_watcher()
+                _schedule_provider = provider
+    return _schedule_provider
+
+
+def get_access_schedule() -> CompiledSchedule:
+    """Shortcut: schedule compilato corrente"""
+    return get_schedule_provider().get()
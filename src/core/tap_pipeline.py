@@ -0,0 +1,131 @@
+# File: /opt/access_control/src/core/tap_pipeline.py
+# Pipeline lettura tessera: decisione e attuazione subito, persistenza e notifiche in background
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.access_engine import AccessDecision, AccessDecisionEngine
+
+logger = logging.getLogger(__name__)
+
+STADI = ('lettura', 'decisione', 'attuazione', 'persistenza', 'notifica')
+
+
+@dataclass
+class TapTimings:
+    """Durate (secondi) dei singoli stadi di una lettura tessera"""
+    lettura: Optional[float] = None
+    decisione: float = 0.0
+    attuazione: float = 0.0
+    persistenza: float = 0.0
+    notifica: float = 0.0
+
+    @property
+    def fino_al_cancello(self) -> float:
+        """Tempo dalla tessera al comando relè"""
+        return (self.lettura or 0.0) + self.decisione + self.attuazione
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        return asdict(self)
+
+
+class TapPipeline:
+    """Esegue una lettura tessera in stadi espliciti.
+
+    lettura → decisione → attuazione avvengono nel thread del lettore: i relè
+    scattano appena la decisione è presa. persistenza (log_accessi con le durate
+    degli stadi) e notifica (log di audit, statistiche, console) girano in un
+    worker dedicato, nell'ordine delle letture, senza ritardare il cancello.
+    """
+
+    def __init__(self, engine: AccessDecisionEngine,
+                 attuatore: Callable[[AccessDecision], None],
+                 notificatori: List[Callable[[AccessDecision, TapTimings], None]] = None):
+        self.engine = engine
+        self.attuatore = attuatore
+        self.notificatori = list(notificatori or [])
+        # Chiamati a lettura completata (tutti gli stadi misurati), es. benchmark
+        self.osservatori: List[Callable[[AccessDecision, TapTimings], None]] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tap-post')
+        self._stats_lock = threading.Lock()
+        self._stats = {stadio: {'conteggio': 0, 'totale': 0.0, 'max': 0.0} for stadio in STADI}
+
+    def process(self, codice_fiscale: str, durata_lettura: float = None,
+                metodo_lettura: str = None, qualita_lettura: int = None,
+                **decide_kwargs) -> Tuple[AccessDecision, TapTimings]:
+        """Decide e attua subito; persistenza e notifiche vengono accodate"""
+        timings = TapTimings(lettura=durata_lettura)
+
+        start = time.perf_counter()
+        decision = self.engine.decide(codice_fiscale, metodo_lettura=metodo_lettura,
+                                      qualita_lettura=qualita_lettura, registra=False,
+                                      **decide_kwargs)
+        timings.decisione = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            self.attuatore(decision)
+        except Exception as e:
+            logger.error(f"❌ Errore attuazione relè per CF {decision.masked_cf}: {e}")
+        timings.attuazione = time.perf_counter() - start
+
+        self._executor.submit(self._post, decision, timings, metodo_lettura, qualita_lettura)
+        return decision, timings
+
+    def _post(self, decision: AccessDecision, timings: TapTimings,
+              metodo_lettura: str, qualita_lettura: int):
+        start = time.perf_counter()
+        try:
+            self.engine.registra(decision, metodo_lettura, qualita_lettura, timings)
+        except Exception as e:
+            logger.error(f"❌ Errore persistenza accesso CF {decision.masked_cf}: {e}")
+        timings.persistenza = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for notificatore in self.notificatori:
+            try:
+                notificatore(decision, timings)
+            except Exception as e:
+                logger.error(f"❌ Errore notifica accesso CF {decision.masked_cf}: {e}")
+        timings.notifica = time.perf_counter() - start
+
+        self._record(timings)
+        for osservatore in self.osservatori:
+            try:
+                osservatore(decision, timings)
+            except Exception as e:
+                logger.debug(f"Errore osservatore pipeline: {e}")
+        logger.debug(
+            "⏱️ Stadi tessera: " +
+            ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in timings.to_dict().items() if v is not None)
+        )
+
+    def _record(self, timings: TapTimings):
+        with self._stats_lock:
+            for stadio, durata in timings.to_dict().items():
+                if durata is None:
+                    continue
+                stat = self._stats[stadio]
+                stat['conteggio'] += 1
+                stat['totale'] += durata
+                stat['max'] = max(stat['max'], durata)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Media e massimo (ms) per stadio"""
+        with self._stats_lock:
+            return {
+                stadio: {
+                    'conteggio': stat['conteggio'],
+                    'media_ms': round(stat['totale'] / stat['conteggio'] * 1000, 2) if stat['conteggio'] else 0.0,
+                    'max_ms': round(stat['max'] * 1000, 2)
+                }
+                for stadio, stat in self._stats.items()
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Attende le persistenze/notifiche in corso"""
+        self._executor.shutdown(wait=wait)
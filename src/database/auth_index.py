@@ -0,0 +1,264 @@
+# File: /opt/access_control/src/database/auth_index.py
+# Indice autorizzazioni in memoria per il percorso decisionale tessera
+
+import sqlite3
+import logging
+import threading
+import time
+from typing import Dict, Optional, NamedTuple
+
+from database.cache_versions import ensure_version_tracking, read_version
+from database.pool import DEFAULT_DB_PATH, connection
+
+logger = logging.getLogger(__name__)
+
+
+class AuthEntry(NamedTuple):
+    """Voce indice: dati minimi necessari alla decisione di accesso"""
+    id: int
+    nome: Optional[str]
+    attivo: bool
+
+
+class AuthorizationIndex:
+    """Indice in memoria degli utenti autorizzati, chiave = codice fiscale.
+
+    Caricato all'avvio con una sola SELECT e mantenuto coerente:
+    - nello stesso processo tramite reload_user()/load() chiamati dopo le scritture
+      (API admin, sync Odoo, DatabaseManager);
+    - tra processi diversi (main.py e web_api.py) tramite un contatore di versione
+      aggiornato da trigger su utenti_autorizzati e controllato da un thread di polling.
+
+    I CF sconosciuti vengono verificati una sola volta sul DB e poi memorizzati
+    in una cache negativa con scadenza, così le letture ripetute di tessere non
+    autorizzate non toccano il database.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, refresh_interval: float = 2.0,
+                 negative_ttl: float = 60.0, negative_max_size: int = 10000):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+
+        self._entries: Dict[str, AuthEntry] = {}
+        self._negative: Dict[str, float] = {}  # {cf: scadenza}
+        self._version = None
+        self._loaded = False
+
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop_event = threading.Event()
+
+        self.stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'db_fallbacks': 0, 'reloads': 0}
+
+    # ===== SCHEMA =====
+
+    def ensure_schema(self, conn: sqlite3.Connection):
+        """Attiva il contatore di versione su utenti_autorizzati"""
+        ensure_version_tracking(conn, 'utenti_autorizzati')
+
+    # ===== CARICAMENTO =====
+
+    def _connect(self):
+        return connection(self.db_path, row_factory=None)
+
+    def load(self) -> int:
+        """Carica (o ricarica) l'intero indice dal database"""
+        start = time.time()
+        try:
+            with self._connect() as conn:
+                self.ensure_schema(conn)
+                cursor = conn.cursor()
+                version = read_version(conn, 'utenti_autorizzati')
+                cursor.execute('SELECT codice_fiscale, id, nome, attivo FROM utenti_autorizzati')
+                entries = {
+                    row[0].upper(): AuthEntry(row[1], row[2], bool(row[3]))
+                    for row in cursor.fetchall() if row[0]
+                }
+        except Exception as e:
+            logger.error(f"❌ Errore caricamento indice autorizzazioni: {e}")
+            return len(self._entries)
+
+        with self._lock:
+            # Swap atomico: i lettori vedono il vecchio o il nuovo dict, mai uno parziale
+            self._entries = entries
+            self._negative = {}
+            self._version = version
+            self._loaded = True
+            self.stats['reloads'] += 1
+
+        logger.info(f"🗂️ Indice autorizzazioni caricato: {len(entries)} utenti in {(time.time() - start) * 1000:.1f}ms")
+        return len(entries)
+
+    def reload_user(self, codice_fiscale: str, conn: sqlite3.Connection = None):
+        """Riallinea una singola voce dopo una scrittura (insert/update/delete)"""
+        cf = (codice_fiscale or '').strip().upper()
+        if not cf:
+            return
+        try:
+            if conn is not None:
+                row = conn.execute(
+                    'SELECT id, nome, attivo FROM utenti_autorizzati WHERE codice_fiscale = ?', (cf,)
+                ).fetchone()
+            else:
+                with self._connect() as own_conn:
+                    row = own_conn.execute(
+                        'SELECT id, nome, attivo FROM utenti_autorizzati WHERE codice_fiscale = ?', (cf,)
+                    ).fetchone()
+        except Exception as e:
+            logger.error(f"❌ Errore riallineamento indice per {cf[:4]}***: {e}")
+            self.invalidate(cf)
+            return
+
+        if row:
+            self.set_user(cf, row[0], row[1], bool(row[2]))
+        else:
+            self.remove_user(cf)
+
+    def set_user(self, codice_fiscale: str, user_id: int, nome: Optional[str], attivo: bool):
+        """Inserisce/aggiorna una voce con dati già noti al chiamante"""
+        cf = codice_fiscale.strip().upper()
+        with self._lock:
+            self._entries[cf] = AuthEntry(user_id, nome, bool(attivo))
+            self._negative.pop(cf, None)
+
+    def remove_user(self, codice_fiscale: str):
+        """Rimuove una voce (utente eliminato)"""
+        cf = codice_fiscale.strip().upper()
+        with self._lock:
+            self._entries.pop(cf, None)
+            self._negative.pop(cf, None)
+
+    def apply_changes(self, changes, versione_prima: Optional[int] = None,
+                      versione_dopo: Optional[int] = None):
+        """Applica le modifiche di una scrittura in blocco (UserChange) senza ricaricare tutto.
+
+        Se prima della scrittura l'indice era alla versione versione_prima,
+        passa direttamente a versione_dopo: il watcher non ricarica per
+        modifiche già applicate.
+        """
+        with self._lock:
+            for change in changes:
+                cf = change.codice_fiscale.strip().upper()
+                self._entries[cf] = AuthEntry(change.id, change.nome, bool(change.attivo))
+                self._negative.pop(cf, None)
+            if versione_prima is not None and self._version == versione_prima:
+                self._version = versione_dopo
+
+    def invalidate(self, codice_fiscale: str):
+        """Dimentica una voce: la prossima lettura passerà dal database"""
+        cf = codice_fiscale.strip().upper()
+        with self._lock:
+            self._entries.pop(cf, None)
+            self._negative.pop(cf, None)
+
+    # ===== LOOKUP =====
+
+    def lookup(self, codice_fiscale: str) -> Optional[AuthEntry]:
+        """Restituisce la voce per il CF oppure None se l'utente non esiste"""
+        if not self._loaded:
+            self.load()
+
+        cf = codice_fiscale.strip().upper()
+        entry = self._entries.get(cf)
+        if entry is not None:
+            self.stats['hits'] += 1
+            return entry
+
+        # Cache negativa: CF già verificato come sconosciuto
+        now = time.monotonic()
+        expires = self._negative.get(cf)
+        if expires is not None and expires > now:
+            self.stats['negative_hits'] += 1
+            return None
+
+        # Miss: una sola verifica sul DB (copre la finestra di polling tra processi)
+        self.stats['misses'] += 1
+        self.stats['db_fallbacks'] += 1
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    'SELECT id, nome, attivo FROM utenti_autorizzati WHERE codice_fiscale = ?', (cf,)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"❌ Errore verifica CF su DB: {e}")
+            return None
+
+        if row:
+            entry = AuthEntry(row[0], row[1], bool(row[2]))
+            self.set_user(cf, *entry)
+            return entry
+
+        with self._lock:
+            if len(self._negative) >= self.negative_max_size:
+                self._negative = {k: v for k, v in self._negative.items() if v > now}
+                if len(self._negative) >= self.negative_max_size:
+                    self._negative.clear()
+            self._negative[cf] = now + self.negative_ttl
+        return None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_status(self) -> Dict:
+        """Stato indice per diagnostica"""
+        return {
+            'loaded': self._loaded,
+            'utenti': len(self._entries),
+            'negative_cache': len(self._negative),
+            'versione': self._version,
+            **self.stats
+        }
+
+    # ===== COERENZA TRA PROCESSI =====
+
+    def check_version(self) -> bool:
+        """Ricarica l'indice se un altro processo ha modificato utenti_autorizzati"""
+        try:
+            with self._connect() as conn:
+                version = read_version(conn, 'utenti_autorizzati')
+        except Exception as e:
+            logger.debug(f"Verifica versione indice fallita: {e}")
+            return False
+
+        if version != self._version:
+            logger.info(f"🔄 Utenti autorizzati modificati (versione {self._version} → {version}), ricarico indice")
+            self.load()
+            return True
+        return False
+
+    def start_watcher(self):
+        """Avvia thread di polling della versione"""
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        def watch():
+            while not self._stop_event.wait(self.refresh_interval):
+                self.check_version()
+
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=watch, name='auth-index-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        """Ferma thread di polling"""
+        self._stop_event.set()
+
+
+# Singleton per processo
+_authorization_index = None
+_authorization_index_lock = threading.Lock()
+
+
+def get_authorization_index(db_path: str = None) -> AuthorizationIndex:
+    """Restituisce l'indice autorizzazioni del processo (caricato e sorvegliato)"""
+    global _authorization_index
+    if _authorization_index is None:
+        with _authorization_index_lock:
+            if _authorization_index is None:
+                index = AuthorizationIndex(db_path or DEFAULT_DB_PATH)
+                index.load()
+                index.start_watcher()
+                _authorization_index = index
+    return _authorization_index
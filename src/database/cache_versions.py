@@ -0,0 +1,32 @@
+# File: /opt/access_control/src/database/cache_versions.py
+# Contatori di versione per invalidare le cache in memoria tra processi
+
+import sqlite3
+from typing import Optional
+
+
+def ensure_version_tracking(conn: sqlite3.Connection, tabella: str):
+    """Crea il contatore per la tabella e i trigger che lo incrementano ad ogni scrittura"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versioni_cache (
+            tabella TEXT PRIMARY KEY,
+            versione INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO versioni_cache (tabella, versione) VALUES (?, 0)', (tabella,))
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_versione_{tabella}_{evento.lower()}
+            AFTER {evento} ON {tabella}
+            BEGIN
+                UPDATE versioni_cache SET versione = versione + 1 WHERE tabella = '{tabella}';
+            END;
+        ''')
+    conn.commit()
+
+
+def read_version(conn: sqlite3.Connection, tabella: str) -> Optional[int]:
+    """Legge la versione corrente (None se il tracking non è attivo)"""
+    row = conn.execute('SELECT versione FROM versioni_cache WHERE tabella = ?', (tabella,)).fetchone()
+    return row[0] if row else None
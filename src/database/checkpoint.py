@@ -0,0 +1,177 @@
+# File: /opt/access_control/src/database/checkpoint.py
+# Checkpoint WAL nei momenti di quiete e monitoraggio dimensione WAL
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from database.pool import DEFAULT_DB_PATH, connect, get_writer
+
+logger = logging.getLogger(__name__)
+
+PASSIVE = 'PASSIVE'
+TRUNCATE = 'TRUNCATE'
+
+
+class CheckpointManager:
+    """Riporta nel database le pagine del WAL senza pesare sulle tessere.
+
+    Ogni `intervallo` secondi controlla il WAL: se nessuno ci ha scritto
+    negli ultimi `quiete` secondi (file -wal fermo e nessun commit del writer
+    di questo processo) esegue un checkpoint PASSIVE, che non attende né
+    blocca lettori e scrittori; oltre `soglia_truncate` byte prova un
+    TRUNCATE senza busy timeout, che rinuncia subito se c'è un export in
+    corso invece di bloccare le scritture ad aspettarlo. Se il WAL supera
+    `massimo` byte il PASSIVE viene fatto anche senza quiete.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, intervallo: float = 30.0, quiete: float = 5.0,
+                 soglia_truncate: int = 4 * 1024 * 1024, massimo: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.wal_path = f"{db_path}-wal"
+        self.intervallo = intervallo
+        self.quiete = quiete
+        self.soglia_truncate = soglia_truncate
+        self.massimo = massimo
+
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.ultimo: Optional[Dict[str, Any]] = None
+        self.stats = {'passive': 0, 'truncate': 0, 'occupato': 0, 'rinviati': 0, 'errori': 0}
+
+    # ===== STATO WAL =====
+
+    def wal_size(self) -> int:
+        try:
+            return os.path.getsize(self.wal_path)
+        except OSError:
+            return 0
+
+    def _secondi_da_ultima_scrittura(self) -> float:
+        """Secondi dall'ultima scrittura nota (commit locale o modifica del file -wal)"""
+        trascorsi = time.monotonic() - get_writer(self.db_path).ultima_scrittura
+        try:
+            trascorsi = min(trascorsi, time.time() - os.path.getmtime(self.wal_path))
+        except OSError:
+            pass
+        return trascorsi
+
+    def is_quiet(self) -> bool:
+        return self._secondi_da_ultima_scrittura() >= self.quiete
+
+    # ===== CHECKPOINT =====
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.db_path, isolation_level=None, check_same_thread=False)
+            # Nessuna attesa: con lettori attivi il checkpoint si ferma dove può
+            self._conn.execute('PRAGMA busy_timeout = 0')
+        return self._conn
+
+    def checkpoint(self, modo: str = PASSIVE) -> Dict[str, Any]:
+        """Esegue il checkpoint e restituisce l'esito (pagine WAL e pagine copiate)"""
+        with self._lock:
+            prima = self.wal_size()
+            start = time.perf_counter()
+            try:
+                occupato, pagine_wal, copiate = self._get_connection().execute(
+                    f'PRAGMA wal_checkpoint({modo})'
+                ).fetchone()
+            except sqlite3.Error as e:
+                self.stats['errori'] += 1
+                self._conn = None
+                logger.warning(f"⚠️ Checkpoint {modo} non eseguito: {e}")
+                return {'modo': modo, 'errore': str(e)}
+            esito = {
+                'modo': modo,
+                'occupato': bool(occupato),
+                'pagine_wal': pagine_wal,
+                'pagine_copiate': copiate,
+                'wal_prima': prima,
+                'wal_dopo': self.wal_size(),
+                'durata_ms': round((time.perf_counter() - start) * 1000, 2),
+                'quando': datetime.now().isoformat(timespec='seconds')
+            }
+            self.stats['passive' if modo == PASSIVE else 'truncate'] += 1
+            if occupato:
+                self.stats['occupato'] += 1
+            self.ultimo = esito
+        logger.debug(f"🗄️ Checkpoint {modo}: {copiate}/{pagine_wal} pagine, WAL {prima} → {esito['wal_dopo']} byte")
+        return esito
+
+    def run_once(self) -> Optional[Dict[str, Any]]:
+        """Un ciclo del manager: checkpoint se c'è quiete (o il WAL è troppo grande)"""
+        dimensione = self.wal_size()
+        if dimensione == 0:
+            return None
+        if not self.is_quiet():
+            if dimensione < self.massimo:
+                self.stats['rinviati'] += 1
+                return None
+            logger.warning(f"⚠️ WAL di {dimensione} byte senza quiete: checkpoint PASSIVE forzato")
+            return self.checkpoint(PASSIVE)
+        if dimensione >= self.soglia_truncate:
+            esito = self.checkpoint(TRUNCATE)
+            if not esito.get('occupato') and 'errore' not in esito:
+                return esito
+        return self.checkpoint(PASSIVE)
+
+    def _run(self):
+        while not self._stop_event.wait(self.intervallo):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats['errori'] += 1
+                logger.error(f"❌ Errore checkpoint WAL: {e}")
+
+    # ===== API =====
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='wal-checkpoint', daemon=True)
+        self._thread.start()
+        logger.info(f"🗄️ Checkpoint WAL ogni {self.intervallo:.0f}s dopo {self.quiete:.0f}s di quiete")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_status(self) -> Dict[str, Any]:
+        """Dimensione WAL e ultimo checkpoint per diagnostica"""
+        return {
+            'wal_bytes': self.wal_size(),
+            'secondi_da_ultima_scrittura': round(self._secondi_da_ultima_scrittura(), 1),
+            'ultimo_checkpoint': self.ultimo,
+            **self.stats
+        }
+
+
+# Singleton per processo
+_checkpoint_manager = None
+_checkpoint_manager_lock = threading.Lock()
+
+
+def get_checkpoint_manager(db_path: str = None) -> CheckpointManager:
+    """Restituisce il checkpoint manager del processo (già avviato)"""
+    global _checkpoint_manager
+    if _checkpoint_manager is None:
+        with _checkpoint_manager_lock:
+            if _checkpoint_manager is None:
+                manager = CheckpointManager(db_path or DEFAULT_DB_PATH)
+                manager.start()
+                _checkpoint_manager = manager
+    return _checkpoint_manager
@@ -4,12 +4,73 @@
 import sqlite3
 import logging
 import os
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Iterable, Optional, Tuple, List
+
+from database.auth_index import get_authorization_index
+from database.log_writer import get_log_writer, utc_timestamp
+from database.rollup import riepilogo
+from database.pool import connection, get_writer
+from database.schema import migrate
+from database.user_sync import confronta, stato_utenti, sync_hash, versione_utenti
 
 logger = logging.getLogger(__name__)
 
+# Tabella di appoggio per bulk_upsert_users (una per connessione, svuotata a ogni uso)
+SQL_STAGING_UTENTI = '''
+    CREATE TEMP TABLE IF NOT EXISTS staging_utenti (
+        codice_fiscale TEXT PRIMARY KEY,
+        nome TEXT,
+        note TEXT,
+        attivo INTEGER,
+        odoo_id INTEGER,
+        sync_hash INTEGER
+    )
+'''
+
+# CF da disattivare (assenti dall'elenco completo o dalla riconciliazione)
+SQL_STAGING_CF = 'CREATE TEMP TABLE IF NOT EXISTS staging_cf (codice_fiscale TEXT PRIMARY KEY)'
+
+# CF per query IN (...): sotto il limite di parametri delle build SQLite più vecchie
+BLOCCO_PARAMETRI = 500
+
+# Nuovo stato di un utente esistente: la sync riattiva solo chi aveva disattivato
+# lei stessa e disattiva (partner archiviato) solo gli utenti che aveva creato;
+# le scelte di un operatore restano
+SQL_ATTIVO_SYNC = '''CASE
+        WHEN excluded.attivo = 1 AND attivo = 0 AND modificato_da = excluded.modificato_da THEN 1
+        WHEN excluded.attivo = 0 AND attivo = 1 AND creato_da = excluded.creato_da THEN 0
+        ELSE attivo END'''
+
+# "WHERE true" evita l'ambiguità di parsing tra SELECT e ON CONFLICT.
+# Partner già disattivati in Odoo e mai visti localmente non vengono inseriti;
+# modificato_da cambia solo quando la sync cambia lo stato attivo.
+SQL_MERGE_UTENTI = f'''
+    INSERT INTO utenti_autorizzati (codice_fiscale, nome, note, attivo, odoo_id, sync_hash, creato_da, modificato_da)
+    SELECT s.codice_fiscale, s.nome, s.note, s.attivo, s.odoo_id, s.sync_hash, ?1, ?1 FROM temp.staging_utenti s
+    WHERE s.attivo = 1 OR EXISTS (SELECT 1 FROM utenti_autorizzati u WHERE u.codice_fiscale = s.codice_fiscale)
+    ON CONFLICT(codice_fiscale) DO UPDATE SET
+        nome = excluded.nome,
+        odoo_id = COALESCE(excluded.odoo_id, odoo_id),
+        sync_hash = excluded.sync_hash,
+        attivo = {SQL_ATTIVO_SYNC},
+        modificato_da = CASE WHEN attivo IS NOT {SQL_ATTIVO_SYNC} THEN excluded.modificato_da ELSE modificato_da END
+    WHERE nome IS NOT excluded.nome
+       OR odoo_id IS NOT COALESCE(excluded.odoo_id, odoo_id)
+       OR attivo IS NOT {SQL_ATTIVO_SYNC}
+'''
+
+# Impronta delle righe che il merge non ha riscritto (dati già allineati o stato
+# scelto da un operatore): la prossima sync le salta senza confrontarle
+SQL_HASH_UTENTI = '''
+    UPDATE utenti_autorizzati
+    SET sync_hash = (SELECT s.sync_hash FROM temp.staging_utenti s WHERE s.codice_fiscale = utenti_autorizzati.codice_fiscale)
+    WHERE codice_fiscale IN (SELECT codice_fiscale FROM temp.staging_utenti)
+      AND sync_hash IS NOT (SELECT s.sync_hash FROM temp.staging_utenti s WHERE s.codice_fiscale = utenti_autorizzati.codice_fiscale)
+'''
+
 class DatabaseManager:
     """Gestore database SQLite per sistema controllo accessi"""
     
@@ -17,6 +78,7 @@ class DatabaseManager:
         self.db_path = db_path
         self.ensure_database_exists()
         self.init_database()
+        self.auth_index = get_authorization_index(db_path)
         logger.info(f"🗄️ Database manager inizializzato: {db_path}")
     
     def ensure_database_exists(self):
@@ -27,147 +89,12 @@ class DatabaseManager:
     def init_database(self):
         """Inizializza database e tabelle"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Tabelle, indici e trigger sono definiti in database/migrations
+            migrate(self.db_path)
+            
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 
-                # Abilita foreign keys
-                cursor.execute("PRAGMA foreign_keys = ON")
-                
-                # Tabella utenti autorizzati
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS utenti_autorizzati (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        codice_fiscale TEXT UNIQUE NOT NULL,
-                        nome TEXT,
-                        data_inserimento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        data_aggiornamento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        attivo BOOLEAN DEFAULT 1,
-                        note TEXT,
-                        creato_da TEXT,
-                        modificato_da TEXT
-                    )
-                ''')
-                
-                # Tabella log accessi
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS log_accessi (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp TIMESTAMP NOT NULL,
-                        codice_fiscale TEXT NOT NULL,
-                        autorizzato BOOLEAN NOT NULL,
-                        durata_elaborazione REAL,
-                        ip_client TEXT,
-                        user_agent TEXT,
-                        terminale_id TEXT,
-                        errore TEXT,
-                        metodo_lettura TEXT,
-                        qualita_lettura INTEGER,
-                        sincronizzato BOOLEAN DEFAULT 0,
-                        data_sincronizzazione TIMESTAMP,
-                        note TEXT
-                    )
-                ''')
-                
-                # Tabella configurazioni
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS configurazioni (
-                        chiave TEXT PRIMARY KEY,
-                        valore TEXT NOT NULL,
-                        tipo TEXT DEFAULT 'string',
-                        descrizione TEXT,
-                        categoria TEXT,
-                        modificabile BOOLEAN DEFAULT 1,
-                        data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        modificato_da TEXT
-                    )
-                ''')
-                
-                # Tabella eventi sistema
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS eventi_sistema (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        tipo_evento TEXT NOT NULL,
-                        livello TEXT DEFAULT 'INFO',
-                        messaggio TEXT NOT NULL,
-                        dettagli TEXT,
-                        componente TEXT,
-                        risolto BOOLEAN DEFAULT 0
-                    )
-                ''')
-                
-                # Tabella statistiche giornaliere
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS statistiche (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        data DATE NOT NULL,
-                        totale_accessi INTEGER DEFAULT 0,
-                        accessi_autorizzati INTEGER DEFAULT 0,
-                        accessi_negati INTEGER DEFAULT 0,
-                        tempo_medio_elaborazione REAL,
-                        uptime_sistema REAL,
-                        errori_hardware INTEGER DEFAULT 0,
-                        UNIQUE(data)
-                    )
-                ''')
-                
-                # Tabella configurazione relè
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS relay_config (
-                        relay_number INTEGER PRIMARY KEY CHECK (relay_number BETWEEN 1 AND 8),
-                        description TEXT NOT NULL,
-                        valid_action TEXT CHECK (valid_action IN ('OFF', 'ON', 'PULSE')),
-                        valid_duration REAL DEFAULT 0,
-                        invalid_action TEXT CHECK (invalid_action IN ('OFF', 'ON', 'PULSE')),
-                        invalid_duration REAL DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_by TEXT
-                    )
-                ''')
-                
-                # Inserisci configurazione di default se la tabella è vuota
-                cursor.execute('SELECT COUNT(*) FROM relay_config')
-                if cursor.fetchone()[0] == 0:
-                    default_configs = [
-                        (1, 'Motore Cancello', 'PULSE', 5.0, 'OFF', 0),
-                        (2, 'LED Rosso', 'OFF', 0, 'PULSE', 3.0),
-                        (3, 'Buzzer', 'PULSE', 0.5, 'PULSE', 2.0),
-                        (4, 'LED Verde', 'PULSE', 3.0, 'OFF', 0),
-                        (5, 'Blocco Magnetico', 'OFF', 5.0, 'ON', 0),
-                        (6, 'Illuminazione', 'ON', 10.0, 'OFF', 0),
-                        (7, 'Riserva 1', 'OFF', 0, 'OFF', 0),
-                        (8, 'Riserva 2', 'OFF', 0, 'OFF', 0)
-                    ]
-                    cursor.executemany('''
-                        INSERT INTO relay_config 
-                        (relay_number, description, valid_action, valid_duration, invalid_action, invalid_duration) 
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', default_configs)
-                
-                # Indici per performance
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_cf ON utenti_autorizzati(codice_fiscale)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_cf_attivo ON utenti_autorizzati(codice_fiscale, attivo)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_log_timestamp ON log_accessi(timestamp)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_log_sync ON log_accessi(sincronizzato)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_log_cf ON log_accessi(codice_fiscale)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_eventi_timestamp ON eventi_sistema(timestamp)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_statistiche_data ON statistiche(data)')
-                
-                # Trigger per aggiornamento timestamp
-                cursor.execute('''
-                    CREATE TRIGGER IF NOT EXISTS update_utente_timestamp 
-                    AFTER UPDATE ON utenti_autorizzati
-                    FOR EACH ROW
-                    BEGIN
-                        UPDATE utenti_autorizzati 
-                        SET data_aggiornamento = CURRENT_TIMESTAMP 
-                        WHERE id = NEW.id;
-                    END;
-                ''')
-                
-                conn.commit()
-                
                 # Inserisci dati di test se database vuoto
                 self._insert_test_data_if_empty(cursor)
                 conn.commit()
@@ -244,7 +171,7 @@ class DatabaseManager:
     def health_check(self) -> bool:
         """Controlla salute del database"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 
                 # Test connessione
@@ -284,27 +211,19 @@ class DatabaseManager:
                 logger.warning(f"Accesso negato per {codice_fiscale}: limite mensile superato")
                 return False, None
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, nome, note
-                    FROM utenti_autorizzati 
-                    WHERE codice_fiscale = ? AND attivo = 1
-                ''', (codice_fiscale.upper(),))
-                
-                result = cursor.fetchone()
-                
-                if result:
-                    user_data = {
-                        'id': result[0],
-                        'nome': result[1],
-                        'note': result[2]
-                    }
-                    logger.debug(f"✅ Accesso autorizzato per {user_data['nome']}")
-                    return True, user_data
-                else:
-                    logger.debug(f"❌ Accesso negato per {codice_fiscale}")
-                    return False, None
+            # Lookup su indice in memoria (nessuna query per CF noti)
+            entry = self.auth_index.lookup(codice_fiscale)
+            
+            if entry and entry.attivo:
+                user_data = {
+                    'id': entry.id,
+                    'nome': entry.nome
+                }
+                logger.debug(f"✅ Accesso autorizzato per {user_data['nome']}")
+                return True, user_data
+            else:
+                logger.debug(f"❌ Accesso negato per {codice_fiscale}")
+                return False, None
                     
         except Exception as e:
             logger.error(f"❌ Errore verifica accesso: {e}")
@@ -312,31 +231,24 @@ class DatabaseManager:
     
     def log_access(self, codice_fiscale: str, authorized: bool, processing_time: float = None, 
                    user_data: Dict = None, error: str = None, terminal_id: str = None):
-        """Registra tentativo di accesso"""
+        """Registra tentativo di accesso (accodato al writer con commit di gruppo)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO log_accessi 
-                    (timestamp, codice_fiscale, autorizzato, durata_elaborazione, errore, terminale_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    datetime.now(),
-                    codice_fiscale.upper(),
-                    authorized,
-                    processing_time,
-                    error,
-                    terminal_id
-                ))
-                conn.commit()
-                
-                # Log dettagliato
-                status = "AUTORIZZATO" if authorized else "NEGATO"
-                user_info = ""
-                if user_data:
-                    user_info = f" - {user_data.get('nome', '')}"
-                
-                logger.info(f"📝 Accesso {status}: {codice_fiscale}{user_info}")
+            get_log_writer(self.db_path).enqueue({
+                'timestamp': utc_timestamp(),
+                'codice_fiscale': codice_fiscale.upper(),
+                'autorizzato': authorized,
+                'durata_elaborazione': processing_time,
+                'errore': error,
+                'terminale_id': terminal_id
+            })
+            
+            # Log dettagliato
+            status = "AUTORIZZATO" if authorized else "NEGATO"
+            user_info = ""
+            if user_data:
+                user_info = f" - {user_data.get('nome', '')}"
+            
+            logger.info(f"📝 Accesso {status}: {codice_fiscale}{user_info}")
                 
         except Exception as e:
             logger.error(f"❌ Errore registrazione accesso: {e}")
@@ -344,7 +256,7 @@ class DatabaseManager:
     def get_user_list(self, active_only: bool = True) -> List[Dict[str, Any]]:
         """Ottiene lista utenti autorizzati (LOG ESTESO SU RICERCA)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 
                 query = '''
@@ -385,7 +297,7 @@ class DatabaseManager:
     def user_exists(self, codice_fiscale: str) -> bool:
         """Controlla se un utente esiste già nel database (CF case-insensitive)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT id FROM utenti_autorizzati WHERE codice_fiscale = ?", (codice_fiscale.upper(),))
                 result = cursor.fetchone()
@@ -402,7 +314,7 @@ class DatabaseManager:
         logger.info(f"🔍 DEBUG add_user - CF: {codice_fiscale}, Nome: {nome}, Created_by: {created_by}")
         print(f"CRITICAL-DEBUG: add_user chiamato con CF={codice_fiscale}, nome={nome}, note={note}, creato_da={created_by}")
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 
                 # Verifica se l'utente esiste già (LOG ESTESO)
@@ -445,6 +357,7 @@ class DatabaseManager:
                 logger.info(f"🔎 [LOG SYNC] Esito verifica post-inserimento CF {codice_fiscale.upper()}: {'TROVATO' if result else 'NON TROVATO'}")
                 print(f"CRITICAL-DEBUG: Verifica post-inserimento CF={codice_fiscale.upper()} -> {'TROVATO' if result else 'NON TROVATO'}")
                 if result:
+                    self.auth_index.set_user(codice_fiscale, result[0], nome, True)
                     logger.info(f"✅ Utente aggiunto con ID {result[0]}: {nome} ({codice_fiscale})")
                     print(f"CRITICAL-DEBUG: Utente aggiunto con ID {result[0]}: {nome} ({codice_fiscale})")
                     return True
@@ -463,7 +376,7 @@ class DatabaseManager:
     def remove_user(self, codice_fiscale: str, soft_delete: bool = True) -> bool:
         """Rimuove utente (soft delete o hard delete) - LOG ESTESO SU UPDATE/DELETE"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 
                 logger.info(f"🔎 [LOG SYNC] Ricerca utente per rimozione CF: {codice_fiscale.upper()}")
@@ -493,6 +406,7 @@ class DatabaseManager:
                 
                 if cursor.rowcount > 0:
                     conn.commit()
+                    self.auth_index.reload_user(codice_fiscale, conn)
                     logger.info(f"✅ Utente {action}: {codice_fiscale}")
                     return True
                 else:
@@ -503,10 +417,193 @@ class DatabaseManager:
             logger.error(f"❌ Errore rimozione utente: {e}")
             return False
     
+    def bulk_upsert_users(self, records: Iterable[Dict[str, Any]], origine: str = 'ODOO_SYNC',
+                          deactivate_missing: bool = False) -> Dict[str, Any]:
+        """Inserisce o aggiorna molti utenti in un'unica transazione (sync Odoo).
+
+        Per ogni record (codice_fiscale, nome, note, attivo, odoo_id) si calcola
+        l'impronta dei campi sincronizzati (sync_hash) e la si confronta in
+        blocco con quella salvata sulla riga, prima di prendere il lock di
+        scrittura: in transazione vanno solo i record nuovi o cambiati,
+        caricati in una tabella TEMP e fusi in utenti_autorizzati con un solo
+        INSERT ... ON CONFLICT. Nuovi CF inseriti, nome e odoo_id aggiornati se
+        cambiati, utenti disattivati da una sync precedente (modificato_da =
+        origine) riattivati, record con attivo False (partner archiviati)
+        disattivati. Le scelte di un operatore non vengono toccate. Con
+        deactivate_missing gli utenti creati da origine che non compaiono nei
+        record vengono disattivati (solo per elenchi completi).
+
+        records può essere un generatore (stream_cittadini): viene consumato
+        per intero prima di aprire la transazione, quindi la lettura da Odoo non
+        tiene il lock di scrittura e un suo errore non scrive nulla. Senza
+        deactivate_missing (sync a batch) le impronte vengono lette solo per i
+        CF ricevuti invece che per tutta la tabella.
+
+        In 'changes' restituisce le modifiche effettive (UserChange), già
+        applicate all'indice autorizzazioni.
+        """
+        stats = {'received': 0, 'added': 0, 'updated': 0, 'unchanged': 0, 'deactivated': 0, 'invalid': 0,
+                 'changes': []}
+        righe = {}
+        for record in records:
+            stats['received'] += 1
+            cf = (record.get('codice_fiscale') or '').strip().upper()
+            if not cf:
+                stats['invalid'] += 1
+                continue
+            attivo = 1 if record.get('attivo', True) else 0
+            righe[cf] = (cf, record.get('nome'), record.get('note'), attivo, record.get('odoo_id'),
+                         sync_hash(record.get('nome'), attivo, record.get('odoo_id')))
+        if not righe:
+            return stats
+
+        start = time.time()
+        try:
+            # Confronto delle impronte su una connessione di lettura, senza lock di scrittura
+            sql_locali = 'SELECT codice_fiscale, sync_hash, attivo = 1 AND creato_da = ? FROM utenti_autorizzati'
+            with connection(self.db_path, row_factory=None) as conn:
+                if deactivate_missing:
+                    locali = {row[0]: (row[1], row[2]) for row in conn.execute(sql_locali, (origine,))}
+                else:
+                    locali = {}
+                    codici = list(righe)
+                    for i in range(0, len(codici), BLOCCO_PARAMETRI):
+                        blocco = codici[i:i + BLOCCO_PARAMETRI]
+                        locali.update(
+                            (row[0], (row[1], row[2])) for row in conn.execute(
+                                f"{sql_locali} WHERE codice_fiscale IN ({','.join('?' * len(blocco))})",
+                                (origine, *blocco)
+                            )
+                        )
+            # Partner archiviati mai visti localmente: il merge non li inserirebbe
+            da_scrivere = [
+                riga for cf, riga in righe.items()
+                if (locali[cf][0] != riga[5] if cf in locali else riga[3] == 1)
+            ]
+            mancanti = [
+                (cf,) for cf, (_, sincronizzato) in locali.items() if sincronizzato and cf not in righe
+            ] if deactivate_missing else []
+
+            if da_scrivere or mancanti:
+                with get_writer(self.db_path).transaction() as conn:
+                    versione_prima = versione_utenti(conn)
+                    conn.execute(SQL_STAGING_UTENTI)
+                    conn.execute('DELETE FROM temp.staging_utenti')
+                    conn.executemany(
+                        'INSERT INTO temp.staging_utenti (codice_fiscale, nome, note, attivo, odoo_id, sync_hash) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        da_scrivere
+                    )
+                    conn.execute(SQL_STAGING_CF)
+                    conn.execute('DELETE FROM temp.staging_cf')
+                    conn.executemany('INSERT INTO temp.staging_cf (codice_fiscale) VALUES (?)', mancanti)
+
+                    prima = {**stato_utenti(conn, 'temp.staging_utenti'), **stato_utenti(conn, 'temp.staging_cf')}
+                    conn.execute(SQL_MERGE_UTENTI, (origine,))
+                    conn.execute(SQL_HASH_UTENTI)
+                    # Impronta azzerata: se il partner ricompare viene riconfrontato
+                    conn.execute('''
+                        UPDATE utenti_autorizzati
+                        SET attivo = 0, modificato_da = ?, sync_hash = NULL
+                        WHERE attivo = 1 AND creato_da = ?
+                          AND codice_fiscale IN (SELECT codice_fiscale FROM temp.staging_cf)
+                    ''', (origine, origine))
+                    dopo = {**stato_utenti(conn, 'temp.staging_utenti'), **stato_utenti(conn, 'temp.staging_cf')}
+                    versione_dopo = versione_utenti(conn)
+
+                    conn.execute('DROP TABLE temp.staging_utenti')
+                    conn.execute('DROP TABLE temp.staging_cf')
+
+                stats['changes'] = confronta(prima, dopo)
+                # Solo le voci cambiate invece di ricaricare l'indice
+                self.auth_index.apply_changes(stats['changes'], versione_prima, versione_dopo)
+
+            for change in stats['changes']:
+                stats['updated' if change.tipo == 'reactivated' else change.tipo] += 1
+            stats['unchanged'] = len(righe) - sum(1 for change in stats['changes'] if change.codice_fiscale in righe)
+
+            logger.info(
+                f"👥 Upsert utenti ({origine}): {stats['added']} aggiunti, {stats['updated']} aggiornati, "
+                f"{stats['deactivated']} disattivati, {stats['unchanged']} invariati "
+                f"({len(da_scrivere)} da confrontare in scrittura) in {time.time() - start:.2f}s"
+            )
+            return stats
+
+        except Exception as e:
+            logger.error(f"❌ Errore upsert utenti: {e}")
+            raise
+
+    def deactivate_missing_odoo_users(self, odoo_ids: List[int], origine: str = 'ODOO_SYNC',
+                                      includi_senza_id: bool = False) -> int:
+        """Disattiva gli utenti creati da origine il cui partner Odoo non è più nell'elenco.
+
+        odoo_ids è l'elenco completo degli id dei partner validi (solo id,
+        riconciliazione della sync incrementale): partner eliminati o usciti
+        dal filtro non hanno un write_date da cui accorgersene. Un elenco vuoto
+        non disattiva nessuno. Con includi_senza_id (fine di una sync completa)
+        vengono disattivati anche gli utenti di origine senza id partner.
+        """
+        if not odoo_ids:
+            return 0
+        try:
+            with get_writer(self.db_path).transaction() as conn:
+                versione_prima = versione_utenti(conn)
+                conn.execute('CREATE TEMP TABLE IF NOT EXISTS staging_odoo_ids (id INTEGER PRIMARY KEY)')
+                conn.execute('DELETE FROM temp.staging_odoo_ids')
+                conn.executemany('INSERT OR IGNORE INTO temp.staging_odoo_ids (id) VALUES (?)',
+                                 ((odoo_id,) for odoo_id in odoo_ids))
+                conn.execute(SQL_STAGING_CF)
+                conn.execute('DELETE FROM temp.staging_cf')
+                conn.execute('''
+                    INSERT INTO temp.staging_cf (codice_fiscale)
+                    SELECT codice_fiscale FROM utenti_autorizzati
+                    WHERE attivo = 1 AND creato_da = ?
+                      AND (odoo_id NOT IN (SELECT id FROM temp.staging_odoo_ids)
+                           OR (odoo_id IS NULL AND ?))
+                ''', (origine, includi_senza_id))
+                prima = stato_utenti(conn, 'temp.staging_cf')
+                conn.execute('''
+                    UPDATE utenti_autorizzati
+                    SET attivo = 0, modificato_da = ?, sync_hash = NULL
+                    WHERE codice_fiscale IN (SELECT codice_fiscale FROM temp.staging_cf)
+                ''', (origine,))
+                changes = confronta(prima, stato_utenti(conn, 'temp.staging_cf'))
+                versione_dopo = versione_utenti(conn)
+                conn.execute('DROP TABLE temp.staging_odoo_ids')
+                conn.execute('DROP TABLE temp.staging_cf')
+
+            if changes:
+                self.auth_index.apply_changes(changes, versione_prima, versione_dopo)
+                logger.info(f"👥 Riconciliazione {origine}: {len(changes)} utenti disattivati")
+            return len(changes)
+
+        except Exception as e:
+            logger.error(f"❌ Errore riconciliazione utenti: {e}")
+            raise
+
+    def get_setting(self, key: str, default: str = None) -> Optional[str]:
+        """Valore di system_settings (default se assente)"""
+        with connection(self.db_path, row_factory=None) as conn:
+            row = conn.execute('SELECT value FROM system_settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, key: str, value: str):
+        """Scrive un valore in system_settings"""
+        with get_writer(self.db_path).transaction() as conn:
+            conn.execute('''
+                INSERT INTO system_settings (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            ''', (key, value))
+
+    def delete_setting(self, key: str):
+        """Elimina una chiave di system_settings"""
+        with get_writer(self.db_path).transaction() as conn:
+            conn.execute('DELETE FROM system_settings WHERE key = ?', (key,))
+
     def get_access_logs(self, limit: int = 100, codice_fiscale: str = None) -> List[Dict[str, Any]]:
         """Ottiene log accessi"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 cursor = conn.cursor()
                 
                 query = '''
@@ -517,10 +614,11 @@ class DatabaseManager:
                 params = []
                 
                 if codice_fiscale:
-                    query += " WHERE codice_fiscale = ?"
+                    # CF risolto prima in log_cf: ricerca sull'indice (cf_id, ts_epoch)
+                    query += " WHERE cf_id = (SELECT id FROM log_cf WHERE codice_fiscale = ?)"
                     params.append(codice_fiscale.upper())
                 
-                query += " ORDER BY timestamp DESC LIMIT ?"
+                query += " ORDER BY ts_epoch DESC, id DESC LIMIT ?"
                 params.append(limit)
                 
                 cursor.execute(query, params)
@@ -546,28 +644,16 @@ class DatabaseManager:
     def get_statistics(self, days: int = 30) -> Dict[str, Any]:
         """Ottiene statistiche accessi"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Statistiche ultimi N giorni
-                cursor.execute('''
-                    SELECT 
-                        COUNT(*) as totale,
-                        SUM(CASE WHEN autorizzato = 1 THEN 1 ELSE 0 END) as autorizzati,
-                        SUM(CASE WHEN autorizzato = 0 THEN 1 ELSE 0 END) as negati,
-                        AVG(durata_elaborazione) as tempo_medio
-                    FROM log_accessi 
-                    WHERE timestamp >= datetime('now', '-{} days')
-                '''.format(days))
-                
-                result = cursor.fetchone()
+            with connection(self.db_path, row_factory=None) as conn:
+                # Statistiche ultimi N giorni dai contatori orari/giornalieri
+                result = riepilogo(conn, (int(time.time()) - days * 86400, None))
                 
                 stats = {
                     'periodo_giorni': days,
-                    'totale_accessi': result[0] or 0,
-                    'accessi_autorizzati': result[1] or 0,
-                    'accessi_negati': result[2] or 0,
-                    'tempo_medio_elaborazione': result[3] or 0,
+                    'totale_accessi': result['totale'],
+                    'accessi_autorizzati': result['autorizzati'],
+                    'accessi_negati': result['negati'],
+                    'tempo_medio_elaborazione': result['tempo_medio'],
                     'tasso_successo': 0
                 }
                 
@@ -590,7 +676,7 @@ class DatabaseManager:
                 backup_path = backup_dir / f"access_backup_{timestamp}.db"
             
             # Backup usando SQLite VACUUM INTO
-            with sqlite3.connect(self.db_path) as conn:
+            with connection(self.db_path, row_factory=None) as conn:
                 conn.execute(f"VACUUM INTO '{backup_path}'")
             
             logger.info(f"✅ Backup creato: {backup_path}")
@@ -0,0 +1,144 @@
+# File: /opt/access_control/src/database/log_filters.py
+# Filtri temporali su log_accessi: colonna ts_epoch (UTC) e predicati a intervallo
+
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Any, List, Optional, Tuple
+
+from core.access_schedule import ROME_TZ
+
+logger = logging.getLogger(__name__)
+
+# timestamp è scritto in UTC ('YYYY-MM-DD HH:MM:SS', come CURRENT_TIMESTAMP);
+# ts_epoch è calcolato con questa espressione (colonna generata dalla migrazione 0003,
+# salvata in log_accessi_dati dalla 0008)
+TS_EPOCH_SQL = "CAST(strftime('%s', timestamp) AS INTEGER)"
+
+Intervallo = Tuple[Optional[int], Optional[int]]
+
+# CF contenuto: prima gli id in log_cf (un valore per CF), poi le righe per
+# cf_id sull'indice (cf_id, ts_epoch) invece della sottoquery della vista riga per riga
+CF_CONTIENE_SQL = "{prefix}cf_id IN (SELECT id FROM log_cf WHERE codice_fiscale LIKE ?)"
+
+
+# ===== INTERVALLI =====
+
+def epoch_inizio_giorno(giorno: date, tz=None) -> int:
+    """Epoch UTC della mezzanotte locale del giorno"""
+    tz = tz or ROME_TZ
+    dt = datetime.combine(giorno, time.min)
+    dt = tz.localize(dt) if hasattr(tz, 'localize') else dt.replace(tzinfo=tz)
+    return int(dt.timestamp())
+
+
+def _parse_data(valore: Optional[str]) -> Optional[date]:
+    if not valore:
+        return None
+    try:
+        return datetime.strptime(valore[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def intervallo_date(data_inizio: Optional[str], data_fine: Optional[str], tz=None) -> Intervallo:
+    """Date 'YYYY-MM-DD' incluse → [mezzanotte inizio, mezzanotte del giorno dopo la fine)"""
+    inizio = _parse_data(data_inizio)
+    fine = _parse_data(data_fine)
+    return (
+        epoch_inizio_giorno(inizio, tz) if inizio else None,
+        epoch_inizio_giorno(fine + timedelta(days=1), tz) if fine else None
+    )
+
+
+def intervallo_periodo(periodo: str, data_inizio: str = None, data_fine: str = None,
+                       tz=None, now: datetime = None) -> Intervallo:
+    """Intervallo [inizio, fine) del periodo della dashboard (oggi, settimana, mese, anno, custom)"""
+    tz = tz or ROME_TZ
+    oggi = (now or datetime.now(tz)).date()
+    domani = oggi + timedelta(days=1)
+    if periodo == 'oggi':
+        return epoch_inizio_giorno(oggi, tz), epoch_inizio_giorno(domani, tz)
+    if periodo == 'settimana':
+        return epoch_inizio_giorno(oggi - timedelta(days=7), tz), epoch_inizio_giorno(domani, tz)
+    if periodo == 'mese':
+        primo = oggi.replace(day=1)
+        successivo = date(primo.year + primo.month // 12, primo.month % 12 + 1, 1)
+        return epoch_inizio_giorno(primo, tz), epoch_inizio_giorno(successivo, tz)
+    if periodo == 'anno':
+        return (epoch_inizio_giorno(date(oggi.year, 1, 1), tz),
+                epoch_inizio_giorno(date(oggi.year + 1, 1, 1), tz))
+    if periodo == 'custom' and data_inizio and data_fine:
+        return intervallo_date(data_inizio, data_fine, tz)
+    return None, None
+
+
+# ===== WHERE =====
+
+class LogFilter:
+    """Condizioni WHERE per le query su log_accessi.
+
+    I periodi diventano predicati semiaperti su ts_epoch (>= inizio AND < fine)
+    risolti con gli indici che iniziano da ts_epoch (migrazioni 0003/0004),
+    mai funzioni applicate a timestamp.
+    """
+
+    def __init__(self, alias: str = ''):
+        self.alias = alias
+        self.prefix = f"{alias}." if alias else ''
+        self.clauses: List[str] = []
+        self.params: List[Any] = []
+        # Intervallo complessivo dei filtri temporali (per scegliere le partizioni)
+        self.estremi: Intervallo = (None, None)
+
+    def intervallo(self, intervallo: Intervallo) -> 'LogFilter':
+        inizio, fine = intervallo
+        minimo, massimo = self.estremi
+        if inizio is not None:
+            self.clauses.append(f"{self.prefix}ts_epoch >= ?")
+            self.params.append(inizio)
+            minimo = inizio if minimo is None else max(minimo, inizio)
+        if fine is not None:
+            self.clauses.append(f"{self.prefix}ts_epoch < ?")
+            self.params.append(fine)
+            massimo = fine if massimo is None else min(massimo, fine)
+        self.estremi = (minimo, massimo)
+        return self
+
+    def periodo(self, periodo: str, data_inizio: str = None, data_fine: str = None, tz=None) -> 'LogFilter':
+        return self.intervallo(intervallo_periodo(periodo, data_inizio, data_fine, tz))
+
+    def date(self, data_inizio: str = None, data_fine: str = None, tz=None) -> 'LogFilter':
+        return self.intervallo(intervallo_date(data_inizio, data_fine, tz))
+
+    def dopo(self, cursore: Optional[Tuple[int, int]]) -> 'LogFilter':
+        """Keyset: righe successive a (ts_epoch, id) nell'ordine ts_epoch DESC, id DESC"""
+        if cursore:
+            ts_epoch, id_log = cursore
+            self.clauses.append(f"({self.prefix}ts_epoch, {self.prefix}id) < (?, ?)")
+            self.params.extend([ts_epoch, id_log])
+            # Le partizioni più recenti del cursore non servono più
+            minimo, massimo = self.estremi
+            self.estremi = (minimo, ts_epoch + 1 if massimo is None else min(massimo, ts_epoch + 1))
+        return self
+
+    def uguale(self, colonna: str, valore: Any) -> 'LogFilter':
+        if valore is not None and valore != '':
+            self.clauses.append(f"{self.prefix}{colonna} = ?")
+            self.params.append(valore)
+        return self
+
+    def contiene(self, colonna: str, valore: str) -> 'LogFilter':
+        if valore:
+            self.clauses.append(f"{self.prefix}{colonna} LIKE ?")
+            self.params.append(f'%{valore}%')
+        return self
+
+    def contiene_cf(self, valore: str) -> 'LogFilter':
+        if valore:
+            self.clauses.append(CF_CONTIENE_SQL.format(prefix=self.prefix))
+            self.params.append(f'%{valore}%')
+        return self
+
+    def where(self) -> str:
+        """Condizioni unite in AND ('1=1' se nessun filtro)"""
+        return ' AND '.join(self.clauses) if self.clauses else '1=1'
@@ -0,0 +1,138 @@
+# File: /opt/access_control/src/database/log_pagination.py
+# Paginazione keyset di log_accessi: cursore opaco e totali in cache per filtro
+
+import time
+import base64
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Cursore = Tuple[int, int]  # (ts_epoch, id) dell'ultima riga della pagina
+
+# Ultimo id assegnato (AUTOINCREMENT), non MAX(id): le righe tardive di un mese
+# già sigillato finiscono nell'archivio con id più alti di quelle rimaste
+SQL_MAX_ID = "SELECT MAX(seq) FROM main.sqlite_sequence WHERE name IN ('log_accessi', 'log_accessi_dati')"
+
+
+# ===== CURSORE =====
+
+def firma_filtro(where: str, params: Sequence[Any]) -> str:
+    """Impronta breve di un filtro (condizioni + parametri)"""
+    return hashlib.sha1(f"{where}|{list(params)!r}".encode()).hexdigest()[:16]
+
+
+def codifica_cursore(ts_epoch: int, id_log: int, firma: str) -> str:
+    """Token opaco per la pagina successiva, valido solo per lo stesso filtro"""
+    testo = f"{ts_epoch}.{id_log}.{firma[:8]}"
+    return base64.urlsafe_b64encode(testo.encode()).decode().rstrip('=')
+
+
+def decodifica_cursore(token: Optional[str], firma: str) -> Optional[Cursore]:
+    """(ts_epoch, id) dal token; None senza token, ValueError se non valido per il filtro"""
+    if not token:
+        return None
+    try:
+        testo = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        ts_epoch, id_log, impronta = testo.split('.')
+        cursore = (int(ts_epoch), int(id_log))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Cursore non valido')
+    if impronta != firma[:8]:
+        raise ValueError('Cursore non valido per i filtri correnti')
+    return cursore
+
+
+def pagina(rows: List[sqlite3.Row], per_pagina: int, firma: str) -> Tuple[List[sqlite3.Row], Optional[str]]:
+    """Righe della pagina e cursore successivo.
+
+    La query deve chiedere per_pagina + 1 righe ordinate per ts_epoch DESC,
+    id DESC e restituire le colonne ts_epoch e id: la riga in più dice se
+    esiste una pagina successiva senza contare nulla.
+    """
+    if len(rows) <= per_pagina:
+        return rows, None
+    rows = rows[:per_pagina]
+    ultima = rows[-1]
+    return rows, codifica_cursore(ultima['ts_epoch'], ultima['id'], firma)
+
+
+# ===== TOTALI =====
+
+class LogCountCache:
+    """Totali dei filtri su log_accessi, ricalcolati solo quando arrivano righe nuove.
+
+    La chiave è la query di conteggio (sorgente con le partizioni + WHERE +
+    parametri), quindi un mese sigillato o compresso produce una chiave nuova.
+    Per ogni chiave si ricorda l'ultimo id di log_accessi al momento del conteggio:
+    se nel frattempo sono state scritte righe, si contano solo quelle con
+    id maggiore (ricerca sulla rowid) e si sommano al totale. Dopo `ttl`
+    secondi il totale viene ricalcolato per intero.
+    """
+
+    def __init__(self, max_voci: int = 128, ttl: float = 600.0):
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self._voci: 'OrderedDict[Tuple, Tuple[int, int, float]]' = OrderedDict()  # {chiave: (max_id, totale, creato)}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'incrementali': 0, 'completi': 0}
+
+    def conta(self, conn: sqlite3.Connection, sorgente: str, where: str, params: Sequence[Any],
+              alias: str = '') -> int:
+        """COUNT(*) di sorgente WHERE where, dalla cache quando possibile"""
+        chiave = (conn.execute('PRAGMA database_list').fetchone()[2], sorgente, where, tuple(params))
+        max_id = conn.execute(SQL_MAX_ID).fetchone()[0] or 0
+        prefix = f"{alias}." if alias else ''
+
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce:
+                self._voci.move_to_end(chiave)
+
+        if voce and time.monotonic() - voce[2] < self.ttl and voce[0] >= max_id:
+            self.stats['hits'] += 1
+            return voce[1]
+
+        # Ultimo id letto nella stessa istruzione del conteggio: stessa istantanea WAL
+        if voce and time.monotonic() - voce[2] < self.ttl:
+            nuove, max_id = conn.execute(
+                f"SELECT COUNT(*), ({SQL_MAX_ID}) FROM {sorgente} WHERE {where} AND {prefix}id > ?",
+                [*params, voce[0]]
+            ).fetchone()
+            totale, creato = voce[1] + nuove, voce[2]
+            self.stats['incrementali'] += 1
+        else:
+            totale, max_id = conn.execute(
+                f"SELECT COUNT(*), ({SQL_MAX_ID}) FROM {sorgente} WHERE {where}", list(params)
+            ).fetchone()
+            creato = time.monotonic()
+            self.stats['completi'] += 1
+
+        with self._lock:
+            self._voci[chiave] = (max_id or 0, totale, creato)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+        return totale
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'voci': len(self._voci), **self.stats}
+
+
+_count_cache = None
+_count_cache_lock = threading.Lock()
+
+
+def get_log_count_cache() -> LogCountCache:
+    """Ottiene la cache dei totali del processo"""
+    global _count_cache
+    if _count_cache is None:
+        with _count_cache_lock:
+            if _count_cache is None:
+                _count_cache = LogCountCache()
+    return _count_cache
@@ -0,0 +1,548 @@
+# File: /opt/access_control/src/database/log_partitions.py
+# Partizioni mensili di log_accessi: sigillatura dei mesi chiusi, archivi compressi e instradamento query
+
+import os
+import csv
+import gzip
+import time
+import logging
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.access_schedule import ROME_TZ
+from database.log_filters import Intervallo, epoch_inizio_giorno
+from database.pool import DEFAULT_DB_PATH, connect, enable_wal, get_writer
+
+logger = logging.getLogger(__name__)
+
+ARCHIVIO_DIR = 'archivio_log'
+ARCHIVIO_FILE = 'log_accessi_archivio.db'
+ARCHIVIO_ALIAS = 'archivio'
+
+RETENTION_KEY = 'log.retention_mesi'
+RETENTION_DEFAULT = 24
+
+ARCHIVIATA = 'archiviata'
+COMPRESSA = 'compressa'
+
+# Indici delle partizioni: gli stessi di log_accessi (migrazioni 0004 e 0008)
+INDICI_PARTIZIONE = (
+    ('ts_tipo', 'ts_epoch, tipo_accesso, autorizzato'),
+    ('cfid_ts', 'cf_id, ts_epoch'),
+    ('aut_ts', 'autorizzato, ts_epoch'),
+)
+
+# Colonne ricavabili nelle partizioni sigillate prima che esistessero, con la
+# stessa affinità della colonna di log_accessi (CAST): i filtri su cf_id
+# trovano anche le righe dei mesi non ancora allineati (_allinea_partizioni)
+DERIVATE = {
+    'cf_id': "CAST((SELECT id FROM main.log_cf WHERE codice_fiscale = {tabella}.codice_fiscale) AS INTEGER)",
+}
+
+# Frazione di pagine libere oltre cui il database principale viene compattato
+SOGLIA_PAGINE_LIBERE = 0.25
+
+# Compattazione a passi (auto_vacuum incrementale): il writer è tenuto per
+# un passo alla volta, con una pausa fra i passi e un tempo massimo per ciclo
+PAGINE_PER_PASSO = 256
+PAUSA_PASSI = 0.05
+TEMPO_COMPATTAZIONE = 2.0
+# Il passaggio ad auto_vacuum incrementale richiede un VACUUM completo: subito
+# solo sotto questa dimensione, altrimenti nella finestra notturna [inizio, fine)
+SOGLIA_VACUUM_BYTES = 8 * 1024 * 1024
+FINESTRA_MANUTENZIONE = (3, 5)
+AUTO_VACUUM_INCREMENTALE = 2
+
+EPOCH_MIN = -(1 << 62)
+EPOCH_MAX = 1 << 62
+
+
+def archivio_path(db_path: str) -> str:
+    """File SQLite dei mesi sigillati, accanto al database principale"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVIO_DIR, ARCHIVIO_FILE)
+
+
+def nome_tabella(anno: int, mese: int) -> str:
+    return f"log_accessi_{anno:04d}_{mese:02d}"
+
+
+def confini_mese(anno: int, mese: int, tz=None) -> Intervallo:
+    """[mezzanotte locale del primo giorno, primo giorno del mese successivo) in epoch UTC"""
+    successivo = date(anno + mese // 12, mese % 12 + 1, 1)
+    return epoch_inizio_giorno(date(anno, mese, 1), tz), epoch_inizio_giorno(successivo, tz)
+
+
+def mese_di(epoch: int, tz=None) -> Tuple[int, int]:
+    locale = datetime.fromtimestamp(epoch, tz or ROME_TZ)
+    return locale.year, locale.month
+
+
+def _mese_precedente(anno: int, mese: int, n: int = 1) -> Tuple[int, int]:
+    indice = anno * 12 + (mese - 1) - n
+    return indice // 12, indice % 12 + 1
+
+
+def _colonne(conn: sqlite3.Connection, tabella: str, schema: str = 'main') -> List[Tuple[str, str]]:
+    """(nome, tipo) delle colonne, comprese le generate (ts_epoch)"""
+    return [(row[1], row[2] or '') for row in conn.execute(f'PRAGMA {schema}.table_xinfo({tabella})')]
+
+
+# ===== INSTRADAMENTO QUERY =====
+
+# Colonne delle partizioni sigillate: non cambiano più, lette una volta
+_colonne_partizioni: Dict[Tuple[str, str], Dict[str, str]] = {}
+
+
+def _db_file(conn: sqlite3.Connection, schema: str = 'main') -> Optional[str]:
+    return next((row[2] for row in conn.execute('PRAGMA database_list') if row[1] == schema), None)
+
+
+def _attach_archivio(conn: sqlite3.Connection):
+    if _db_file(conn, ARCHIVIO_ALIAS) is None:
+        conn.execute(f'ATTACH DATABASE ? AS {ARCHIVIO_ALIAS}', (archivio_path(_db_file(conn)),))
+
+
+def partizioni_archiviate(conn: sqlite3.Connection, intervallo: Intervallo = (None, None)) -> List[str]:
+    """Tabelle dei mesi sigillati che si sovrappongono all'intervallo"""
+    inizio, fine = intervallo
+    try:
+        return [row[0] for row in conn.execute(
+            'SELECT tabella FROM log_partizioni WHERE stato = ? AND fine > ? AND inizio < ? ORDER BY inizio',
+            (ARCHIVIATA, EPOCH_MIN if inizio is None else inizio, EPOCH_MAX if fine is None else fine)
+        )]
+    except sqlite3.OperationalError:
+        # DB senza migrazione 0005
+        return []
+
+
+def sorgente_log(conn: sqlite3.Connection, intervallo: Intervallo = (None, None), alias: str = '') -> str:
+    """Sorgente FROM per log_accessi nell'intervallo.
+
+    Il mese corrente (e quelli non ancora sigillati) sono in log_accessi, che
+    è sempre incluso; i mesi chiusi che cadono nell'intervallo vengono
+    aggiunti in UNION ALL dal database di archivio, collegato alla
+    connessione al primo uso. Senza mesi sigillati nell'intervallo la
+    sorgente è la sola log_accessi: le query del mese corrente non toccano
+    l'archivio.
+    """
+    tabelle = partizioni_archiviate(conn, intervallo)
+    if not tabelle:
+        return f"log_accessi {alias}".rstrip()
+
+    _attach_archivio(conn)
+    colonne = _colonne(conn, 'log_accessi')
+    partizioni = []
+    for tabella in tabelle:
+        chiave = (_db_file(conn, ARCHIVIO_ALIAS), tabella)
+        presenti = _colonne_partizioni.get(chiave)
+        if presenti is None:
+            presenti = _colonne_partizioni[chiave] = dict(_colonne(conn, tabella, ARCHIVIO_ALIAS))
+        partizioni.append((tabella, presenti))
+
+    # I rami dell'UNION ALL devono avere la stessa affinità per ogni colonna,
+    # altrimenti SQLite non appiattisce l'unione e ordina tutte le righe
+    # invece di unire i rami per ts_epoch. Le colonne calcolate dalla vista
+    # log_accessi (senza tipo: timestamp, nome_utente) e quelle con tipo
+    # diverso in una partizione (user_id assente nei mesi sigillati prima
+    # della migrazione 0008) diventano +colonna / NULL, senza affinità in
+    # nessun ramo.
+    diverse = {
+        nome for nome, tipo in colonne
+        if not tipo or any(p.get(nome, tipo if nome in DERIVATE else None) != tipo for _, p in partizioni)
+    }
+
+    def campi(tabella: str = None, presenti: Optional[Dict[str, str]] = None) -> str:
+        def campo(nome: str) -> str:
+            if presenti is not None and nome not in presenti:
+                # Assente nella partizione: ricavata (stessa affinità) o NULL
+                return f"NULL AS {nome}" if nome in diverse else f"{DERIVATE[nome].format(tabella=tabella)} AS {nome}"
+            return f"+{nome} AS {nome}" if nome in diverse else nome
+        return ', '.join(campo(nome) for nome, _ in colonne)
+
+    selects = [f"SELECT {campi()} FROM main.log_accessi"]
+    selects += [f"SELECT {campi(tabella, presenti)} FROM {ARCHIVIO_ALIAS}.{tabella}"
+                for tabella, presenti in partizioni]
+    return f"({' UNION ALL '.join(selects)}) {alias}".rstrip()
+
+
+def elenco_partizioni(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """Mesi registrati in log_partizioni (sigillati o compressi)"""
+    try:
+        return [
+            dict(zip(('mese', 'tabella', 'righe', 'stato', 'file'), row))
+            for row in conn.execute('SELECT mese, tabella, righe, stato, file FROM log_partizioni ORDER BY inizio')
+        ]
+    except sqlite3.OperationalError:
+        return []
+
+
+# ===== MANUTENZIONE =====
+
+class LogPartitionManager:
+    """Sposta i mesi chiusi di log_accessi nell'archivio e comprime quelli scaduti.
+
+    Un mese viene sigillato `attesa` secondi dopo la sua fine: le righe sono
+    copiate in una tabella log_accessi_AAAA_MM del database di archivio
+    (stessi indici), poi in un'unica transazione sul writer il mese viene
+    registrato in log_partizioni e le righe copiate sono cancellate da
+    log_accessi. Il database principale contiene così solo il mese corrente
+    e i backup restano piccoli. I mesi più vecchi di `log.retention_mesi`
+    (system_settings) sono esportati in CSV gzip e rimossi dall'archivio.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, intervallo: float = 3600.0,
+                 attesa: float = 6 * 3600.0, tz=None):
+        self.db_path = db_path
+        self.archivio = archivio_path(db_path)
+        self.intervallo = intervallo
+        self.attesa = attesa
+        self.tz = tz or ROME_TZ
+
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.ultimo: Optional[Dict[str, Any]] = None
+        self.stats = {'sigillati': 0, 'compressi': 0, 'righe_spostate': 0, 'errori': 0}
+
+    # ===== CONNESSIONE =====
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Connessione dedicata: legge log_accessi e scrive solo sull'archivio"""
+        if self._conn is None:
+            if not os.path.exists(self.archivio):
+                os.makedirs(os.path.dirname(self.archivio), exist_ok=True)
+                nuovo = sqlite3.connect(self.archivio)
+                try:
+                    # Prima di ogni tabella: lo spazio dei mesi compressi torna al filesystem
+                    nuovo.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    nuovo.execute('VACUUM')
+                finally:
+                    nuovo.close()
+            enable_wal(self.archivio)
+            conn = connect(self.db_path, isolation_level=None, check_same_thread=False)
+            conn.execute(f'ATTACH DATABASE ? AS {ARCHIVIO_ALIAS}', (self.archivio,))
+            self._conn = conn
+        return self._conn
+
+    def _retention_mesi(self, conn: sqlite3.Connection) -> int:
+        try:
+            row = conn.execute('SELECT value FROM system_settings WHERE key = ?', (RETENTION_KEY,)).fetchone()
+            return int(row[0]) if row else RETENTION_DEFAULT
+        except (sqlite3.Error, ValueError):
+            return RETENTION_DEFAULT
+
+    # ===== SIGILLATURA =====
+
+    def mesi_da_sigillare(self, now: float = None) -> List[Tuple[int, int]]:
+        """Mesi chiusi (da almeno `attesa` secondi) con righe ancora in log_accessi"""
+        now = now or time.time()
+        conn = self._get_connection()
+        minimo = conn.execute('SELECT MIN(ts_epoch) FROM main.log_accessi').fetchone()[0]
+        if minimo is None:
+            return []
+        corrente = confini_mese(*mese_di(int(now), self.tz), self.tz)[0]
+        mesi = []
+        anno, mese = mese_di(minimo, self.tz)
+        while True:
+            inizio, fine = confini_mese(anno, mese, self.tz)
+            if fine > corrente or fine + self.attesa > now:
+                break
+            if conn.execute('SELECT 1 FROM main.log_accessi WHERE ts_epoch >= ? AND ts_epoch < ? LIMIT 1',
+                            (inizio, fine)).fetchone():
+                mesi.append((anno, mese))
+            anno, mese = (anno + 1, 1) if mese == 12 else (anno, mese + 1)
+        return mesi
+
+    def sigilla(self, anno: int, mese: int) -> int:
+        """Sposta le righe del mese nell'archivio; restituisce le righe spostate"""
+        tabella = nome_tabella(anno, mese)
+        inizio, fine = confini_mese(anno, mese, self.tz)
+        conn = self._get_connection()
+        colonne = _colonne(conn, 'log_accessi')
+        nomi = ', '.join(nome for nome, _ in colonne)
+
+        # 1. Copia nell'archivio (idempotente: la chiave è l'id originale)
+        definizioni = ', '.join(
+            'id INTEGER PRIMARY KEY' if nome == 'id' else f"{nome} {tipo}".strip() for nome, tipo in colonne
+        )
+        conn.execute('BEGIN')
+        try:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {ARCHIVIO_ALIAS}.{tabella} ({definizioni})')
+            # Mese sigillato con uno schema precedente (es. senza user_id): righe tardive
+            presenti = dict(_colonne(conn, tabella, ARCHIVIO_ALIAS))
+            for nome, tipo in colonne:
+                if nome not in presenti:
+                    conn.execute(f'ALTER TABLE {ARCHIVIO_ALIAS}.{tabella} ADD COLUMN {nome} {tipo}'.rstrip())
+                    _colonne_partizioni.pop((_db_file(conn, ARCHIVIO_ALIAS), tabella), None)
+            for suffisso, campi in INDICI_PARTIZIONE:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {ARCHIVIO_ALIAS}.{tabella}_{suffisso} ON {tabella}({campi})'
+                )
+            conn.execute(
+                f'INSERT OR IGNORE INTO {ARCHIVIO_ALIAS}.{tabella} ({nomi}) '
+                f'SELECT {nomi} FROM main.log_accessi WHERE ts_epoch >= ? AND ts_epoch < ?',
+                (inizio, fine)
+            )
+            ultimo_id, righe = conn.execute(
+                f'SELECT MAX(id), COUNT(*) FROM {ARCHIVIO_ALIAS}.{tabella}'
+            ).fetchone()
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        conn.execute(f'PRAGMA {ARCHIVIO_ALIAS}.wal_checkpoint(TRUNCATE)')
+
+        # 2. Registrazione e cancellazione atomiche: le query vedono il mese
+        # o in log_accessi o nell'archivio, mai in entrambi. Le righe arrivate
+        # dopo la copia (id maggiori) restano e saranno spostate al giro dopo.
+        with get_writer(self.db_path).transaction() as w:
+            w.execute('''
+                INSERT INTO log_partizioni (mese, tabella, inizio, fine, righe)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(mese) DO UPDATE SET righe = excluded.righe, stato = 'archiviata'
+            ''', (f"{anno:04d}-{mese:02d}", tabella, inizio, fine, righe))
+            spostate = w.execute(
+                'DELETE FROM log_accessi_dati WHERE ts_epoch >= ? AND ts_epoch < ? AND id <= ?',
+                (inizio, fine, ultimo_id)
+            ).rowcount
+
+        self.stats['sigillati'] += 1
+        self.stats['righe_spostate'] += spostate
+        logger.info(f"🗃️ Log {anno:04d}-{mese:02d} sigillato in {tabella}: {spostate} righe spostate")
+        return spostate
+
+    def compatta(self, now: float = None) -> bool:
+        """Restituisce al filesystem le pagine lasciate libere dai mesi spostati.
+
+        Con auto_vacuum incrementale le pagine vengono rilasciate a passi di
+        PAGINE_PER_PASSO, prendendo il writer un passo alla volta e per al più
+        TEMPO_COMPATTAZIONE secondi a ciclo: una tessera attende al massimo un
+        passo, il resto viene rilasciato ai cicli successivi. Un database
+        senza auto_vacuum incrementale viene convertito con un VACUUM completo
+        una sola volta, solo se le pagine libere superano SOGLIA_PAGINE_LIBERE
+        e il database è piccolo o si è nella FINESTRA_MANUTENZIONE.
+        """
+        writer = get_writer(self.db_path)
+        with writer.locked() as w:
+            modo, pagine, libere, dimensione_pagina = (
+                w.execute(f'PRAGMA {nome}').fetchone()[0]
+                for nome in ('auto_vacuum', 'page_count', 'freelist_count', 'page_size')
+            )
+        if modo != AUTO_VACUUM_INCREMENTALE:
+            return self._converti_incrementale(pagine, libere, pagine * dimensione_pagina, now)
+        if libere < PAGINE_PER_PASSO:
+            return False
+
+        start = time.perf_counter()
+        iniziali = libere
+        while libere and time.perf_counter() - start < TEMPO_COMPATTAZIONE:
+            with writer.locked() as w:
+                # execute() esegue un solo passo del PRAGMA (una pagina): executescript fino in fondo
+                w.executescript(f'PRAGMA incremental_vacuum({PAGINE_PER_PASSO})')
+                libere = w.execute('PRAGMA freelist_count').fetchone()[0]
+            if libere and self._stop_event.wait(PAUSA_PASSI):
+                break
+        logger.info(f"🧹 Database compattato: {iniziali - libere}/{iniziali} pagine libere rilasciate "
+                    f"in {time.perf_counter() - start:.1f}s")
+        return libere < iniziali
+
+    def _converti_incrementale(self, pagine: int, libere: int, dimensione: int, now: float = None) -> bool:
+        """VACUUM completo che porta il database ad auto_vacuum incrementale"""
+        if libere < pagine * SOGLIA_PAGINE_LIBERE:
+            return False
+        inizio, fine = FINESTRA_MANUTENZIONE
+        ora = datetime.fromtimestamp(now or time.time(), self.tz).hour
+        if dimensione > SOGLIA_VACUUM_BYTES and not inizio <= ora < fine:
+            logger.debug(f"🧹 Compattazione database rinviata alla finestra {inizio:02d}-{fine:02d} "
+                        f"({libere}/{pagine} pagine libere)")
+            return False
+        start = time.perf_counter()
+        with get_writer(self.db_path).locked() as w:
+            w.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            w.execute('VACUUM')
+        logger.info(f"🧹 Database compattato e convertito ad auto_vacuum incrementale: {libere}/{pagine} "
+                    f"pagine libere in {time.perf_counter() - start:.1f}s")
+        return True
+
+    # ===== RETENTION =====
+
+    def mesi_da_comprimere(self, now: float = None) -> List[Tuple[str, str]]:
+        """(mese, tabella) archiviati più vecchi della retention"""
+        conn = self._get_connection()
+        retention = self._retention_mesi(conn)
+        if retention <= 0:
+            return []
+        anno, mese = _mese_precedente(*mese_di(int(now or time.time()), self.tz), retention)
+        limite = confini_mese(anno, mese, self.tz)[0]
+        return conn.execute(
+            'SELECT mese, tabella FROM main.log_partizioni WHERE stato = ? AND fine <= ? ORDER BY inizio',
+            (ARCHIVIATA, limite)
+        ).fetchall()
+
+    def comprimi(self, mese: str, tabella: str) -> str:
+        """Esporta il mese in CSV gzip e lo rimuove dall'archivio; restituisce il file"""
+        conn = self._get_connection()
+        destinazione = os.path.join(os.path.dirname(self.archivio), f"{tabella}.csv.gz")
+        temporaneo = f"{destinazione}.tmp"
+        cursor = conn.execute(f'SELECT * FROM {ARCHIVIO_ALIAS}.{tabella} ORDER BY id')
+        with gzip.open(temporaneo, 'wt', encoding='utf-8', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow([d[0] for d in cursor.description])
+            writer.writerows(cursor)
+        os.replace(temporaneo, destinazione)
+
+        with get_writer(self.db_path).transaction() as w:
+            w.execute('''
+                UPDATE log_partizioni SET stato = ?, file = ?, compressa_il = CURRENT_TIMESTAMP
+                WHERE mese = ?
+            ''', (COMPRESSA, os.path.basename(destinazione), mese))
+        self._elimina_tabella(tabella)
+
+        self.stats['compressi'] += 1
+        logger.info(f"🗜️ Log {mese} compresso in {os.path.basename(destinazione)}")
+        return destinazione
+
+    def _elimina_tabella(self, tabella: str):
+        conn = self._get_connection()
+        conn.execute(f'DROP TABLE IF EXISTS {ARCHIVIO_ALIAS}.{tabella}')
+        # executescript: con execute() il PRAGMA rilascerebbe una sola pagina
+        conn.executescript(f'PRAGMA {ARCHIVIO_ALIAS}.incremental_vacuum')
+        conn.execute(f'PRAGMA {ARCHIVIO_ALIAS}.wal_checkpoint(TRUNCATE)')
+
+    def _pulisci_compressi(self):
+        """Tabelle rimaste nell'archivio per mesi già compressi (interruzione a metà)"""
+        conn = self._get_connection()
+        for (tabella,) in conn.execute(
+            f'SELECT p.tabella FROM main.log_partizioni p '
+            f'JOIN {ARCHIVIO_ALIAS}.sqlite_master m ON m.type = \'table\' AND m.name = p.tabella '
+            f'WHERE p.stato = ?', (COMPRESSA,)
+        ).fetchall():
+            self._elimina_tabella(tabella)
+
+    def _allinea_partizioni(self):
+        """Partizioni sigillate prima di cf_id nella vista: CF in log_cf, colonna cf_id e indice"""
+        conn = self._get_connection()
+        for (tabella,) in conn.execute(
+            'SELECT tabella FROM main.log_partizioni WHERE stato = ?', (ARCHIVIATA,)
+        ).fetchall():
+            if 'cf_id' in dict(_colonne(conn, tabella, ARCHIVIO_ALIAS)):
+                continue
+            mancanti = conn.execute(
+                f'SELECT DISTINCT codice_fiscale FROM {ARCHIVIO_ALIAS}.{tabella} '
+                f'WHERE codice_fiscale NOT IN (SELECT codice_fiscale FROM main.log_cf)'
+            ).fetchall()
+            if mancanti:
+                with get_writer(self.db_path).transaction() as w:
+                    w.executemany('INSERT OR IGNORE INTO log_cf (codice_fiscale) VALUES (?)', mancanti)
+            conn.execute('BEGIN')
+            try:
+                conn.execute(f'ALTER TABLE {ARCHIVIO_ALIAS}.{tabella} ADD COLUMN cf_id INTEGER')
+                conn.execute(
+                    f'UPDATE {ARCHIVIO_ALIAS}.{tabella} SET cf_id = '
+                    f'(SELECT id FROM main.log_cf WHERE codice_fiscale = {tabella}.codice_fiscale)'
+                )
+                for suffisso, campi in INDICI_PARTIZIONE:
+                    conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS {ARCHIVIO_ALIAS}.{tabella}_{suffisso} ON {tabella}({campi})'
+                    )
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            _colonne_partizioni.pop((_db_file(conn, ARCHIVIO_ALIAS), tabella), None)
+            logger.info(f"🗃️ Partizione {tabella} allineata: colonna cf_id indicizzata")
+
+    # ===== CICLO =====
+
+    def run_once(self, now: float = None) -> Dict[str, Any]:
+        """Sigilla i mesi chiusi e comprime quelli oltre la retention"""
+        with self._lock:
+            start = time.perf_counter()
+            esito = {'sigillati': [], 'compressi': []}
+            try:
+                self._pulisci_compressi()
+                self._allinea_partizioni()
+                for anno, mese in self.mesi_da_sigillare(now):
+                    self.sigilla(anno, mese)
+                    esito['sigillati'].append(f"{anno:04d}-{mese:02d}")
+                # Ogni ciclo: la compattazione a passi prosegue da dove si era fermata
+                esito['compattato'] = self.compatta(now)
+                for mese, tabella in self.mesi_da_comprimere(now):
+                    self.comprimi(mese, tabella)
+                    esito['compressi'].append(mese)
+            except Exception as e:
+                self.stats['errori'] += 1
+                esito['errore'] = str(e)
+                self._close()
+                logger.error(f"❌ Errore manutenzione partizioni log: {e}")
+            esito['durata_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            esito['quando'] = datetime.now().isoformat(timespec='seconds')
+            self.ultimo = esito
+            return esito
+
+    def _run(self):
+        while True:
+            self.run_once()
+            if self._stop_event.wait(self.intervallo):
+                break
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    # ===== API =====
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='log-partitions', daemon=True)
+        self._thread.start()
+        logger.info(f"🗃️ Partizioni log: controllo ogni {self.intervallo / 60:.0f} minuti")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        with self._lock:
+            self._close()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Partizioni registrate e ultimo ciclo per diagnostica"""
+        with self._lock:
+            conn = self._get_connection()
+            return {
+                'retention_mesi': self._retention_mesi(conn),
+                'archivio_bytes': os.path.getsize(self.archivio) if os.path.exists(self.archivio) else 0,
+                'partizioni': elenco_partizioni(conn),
+                'ultimo': self.ultimo,
+                **self.stats
+            }
+
+
+# Singleton per processo
+_log_partitions = None
+_log_partitions_lock = threading.Lock()
+
+
+def get_log_partitions(db_path: str = None) -> LogPartitionManager:
+    """Restituisce il gestore partizioni del processo (già avviato)"""
+    global _log_partitions
+    if _log_partitions is None:
+        with _log_partitions_lock:
+            if _log_partitions is None:
+                manager = LogPartitionManager(db_path or DEFAULT_DB_PATH)
+                manager.start()
+                _log_partitions = manager
+    return _log_partitions
@@ -0,0 +1,453 @@
+# File: /opt/access_control/src/database/log_writer.py
+# Scrittura asincrona di log_accessi con commit di gruppo
+
+import os
+import re
+import sys
+import fcntl
+import json
+import queue
+import atexit
+import signal
+import sqlite3
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from database.pool import DEFAULT_DB_PATH, connection, get_writer
+from database.rollup import aggiorna as aggiorna_statistiche
+from database.schema import migrate
+
+logger = logging.getLogger(__name__)
+
+# Colonne ammesse: i nomi finiscono nell'SQL, i valori sono sempre parametri
+COLONNE_LOG = (
+    'timestamp', 'codice_fiscale', 'autorizzato', 'durata_elaborazione', 'ip_client',
+    'user_agent', 'terminale_id', 'errore', 'metodo_lettura', 'qualita_lettura',
+    'note', 'tipo_accesso', 'motivo_rifiuto', 'nome_utente',
+    'durata_lettura', 'durata_decisione', 'durata_attuazione'
+)
+
+
+# Numero dell'ultima riga dello spill committata, scritto nella stessa
+# transazione delle righe: al recupero le righe fino a lì vengono saltate.
+# Un valore per writer: main.py e web_api scrivono sullo stesso database
+CHIAVE_SPILL_COMMIT = 'log_writer.spill_seq.{ruolo}'
+# Con traffico continuo lo spill non si svuota mai: oltre questa dimensione
+# viene riscritto con le sole righe non ancora committate
+SPILL_MAX_BYTES = 1024 * 1024
+
+
+def utc_timestamp() -> str:
+    """Timestamp nello stesso formato di CURRENT_TIMESTAMP di SQLite"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def ruolo_processo() -> str:
+    """Nome stabile del processo (script avviato: main, web_api), uguale fra i riavvii"""
+    nome = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ''))[0]
+    return re.sub(r'\W', '', nome) or 'processo'
+
+
+def _ritentabile(errore: Exception) -> bool:
+    """Database occupato o bloccato da un'altra connessione: il batch va ritentato"""
+    messaggio = str(errore).lower()
+    return isinstance(errore, sqlite3.OperationalError) and ('locked' in messaggio or 'busy' in messaggio)
+
+
+class LogWriter:
+    """Thread di scrittura per log_accessi con commit di gruppo.
+
+    Le righe vengono accodate (coda limitata) e scritte in un'unica transazione
+    ogni flush_interval secondi o ogni batch_size righe: su SD/eMMC ogni commit è
+    un fsync, così una raffica di tessere costa un solo fsync. Ogni riga accodata
+    viene prima aggiunta a un file di spill con un numero progressivo e rigiocata
+    all'avvio: un crash del processo non perde i tentativi già decisi. Il numero
+    dell'ultima riga committata viene salvato nella transazione delle righe, così
+    il recupero non reinserisce (né riconta nei contatori) righe già scritte.
+    Se la coda è piena la riga viene scritta in modo sincrono, mai scartata.
+    Solo database occupato/bloccato viene ritentato: un batch che fallisce per
+    altri motivi (schema, disco) finisce nel file dead-letter e la coda prosegue.
+
+    Spill e numero committato sono del singolo writer (ruolo del processo):
+    ogni processo che scrive sul database ha i propri e recupera solo le
+    proprie righe. Un lock sul file di spill impedisce che due processi con
+    lo stesso ruolo lo condividano; il secondo usa ruolo-pid.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, flush_interval: float = 0.5,
+                 batch_size: int = 100, max_queue: int = 5000, spill_path: str = None, ruolo: str = None):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._spill_path_esplicito = spill_path
+        self._imposta_ruolo(ruolo or ruolo_processo())
+        self._lock_fd = None
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self._stop_event = threading.Event()
+        self._flushed = threading.Condition()
+        self._pending = 0  # righe accodate non ancora committate
+        self._seq = 0  # ultimo numero assegnato a una riga dello spill
+        self._committed_seq = 0  # righe dello spill fino a questo numero già gestite
+        self._thread = None
+
+        self.stats = {'accodate': 0, 'scritte': 0, 'batch': 0, 'sincrone': 0, 'errori': 0, 'recuperate': 0,
+                      'scartate': 0}
+
+    # ===== SPILL FILE =====
+
+    def _imposta_ruolo(self, ruolo: str):
+        self.ruolo = ruolo
+        self.spill_path = self._spill_path_esplicito or f"{self.db_path}.log-spill.{ruolo}.jsonl"
+        self.dead_letter_path = f"{self.db_path}.log-dead.{ruolo}.jsonl"
+        self.chiave_commit = CHIAVE_SPILL_COMMIT.format(ruolo=ruolo)
+
+    def _blocca_spill(self):
+        """Lock esclusivo sullo spill; se un altro processo ha lo stesso ruolo passa a ruolo-pid"""
+        for ruolo in (self.ruolo, f"{self.ruolo}-{os.getpid()}"):
+            self._imposta_ruolo(ruolo)
+            fd = os.open(f"{self.spill_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                logger.warning(f"⚠️ Spill log accessi {self.spill_path} già in uso da un altro processo")
+                continue
+            self._lock_fd = fd
+            return
+        raise RuntimeError(f"Spill log accessi non disponibile: {self.spill_path}")
+
+    def _sblocca_spill(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _open_spill(self):
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, 'a', encoding='utf-8')
+
+    def _spill_locked(self, row: Dict[str, Any]):
+        """Aggiunge una riga allo spill (lock dello spill tenuto dal chiamante)"""
+        try:
+            self._open_spill()
+            self._spill_file.write(json.dumps(row, default=str) + '\n')
+            self._spill_file.flush()
+        except Exception as e:
+            logger.error(f"❌ Errore scrittura spill log accessi: {e}")
+
+    def _compact_spill(self):
+        """Svuota lo spill quando coda e batch sono stati tutti committati; con
+        traffico continuo, oltre SPILL_MAX_BYTES lo riscrive senza le righe già gestite"""
+        with self._spill_lock:
+            try:
+                if self._pending == 0:
+                    self._open_spill()
+                    self._spill_file.seek(0)
+                    self._spill_file.truncate()
+                elif self._spill_file is not None and self._spill_file.tell() > SPILL_MAX_BYTES:
+                    self._rewrite_spill_locked([
+                        row for row in self._read_spill() if row.get('_seq', 0) > self._committed_seq
+                    ])
+            except Exception as e:
+                logger.error(f"❌ Errore svuotamento spill log accessi: {e}")
+
+    def _read_spill(self) -> List[Dict[str, Any]]:
+        rows = []
+        with open(self.spill_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # Riga troncata dal crash
+                    continue
+        return rows
+
+    def _rewrite_spill_locked(self, rows: List[Dict[str, Any]]):
+        """Sostituisce lo spill con le righe indicate (file temporaneo + rename)"""
+        temporaneo = f"{self.spill_path}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        os.replace(temporaneo, self.spill_path)
+
+    def _read_committed_seq(self) -> int:
+        with connection(self.db_path, row_factory=None) as conn:
+            row = conn.execute('SELECT value FROM system_settings WHERE key = ?',
+                               (self.chiave_commit,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def _recover_spill(self) -> List[Dict[str, Any]]:
+        """Righe rimaste nello spill da un'esecuzione precedente e non committate.
+
+        Quelle con numero fino all'ultimo committato sono già in log_accessi e
+        vengono scartate. Le altre (numerate, comprese quelle di uno spill senza
+        numeri) restano nello spill e il thread le scrive prima delle nuove.
+        """
+        committed = self._read_committed_seq()
+        self._seq = self._committed_seq = committed
+        if not os.path.exists(self.spill_path) or os.path.getsize(self.spill_path) == 0:
+            return []
+        rows = [row for row in self._read_spill() if row.get('_seq', committed + 1) > committed]
+        self._seq = max([committed] + [row['_seq'] for row in rows if '_seq' in row])
+        for row in rows:
+            if '_seq' not in row:
+                self._seq += 1
+                row['_seq'] = self._seq
+        rows.sort(key=lambda row: row['_seq'])
+        with self._spill_lock:
+            self._rewrite_spill_locked(rows)
+        if rows:
+            self.stats['recuperate'] += len(rows)
+            logger.warning(f"♻️ Recuperate {len(rows)} righe log_accessi non committate")
+        return rows
+
+    def _dead_letter(self, batch: List[Dict[str, Any]], errore: Exception):
+        """Sposta nel file dead-letter un batch che non si può scrivere"""
+        self.stats['errori'] += 1
+        self.stats['scartate'] += len(batch)
+        logger.error(f"❌ Errore scrittura batch log accessi ({len(batch)} righe spostate in "
+                     f"{self.dead_letter_path}): {errore}")
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for row in batch:
+                    f.write(json.dumps({**row, '_errore': str(errore)}, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            logger.critical(f"❌ Righe log accessi perse, dead-letter non scrivibile: {e}")
+        # Gestite: la compattazione dello spill può eliminarle
+        self._committed_seq = max([self._committed_seq] + [row.get('_seq', 0) for row in batch])
+
+    # ===== SCRITTURA =====
+
+    def _write_batch(self, rows: List[Dict[str, Any]]):
+        """Scrive le righe in un'unica transazione, raggruppate per insieme di colonne"""
+        gruppi: Dict[tuple, List[tuple]] = {}
+        for row in rows:
+            colonne = tuple(c for c in COLONNE_LOG if c in row)
+            gruppi.setdefault(colonne, []).append(tuple(row[c] for c in colonne))
+
+        # Connessione di scrittura condivisa con il motore decisionale
+        with get_writer(self.db_path).transaction() as conn:
+            for colonne, valori in gruppi.items():
+                conn.executemany(
+                    f"INSERT INTO log_accessi ({', '.join(colonne)}) "
+                    f"VALUES ({', '.join('?' for _ in colonne)})",
+                    valori
+                )
+            # Contatori orari/giornalieri nella stessa transazione delle righe
+            aggiorna_statistiche(conn, rows)
+            ultimo = max(row.get('_seq', 0) for row in rows)
+            if ultimo:
+                conn.execute('''
+                    INSERT INTO system_settings (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+                ''', (self.chiave_commit, str(ultimo)))
+        self._committed_seq = max(self._committed_seq, ultimo)
+        self.stats['scritte'] += len(rows)
+        self.stats['batch'] += 1
+
+    def _drain(self, first: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_batch(self, batch: List[Dict[str, Any]]) -> bool:
+        """Scrive un batch; False se il database è occupato e va ritentato"""
+        if not batch:
+            return True
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            if _ritentabile(e):
+                # Database occupato/bloccato: le righe restano nello spill e in memoria
+                logger.warning(f"⚠️ Scrittura log accessi rinviata: {e}")
+                return False
+            # Schema, disco, file corrotto: ritentare bloccherebbe tutta la coda
+            self._dead_letter(batch, e)
+        with self._flushed:
+            self._pending -= len(batch)
+            self._flushed.notify_all()
+        self._compact_spill()
+        return True
+
+    def _run(self, recuperate: Optional[List[Dict[str, Any]]] = None):
+        # Righe recuperate dallo spill prima delle nuove (numerazione in ordine)
+        retry: List[Dict[str, Any]] = list(recuperate or [])
+        if retry and self._flush_batch(retry):
+            retry = []
+        while not self._stop_event.is_set():
+            if retry:
+                if self._stop_event.wait(self.flush_interval):
+                    break
+                if self._flush_batch(retry):
+                    retry = []
+                continue
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Attendi il resto del gruppo per al massimo flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            batch = [first]
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if not self._flush_batch(batch):
+                retry = batch
+
+        # Arresto: scrivi tutto ciò che resta (quanto non scritto resta nello spill)
+        if retry and not self._flush_batch(retry):
+            return
+        while not self._queue.empty():
+            if not self._flush_batch(self._drain()):
+                return
+
+    # ===== API =====
+
+    def enqueue(self, row: Dict[str, Any]):
+        """Accoda una riga di log_accessi (dict colonna -> valore)"""
+        row = {k: v for k, v in row.items() if k in COLONNE_LOG}
+        row.setdefault('timestamp', utc_timestamp())
+        self.stats['accodate'] += 1
+
+        if self._thread is None or not self._thread.is_alive():
+            self._write_sync(row)
+            return
+
+        with self._spill_lock:
+            # Numero, spill e coda nello stesso ordine: i batch committano numeri
+            # crescenti. Si accoda solo qui, sotto il lock: se c'è posto, resta
+            if not self._queue.full():
+                self._seq += 1
+                row['_seq'] = self._seq
+                with self._flushed:
+                    self._pending += 1
+                self._spill_locked(row)
+                self._queue.put_nowait(row)
+                return
+        # Riga non nello spill: scritta subito, un crash non la duplica
+        logger.warning("⚠️ Coda log accessi piena: scrittura sincrona")
+        self._write_sync(row)
+
+    def _write_sync(self, row: Dict[str, Any]):
+        self.stats['sincrone'] += 1
+        try:
+            with get_writer(self.db_path).transaction() as conn:
+                colonne = [c for c in COLONNE_LOG if c in row]
+                conn.execute(
+                    f"INSERT INTO log_accessi ({', '.join(colonne)}) "
+                    f"VALUES ({', '.join('?' for _ in colonne)})",
+                    [row[c] for c in colonne]
+                )
+                aggiorna_statistiche(conn, [row])
+        except Exception as e:
+            self.stats['errori'] += 1
+            logger.error(f"❌ Errore scrittura sincrona log accessi: {e}")
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Attende che le righe accodate siano committate"""
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._pending > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not (self._thread and self._thread.is_alive()):
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def start(self):
+        """Recupera lo spill e avvia il thread di scrittura"""
+        if self._thread and self._thread.is_alive():
+            return
+        recuperate = []
+        try:
+            # Tabelle dei contatori (migrazione 0006) prima di qualunque scrittura
+            migrate(self.db_path)
+            if self._lock_fd is None:
+                self._blocca_spill()
+            recuperate = self._recover_spill()
+        except Exception as e:
+            logger.error(f"❌ Errore recupero spill log accessi: {e}")
+        with self._flushed:
+            self._pending += len(recuperate)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(recuperate,), name='log-accessi-writer',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info(f"📝 Writer log accessi avviato (batch {self.batch_size} righe / {self.flush_interval * 1000:.0f}ms)")
+
+    def stop(self, timeout: float = 10.0):
+        """Ferma il thread dopo aver scritto le righe in coda"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+            self._sblocca_spill()
+        logger.info(f"📝 Writer log accessi fermato ({self.stats['scritte']} righe scritte)")
+
+    def install_signal_handler(self):
+        """Svuota la coda su SIGTERM, poi passa al gestore precedente"""
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handler(signum, frame):
+            self.stop()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                sys.exit(0)
+
+        signal.signal(signal.SIGTERM, handler)
+
+    def get_status(self) -> Dict:
+        """Stato writer per diagnostica"""
+        return {
+            'attivo': bool(self._thread and self._thread.is_alive()),
+            'in_coda': self._queue.qsize(),
+            **self.stats
+        }
+
+
+# Singleton per processo
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def get_log_writer(db_path: str = None) -> LogWriter:
+    """Restituisce il writer log_accessi del processo (già avviato)"""
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                writer = LogWriter(db_path or DEFAULT_DB_PATH)
+                writer.start()
+                writer.install_signal_handler()
+                _log_writer = writer
+    return _log_writer
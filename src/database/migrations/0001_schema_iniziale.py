@@ -0,0 +1,214 @@
+# File: /opt/access_control/src/database/migrations/0001_schema_iniziale.py
+# Schema di partenza: tabelle, valori di default, indici e trigger creati finora all'avvio
+
+import sqlite3
+
+TABELLE = (
+    '''
+    CREATE TABLE IF NOT EXISTS utenti_autorizzati (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codice_fiscale TEXT UNIQUE NOT NULL,
+        nome TEXT,
+        data_inserimento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        data_aggiornamento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        attivo BOOLEAN DEFAULT 1,
+        note TEXT,
+        creato_da TEXT,
+        modificato_da TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS log_accessi (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TIMESTAMP NOT NULL,
+        codice_fiscale TEXT NOT NULL,
+        autorizzato BOOLEAN NOT NULL,
+        durata_elaborazione REAL,
+        ip_client TEXT,
+        user_agent TEXT,
+        terminale_id TEXT,
+        errore TEXT,
+        metodo_lettura TEXT,
+        qualita_lettura INTEGER,
+        sincronizzato BOOLEAN DEFAULT 0,
+        data_sincronizzazione TIMESTAMP,
+        note TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS configurazioni (
+        chiave TEXT PRIMARY KEY,
+        valore TEXT NOT NULL,
+        tipo TEXT DEFAULT 'string',
+        descrizione TEXT,
+        categoria TEXT,
+        modificabile BOOLEAN DEFAULT 1,
+        data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modificato_da TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS eventi_sistema (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        tipo_evento TEXT NOT NULL,
+        livello TEXT DEFAULT 'INFO',
+        messaggio TEXT NOT NULL,
+        dettagli TEXT,
+        componente TEXT,
+        risolto BOOLEAN DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS statistiche (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data DATE NOT NULL,
+        totale_accessi INTEGER DEFAULT 0,
+        accessi_autorizzati INTEGER DEFAULT 0,
+        accessi_negati INTEGER DEFAULT 0,
+        tempo_medio_elaborazione REAL,
+        uptime_sistema REAL,
+        errori_hardware INTEGER DEFAULT 0,
+        UNIQUE(data)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS relay_config (
+        relay_number INTEGER PRIMARY KEY CHECK (relay_number BETWEEN 1 AND 8),
+        description TEXT NOT NULL,
+        valid_action TEXT CHECK (valid_action IN ('OFF', 'ON', 'PULSE')),
+        valid_duration REAL DEFAULT 0,
+        invalid_action TEXT CHECK (invalid_action IN ('OFF', 'ON', 'PULSE')),
+        invalid_duration REAL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_by TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS system_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Configurazione accessi (orari, limite mensile, contatori)
+    '''
+    CREATE TABLE IF NOT EXISTS orari_accesso (
+        giorno TEXT PRIMARY KEY,
+        aperto BOOLEAN DEFAULT true,
+        mattina_inizio TIME,
+        mattina_fine TIME,
+        pomeriggio_inizio TIME,
+        pomeriggio_fine TIME,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_by TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS limiti_accesso (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        max_ingressi_mensili INTEGER DEFAULT 3,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_by TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS log_forzature (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL,
+        utente TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        dettagli TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS conteggio_ingressi_mensili (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codice_fiscale TEXT NOT NULL,
+        mese INTEGER NOT NULL,
+        anno INTEGER NOT NULL,
+        numero_ingressi INTEGER DEFAULT 0,
+        ultimo_ingresso TIMESTAMP,
+        UNIQUE(codice_fiscale, mese, anno)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS conteggio_ingressi_mensili_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codice_fiscale TEXT NOT NULL,
+        mese INTEGER NOT NULL,
+        anno INTEGER NOT NULL,
+        numero_ingressi INTEGER,
+        ultimo_ingresso TIMESTAMP,
+        data_archiviazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+)
+
+INDICI = (
+    'CREATE INDEX IF NOT EXISTS idx_cf ON utenti_autorizzati(codice_fiscale)',
+    'CREATE INDEX IF NOT EXISTS idx_cf_attivo ON utenti_autorizzati(codice_fiscale, attivo)',
+    'CREATE INDEX IF NOT EXISTS idx_log_timestamp ON log_accessi(timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_log_sync ON log_accessi(sincronizzato)',
+    'CREATE INDEX IF NOT EXISTS idx_log_cf ON log_accessi(codice_fiscale)',
+    'CREATE INDEX IF NOT EXISTS idx_eventi_timestamp ON eventi_sistema(timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_statistiche_data ON statistiche(data)',
+)
+
+TRIGGER_AGGIORNAMENTO_UTENTE = '''
+    CREATE TRIGGER IF NOT EXISTS update_utente_timestamp
+    AFTER UPDATE ON utenti_autorizzati
+    FOR EACH ROW
+    BEGIN
+        UPDATE utenti_autorizzati
+        SET data_aggiornamento = CURRENT_TIMESTAMP
+        WHERE id = NEW.id;
+    END
+'''
+
+RELAY_DEFAULT = (
+    (1, 'Motore Cancello', 'PULSE', 5.0, 'OFF', 0),
+    (2, 'LED Rosso', 'OFF', 0, 'PULSE', 3.0),
+    (3, 'Buzzer', 'PULSE', 0.5, 'PULSE', 2.0),
+    (4, 'LED Verde', 'PULSE', 3.0, 'OFF', 0),
+    (5, 'Blocco Magnetico', 'OFF', 5.0, 'ON', 0),
+    (6, 'Illuminazione', 'ON', 10.0, 'OFF', 0),
+    (7, 'Riserva 1', 'OFF', 0, 'OFF', 0),
+    (8, 'Riserva 2', 'OFF', 0, 'OFF', 0),
+)
+
+GIORNI = ('Lunedi', 'Martedi', 'Mercoledi', 'Giovedi', 'Venerdi', 'Sabato', 'Domenica')
+ORARIO_DEFAULT = ('09:00', '12:00', '15:00', '17:00')
+LIMITE_MENSILE_DEFAULT = 3
+
+
+def _vuota(conn: sqlite3.Connection, tabella: str) -> bool:
+    return conn.execute(f'SELECT COUNT(*) FROM {tabella}').fetchone()[0] == 0
+
+
+def upgrade(conn: sqlite3.Connection):
+    """Crea le tabelle mancanti; i default solo nelle tabelle vuote"""
+    for ddl in TABELLE:
+        conn.execute(ddl)
+
+    if _vuota(conn, 'relay_config'):
+        conn.executemany('''
+            INSERT INTO relay_config
+            (relay_number, description, valid_action, valid_duration, invalid_action, invalid_duration)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', RELAY_DEFAULT)
+
+    if _vuota(conn, 'orari_accesso'):
+        conn.executemany('''
+            INSERT INTO orari_accesso
+            (giorno, aperto, mattina_inizio, mattina_fine, pomeriggio_inizio, pomeriggio_fine)
+            VALUES (?, 1, ?, ?, ?, ?)
+        ''', [(giorno, *ORARIO_DEFAULT) for giorno in GIORNI])
+
+    if _vuota(conn, 'limiti_accesso'):
+        conn.execute('INSERT INTO limiti_accesso (max_ingressi_mensili) VALUES (?)', (LIMITE_MENSILE_DEFAULT,))
+
+    for ddl in INDICI:
+        conn.execute(ddl)
+    conn.execute(TRIGGER_AGGIORNAMENTO_UTENTE)
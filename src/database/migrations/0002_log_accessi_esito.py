@@ -0,0 +1,21 @@
+# File: /opt/access_control/src/database/migrations/0002_log_accessi_esito.py
+# Colonne di esito e tempi per fase della decisione su log_accessi
+
+import sqlite3
+
+from database.schema import add_column
+
+COLONNE = (
+    ('tipo_accesso', 'TEXT'),
+    ('motivo_rifiuto', 'TEXT'),
+    ('nome_utente', 'TEXT'),
+    ('durata_lettura', 'REAL'),
+    ('durata_decisione', 'REAL'),
+    ('durata_attuazione', 'REAL'),
+)
+
+
+def upgrade(conn: sqlite3.Connection):
+    """Aggiunge le colonne scritte dal motore decisionale"""
+    for nome, tipo in COLONNE:
+        add_column(conn, 'log_accessi', nome, tipo)
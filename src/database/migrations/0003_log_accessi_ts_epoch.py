@@ -0,0 +1,35 @@
+# File: /opt/access_control/src/database/migrations/0003_log_accessi_ts_epoch.py
+# Colonna generata ts_epoch (secondi UTC) per i filtri per periodo
+
+import sqlite3
+from datetime import datetime, timezone
+
+from core.access_schedule import ROME_TZ
+from database.schema import add_column
+
+# Stessa espressione di database.log_filters.TS_EPOCH_SQL, fissata alla versione 3
+TS_EPOCH_SQL = "CAST(strftime('%s', timestamp) AS INTEGER)"
+
+# Righe scritte con datetime.now() (ora locale, con microsecondi) prima che i
+# writer passassero a UTC: CURRENT_TIMESTAMP e utc_timestamp() non hanno frazioni
+TIMESTAMP_LOCALE = "timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9].*'"
+
+
+def _utc_da_locale(valore: str) -> str:
+    """'YYYY-MM-DD HH:MM:SS[.ffffff]' ora di Roma → 'YYYY-MM-DD HH:MM:SS' UTC"""
+    locale = datetime.strptime(valore[:19], '%Y-%m-%d %H:%M:%S')
+    locale = ROME_TZ.localize(locale) if hasattr(ROME_TZ, 'localize') else locale.replace(tzinfo=ROME_TZ)
+    return locale.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def upgrade(conn: sqlite3.Connection):
+    """ts_epoch derivata da timestamp: vale anche per le righe già presenti, senza backfill.
+
+    Le righe in ora locale vengono prima portate in UTC nel formato dei
+    writer attuali, altrimenti ts_epoch (e le statistiche e le partizioni
+    che ne derivano) le sposterebbe di una o due ore.
+    """
+    conn.create_function('utc_da_locale', 1, _utc_da_locale, deterministic=True)
+    conn.execute(f'UPDATE log_accessi SET timestamp = utc_da_locale(timestamp) WHERE {TIMESTAMP_LOCALE}')
+    add_column(conn, 'log_accessi', 'ts_epoch', f'INTEGER GENERATED ALWAYS AS ({TS_EPOCH_SQL}) VIRTUAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_ts_epoch ON log_accessi(ts_epoch)')
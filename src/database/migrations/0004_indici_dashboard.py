@@ -0,0 +1,17 @@
+# File: /opt/access_control/src/database/migrations/0004_indici_dashboard.py
+# Indici coprenti per le query della dashboard su log_accessi
+
+import sqlite3
+
+
+def upgrade(conn: sqlite3.Connection):
+    """Indici composti con ts_epoch: conteggi e filtri senza leggere la tabella"""
+    # Statistiche per periodo: COUNT/SUM su autorizzato e raggruppamenti per esito
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_ts_tipo ON log_accessi(ts_epoch, tipo_accesso, autorizzato)')
+    # Storico di un utente ordinato per data
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_cf_ts ON log_accessi(codice_fiscale, ts_epoch)')
+    # Filtro autorizzati/negati nel periodo
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_aut_ts ON log_accessi(autorizzato, ts_epoch)')
+    # Prefissi degli indici composti
+    conn.execute('DROP INDEX IF EXISTS idx_log_ts_epoch')
+    conn.execute('DROP INDEX IF EXISTS idx_log_cf')
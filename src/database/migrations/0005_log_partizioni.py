@@ -0,0 +1,23 @@
+# File: /opt/access_control/src/database/migrations/0005_log_partizioni.py
+# Catalogo dei mesi di log_accessi sigillati nell'archivio e retention di default
+
+import sqlite3
+
+
+def upgrade(conn: sqlite3.Connection):
+    """Tabella log_partizioni (vedi database.log_partitions) e log.retention_mesi"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_partizioni (
+            mese TEXT PRIMARY KEY,
+            tabella TEXT NOT NULL,
+            inizio INTEGER NOT NULL,
+            fine INTEGER NOT NULL,
+            righe INTEGER DEFAULT 0,
+            stato TEXT NOT NULL DEFAULT 'archiviata' CHECK (stato IN ('archiviata', 'compressa')),
+            file TEXT,
+            sigillata_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            compressa_il TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_log_partizioni_periodo ON log_partizioni(stato, inizio, fine)')
+    conn.execute("INSERT OR IGNORE INTO system_settings (key, value) VALUES ('log.retention_mesi', '24')")
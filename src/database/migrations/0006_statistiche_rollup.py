@@ -0,0 +1,56 @@
+# File: /opt/access_control/src/database/migrations/0006_statistiche_rollup.py
+# Contatori accessi per ora e per giorno, ricostruiti una volta dallo storico
+
+import os
+import sqlite3
+
+from database.log_partitions import archivio_path, partizioni_archiviate
+from database.rollup import ricostruisci
+
+TABELLE = (
+    '''
+    CREATE TABLE IF NOT EXISTS statistiche_orarie (
+        ora INTEGER NOT NULL,
+        tipo_accesso TEXT NOT NULL,
+        totale INTEGER NOT NULL DEFAULT 0,
+        autorizzati INTEGER NOT NULL DEFAULT 0,
+        negati INTEGER NOT NULL DEFAULT 0,
+        durata_totale REAL NOT NULL DEFAULT 0,
+        durata_conteggio INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (ora, tipo_accesso)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS statistiche_giornaliere (
+        data TEXT NOT NULL,
+        tipo_accesso TEXT NOT NULL,
+        totale INTEGER NOT NULL DEFAULT 0,
+        autorizzati INTEGER NOT NULL DEFAULT 0,
+        negati INTEGER NOT NULL DEFAULT 0,
+        durata_totale REAL NOT NULL DEFAULT 0,
+        durata_conteggio INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (data, tipo_accesso)
+    ) WITHOUT ROWID
+    ''',
+)
+
+
+def upgrade(conn: sqlite3.Connection):
+    """Crea i contatori e li riempie da log_accessi e dai mesi già archiviati"""
+    for ddl in TABELLE:
+        conn.execute(ddl)
+
+    sorgenti = [(conn, 'log_accessi')]
+    # Mesi sigillati: letti con una connessione separata, ATTACH non è
+    # ammesso dentro la transazione della migrazione
+    archivio = None
+    tabelle = partizioni_archiviate(conn)
+    percorso = archivio_path(next(row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main'))
+    if tabelle and os.path.exists(percorso):
+        archivio = sqlite3.connect(percorso)
+        sorgenti += [(archivio, tabella) for tabella in tabelle]
+    try:
+        ricostruisci(conn, sorgenti)
+    finally:
+        if archivio is not None:
+            archivio.close()
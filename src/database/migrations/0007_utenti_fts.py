@@ -0,0 +1,53 @@
+# File: /opt/access_control/src/database/migrations/0007_utenti_fts.py
+# Indice FTS5 trigram su codice fiscale e nome degli utenti autorizzati
+
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Tabella a contenuto esterno: il testo resta in utenti_autorizzati, rowid = id
+SQL_UTENTI_FTS = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS utenti_fts USING fts5(
+        codice_fiscale, nome,
+        content='utenti_autorizzati', content_rowid='id',
+        tokenize='trigram'
+    )
+'''
+
+# Solo CF e nome: l'UPDATE di data_aggiornamento del trigger esistente non reindicizza
+TRIGGERS_UTENTI_FTS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS utenti_fts_insert AFTER INSERT ON utenti_autorizzati BEGIN
+        INSERT INTO utenti_fts (rowid, codice_fiscale, nome) VALUES (NEW.id, NEW.codice_fiscale, NEW.nome);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS utenti_fts_delete AFTER DELETE ON utenti_autorizzati BEGIN
+        INSERT INTO utenti_fts (utenti_fts, rowid, codice_fiscale, nome)
+        VALUES ('delete', OLD.id, OLD.codice_fiscale, OLD.nome);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS utenti_fts_update AFTER UPDATE OF codice_fiscale, nome ON utenti_autorizzati BEGIN
+        INSERT INTO utenti_fts (utenti_fts, rowid, codice_fiscale, nome)
+        VALUES ('delete', OLD.id, OLD.codice_fiscale, OLD.nome);
+        INSERT INTO utenti_fts (rowid, codice_fiscale, nome) VALUES (NEW.id, NEW.codice_fiscale, NEW.nome);
+    END
+    ''',
+)
+
+
+def upgrade(conn: sqlite3.Connection):
+    """utenti_fts con i trigger di allineamento, popolata dagli utenti esistenti"""
+    # Elenco senza ricerca ordinato per nome a pagine
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_utenti_nome ON utenti_autorizzati(nome)')
+    try:
+        conn.execute(SQL_UTENTI_FTS)
+    except sqlite3.OperationalError as e:
+        # SQLite senza FTS5/trigram (< 3.34): la ricerca resta su LIKE
+        logger.warning(f"⚠️ Indice di ricerca utenti non creato: {e}")
+        return
+    for trigger in TRIGGERS_UTENTI_FTS:
+        conn.execute(trigger)
+    conn.execute("INSERT INTO utenti_fts (utenti_fts) VALUES ('rebuild')")
@@ -0,0 +1,219 @@
+# File: /opt/access_control/src/database/migrations/0008_log_compatto.py
+# log_accessi compatto: chiavi intere per CF, utente, nome, esito, motivo e terminale
+
+import sqlite3
+
+# Codici degli esiti noti (valori di tipo_accesso); quelli nuovi prendono il codice successivo
+ESITI = (
+    (1, 'AUTORIZZATO'),
+    (2, 'NEGATO'),
+    (3, 'UTENTE_NON_TROVATO'),
+    (4, 'UTENTE_DISATTIVATO'),
+    (5, 'FUORI_ORARIO'),
+    (6, 'LIMITE_SUPERATO'),
+    (7, 'ERRORE'),
+)
+
+TABELLE = (
+    # CF letti (anche quelli non registrati)
+    '''
+    CREATE TABLE IF NOT EXISTS log_cf (
+        id INTEGER PRIMARY KEY,
+        codice_fiscale TEXT UNIQUE NOT NULL
+    )
+    ''',
+    # Nomi registrati negli accessi, come erano al momento dell'accesso
+    '''
+    CREATE TABLE IF NOT EXISTS log_nomi (
+        id INTEGER PRIMARY KEY,
+        nome TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS log_terminali (
+        id INTEGER PRIMARY KEY,
+        nome TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS log_esiti (
+        codice INTEGER PRIMARY KEY,
+        tipo_accesso TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS log_motivi (
+        id INTEGER PRIMARY KEY,
+        testo TEXT UNIQUE NOT NULL
+    )
+    ''',
+    # Righe di log: solo interi e valori propri dell'accesso. Tipi dichiarati
+    # come nella tabella originale (stessa affinità delle partizioni archiviate).
+    # ts_testo è il timestamp scritto, solo se diverso da datetime(ts_epoch)
+    # (formati non canonici): la vista restituisce sempre il valore salvato
+    '''
+    CREATE TABLE IF NOT EXISTS log_accessi_dati (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts_epoch INTEGER,
+        ts_testo TEXT,
+        cf_id INTEGER NOT NULL REFERENCES log_cf(id),
+        user_id INTEGER,
+        nome INTEGER REFERENCES log_nomi(id),
+        autorizzato BOOLEAN NOT NULL,
+        esito INTEGER REFERENCES log_esiti(codice),
+        motivo INTEGER REFERENCES log_motivi(id),
+        terminale INTEGER REFERENCES log_terminali(id),
+        durata_elaborazione REAL,
+        durata_lettura REAL,
+        durata_decisione REAL,
+        durata_attuazione REAL,
+        metodo_lettura TEXT,
+        qualita_lettura INTEGER,
+        ip_client TEXT,
+        user_agent TEXT,
+        errore TEXT,
+        note TEXT,
+        sincronizzato BOOLEAN DEFAULT 0,
+        data_sincronizzazione TIMESTAMP
+    )
+    ''',
+)
+
+# Stesse colonne (e stesso ordine) della tabella originale più user_id e cf_id
+# (chiavi per JOIN e filtri sugli indici, senza passare dalle sottoquery).
+# Dimensioni con sottoquery scalari e non con JOIN: la vista resta una SELECT
+# su una sola tabella, quindi SQLite la appiattisce anche dentro l'UNION ALL
+# con l'archivio (sorgente_log) e valuta solo le colonne che la query usa.
+SQL_VISTA = '''
+    CREATE VIEW log_accessi AS
+    SELECT d.id,
+           COALESCE(d.ts_testo, datetime(d.ts_epoch, 'unixepoch')) AS timestamp,
+           (SELECT codice_fiscale FROM log_cf WHERE id = d.cf_id) AS codice_fiscale,
+           d.autorizzato,
+           d.durata_elaborazione,
+           d.ip_client,
+           d.user_agent,
+           (SELECT nome FROM log_terminali WHERE id = d.terminale) AS terminale_id,
+           d.errore,
+           d.metodo_lettura,
+           d.qualita_lettura,
+           d.sincronizzato,
+           d.data_sincronizzazione,
+           d.note,
+           (SELECT tipo_accesso FROM log_esiti WHERE codice = d.esito) AS tipo_accesso,
+           (SELECT testo FROM log_motivi WHERE id = d.motivo) AS motivo_rifiuto,
+           (SELECT nome FROM log_nomi WHERE id = d.nome) AS nome_utente,
+           d.durata_lettura,
+           d.durata_decisione,
+           d.durata_attuazione,
+           d.ts_epoch,
+           d.user_id,
+           d.cf_id
+    FROM log_accessi_dati d
+'''
+
+# INSERT sulla vista (LogWriter, test hardware, seed): dimensioni risolte nel trigger
+TRIGGER_INSERT = '''
+    CREATE TRIGGER log_accessi_insert INSTEAD OF INSERT ON log_accessi
+    BEGIN
+        INSERT OR IGNORE INTO log_cf (codice_fiscale) VALUES (NEW.codice_fiscale);
+        INSERT OR IGNORE INTO log_nomi (nome) SELECT NEW.nome_utente WHERE NEW.nome_utente IS NOT NULL;
+        INSERT OR IGNORE INTO log_terminali (nome) SELECT NEW.terminale_id WHERE NEW.terminale_id IS NOT NULL;
+        INSERT OR IGNORE INTO log_esiti (tipo_accesso) SELECT NEW.tipo_accesso WHERE NEW.tipo_accesso IS NOT NULL;
+        INSERT OR IGNORE INTO log_motivi (testo) SELECT NEW.motivo_rifiuto WHERE NEW.motivo_rifiuto IS NOT NULL;
+        INSERT INTO log_accessi_dati (
+            id, ts_epoch, ts_testo, cf_id, user_id, nome, autorizzato, esito, motivo, terminale,
+            durata_elaborazione, durata_lettura, durata_decisione, durata_attuazione,
+            metodo_lettura, qualita_lettura, ip_client, user_agent, errore, note,
+            sincronizzato, data_sincronizzazione
+        ) VALUES (
+            NEW.id,
+            CAST(strftime('%s', COALESCE(NEW.timestamp, CURRENT_TIMESTAMP)) AS INTEGER),
+            CASE WHEN NEW.timestamp IS NOT datetime(NEW.timestamp) THEN NEW.timestamp END,
+            (SELECT id FROM log_cf WHERE codice_fiscale = NEW.codice_fiscale),
+            COALESCE(NEW.user_id, (SELECT id FROM utenti_autorizzati WHERE codice_fiscale = NEW.codice_fiscale)),
+            (SELECT id FROM log_nomi WHERE nome = NEW.nome_utente),
+            NEW.autorizzato,
+            (SELECT codice FROM log_esiti WHERE tipo_accesso = NEW.tipo_accesso),
+            (SELECT id FROM log_motivi WHERE testo = NEW.motivo_rifiuto),
+            (SELECT id FROM log_terminali WHERE nome = NEW.terminale_id),
+            NEW.durata_elaborazione, NEW.durata_lettura, NEW.durata_decisione, NEW.durata_attuazione,
+            NEW.metodo_lettura, NEW.qualita_lettura, NEW.ip_client, NEW.user_agent, NEW.errore, NEW.note,
+            COALESCE(NEW.sincronizzato, 0), NEW.data_sincronizzazione
+        );
+    END
+'''
+
+TRIGGER_DELETE = '''
+    CREATE TRIGGER log_accessi_delete INSTEAD OF DELETE ON log_accessi
+    BEGIN
+        DELETE FROM log_accessi_dati WHERE id = OLD.id;
+    END
+'''
+
+INDICI = (
+    'CREATE INDEX IF NOT EXISTS idx_log_ts_tipo ON log_accessi_dati(ts_epoch, esito, autorizzato)',
+    'CREATE INDEX IF NOT EXISTS idx_log_cf_ts ON log_accessi_dati(cf_id, ts_epoch)',
+    'CREATE INDEX IF NOT EXISTS idx_log_aut_ts ON log_accessi_dati(autorizzato, ts_epoch)',
+)
+
+
+def upgrade(conn: sqlite3.Connection):
+    """Sposta log_accessi in log_accessi_dati + dimensioni e la sostituisce con una vista"""
+    for sql in TABELLE:
+        conn.execute(sql)
+    conn.executemany('INSERT OR IGNORE INTO log_esiti (codice, tipo_accesso) VALUES (?, ?)', ESITI)
+
+    # Dimensioni dai valori distinti già presenti
+    conn.execute('INSERT OR IGNORE INTO log_cf (codice_fiscale) SELECT DISTINCT codice_fiscale FROM log_accessi')
+    for tabella, colonna, sorgente in (('log_nomi', 'nome', 'nome_utente'),
+                                       ('log_terminali', 'nome', 'terminale_id'),
+                                       ('log_esiti', 'tipo_accesso', 'tipo_accesso'),
+                                       ('log_motivi', 'testo', 'motivo_rifiuto')):
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {tabella} ({colonna})
+            SELECT DISTINCT {sorgente} FROM log_accessi WHERE {sorgente} IS NOT NULL
+        ''')
+
+    # Righe in ordine di id (AUTOINCREMENT riparte dall'ultimo id); nome e
+    # timestamp restano quelli scritti all'accesso
+    conn.execute('''
+        INSERT INTO log_accessi_dati (
+            id, ts_epoch, ts_testo, cf_id, user_id, nome, autorizzato, esito, motivo, terminale,
+            durata_elaborazione, durata_lettura, durata_decisione, durata_attuazione,
+            metodo_lettura, qualita_lettura, ip_client, user_agent, errore, note,
+            sincronizzato, data_sincronizzazione
+        )
+        SELECT l.id, l.ts_epoch, CASE WHEN l.timestamp IS NOT datetime(l.timestamp) THEN l.timestamp END,
+               c.id, u.id, n.id, l.autorizzato, e.codice, m.id, t.id,
+               l.durata_elaborazione, l.durata_lettura, l.durata_decisione, l.durata_attuazione,
+               l.metodo_lettura, l.qualita_lettura, l.ip_client, l.user_agent, l.errore, l.note,
+               l.sincronizzato, l.data_sincronizzazione
+        FROM log_accessi l
+        LEFT JOIN log_cf c ON c.codice_fiscale = l.codice_fiscale
+        LEFT JOIN utenti_autorizzati u ON u.codice_fiscale = l.codice_fiscale
+        LEFT JOIN log_nomi n ON n.nome = l.nome_utente
+        LEFT JOIN log_esiti e ON e.tipo_accesso = l.tipo_accesso
+        LEFT JOIN log_motivi m ON m.testo = l.motivo_rifiuto
+        LEFT JOIN log_terminali t ON t.nome = l.terminale_id
+        ORDER BY l.id
+    ''')
+
+    # Gli id non devono ripartire da quelli già spostati nell'archivio
+    ultimo = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'log_accessi'").fetchone()
+    if ultimo:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'log_accessi_dati'")
+        conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES ('log_accessi_dati', "
+            "MAX(?, (SELECT IFNULL(MAX(id), 0) FROM log_accessi_dati)))", (ultimo[0],)
+        )
+
+    conn.execute('DROP TABLE log_accessi')
+    conn.execute(SQL_VISTA)
+    conn.execute(TRIGGER_INSERT)
+    conn.execute(TRIGGER_DELETE)
+    for sql in INDICI:
+        conn.execute(sql)
+    # Statistiche del pianificatore per la nuova tabella (se il DB le usa già)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        conn.execute('ANALYZE log_accessi_dati')
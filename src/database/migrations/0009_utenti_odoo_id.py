@@ -0,0 +1,12 @@
+# File: /opt/access_control/src/database/migrations/0009_utenti_odoo_id.py
+# Id del partner Odoo sugli utenti sincronizzati (riconciliazione della sync incrementale)
+
+import sqlite3
+
+from database.schema import add_column
+
+
+def upgrade(conn: sqlite3.Connection):
+    """utenti_autorizzati.odoo_id, valorizzato dalla prossima sync completa"""
+    add_column(conn, 'utenti_autorizzati', 'odoo_id', 'INTEGER')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_utenti_odoo_id ON utenti_autorizzati(odoo_id)')
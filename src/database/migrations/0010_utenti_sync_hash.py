@@ -0,0 +1,11 @@
+# File: /opt/access_control/src/database/migrations/0010_utenti_sync_hash.py
+# Impronta dei campi sincronizzati da Odoo sugli utenti (la sync riscrive solo le righe cambiate)
+
+import sqlite3
+
+from database.schema import add_column
+
+
+def upgrade(conn: sqlite3.Connection):
+    """utenti_autorizzati.sync_hash, valorizzata dalla prossima sync (NULL = da confrontare)"""
+    add_column(conn, 'utenti_autorizzati', 'sync_hash', 'INTEGER')
@@ -0,0 +1,247 @@
+# File: /opt/access_control/src/database/monthly_counters.py
+# Contatori ingressi mensili e limiti in memoria con scrittura UPSERT
+
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Set, Tuple
+
+from database.cache_versions import ensure_version_tracking, read_version
+from database.pool import DEFAULT_DB_PATH, connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITE_MENSILE = 3
+
+SQL_CONTEGGI_MESE = '''
+    SELECT codice_fiscale, numero_ingressi FROM conteggio_ingressi_mensili
+    WHERE anno = ? AND mese = ?
+'''
+SQL_INCREMENTA = '''
+    INSERT INTO conteggio_ingressi_mensili
+    (codice_fiscale, mese, anno, numero_ingressi, ultimo_ingresso)
+    VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT(codice_fiscale, mese, anno) DO UPDATE SET
+        numero_ingressi = numero_ingressi + 1,
+        ultimo_ingresso = CURRENT_TIMESTAMP
+'''
+
+
+class MonthlyCounterStore:
+    """Mappa in memoria {(cf, anno, mese): ingressi} più i limiti configurati.
+
+    Il mese corrente viene precaricato, i limiti (limiti_accesso e limiti_utenti)
+    sono tenuti in cache: il controllo del limite mensile è una lettura di dizionario.
+    Gli incrementi sono scritti subito con INSERT ... ON CONFLICT DO UPDATE nella
+    transazione del chiamante. Le modifiche fatte da altri processi o dalle API di
+    amministrazione sono rilevate con i contatori di versione di cache_versions.
+    """
+
+    MAX_MESI_IN_CACHE = 3
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, refresh_interval: float = 5.0):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+
+        self._counts: Dict[Tuple[str, int, int], int] = {}
+        self._mesi_caricati: Set[Tuple[int, int]] = set()
+        self._counts_version = None
+
+        self.limite_globale = DEFAULT_LIMITE_MENSILE
+        self._limiti_utente: Dict[str, int] = {}
+        self._limiti_version = None
+
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._watcher = None
+
+    # ===== CARICAMENTO =====
+
+    def _connect(self):
+        return connection(self.db_path, row_factory=None)
+
+    def _limiti_versions(self, conn: sqlite3.Connection) -> Tuple:
+        return (read_version(conn, 'limiti_accesso'), read_version(conn, 'limiti_utenti'))
+
+    def _has_table(self, conn: sqlite3.Connection, tabella: str) -> bool:
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabella,)).fetchone()
+        return row is not None
+
+    def load(self):
+        """Attiva il tracking, carica i limiti e i conteggi del mese corrente"""
+        try:
+            with self._connect() as conn:
+                for tabella in ('conteggio_ingressi_mensili', 'limiti_accesso', 'limiti_utenti'):
+                    if self._has_table(conn, tabella):
+                        ensure_version_tracking(conn, tabella)
+                self.load_limits(conn)
+                oggi = datetime.now()
+                with self._lock:
+                    self._counts.clear()
+                    self._mesi_caricati.clear()
+                    self._counts_version = read_version(conn, 'conteggio_ingressi_mensili')
+                    self._load_month(conn, oggi.year, oggi.month)
+        except Exception as e:
+            logger.error(f"❌ Errore caricamento contatori mensili: {e}")
+
+    def load_limits(self, conn: sqlite3.Connection = None):
+        """Ricarica limite globale e limiti per utente"""
+        if conn is None:
+            with self._connect() as own_conn:
+                return self.load_limits(own_conn)
+        row = conn.execute('SELECT max_ingressi_mensili FROM limiti_accesso ORDER BY id DESC LIMIT 1').fetchone()
+        limite_globale = row[0] if row and row[0] is not None else DEFAULT_LIMITE_MENSILE
+        limiti_utente = {}
+        if self._has_table(conn, 'limiti_utenti'):
+            limiti_utente = {
+                cf.upper(): limite
+                for cf, limite in conn.execute('SELECT codice_fiscale, max_ingressi_mensili FROM limiti_utenti')
+                if cf
+            }
+        versions = self._limiti_versions(conn)
+
+        with self._lock:
+            self.limite_globale = limite_globale
+            self._limiti_utente = limiti_utente
+            self._limiti_version = versions
+        logger.info(f"📏 Limiti mensili caricati: globale={limite_globale}, per utente={len(limiti_utente)}")
+
+    def _load_month(self, conn: sqlite3.Connection, anno: int, mese: int):
+        for cf, numero in conn.execute(SQL_CONTEGGI_MESE, (anno, mese)):
+            if cf:
+                self._counts[(cf.upper(), anno, mese)] = numero or 0
+        self._mesi_caricati.add((anno, mese))
+
+        # Tieni in memoria solo gli ultimi mesi
+        if len(self._mesi_caricati) > self.MAX_MESI_IN_CACHE:
+            vecchi = sorted(self._mesi_caricati)[:-self.MAX_MESI_IN_CACHE]
+            for mese_vecchio in vecchi:
+                self._mesi_caricati.discard(mese_vecchio)
+            self._counts = {k: v for k, v in self._counts.items() if (k[1], k[2]) in self._mesi_caricati}
+
+    # ===== COERENZA =====
+
+    def sync(self, conn: sqlite3.Connection):
+        """Riallinea i conteggi se la tabella è cambiata fuori da questo processo.
+
+        Va chiamato dentro la transazione di scrittura del chiamante: costa una
+        lettura per chiave primaria su versioni_cache.
+        """
+        try:
+            version = read_version(conn, 'conteggio_ingressi_mensili')
+        except sqlite3.OperationalError:
+            version = None  # tracking non attivo: rilegge sempre
+        with self._lock:
+            if version is not None and version == self._counts_version:
+                return
+            mesi = list(self._mesi_caricati)
+            self._counts.clear()
+            self._mesi_caricati.clear()
+            for anno, mese in mesi:
+                self._load_month(conn, anno, mese)
+            self._counts_version = version
+        logger.debug(f"🔄 Contatori mensili riallineati (versione {version})")
+
+    def invalidate(self):
+        """Forza il riallineamento al prossimo sync (es. dopo un rollback)"""
+        with self._lock:
+            self._counts_version = None
+
+    # ===== LETTURA =====
+
+    def get_limit(self, codice_fiscale: str) -> int:
+        """Limite mensile per l'utente (limiti_utenti se presente, altrimenti globale)"""
+        return self._limiti_utente.get(codice_fiscale.strip().upper(), self.limite_globale)
+
+    def get_count(self, codice_fiscale: str, anno: int, mese: int, conn: sqlite3.Connection = None) -> int:
+        """Ingressi registrati per l'utente nel mese indicato"""
+        cf = codice_fiscale.strip().upper()
+        if (anno, mese) not in self._mesi_caricati:
+            with self._lock:
+                if (anno, mese) not in self._mesi_caricati:
+                    if conn is not None:
+                        self._load_month(conn, anno, mese)
+                    else:
+                        with self._connect() as own_conn:
+                            self._load_month(own_conn, anno, mese)
+        return self._counts.get((cf, anno, mese), 0)
+
+    def check(self, codice_fiscale: str, anno: int, mese: int,
+              conn: sqlite3.Connection = None) -> Tuple[bool, int, int]:
+        """(sotto_limite, ingressi, limite) per l'utente nel mese indicato"""
+        ingressi = self.get_count(codice_fiscale, anno, mese, conn)
+        limite = self.get_limit(codice_fiscale)
+        return ingressi < limite, ingressi, limite
+
+    # ===== SCRITTURA =====
+
+    def increment(self, conn: sqlite3.Connection, codice_fiscale: str, anno: int, mese: int) -> int:
+        """Incrementa il contatore nella transazione del chiamante e aggiorna la cache"""
+        cf = codice_fiscale.strip().upper()
+        conn.execute(SQL_INCREMENTA, (cf, mese, anno))
+        with self._lock:
+            key = (cf, anno, mese)
+            nuovo = self._counts.get(key, 0) + 1
+            self._counts[key] = nuovo
+            # Il trigger di versione è scattato una volta per la nostra scrittura
+            if self._counts_version is not None:
+                self._counts_version += 1
+        return nuovo
+
+    def get_status(self) -> Dict:
+        """Stato cache per diagnostica"""
+        return {
+            'conteggi': len(self._counts),
+            'mesi': sorted(f"{anno}-{mese:02d}" for anno, mese in self._mesi_caricati),
+            'limite_globale': self.limite_globale,
+            'limiti_utente': len(self._limiti_utente),
+            'versione': self._counts_version
+        }
+
+    # ===== WATCHER LIMITI =====
+
+    def check_limits_version(self) -> bool:
+        """Ricarica i limiti se modificati da un altro processo"""
+        try:
+            with self._connect() as conn:
+                versions = self._limiti_versions(conn)
+                if versions != self._limiti_version:
+                    self.load_limits(conn)
+                    return True
+        except Exception as e:
+            logger.debug(f"Verifica versione limiti fallita: {e}")
+        return False
+
+    def start_watcher(self):
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        def watch():
+            while not self._stop_event.wait(self.refresh_interval):
+                self.check_limits_version()
+
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=watch, name='monthly-counters-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop_event.set()
+
+
+# Singleton per processo
+_monthly_counters = None
+_monthly_counters_lock = threading.Lock()
+
+
+def get_monthly_counters(db_path: str = None) -> MonthlyCounterStore:
+    """Restituisce la cache contatori del processo (caricata e sorvegliata)"""
+    global _monthly_counters
+    if _monthly_counters is None:
+        with _monthly_counters_lock:
+            if _monthly_counters is None:
+                store = MonthlyCounterStore(db_path or DEFAULT_DB_PATH)
+                store.load()
+                store.start_watcher()
+                _monthly_counters = store
+    return _monthly_counters
@@ -0,0 +1,385 @@
+# File: /opt/access_control/src/database/pool.py
+# Pool di connessioni SQLite condiviso con configurazione uniforme
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.getenv(
+    'ACCESS_CONTROL_DB',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'access.db')
+)
+
+# ===== CONFIGURAZIONE =====
+# Unico punto in cui regolare costo di connessione e comportamento sui lock
+
+BUSY_TIMEOUT_MS = 10000
+CACHED_STATEMENTS = 256
+MAX_IDLE = 4
+
+# WAL: lettori e scrittore non si bloccano a vicenda; con synchronous=NORMAL
+# il commit non fa fsync (solo i checkpoint), il database resta consistente
+JOURNAL_MODE = 'WAL'
+JOURNAL_SIZE_LIMIT = 16 * 1024 * 1024
+
+PRAGMAS = (
+    ('busy_timeout', BUSY_TIMEOUT_MS),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('cache_size', -8000),          # KiB (8 MB per connessione)
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+
+def configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Applica i PRAGMA comuni a una connessione"""
+    for nome, valore in PRAGMAS:
+        conn.execute(f'PRAGMA {nome} = {valore}')
+    return conn
+
+
+_wal_pronti = set()
+_wal_lock = threading.Lock()
+
+
+def enable_wal(db_path: str):
+    """Porta il database in modalità WAL (persistente nel file, una volta per processo)"""
+    path = os.path.abspath(db_path)
+    if path in _wal_pronti:
+        return
+    with _wal_lock:
+        if path in _wal_pronti:
+            return
+        try:
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+            try:
+                modo = conn.execute(f'PRAGMA journal_mode = {JOURNAL_MODE}').fetchone()[0]
+                conn.execute(f'PRAGMA journal_size_limit = {JOURNAL_SIZE_LIMIT}')
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Modalità WAL non attivata su {path}: {e}")
+            return
+        if modo.upper() != JOURNAL_MODE:
+            logger.warning(f"⚠️ Journal mode {modo} su {path} (atteso {JOURNAL_MODE})")
+            return
+        _wal_pronti.add(path)
+        logger.info(f"🗄️ Database in modalità WAL: {path}")
+
+
+def connect(db_path: str = None, **kwargs) -> sqlite3.Connection:
+    """Nuova connessione dedicata (non condivisa) con la configurazione comune.
+
+    Per i componenti che tengono aperta la propria connessione (scrittore,
+    checkpoint); il resto del codice usa get_connection() o connection().
+    """
+    db_path = db_path or DEFAULT_DB_PATH
+    enable_wal(db_path)
+    kwargs.setdefault('timeout', BUSY_TIMEOUT_MS / 1000)
+    kwargs.setdefault('cached_statements', CACHED_STATEMENTS)
+    return configure(sqlite3.connect(db_path, **kwargs))
+
+
+def copy_database(db_path: str, dest: str):
+    """Copia consistente in un solo file (comprese le pagine ancora nel WAL)"""
+    src = connect(db_path)
+    try:
+        dst = sqlite3.connect(str(dest))
+        try:
+            src.backup(dst)
+            dst.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _file_id(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connessione del pool: close() la restituisce invece di chiuderla"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._chiave = None
+        self._file_id = None
+        self._checkout = 0
+        self._cursori = weakref.WeakSet()
+
+    def cursor(self, *args, **kwargs):
+        cur = super().cursor(*args, **kwargs)
+        self._cursori.add(cur)
+        return cur
+
+    # Le scorciatoie di sqlite3.Connection creano il cursore in C, senza cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def _reset(self):
+        """Chiude i cursori rimasti aperti (e il loro snapshot) e annulla la transazione"""
+        for cur in list(self._cursori):
+            cur.close()
+        self._cursori.clear()
+        if self.in_transaction:
+            self.rollback()
+        self.row_factory = self._chiave
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            super().close()
+
+    def _close(self):
+        self._pool = None
+        try:
+            super().close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Connessioni riutilizzabili per un file di database.
+
+    Ogni thread ottiene sempre la stessa connessione finché la tiene in uso
+    (le chiamate annidate la condividono, quindi niente lock tra connessioni
+    dello stesso thread); alla chiusura dell'ultima la transazione aperta
+    viene annullata e la connessione torna tra quelle libere, pronta per il
+    prossimo thread con PRAGMA e cache delle query già pronti. Se il file
+    viene sostituito (ripristino backup) le connessioni libere vengono scartate.
+    Con query_only=True le connessioni rifiutano le scritture: sono quelle
+    delle letture lunghe (dashboard, export), separate da quelle di lavoro.
+    """
+
+    def __init__(self, db_path: str, max_idle: int = MAX_IDLE, query_only: bool = False):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.query_only = query_only
+        self._local = threading.local()
+        self._idle: Dict[object, List[PooledConnection]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'aperte': 0, 'riusate': 0, 'scartate': 0}
+
+    def _attive(self) -> Dict[object, PooledConnection]:
+        attive = getattr(self._local, 'attive', None)
+        if attive is None:
+            attive = self._local.attive = {}
+        return attive
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, factory=PooledConnection,
+                               cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+        configure(conn)
+        if self.query_only:
+            conn.execute('PRAGMA query_only = ON')
+        conn._file_id = _file_id(self.db_path)
+        self.stats['aperte'] += 1
+        return conn
+
+    def _take_idle(self, row_factory) -> Optional[PooledConnection]:
+        file_id = _file_id(self.db_path)
+        with self._lock:
+            libere = self._idle.get(row_factory)
+            while libere:
+                conn = libere.pop()
+                if conn._file_id == file_id:
+                    self.stats['riusate'] += 1
+                    return conn
+                self.stats['scartate'] += 1
+                conn._close()
+        return None
+
+    def acquire(self, row_factory=sqlite3.Row) -> PooledConnection:
+        """Connessione del thread corrente (da restituire con close())"""
+        attive = self._attive()
+        conn = attive.get(row_factory)
+        if conn is None:
+            conn = self._take_idle(row_factory) or self._open()
+            conn._pool = self
+            conn._chiave = row_factory
+            conn.row_factory = row_factory
+            attive[row_factory] = conn
+        conn._checkout += 1
+        return conn
+
+    def release(self, conn: PooledConnection, force: bool = False):
+        """Restituisce la connessione; torna libera alla chiusura dell'ultimo utilizzo"""
+        conn._checkout = 0 if force else conn._checkout - 1
+        if conn._checkout > 0:
+            return
+        conn._checkout = 0
+        attive = self._attive()
+        if attive.get(conn._chiave) is conn:
+            del attive[conn._chiave]
+        try:
+            conn._reset()
+        except Exception as e:
+            logger.warning(f"⚠️ Connessione database scartata: {e}")
+            conn._close()
+            return
+        with self._lock:
+            libere = self._idle.setdefault(conn._chiave, [])
+            if len(libere) < self.max_idle:
+                libere.append(conn)
+                return
+        conn._close()
+
+    def release_thread(self):
+        """Restituisce le connessioni lasciate aperte dal thread corrente"""
+        for conn in list(self._attive().values()):
+            self.release(conn, force=True)
+
+    def close_idle(self):
+        with self._lock:
+            libere = [conn for lista in self._idle.values() for conn in lista]
+            self._idle.clear()
+        for conn in libere:
+            conn._close()
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            libere = sum(len(lista) for lista in self._idle.values())
+        return {'db_path': self.db_path, 'query_only': self.query_only, 'libere': libere, **self.stats}
+
+
+class WriterConnection:
+    """Unica connessione di scrittura del processo per un database.
+
+    Decisioni di accesso (contatori) e LogWriter scrivono in transazioni
+    BEGIN IMMEDIATE serializzate da un lock Python: l'attesa tra scritture
+    dello stesso processo si risolve al rilascio del lock invece che con i
+    tentativi a intervalli del busy handler di SQLite. Il checkpoint
+    automatico è disattivato: lo esegue il CheckpointManager nei momenti di
+    quiete, così un commit sulla tessera non copia mai pagine nel database.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = None
+        self.ultima_scrittura = 0.0  # time.monotonic() dell'ultimo commit
+        self.stats = {'transazioni': 0, 'rollback': 0, 'riaperture': 0}
+
+    def _get(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # isolation_level=None: le transazioni sono gestite esplicitamente
+            self._conn = connect(self.db_path, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA wal_autocheckpoint = 0')
+        return self._conn
+
+    def reset(self):
+        """Chiude la connessione dopo un errore; la successiva viene riaperta"""
+        with self._lock:
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                self.stats['riaperture'] += 1
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    @contextmanager
+    def locked(self) -> Iterator[sqlite3.Connection]:
+        """Connessione di scrittura in autocommit (DDL, letture sul writer)"""
+        with self._lock:
+            yield self._get()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Transazione BEGIN IMMEDIATE: COMMIT all'uscita, ROLLBACK su eccezione"""
+        with self._lock:
+            conn = self._get()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                self.stats['rollback'] += 1
+                try:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                except Exception:
+                    self.reset()
+                raise
+            self.stats['transazioni'] += 1
+            self.ultima_scrittura = time.monotonic()
+
+    def get_status(self) -> Dict:
+        return {'db_path': self.db_path, 'aperta': self._conn is not None, **self.stats}
+
+
+# Un pool per file di database (e uno in sola lettura)
+_pools: Dict[Tuple[str, bool], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_writers: Dict[str, WriterConnection] = {}
+
+
+def get_pool(db_path: str = None, query_only: bool = False) -> ConnectionPool:
+    """Restituisce il pool del database (creato al primo uso)"""
+    chiave = (os.path.abspath(db_path or DEFAULT_DB_PATH), query_only)
+    pool = _pools.get(chiave)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(chiave)
+            if pool is None:
+                enable_wal(chiave[0])
+                pool = _pools[chiave] = ConnectionPool(chiave[0], query_only=query_only)
+    return pool
+
+
+def get_writer(db_path: str = None) -> WriterConnection:
+    """Restituisce la connessione di scrittura del processo per il database"""
+    path = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    writer = _writers.get(path)
+    if writer is None:
+        with _pools_lock:
+            writer = _writers.get(path)
+            if writer is None:
+                writer = _writers[path] = WriterConnection(path)
+    return writer
+
+
+def get_connection(db_path: str = None, row_factory=sqlite3.Row) -> PooledConnection:
+    """Connessione dal pool; conn.close() la restituisce"""
+    return get_pool(db_path).acquire(row_factory)
+
+
+def get_read_connection(db_path: str = None, row_factory=sqlite3.Row) -> PooledConnection:
+    """Connessione in sola lettura per dashboard ed export; conn.close() la restituisce"""
+    return get_pool(db_path, query_only=True).acquire(row_factory)
+
+
+@contextmanager
+def connection(db_path: str = None, row_factory=sqlite3.Row,
+               query_only: bool = False) -> Iterator[PooledConnection]:
+    """Come `with sqlite3.connect(...)`: commit o rollback all'uscita, poi restituisce"""
+    conn = get_pool(db_path, query_only).acquire(row_factory)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def release_thread_connections():
+    """Restituisce tutte le connessioni del thread corrente (fine richiesta web)"""
+    for pool in list(_pools.values()):
+        pool.release_thread()
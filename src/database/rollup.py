@@ -0,0 +1,197 @@
+# File: /opt/access_control/src/database/rollup.py
+# Statistiche accessi pre-aggregate per ora e per giorno, aggiornate alla scrittura dei log
+
+import sqlite3
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from core.access_schedule import ROME_TZ
+from database.log_filters import Intervallo, TS_EPOCH_SQL, epoch_inizio_giorno
+
+logger = logging.getLogger(__name__)
+
+ORA = 3600
+
+# Righe senza tipo_accesso (schema originale): esito dedotto da autorizzato
+TIPO_SQL = "COALESCE(tipo_accesso, CASE WHEN autorizzato THEN 'AUTORIZZATO' ELSE 'NEGATO' END)"
+
+SQL_UPSERT = '''
+    INSERT INTO {tabella} ({chiave}, tipo_accesso, totale, autorizzati, negati, durata_totale, durata_conteggio)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT({chiave}, tipo_accesso) DO UPDATE SET
+        totale = totale + excluded.totale,
+        autorizzati = autorizzati + excluded.autorizzati,
+        negati = negati + excluded.negati,
+        durata_totale = durata_totale + excluded.durata_totale,
+        durata_conteggio = durata_conteggio + excluded.durata_conteggio
+'''
+
+Contatori = List[float]  # [totale, autorizzati, negati, durata_totale, durata_conteggio]
+
+
+def _tipo(row: Dict[str, Any]) -> str:
+    return row.get('tipo_accesso') or ('AUTORIZZATO' if row.get('autorizzato') else 'NEGATO')
+
+
+def _epoch(timestamp: str) -> Optional[int]:
+    """Epoch di un timestamp UTC 'YYYY-MM-DD HH:MM:SS' (come ts_epoch)"""
+    try:
+        dt = datetime.strptime(str(timestamp)[:19].replace('T', ' '), '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def giorno_locale(epoch: int, tz=None) -> str:
+    return datetime.fromtimestamp(epoch, tz or ROME_TZ).date().isoformat()
+
+
+def _somma(contatori: Contatori, autorizzato, durata):
+    contatori[0] += 1
+    contatori[1 if autorizzato else 2] += 1
+    if durata is not None:
+        contatori[3] += durata
+        contatori[4] += 1
+
+
+# ===== AGGIORNAMENTO =====
+
+def _scrivi(conn: sqlite3.Connection, orari: Dict[Tuple[int, str], Contatori],
+            giornalieri: Dict[Tuple[str, str], Contatori]):
+    for tabella, chiave, gruppi in (('statistiche_orarie', 'ora', orari),
+                                    ('statistiche_giornaliere', 'data', giornalieri)):
+        if gruppi:
+            conn.executemany(SQL_UPSERT.format(tabella=tabella, chiave=chiave),
+                             [(k[0], k[1], *v) for k, v in gruppi.items()])
+
+
+def aggiorna(conn: sqlite3.Connection, rows: Iterable[Dict[str, Any]], tz=None):
+    """Somma le righe di log appena inserite ai contatori (stessa transazione dell'INSERT).
+
+    Le righe di un batch vengono prima raggruppate per ora/giorno ed esito,
+    quindi ogni commit del LogWriter costa al più qualche UPSERT.
+    """
+    orari: Dict[Tuple[int, str], Contatori] = {}
+    giornalieri: Dict[Tuple[str, str], Contatori] = {}
+    for row in rows:
+        epoch = _epoch(row.get('timestamp'))
+        if epoch is None:
+            continue
+        tipo = _tipo(row)
+        for gruppi, chiave in ((orari, (epoch - epoch % ORA, tipo)),
+                               (giornalieri, (giorno_locale(epoch, tz), tipo))):
+            _somma(gruppi.setdefault(chiave, [0, 0, 0, 0.0, 0]),
+                   row.get('autorizzato'), row.get('durata_elaborazione'))
+    _scrivi(conn, orari, giornalieri)
+
+
+def ricostruisci(conn: sqlite3.Connection, sorgenti: Iterable[Tuple[sqlite3.Connection, str]] = None,
+                 tz=None) -> int:
+    """Ricalcola i contatori dallo storico (una tantum, dalla migrazione).
+
+    sorgenti: coppie (connessione, tabella) da leggere, di default log_accessi
+    di conn. SQLite raggruppa per ora UTC; il giorno locale di ogni ora è
+    calcolato in Python, così le righe lette sono ore × esiti e non l'intero log.
+    """
+    conn.execute('DELETE FROM statistiche_orarie')
+    conn.execute('DELETE FROM statistiche_giornaliere')
+    orari: Dict[Tuple[int, str], Contatori] = {}
+    righe = 0
+    for origine, tabella in (sorgenti or [(conn, 'log_accessi')]):
+        for ora, tipo, totale, autorizzati, durata_totale, durata_conteggio in origine.execute(f'''
+            SELECT ({TS_EPOCH_SQL} / {ORA}) * {ORA} AS ora, {TIPO_SQL} AS tipo, COUNT(*),
+                   SUM(CASE WHEN autorizzato THEN 1 ELSE 0 END),
+                   TOTAL(durata_elaborazione), COUNT(durata_elaborazione)
+            FROM {tabella}
+            WHERE timestamp IS NOT NULL
+            GROUP BY ora, tipo
+        '''):
+            if ora is None:
+                continue
+            contatori = orari.setdefault((ora, tipo), [0, 0, 0, 0.0, 0])
+            for i, valore in enumerate((totale, autorizzati, totale - autorizzati, durata_totale, durata_conteggio)):
+                contatori[i] += valore
+            righe += totale
+
+    giornalieri: Dict[Tuple[str, str], Contatori] = {}
+    for (ora, tipo), contatori in orari.items():
+        giorno = giornalieri.setdefault((giorno_locale(ora, tz), tipo), [0, 0, 0, 0.0, 0])
+        for i, valore in enumerate(contatori):
+            giorno[i] += valore
+    _scrivi(conn, orari, giornalieri)
+    logger.info(f"📊 Statistiche ricostruite: {righe} accessi in {len(orari)} righe orarie")
+    return righe
+
+
+# ===== LETTURA =====
+
+def _mezzanotte_successiva(epoch: int, tz) -> int:
+    """Prima mezzanotte locale >= epoch"""
+    giorno = datetime.fromtimestamp(epoch, tz).date()
+    mezzanotte = epoch_inizio_giorno(giorno, tz)
+    return mezzanotte if mezzanotte >= epoch else epoch_inizio_giorno(giorno + timedelta(days=1), tz)
+
+
+def _mezzanotte_precedente(epoch: int, tz) -> int:
+    """Ultima mezzanotte locale <= epoch"""
+    return epoch_inizio_giorno(datetime.fromtimestamp(epoch, tz).date(), tz)
+
+
+def _leggi(conn: sqlite3.Connection, tabella: str, chiave: str, dal, al, totali: Dict[str, Contatori]):
+    condizioni, params = [], []
+    if dal is not None:
+        condizioni.append(f"{chiave} >= ?")
+        params.append(dal)
+    if al is not None:
+        condizioni.append(f"{chiave} < ?")
+        params.append(al)
+    for tipo, *valori in conn.execute(f'''
+        SELECT tipo_accesso, SUM(totale), SUM(autorizzati), SUM(negati), TOTAL(durata_totale), SUM(durata_conteggio)
+        FROM {tabella}
+        WHERE {' AND '.join(condizioni) if condizioni else '1=1'}
+        GROUP BY tipo_accesso
+    ''', params):
+        contatori = totali.setdefault(tipo, [0, 0, 0, 0.0, 0])
+        for i, valore in enumerate(valori):
+            contatori[i] += valore or 0
+
+
+def riepilogo(conn: sqlite3.Connection, intervallo: Intervallo = (None, None), tz=None) -> Dict[str, Any]:
+    """Totali dell'intervallo [inizio, fine) letti dai contatori.
+
+    I giorni interi (mezzanotte locale → mezzanotte) vengono da
+    statistiche_giornaliere, gli eventuali spezzoni ai bordi da
+    statistiche_orarie: il costo dipende dai giorni dell'intervallo, non dal
+    numero di accessi. Estremi non allineati all'ora sono arrotondati all'ora;
+    tz è il fuso dei giorni di statistiche_giornaliere (Europe/Rome).
+    """
+    tz = tz or ROME_TZ
+    inizio, fine = intervallo
+    if inizio is not None:
+        inizio -= inizio % ORA
+    if fine is not None and fine % ORA:
+        fine += ORA - fine % ORA
+
+    totali: Dict[str, Contatori] = {}
+    primo = _mezzanotte_successiva(inizio, tz) if inizio is not None else None
+    ultimo = _mezzanotte_precedente(fine, tz) if fine is not None else None
+    if primo is None or ultimo is None or primo < ultimo:
+        _leggi(conn, 'statistiche_giornaliere', 'data',
+               giorno_locale(primo, tz) if primo is not None else None,
+               giorno_locale(ultimo, tz) if ultimo is not None else None, totali)
+        if inizio is not None and inizio < primo:
+            _leggi(conn, 'statistiche_orarie', 'ora', inizio, primo, totali)
+        if fine is not None and ultimo < fine:
+            _leggi(conn, 'statistiche_orarie', 'ora', ultimo, fine, totali)
+    else:
+        _leggi(conn, 'statistiche_orarie', 'ora', inizio, fine, totali)
+
+    durata_conteggio = sum(c[4] for c in totali.values())
+    return {
+        'totale': int(sum(c[0] for c in totali.values())),
+        'autorizzati': int(sum(c[1] for c in totali.values())),
+        'negati': int(sum(c[2] for c in totali.values())),
+        'tempo_medio': sum(c[3] for c in totali.values()) / durata_conteggio if durata_conteggio else 0,
+        'per_tipo': {tipo: int(c[0]) for tipo, c in totali.items()}
+    }
@@ -0,0 +1,151 @@
+# File: /opt/access_control/src/database/schema.py
+# Migrazioni versionate dello schema: tabella schema_version e file in database/migrations
+
+import os
+import re
+import time
+import logging
+import sqlite3
+import threading
+import importlib.util
+from typing import Callable, Dict, List, NamedTuple
+
+from database.pool import DEFAULT_DB_PATH, connection, get_writer
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+# 0001_schema_iniziale.py → versione 1, nome 'schema_iniziale'
+MIGRATION_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+SQL_SCHEMA_VERSION = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        versione INTEGER PRIMARY KEY,
+        nome TEXT NOT NULL,
+        applicata_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        durata REAL
+    )
+'''
+
+
+class Migration(NamedTuple):
+    versione: int
+    nome: str
+    upgrade: Callable[[sqlite3.Connection], None]
+
+
+# ===== HELPER PER LE MIGRAZIONI =====
+
+def table_columns(conn: sqlite3.Connection, tabella: str) -> set:
+    """Nomi delle colonne della tabella, comprese quelle generate"""
+    return {row[1] for row in conn.execute(f'PRAGMA table_xinfo({tabella})')}
+
+
+def add_column(conn: sqlite3.Connection, tabella: str, colonna: str, definizione: str) -> bool:
+    """ALTER TABLE ADD COLUMN se la colonna non c'è già (DB creati prima delle migrazioni)"""
+    if colonna in table_columns(conn, tabella):
+        return False
+    conn.execute(f'ALTER TABLE {tabella} ADD COLUMN {colonna} {definizione}')
+    return True
+
+
+# ===== CARICAMENTO =====
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """Migrazioni in ordine di versione, lette dai file NNNN_nome.py"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE_RE.match(filename)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location(
+            f'database.migrations.m{match.group(1)}', os.path.join(directory, filename)
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append(Migration(int(match.group(1)), match.group(2), module.upgrade))
+
+    versioni = [m.versione for m in migrations]
+    if len(set(versioni)) != len(versioni):
+        raise RuntimeError(f"Versioni di migrazione duplicate in {directory}")
+    return migrations
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Versione dello schema (0 se schema_version non esiste)"""
+    try:
+        row = conn.execute('SELECT MAX(versione) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+# ===== MIGRATE =====
+
+_migrated: Dict[str, int] = {}
+_migrate_lock = threading.Lock()
+
+
+def migrate(db_path: str = None) -> int:
+    """Porta il database all'ultima versione e restituisce la versione finale.
+
+    All'avvio costa una lettura di schema_version; le migrazioni mancanti
+    vengono applicate in ordine in un'unica transazione BEGIN IMMEDIATE sul
+    writer del processo, quindi un processo che parte insieme a un altro
+    le trova già applicate invece di ripeterle. Ogni file di migrazione
+    espone upgrade(conn) e non deve fare commit.
+    """
+    db_path = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    if db_path in _migrated:
+        return _migrated[db_path]
+
+    with _migrate_lock:
+        if db_path in _migrated:
+            return _migrated[db_path]
+
+        migrations = load_migrations()
+        ultima = migrations[-1].versione if migrations else 0
+        versione = current_version_of(db_path)
+
+        if versione < ultima:
+            with get_writer(db_path).transaction() as conn:
+                conn.execute(SQL_SCHEMA_VERSION)
+                # Riletta sotto lock: un altro processo può averle già applicate
+                versione = current_version(conn)
+                for migration in migrations:
+                    if migration.versione <= versione:
+                        continue
+                    start = time.perf_counter()
+                    migration.upgrade(conn)
+                    durata = round(time.perf_counter() - start, 3)
+                    conn.execute(
+                        'INSERT INTO schema_version (versione, nome, durata) VALUES (?, ?, ?)',
+                        (migration.versione, migration.nome, durata)
+                    )
+                    logger.info(f"🔧 Migrazione {migration.versione:04d} {migration.nome} applicata ({durata}s)")
+                    versione = migration.versione
+        elif versione > ultima:
+            logger.warning(f"⚠️ Schema alla versione {versione}, più recente del codice ({ultima})")
+
+        _migrated[db_path] = versione
+        return versione
+
+
+def current_version_of(db_path: str = None) -> int:
+    """Versione dello schema letta da una connessione del pool"""
+    with connection(db_path or DEFAULT_DB_PATH, row_factory=None) as conn:
+        return current_version(conn)
+
+
+def get_status(db_path: str = None) -> Dict:
+    """Migrazioni applicate per diagnostica"""
+    with connection(db_path or DEFAULT_DB_PATH) as conn:
+        try:
+            applicate = [dict(row) for row in conn.execute('SELECT * FROM schema_version ORDER BY versione')]
+        except sqlite3.OperationalError:
+            applicate = []
+    return {
+        'versione': applicate[-1]['versione'] if applicate else 0,
+        'disponibile': max((m.versione for m in load_migrations()), default=0),
+        'applicate': applicate
+    }
@@ -0,0 +1,77 @@
+# File: /opt/access_control/src/database/user_search.py
+# Ricerca utenti autorizzati per CF o nome sull'indice FTS5 utenti_fts
+
+import sqlite3
+import logging
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Il tokenizer trigram trova sottostringhe di almeno 3 caratteri
+MIN_CARATTERI_FTS = 3
+
+
+def fts_disponibile(conn: sqlite3.Connection) -> bool:
+    """True se la migrazione 0007 ha creato utenti_fts (SQLite con FTS5)"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'utenti_fts'"
+    ).fetchone() is not None
+
+
+def espressione_fts(testo: str) -> Optional[str]:
+    """Testo di ricerca → frase FTS5 (sottostringa, maiuscole/minuscole indifferenti).
+
+    None se il testo è troppo corto per il trigram: in quel caso si usa LIKE.
+    """
+    testo = testo.strip()
+    if len(testo) < MIN_CARATTERI_FTS:
+        return None
+    return '"' + testo.replace('"', '""') + '"'
+
+
+def condizione_ricerca(conn: sqlite3.Connection, testo: str, colonna_id: str = 'id') -> Tuple[str, List[Any]]:
+    """Condizione sugli id di utenti_autorizzati che contengono testo nel CF o nel nome"""
+    espressione = espressione_fts(testo) if fts_disponibile(conn) else None
+    if espressione:
+        return f"{colonna_id} IN (SELECT rowid FROM utenti_fts WHERE utenti_fts MATCH ?)", [espressione]
+    like = f"%{testo.strip().upper()}%"
+    return (f"{colonna_id} IN (SELECT id FROM utenti_autorizzati "
+            f"WHERE UPPER(codice_fiscale) LIKE ? OR UPPER(nome) LIKE ?)"), [like, like]
+
+
+def cerca_utenti(conn: sqlite3.Connection, testo: str, colonne: str,
+                 limite: int = 50, offset: int = 0) -> Tuple[List[sqlite3.Row], int]:
+    """Pagina di utenti che corrispondono a testo e totale dei risultati.
+
+    Con l'indice i risultati sono ordinati per rilevanza (bm25) e poi per
+    nome; senza indice, o per testi di 1-2 caratteri, si ripiega su LIKE
+    ordinato per nome. colonne è la lista SELECT su utenti_autorizzati (alias u).
+    """
+    espressione = espressione_fts(testo) if fts_disponibile(conn) else None
+    if espressione:
+        totale = conn.execute(
+            'SELECT COUNT(*) FROM utenti_fts WHERE utenti_fts MATCH ?', (espressione,)
+        ).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT {colonne}
+            FROM utenti_fts f
+            JOIN utenti_autorizzati u ON u.id = f.rowid
+            WHERE utenti_fts MATCH ?
+            ORDER BY f.rank, u.nome
+            LIMIT ? OFFSET ?
+        ''', (espressione, limite, offset)).fetchall()
+        return rows, totale
+
+    like = f"%{testo.strip().upper()}%"
+    where = 'UPPER(u.codice_fiscale) LIKE ? OR UPPER(u.nome) LIKE ?'
+    totale = conn.execute(
+        f'SELECT COUNT(*) FROM utenti_autorizzati u WHERE {where}', (like, like)
+    ).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT {colonne}
+        FROM utenti_autorizzati u
+        WHERE {where}
+        ORDER BY u.nome
+        LIMIT ? OFFSET ?
+    ''', (like, like, limite, offset)).fetchall()
+    return rows, totale
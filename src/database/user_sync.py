@@ -0,0 +1,68 @@
+# File: /opt/access_control/src/database/user_sync.py
+# Impronte dei campi sincronizzati e insieme delle modifiche agli utenti (sync Odoo)
+
+import sqlite3
+import hashlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from database.cache_versions import read_version
+
+# Stato di un utente prima/dopo una scrittura: (id, nome, attivo, odoo_id)
+StatoUtente = Tuple[int, Optional[str], int, Optional[int]]
+
+
+class UserChange(NamedTuple):
+    """Utente aggiunto o modificato da una scrittura in blocco, con i dati dopo la modifica"""
+    tipo: str  # 'added', 'updated', 'deactivated', 'reactivated'
+    codice_fiscale: str
+    id: int
+    nome: Optional[str]
+    attivo: bool
+
+
+def sync_hash(nome: Optional[str], attivo: bool, odoo_id: Optional[int]) -> int:
+    """Impronta a 64 bit (INTEGER SQLite) dei campi che la sync applica.
+
+    La nota non ne fa parte: contiene la data della sync e il merge non la
+    aggiorna. Stessa impronta = stesso contenuto Odoo già applicato.
+    """
+    testo = f"{nome or ''}\x1f{1 if attivo else 0}\x1f{odoo_id or ''}"
+    return int.from_bytes(hashlib.blake2b(testo.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def stato_utenti(conn: sqlite3.Connection, tabella_cf: str) -> Dict[str, StatoUtente]:
+    """Stato corrente degli utenti con CF nella tabella di appoggio (codice_fiscale)"""
+    return {
+        row[0]: tuple(row[1:])
+        for row in conn.execute(f'''
+            SELECT codice_fiscale, id, nome, attivo, odoo_id FROM utenti_autorizzati
+            WHERE codice_fiscale IN (SELECT codice_fiscale FROM {tabella_cf})
+        ''')
+    }
+
+
+def confronta(prima: Dict[str, StatoUtente], dopo: Dict[str, StatoUtente]) -> List[UserChange]:
+    """Modifiche effettive tra due stati: righe riscritte con gli stessi valori non compaiono"""
+    modifiche = []
+    for cf, (user_id, nome, attivo, odoo_id) in dopo.items():
+        precedente = prima.get(cf)
+        if precedente is None:
+            tipo = 'added'
+        elif precedente[2] and not attivo:
+            tipo = 'deactivated'
+        elif not precedente[2] and attivo:
+            tipo = 'reactivated'
+        elif (precedente[1], precedente[3]) != (nome, odoo_id):
+            tipo = 'updated'
+        else:
+            continue
+        modifiche.append(UserChange(tipo, cf, user_id, nome, bool(attivo)))
+    return modifiche
+
+
+def versione_utenti(conn: sqlite3.Connection) -> Optional[int]:
+    """Versione di utenti_autorizzati (None finché l'indice non ha attivato il contatore)"""
+    try:
+        return read_version(conn, 'utenti_autorizzati')
+    except sqlite3.OperationalError:
+        return None
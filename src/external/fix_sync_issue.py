@@ -7,7 +7,6 @@ import sys
 import os
 from pathlib import Path
 import logging
-import json
 from datetime import datetime
 
 # Configurazione logging
@@ -90,18 +89,17 @@ def check_user_in_db(codice_fiscale):
 def check_user_in_cache(codice_fiscale):
     """Verifica se l'utente esiste nella cache"""
     try:
-        cache_file = Path("/opt/access_control/data/partner_cache.json")
+        cache_file = Path("/opt/access_control/data/partner_cache.snap")
         
         if not cache_file.exists():
             print("⚠️ File cache non trovato")
             return False, None
         
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
+        # Snapshot compresso + delta (external/partner_cache.py)
+        sys.path.append("/opt/access_control/src")
+        from external.partner_cache import PartnerSnapshot
         
-        cittadini = cache_data.get('cittadini', [])
-        
-        for cittadino in cittadini:
+        for cittadino in PartnerSnapshot(cache_file).leggi():
             if cittadino.get('codice_fiscale', '').upper() == codice_fiscale.upper():
                 return True, cittadino
         
@@ -6,14 +6,57 @@ import xmlrpc.client
 import logging
 import time
 import json
+import os
+import fcntl
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import threading
 import re
 from pathlib import Path
 
+from external.partner_cache import PartnerSnapshot, SnapshotNonValido
+
 logger = logging.getLogger(__name__)
 
+# Letture read in parallelo, ognuna sul proprio ServerProxy (non thread-safe)
+CONNESSIONI_PARALLELE = 4
+# Partner per chiamata read: si parte da BATCH_LETTURA e si adatta la
+# dimensione perché ogni chiamata duri circa LATENZA_OBIETTIVO secondi
+BATCH_LETTURA = 1000
+BATCH_MIN = 200
+BATCH_MAX = 5000
+LATENZA_OBIETTIVO = 2.0
+
+# Sync incrementale: write_date più recente già applicato, per comune (system_settings)
+CHIAVE_WATERMARK = 'odoo.write_date.{comune}'
+# Sync interrotta: ultimo partner scritto e watermark di partenza (JSON, system_settings)
+CHIAVE_CHECKPOINT = 'odoo.checkpoint.{comune}'
+# Margine sul watermark: una transazione Odoo lunga può scrivere un write_date
+# precedente all'ultimo già letto; rileggere qualche minuto costa poco
+MARGINE_WATERMARK = timedelta(minutes=10)
+# Riconciliazione per soli id (partner eliminati o usciti dal filtro) al più ogni...
+INTERVALLO_RICONCILIAZIONE = 24 * 3600
+FORMATO_WRITE_DATE = '%Y-%m-%d %H:%M:%S'
+# Intervallo fra i tentativi sul lock di sync tenuto da un altro processo
+ATTESA_LOCK_SYNC = 1.0
+
+
+class OdooNonRaggiungibile(Exception):
+    """Odoo non risponde o rifiuta una chiamata durante la lettura dei partner"""
+
+
+class BatchCittadini(NamedTuple):
+    """Batch di partner letti da Odoo (leggi_batch_cittadini)"""
+    cittadini: List[Dict]        # Record validi del batch
+    letti: int                   # Partner letti nel batch, scartati compresi
+    completati: int              # Partner letti senza buchi dall'inizio della lettura
+    totale: int                  # Partner trovati dalla ricerca
+    dopo_id: Optional[int]       # Tutti i partner fino a questo id sono stati letti
+    write_date: Optional[str]    # write_date più recente letto finora
+
+
 class OdooPartnerConnector:
     """Connettore Odoo ROBUSTO per cittadini - Solo campi essenziali"""
     
@@ -30,14 +73,22 @@ class OdooPartnerConnector:
         self.last_sync = None
         self.sync_errors = 0
         self.max_sync_errors = 3
+        # True se l'ultimo fetch ha letto da Odoo l'elenco intero (non cache, non delta)
+        self.elenco_completo = False
+        # write_date più recente dell'ultimo fetch riuscito da Odoo (None se da cache)
+        self.ultimo_write_date = None
+        self.ultima_riconciliazione = 0.0
+        # ServerProxy per thread di lettura (_leggi_partner)
+        self._proxy_thread = threading.local()
         
         # Thread sincronizzazione
         self.sync_thread = None
         self.running = False
         
-        # Cache file
+        # Cache: snapshot compresso + delta; il JSON è quello delle versioni precedenti
+        self.cache = PartnerSnapshot(Path("/opt/access_control/data/partner_cache.snap"))
+        self.cache.percorso.parent.mkdir(parents=True, exist_ok=True)
         self.cache_file = Path("/opt/access_control/data/partner_cache.json")
-        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
         
         logger.info("🔗 OdooPartnerConnector ROBUSTO inizializzato")
     
@@ -138,129 +189,290 @@ class OdooPartnerConnector:
             logger.error(f"❌ Errore connessione: {e}")
             return False
     
-    def fetch_cittadini_autorizzati(self) -> List[Dict]:
+    def _domain_cittadini(self) -> List[Tuple]:
+        """Filtro dei partner cittadini del comune con CF (attivi e archiviati)"""
+        return [
+            ('city', '=', self.comune_filter),
+            ('is_person', '=', True),
+            ('is_company', '=', False),
+            ('is_ente', '=', False),
+            ('l10n_it_codice_fiscale', '!=', False),
+            ('l10n_it_codice_fiscale', '!=', '')
+        ]
+    
+    def fetch_cittadini_autorizzati(self, dal: Optional[str] = None) -> Optional[List[Dict]]:
         """Recupera cittadini SOLO con campi essenziali
         
+        Args:
+            dal: write_date (UTC) dell'ultima sync; se indicato legge solo i
+                partner modificati da allora, archiviati compresi (attivo False)
+        
         Returns:
-            Lista dizionari con dati cittadini essenziali
+            Lista dizionari con dati cittadini essenziali. Senza Odoo: la cache
+            per la lettura completa, None per quella incrementale (il database
+            locale è già più recente della cache)
         """
         try:
-            if not self.is_connected and not self.connect():
-                logger.warning("⚠️ Connessione Odoo non disponibile - uso cache")
-                return self._load_from_cache()
-            
-            # Domain ROBUSTO per filtri
-            domain = [
-                ('city', '=', self.comune_filter),
-                ('is_person', '=', True),
-                ('is_company', '=', False),
-                ('is_ente', '=', False),
-                ('l10n_it_codice_fiscale', '!=', False),
-                ('l10n_it_codice_fiscale', '!=', ''),
-                ('active', '=', True)  # Solo attivi
-            ]
-            
-            # SOLO 4 campi essenziali - PERFORMANCE OTTIMIZZATA
-            fields = [
-                'l10n_it_codice_fiscale',  # CF per identificazione
-                'name',                    # Nome completo per log
-                'city',                    # Città per verifica
-                'active'                   # Stato attivo
+            return list(self.stream_cittadini(dal=dal))
+        except OdooNonRaggiungibile as e:
+            if dal:
+                logger.warning(f"⚠️ Odoo non raggiungibile - sync incrementale rinviata: {e}")
+                return None
+            logger.warning(f"⚠️ Odoo non raggiungibile - uso cache: {e}")
+            return self._load_from_cache()
+    
+    def stream_cittadini(self, dal: Optional[str] = None) -> Iterator[Dict]:
+        """Cittadini validi man mano che arrivano i batch letti in parallelo
+        
+        Stessi record e stesso filtro di fetch_cittadini_autorizzati, ma
+        restituiti mentre le altre letture sono ancora in corso: chi consuma il
+        generatore (bulk_upsert_users) valida e prepara i record senza
+        attendere l'ultimo batch. ultimo_write_date, elenco_completo e la cache
+        vengono aggiornati solo quando il generatore è esaurito.
+        
+        Raises:
+            OdooNonRaggiungibile: connessione assente o chiamata fallita
+        """
+        self.elenco_completo = False
+        cittadini_validi = []  # Per la cache: snapshot (elenco completo) o delta
+        letti = 0
+        
+        for batch in self.leggi_batch_cittadini(dal=dal):
+            letti += batch.letti
+            cittadini_validi.extend(batch.cittadini)
+            yield from batch.cittadini
+        
+        if not letti:
+            return
+        
+        # L'elenco completo sostituisce lo snapshot, il delta gli viene accodato
+        if dal:
+            self._save_delta_to_cache(cittadini_validi)
+        else:
+            self._save_to_cache(cittadini_validi)
+        
+        self.elenco_completo = not dal
+    
+    def leggi_batch_cittadini(self, dal: Optional[str] = None,
+                              dopo_id: Optional[int] = None) -> Iterator[BatchCittadini]:
+        """Batch di cittadini validi man mano che finiscono le read parallele
+        
+        Con dopo_id (ripresa di una sync interrotta) legge solo i partner con
+        id successivo. I batch arrivano in ordine di completamento: dopo_id di
+        ogni batch è l'id fino al quale tutti i partner sono stati letti, e
+        avanza solo quando sono arrivati tutti i batch precedenti.
+        ultimo_write_date viene aggiornato a generatore esaurito.
+        
+        Raises:
+            OdooNonRaggiungibile: connessione assente o chiamata fallita
+        """
+        self.ultimo_write_date = None
+        if not self.is_connected and not self.connect():
+            raise OdooNonRaggiungibile("connessione Odoo non disponibile")
+        
+        # Domain ROBUSTO per filtri
+        domain = self._domain_cittadini()
+        if dal:
+            inizio = datetime.strptime(dal, FORMATO_WRITE_DATE) - MARGINE_WATERMARK
+            domain += [
+                ('write_date', '>=', inizio.strftime(FORMATO_WRITE_DATE)),
+                ('active', 'in', [True, False])  # Archiviati: da disattivare
             ]
-            
+        else:
+            domain.append(('active', '=', True))  # Solo attivi
+        if dopo_id:
+            domain.append(('id', '>', dopo_id))
+        
+        # SOLO campi essenziali - PERFORMANCE OTTIMIZZATA
+        fields = [
+            'l10n_it_codice_fiscale',  # CF per identificazione
+            'name',                    # Nome completo per log
+            'city',                    # Città per verifica
+            'active',                  # Stato attivo
+            'write_date'               # Watermark sync incrementale
+        ]
+        
+        if dal:
+            logger.info(f"📥 Recupero cittadini {self.comune_filter} modificati dal {dal}...")
+        else:
             logger.info(f"📥 Recupero cittadini {self.comune_filter} - SOLO campi essenziali...")
-            
-            # Ricerca IDs con LIMIT per sicurezza
+        
+        # Ricerca IDs (elenco intero, senza limite)
+        try:
             partner_ids = self.object_proxy.execute_kw(
                 self.odoo_database, self.uid, self.odoo_password,
-                'res.partner', 'search', [domain], {'limit': 30000}
+                'res.partner', 'search', [domain], {'order': 'id'}
             )
-            
-            if not partner_ids:
+        except Exception as e:
+            self.sync_errors += 1
+            raise OdooNonRaggiungibile(f"ricerca partner: {e}") from e
+        
+        if not partner_ids:
+            if dal:
+                logger.info(f"✅ Nessun cittadino modificato dal {dal}")
+                self.ultimo_write_date = dal
+            elif not dopo_id:
                 logger.warning(f"⚠️ Nessun cittadino per {self.comune_filter}")
-                return []
-            
-            logger.info(f"📋 Trovati {len(partner_ids)} cittadini, recupero dati essenziali...")
-            
-            # Lettura dati in batch per performance
-            batch_size = 1000
-            all_partners = []
-            
-            for i in range(0, len(partner_ids), batch_size):
-                batch_ids = partner_ids[i:i + batch_size]
-                
-                batch_partners = self.object_proxy.execute_kw(
-                    self.odoo_database, self.uid, self.odoo_password,
-                    'res.partner', 'read', [batch_ids], {'fields': fields}
-                )
+            return
+        
+        logger.info(f"📋 Trovati {len(partner_ids)} cittadini, recupero dati essenziali...")
+        
+        # Processamento SEMPLIFICATO e ROBUSTO, batch per batch
+        validi = 0
+        dettagli_cf_invalidi = []
+        # Anche i partner scartati contano per il watermark: sono già stati letti
+        ultimo_write_date = dal
+        # Batch arrivati oltre la frontiera (inizio → fine) e posizione fino a cui è tutto letto
+        arrivati = {}
+        frontiera = 0
+        
+        for inizio, fine, partners in self._leggi_partner(partner_ids, fields):
+            cittadini = []
+            for partner in partners:
+                write_date = partner.get('write_date')
+                if write_date and (ultimo_write_date is None or write_date > ultimo_write_date):
+                    ultimo_write_date = write_date
                 
-                all_partners.extend(batch_partners)
-                logger.info(f"📦 Batch {i//batch_size + 1}: {len(batch_partners)} record")
-            
-            # Processamento SEMPLIFICATO e ROBUSTO
-            cittadini_validi = []
-            errori_cf = 0
-            dettagli_cf_invalidi = []
-
-            for partner in all_partners:
-                try:
-                    # CF validation ROBUSTA
-                    cf = partner.get('l10n_it_codice_fiscale', '').strip().upper()
-                    
-                    if not self._validate_codice_fiscale(cf):
-                        errori_cf += 1
-                        dettagli_cf_invalidi.append({
-                            'id': partner.get('id'),
-                            'nome': partner.get('name', '').strip(),
-                            'cf': cf
-                        })
-                        continue
-                    
-                    # Nome completo da Odoo
-                    nome = partner.get('name', '').strip()
-                    if not nome:
-                        nome = 'Cittadino Sconosciuto'
-                    
-                    # Dati cittadino ESSENZIALI
-                    cittadino = {
-                        'codice_fiscale': cf,
-                        'nome': nome,
-                        'note': f"Sync Odoo {datetime.now().strftime('%Y-%m-%d')}",
-                        'attivo': partner.get('active', True),
-                        'odoo_id': partner.get('id'),
-                        'sync_timestamp': datetime.now().isoformat(),
-                        'creato_da': 'ODOO_SYNC',
-                        'modificato_da': 'ODOO_SYNC'
-                    }
-                    
-                    cittadini_validi.append(cittadino)
-                    
-                except Exception as e:
-                    errori_cf += 1
+                cittadino = self._cittadino_da_partner(partner)
+                if cittadino is None:
                     dettagli_cf_invalidi.append({
                         'id': partner.get('id'),
-                        'nome': partner.get('name', '').strip(),
-                        'cf': partner.get('l10n_it_codice_fiscale', '')
+                        'nome': (partner.get('name') or '').strip(),
+                        'cf': partner.get('l10n_it_codice_fiscale') or ''
                     })
-                    logger.debug(f"⚠️ Errore partner {partner.get('id')}: {e}")
-
-            # Statistiche finali
-            logger.info(f"✅ Processati {len(cittadini_validi)} cittadini validi")
-            if errori_cf > 0:
-                logger.warning(f"⚠️ {errori_cf} record con CF invalido/mancante: {dettagli_cf_invalidi}")
-
-            # Salva in cache
-            self._save_to_cache(cittadini_validi)
-            
-            return cittadini_validi
-            
+                    continue
+                cittadini.append(cittadino)
+            
+            validi += len(cittadini)
+            arrivati[inizio] = fine
+            while frontiera in arrivati:
+                frontiera = arrivati.pop(frontiera)
+            yield BatchCittadini(
+                cittadini=cittadini,
+                letti=fine - inizio,
+                completati=frontiera,
+                totale=len(partner_ids),
+                dopo_id=partner_ids[frontiera - 1] if frontiera else dopo_id,
+                write_date=ultimo_write_date
+            )
+        
+        # Statistiche finali
+        logger.info(f"✅ Processati {validi} cittadini validi")
+        if dettagli_cf_invalidi:
+            logger.warning(f"⚠️ {len(dettagli_cf_invalidi)} record con CF invalido/mancante: {dettagli_cf_invalidi}")
+        
+        self.ultimo_write_date = ultimo_write_date
+    
+    def _cittadino_da_partner(self, partner: Dict) -> Optional[Dict]:
+        """Record cittadino da un partner letto, None se il CF non è valido"""
+        try:
+            # CF validation ROBUSTA
+            cf = (partner.get('l10n_it_codice_fiscale') or '').strip().upper()
+            if not self._validate_codice_fiscale(cf):
+                return None
+            
+            # Nome completo da Odoo
+            nome = (partner.get('name') or '').strip()
+            if not nome:
+                nome = 'Cittadino Sconosciuto'
+            
+            # Dati cittadino ESSENZIALI
+            return {
+                'codice_fiscale': cf,
+                'nome': nome,
+                'note': f"Sync Odoo {datetime.now().strftime('%Y-%m-%d')}",
+                'attivo': partner.get('active', True),
+                'odoo_id': partner.get('id'),
+                'sync_timestamp': datetime.now().isoformat(),
+                'creato_da': 'ODOO_SYNC',
+                'modificato_da': 'ODOO_SYNC'
+            }
+        except Exception as e:
+            logger.debug(f"⚠️ Errore partner {partner.get('id')}: {e}")
+            return None
+    
+    def _read_batch(self, batch_ids: List[int], fields: List[str]) -> Tuple[List[Dict], float]:
+        """read di un batch sul ServerProxy del thread corrente, con la durata della chiamata"""
+        proxy = getattr(self._proxy_thread, 'proxy', None)
+        if proxy is None or self._proxy_thread.url != self.object_url:
+            proxy = xmlrpc.client.ServerProxy(self.object_url)
+            self._proxy_thread.proxy = proxy
+            self._proxy_thread.url = self.object_url
+        
+        inizio = time.monotonic()
+        partners = proxy.execute_kw(
+            self.odoo_database, self.uid, self.odoo_password,
+            'res.partner', 'read', [batch_ids], {'fields': fields}
+        )
+        return partners, time.monotonic() - inizio
+    
+    def _leggi_partner(self, partner_ids: List[int], fields: List[str]) -> Iterator[Tuple[int, int, List[Dict]]]:
+        """Batch di partner letti con CONNESSIONI_PARALLELE read contemporanee
+        
+        Restituisce (inizio, fine, partner) con la posizione del batch in
+        partner_ids; i batch arrivano nell'ordine in cui finiscono. Quando una read termina
+        parte subito la successiva, con una dimensione ricalcolata dalla
+        latenza per record osservata (media con la precedente, entro
+        BATCH_MIN-BATCH_MAX): il tempo totale è circa quello del gruppo di
+        batch più lento invece della somma di tutte le chiamate.
+        """
+        batch_size = BATCH_LETTURA
+        posizione = 0
+        numero = 0
+        in_corso = {}
+        pool = ThreadPoolExecutor(max_workers=CONNESSIONI_PARALLELE, thread_name_prefix='odoo-read')
+        
+        def avvia():
+            nonlocal posizione
+            # In coda il resto va diviso fra le connessioni: nessun batch grande da solo alla fine
+            rimanenti = len(partner_ids) - posizione
+            dimensione = min(batch_size, max(BATCH_MIN, -(-rimanenti // CONNESSIONI_PARALLELE)))
+            batch_ids = partner_ids[posizione:posizione + dimensione]
+            in_corso[pool.submit(self._read_batch, batch_ids, fields)] = (posizione, posizione + len(batch_ids))
+            posizione += len(batch_ids)
+        
+        try:
+            while posizione < len(partner_ids) and len(in_corso) < CONNESSIONI_PARALLELE:
+                avvia()
+            
+            while in_corso:
+                completati, _ = wait(in_corso, return_when=FIRST_COMPLETED)
+                for futuro in completati:
+                    inizio, fine = in_corso.pop(futuro)
+                    richiesti = fine - inizio
+                    try:
+                        partners, durata = futuro.result()
+                    except Exception as e:
+                        self.sync_errors += 1
+                        raise OdooNonRaggiungibile(f"lettura partner: {e}") from e
+                    
+                    numero += 1
+                    if durata > 0:
+                        ottimale = int(richiesti * LATENZA_OBIETTIVO / durata)
+                        batch_size = max(BATCH_MIN, min(BATCH_MAX, (batch_size + ottimale) // 2))
+                    logger.info(f"📦 Batch {numero}: {len(partners)} record in {durata:.2f}s "
+                                f"({posizione}/{len(partner_ids)} richiesti, prossimo batch {batch_size})")
+                    
+                    if posizione < len(partner_ids):
+                        avvia()
+                    yield inizio, fine, partners
+        finally:
+            # Errore o generatore abbandonato: niente nuove read, quelle in corso finiscono da sole
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def fetch_id_partner(self) -> Optional[List[int]]:
+        """Id di tutti i partner cittadini attivi (riconciliazione, nessun campo letto)"""
+        try:
+            if not self.is_connected and not self.connect():
+                return None
+            return self.object_proxy.execute_kw(
+                self.odoo_database, self.uid, self.odoo_password,
+                'res.partner', 'search', [self._domain_cittadini() + [('active', '=', True)]]
+            )
         except Exception as e:
-            logger.error(f"❌ Errore recupero cittadini: {e}")
+            logger.error(f"❌ Errore recupero id partner: {e}")
             self.sync_errors += 1
-            
-            # Fallback cache
-            logger.info("🔄 Fallback su cache locale")
-            return self._load_from_cache()
+            return None
     
     def _validate_codice_fiscale(self, cf: str) -> bool:
         """Validazione CF ROBUSTA"""
@@ -279,51 +491,240 @@ class OdooPartnerConnector:
         return True
     
     def _save_to_cache(self, cittadini: List[Dict]):
-        """Salva cittadini in cache locale ROBUSTA"""
+        """Salva l'elenco completo come snapshot compresso della cache locale"""
         try:
-            cache_data = {
-                'timestamp': datetime.now().isoformat(),
-                'comune': self.comune_filter,
-                'count': len(cittadini),
-                'cittadini': cittadini
-            }
-            
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, indent=2, ensure_ascii=False, default=str)
-            
-            logger.info(f"💾 Cache salvata: {len(cittadini)} cittadini")
-            
+            self.cache.scrivi(cittadini, self.comune_filter)
+            self.cache_file.unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"❌ Errore salvataggio cache: {e}")
+    
+    def _save_delta_to_cache(self, cittadini: List[Dict]):
+        """Accoda i partner di una sync incrementale alla cache (compattata se i delta crescono)"""
+        try:
+            self.cache.aggiungi_delta(cittadini)
+            if self.cache.da_compattare():
+                self.cache.compatta()
+        except Exception as e:
+            logger.error(f"❌ Errore salvataggio delta cache: {e}")
+    
+    def _save_partial_to_cache(self, cittadini: List[Dict]):
+        """Accoda un batch della sync completa, che diventa snapshot a lettura conclusa"""
+        try:
+            self.cache.aggiungi_parziale(cittadini)
+        except Exception as e:
+            logger.error(f"❌ Errore salvataggio batch cache: {e}")
+    
+    def _conclude_partial_cache(self):
+        """Sostituisce lo snapshot con i batch della sync completa appena conclusa"""
+        try:
+            self.cache.concludi_parziale(self.comune_filter)
+            self.cache_file.unlink(missing_ok=True)
         except Exception as e:
             logger.error(f"❌ Errore salvataggio cache: {e}")
     
+    def _stream_cache(self) -> Iterator[Dict]:
+        """Cittadini della cache locale man mano che vengono decompressi
+        
+        Raises:
+            SnapshotNonValido: snapshot corrotto (anche a lettura avviata)
+        """
+        if not self.cache.percorso.exists():
+            # Cache JSON delle versioni precedenti, finché non c'è uno snapshot
+            if self.cache_file.exists():
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    yield from json.load(f).get('cittadini', [])
+            else:
+                logger.warning("⚠️ Cache locale non esistente")
+            return
+        
+        info = self.cache.info()
+        if info.get('comune') != self.comune_filter:
+            logger.warning(f"⚠️ Cache locale di un altro comune ({info.get('comune')}), ignorata")
+            return
+        logger.info(f"📂 Cache: {info['count']} cittadini ({info['timestamp']}, delta {info['delta_size']} byte)")
+        yield from self.cache.leggi()
+    
     def _load_from_cache(self) -> List[Dict]:
         """Carica cittadini da cache locale"""
         try:
-            if not self.cache_file.exists():
-                logger.warning("⚠️ Cache locale non esistente")
-                return []
-            
-            with open(self.cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            
-            cittadini = cache_data.get('cittadini', [])
-            timestamp = cache_data.get('timestamp', 'Unknown')
-            
-            logger.info(f"📂 Cache: {len(cittadini)} cittadini ({timestamp})")
-            return cittadini
-            
+            return list(self._stream_cache())
         except Exception as e:
             logger.error(f"❌ Errore caricamento cache: {e}")
             return []
     
-    def sync_to_database(self, database_manager) -> Tuple[bool, Dict]:
-        """Sincronizza cittadini con database locale ROBUSTO"""
+    def sync_to_database(self, database_manager,
+                         progresso: Optional[Callable[[Dict], None]] = None) -> Tuple[bool, Dict]:
+        """Sincronizza cittadini con database locale ROBUSTO
+        
+        Con un database che supporta l'upsert in blocco la sync è incrementale:
+        la prima legge l'elenco completo, le successive solo i partner con
+        write_date successivo al watermark salvato in system_settings. Una
+        riconciliazione per soli id (al più ogni INTERVALLO_RICONCILIAZIONE)
+        disattiva i partner eliminati o usciti dal filtro.
+        
+        Ogni batch letto viene scritto subito e seguito da un checkpoint in
+        system_settings: una sync interrotta (arresto, Odoo caduto a metà)
+        riparte dal primo partner non ancora scritto invece che da capo.
+        progresso, se indicato, riceve a ogni batch fase, partner letti e
+        totale; un'eccezione sollevata da progresso interrompe la sync.
+        
+        Una sola sync alla volta fra i processi (main.py e web_api hanno
+        ciascuno il proprio worker): checkpoint, watermark e cache sono
+        condivisi, quindi la sync attende il lock esclusivo sulla cartella
+        della cache, segnalando la fase 'attesa' a progresso.
+        """
+        with self._lock_sync(progresso):
+            return self._sync_to_database(database_manager, progresso)
+    
+    @contextmanager
+    def _lock_sync(self, progresso: Optional[Callable[[Dict], None]] = None):
+        """Lock esclusivo (flock) sulla cartella della cache per tutta la sync"""
+        fd = os.open(self.cache.percorso.parent, os.O_RDONLY)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    # progresso solleva un'eccezione se chi ha avviato la sync si ferma
+                    logger.debug("⏳ Sync Odoo in corso in un altro processo, attesa")
+                    self._avanzamento(progresso, fase='attesa')
+                    time.sleep(ATTESA_LOCK_SYNC)
+            yield
+        finally:
+            # La chiusura rilascia il lock (anche se il processo termina)
+            os.close(fd)
+    
+    def _sync_to_database(self, database_manager,
+                          progresso: Optional[Callable[[Dict], None]] = None) -> Tuple[bool, Dict]:
+        """Corpo di sync_to_database, eseguito con il lock di sync"""
         start_time = time.time()
-        stats = {'fetched': 0, 'updated': 0, 'added': 0, 'errors': 0, 'skipped': 0}
+        stats = {'fetched': 0, 'updated': 0, 'added': 0, 'errors': 0, 'skipped': 0, 'deactivated': 0}
         
         try:
             logger.info(f"🔄 Sync ROBUSTA cittadini {self.comune_filter}")
             
+            incrementale = hasattr(database_manager, 'bulk_upsert_users')
+            chiave_watermark = CHIAVE_WATERMARK.format(comune=self.comune_filter)
+            watermark = database_manager.get_setting(chiave_watermark) if incrementale else None
+            
+            # Sincronizzazione a batch: ogni batch delle read parallele va in una
+            # transazione appena arriva, seguito dal checkpoint
+            if incrementale:
+                chiave_checkpoint = CHIAVE_CHECKPOINT.format(comune=self.comune_filter)
+                checkpoint = self._leggi_checkpoint(database_manager, chiave_checkpoint, watermark)
+                letti = checkpoint['letti'] if checkpoint else 0
+                if checkpoint:
+                    logger.info(f"⏯️ Ripresa sync interrotta: {letti} partner già scritti (id > {checkpoint['dopo_id']})")
+                elif not watermark:
+                    self.cache.scarta_parziale()
+                
+                logger.info("📥 Recupero cittadini autorizzati...")
+                self._avanzamento(progresso, fase='lettura', letti=letti)
+                modifiche = []
+                cittadini_delta = []  # Per la cache della sync incrementale
+                batch_scritti = 0
+                try:
+                    for batch in self.leggi_batch_cittadini(dal=watermark,
+                                                            dopo_id=checkpoint['dopo_id'] if checkpoint else None):
+                        risultato = database_manager.bulk_upsert_users(batch.cittadini, origine='ODOO_SYNC')
+                        self._somma_risultato(stats, risultato)
+                        modifiche.extend(risultato.get('changes', []))
+                        if watermark:
+                            cittadini_delta.extend(batch.cittadini)
+                        else:
+                            self._save_partial_to_cache(batch.cittadini)
+                        
+                        # Checkpoint dopo l'upsert: la ripresa rilegge solo i partner oltre dopo_id.
+                        # Il watermark resta quello della prima lettura interrotta: i partner
+                        # già letti e poi modificati verranno riletti dalla sync successiva
+                        batch_scritti += 1
+                        database_manager.set_setting(chiave_checkpoint, json.dumps({
+                            'dal': watermark,
+                            'dopo_id': batch.dopo_id,
+                            'letti': (checkpoint['letti'] if checkpoint else 0) + batch.completati,
+                            'write_date': checkpoint['write_date'] if checkpoint else batch.write_date
+                        }))
+                        letti += batch.letti
+                        self._avanzamento(progresso, fase='lettura', letti=letti,
+                                          totale=(checkpoint['letti'] if checkpoint else 0) + batch.totale,
+                                          batch=batch_scritti, stats=dict(stats))
+                except OdooNonRaggiungibile as e:
+                    if checkpoint or batch_scritti:
+                        # Niente cache sopra i batch già scritti: la prossima sync riprende da qui
+                        logger.warning(f"⚠️ Sync interrotta: Odoo non raggiungibile ({e}) - "
+                                       f"ripresa dal checkpoint alla prossima sync")
+                        return False, stats
+                    if watermark:
+                        logger.warning(f"⚠️ Sync incrementale non eseguita: Odoo non raggiungibile ({e})")
+                        return False, stats
+                    # Prima sync senza Odoo: utenti dalla cache, nessuna disattivazione
+                    logger.warning(f"⚠️ Odoo non raggiungibile ({e}) - uso cache")
+                    self._avanzamento(progresso, fase='cache')
+                    try:
+                        risultato = database_manager.bulk_upsert_users(self._stream_cache(), origine='ODOO_SYNC')
+                    except SnapshotNonValido as errore_cache:
+                        logger.error(f"❌ Cache locale non utilizzabile: {errore_cache}")
+                        return False, stats
+                    self._somma_risultato(stats, risultato)
+                    modifiche.extend(risultato.get('changes', []))
+                    if not stats['fetched']:
+                        logger.warning("⚠️ Nessun cittadino da sincronizzare")
+                        return False, stats
+                    self._log_modifiche(modifiche)
+                    self.last_sync = datetime.now()
+                    logger.info(f"✅ Sync da cache completata in {time.time() - start_time:.2f}s")
+                    return True, stats
+                
+                if not letti and not watermark:
+                    logger.warning("⚠️ Nessun cittadino da sincronizzare")
+                    return False, stats
+                
+                self._log_modifiche(modifiche)
+                
+                if not watermark:
+                    # Fine dell'elenco completo: via gli utenti dei partner che non ne fanno più
+                    # parte (la lettura può essere stata ripresa, quindi per id e non per CF)
+                    self._avanzamento(progresso, fase='riconciliazione', letti=letti)
+                    odoo_ids = self.fetch_id_partner()
+                    if odoo_ids is None:
+                        logger.warning("⚠️ Sync completa non conclusa: id partner non disponibili, "
+                                       "ripresa alla prossima sync")
+                        return False, stats
+                    stats['deactivated'] += database_manager.deactivate_missing_odoo_users(
+                        odoo_ids, 'ODOO_SYNC', includi_senza_id=True
+                    )
+                    self.ultima_riconciliazione = time.time()
+                    self._conclude_partial_cache()
+                else:
+                    self._save_delta_to_cache(cittadini_delta)
+                    if time.time() - self.ultima_riconciliazione >= INTERVALLO_RICONCILIAZIONE:
+                        self._avanzamento(progresso, fase='riconciliazione', letti=letti)
+                        odoo_ids = self.fetch_id_partner()
+                        if odoo_ids is not None:
+                            stats['deactivated'] += database_manager.deactivate_missing_odoo_users(odoo_ids, 'ODOO_SYNC')
+                            self.ultima_riconciliazione = time.time()
+                            # Partner eliminati fuori anche dalla cache (i delta non li vedono)
+                            try:
+                                self.cache.compatta(set(odoo_ids))
+                            except Exception as errore_cache:
+                                logger.warning(f"⚠️ Compattazione cache non eseguita: {errore_cache}")
+                
+                # Watermark salvato dopo l'upsert: una sync interrotta rilegge il delta
+                nuovo_watermark = (checkpoint or {}).get('write_date') or self.ultimo_write_date
+                if nuovo_watermark and nuovo_watermark != watermark:
+                    database_manager.set_setting(chiave_watermark, nuovo_watermark)
+                if checkpoint or batch_scritti:
+                    database_manager.delete_setting(chiave_checkpoint)
+                
+                self.last_sync = datetime.now()
+                duration = time.time() - start_time
+                self._avanzamento(progresso, fase='completata', letti=letti, stats=dict(stats))
+                logger.info(f"✅ Sync {'incrementale' if watermark else 'completa'} completata in {duration:.2f}s")
+                logger.info(f"📊 {stats['added']} aggiunti, {stats['updated']} aggiornati, "
+                            f"{stats['deactivated']} disattivati, {stats['skipped']} invariati")
+                return True, stats
+            
             # Recupera cittadini
             logger.info("📥 Recupero cittadini autorizzati...")
             cittadini = self.fetch_cittadini_autorizzati()
@@ -444,6 +845,45 @@ class OdooPartnerConnector:
             logger.error(f"❌ Errore sincronizzazione: {e}")
             return False, stats
     
+    def _leggi_checkpoint(self, database_manager, chiave: str, watermark: Optional[str]) -> Optional[Dict]:
+        """Checkpoint della sync interrotta, se riprendibile (stesso watermark, almeno un batch completo)"""
+        valore = database_manager.get_setting(chiave)
+        if not valore:
+            return None
+        try:
+            checkpoint = json.loads(valore)
+        except ValueError:
+            logger.warning(f"⚠️ Checkpoint sync non valido, ignorato: {valore!r}")
+            return None
+        if checkpoint.get('dal') != watermark or not checkpoint.get('dopo_id'):
+            return None
+        return checkpoint
+    
+    def _avanzamento(self, progresso: Optional[Callable[[Dict], None]], **avanzamento):
+        """Notifica l'avanzamento a chi ha avviato la sync"""
+        if progresso:
+            progresso(avanzamento)
+    
+    def _somma_risultato(self, stats: Dict, risultato: Dict):
+        """Aggiunge alle statistiche della sync quelle di un bulk_upsert_users"""
+        stats['fetched'] += risultato['received']
+        stats['added'] += risultato['added']
+        stats['updated'] += risultato['updated']
+        stats['skipped'] += risultato['unchanged']
+        stats['deactivated'] += risultato['deactivated']
+        stats['errors'] += risultato['invalid']
+    
+    def _log_modifiche(self, modifiche: List):
+        """Log delle modifiche effettive agli utenti (max 20)"""
+        if not modifiche:
+            return
+        max_log = 20
+        logger.info(f"👤 Dettaglio modifiche utenti (max {max_log}):")
+        for modifica in modifiche[:max_log]:
+            logger.info(f"   - {modifica.tipo}: {modifica.nome} ({modifica.codice_fiscale})")
+        if len(modifiche) > max_log:
+            logger.info(f"... altre {len(modifiche) - max_log} non mostrate")
+    
     def get_sync_status(self) -> Dict:
         """Status connessione e sincronizzazione"""
         return {
@@ -451,8 +891,8 @@ class OdooPartnerConnector:
             'comune': self.comune_filter,
             'last_sync': self.last_sync.isoformat() if self.last_sync else None,
             'sync_errors': self.sync_errors,
-            'cache_exists': self.cache_file.exists(),
-            'cache_size': self.cache_file.stat().st_size if self.cache_file.exists() else 0
+            'cache_exists': self.cache.percorso.exists(),
+            'cache_size': self.cache.info()['size']
         }
     
     def disconnect(self):
@@ -0,0 +1,338 @@
+# File: /opt/access_control/src/external/partner_cache.py
+# Cache locale dei partner Odoo: snapshot compresso versionato + delta in append
+
+import os
+import time
+import fcntl
+import tempfile
+import zlib
+import struct
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Snapshot: intestazione fissa + nome comune + righe TSV compresse con zlib
+# (codice fiscale, nome, attivo 0/1, id partner).
+# magic, versione formato, flag, numero record, crc32 del contenuto non
+# compresso, timestamp (id dello snapshot), lunghezza del nome comune
+MAGIC_SNAPSHOT = b'ACPS'
+VERSIONE_FORMATO = 1
+INTESTAZIONE = struct.Struct('<4sHHIIdH')
+
+# Delta: blocchi autonomi accodati dopo lo snapshot a cui si riferiscono.
+# magic, timestamp dello snapshot, numero record, crc32, lunghezza compressa
+MAGIC_DELTA = b'ACPD'
+BLOCCO = struct.Struct('<4sdIII')
+
+LETTURA_CHUNK = 64 * 1024
+RIGHE_PER_BLOCCO = 1000
+# Oltre questa dimensione dei delta (rispetto allo snapshot) si riscrive lo snapshot
+SOGLIA_COMPATTAZIONE = 0.5
+
+
+class SnapshotNonValido(Exception):
+    """Snapshot assente, di un altro formato o con checksum errato"""
+
+
+def _riga(cittadino: Dict) -> str:
+    """Record → riga TSV: cf, nome (senza separatori), attivo, odoo_id"""
+    nome = (cittadino.get('nome') or '').replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+    return (f"{cittadino['codice_fiscale']}\t{nome}\t"
+            f"{1 if cittadino.get('attivo', True) else 0}\t{cittadino.get('odoo_id') or ''}\n")
+
+
+def _record(riga: str) -> Tuple[str, str, bool, Optional[int]]:
+    """Riga TSV → (cf, nome, attivo, odoo_id)"""
+    cf, nome, attivo, odoo_id = riga.split('\t')
+    return cf, nome, attivo == '1', int(odoo_id) if odoo_id else None
+
+
+class PartnerSnapshot:
+    """Cache dei cittadini letti da Odoo per la sync senza connessione.
+
+    Lo snapshot completo (percorso) viene riscritto solo dopo una lettura
+    completa: file temporaneo, fsync e os.replace, quindi un lettore vede
+    sempre il vecchio o il nuovo file intero. Le sync incrementali accodano
+    i partner cambiati al file .delta in blocchi compressi con il proprio
+    checksum; un blocco troncato (spegnimento durante la scrittura) viene
+    ignorato. La lettura decomprime a blocchi e restituisce i record man mano,
+    con i delta già applicati.
+
+    Una lettura completa che può essere interrotta e ripresa (sync a
+    checkpoint) accumula i batch nel file .parziale, con lo stesso formato
+    dei delta: concludi_parziale() lo trasforma nel nuovo snapshot.
+    """
+
+    def __init__(self, percorso: Path):
+        self.percorso = Path(percorso)
+        self.percorso_delta = self.percorso.with_suffix(self.percorso.suffix + '.delta')
+        self.percorso_parziale = self.percorso.with_suffix(self.percorso.suffix + '.parziale')
+
+    # ===== SCRITTURA =====
+
+    def scrivi(self, cittadini: Iterable[Dict], comune: str) -> int:
+        """Scrive uno snapshot completo e azzera i delta; restituisce i record scritti"""
+        start = time.time()
+        identificativo = time.time()
+        compressore = zlib.compressobj(6)
+        crc = 0
+        conteggio = 0
+        nome_comune = (comune or '').encode('utf-8')
+        # Temporaneo proprio di ogni writer: main.py e web_api scrivono la stessa cache
+        fd, temporaneo = tempfile.mkstemp(prefix=f"{self.percorso.name}.", suffix='.tmp',
+                                          dir=self.percorso.parent)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # Intestazione provvisoria, riscritta con conteggio e checksum a fine file
+                f.write(INTESTAZIONE.pack(MAGIC_SNAPSHOT, VERSIONE_FORMATO, 0, 0, 0, identificativo, len(nome_comune)))
+                f.write(nome_comune)
+                blocco = []
+                for cittadino in cittadini:
+                    blocco.append(_riga(cittadino))
+                    conteggio += 1
+                    if len(blocco) == RIGHE_PER_BLOCCO:
+                        dati = ''.join(blocco).encode('utf-8')
+                        crc = zlib.crc32(dati, crc)
+                        f.write(compressore.compress(dati))
+                        blocco = []
+                dati = ''.join(blocco).encode('utf-8')
+                crc = zlib.crc32(dati, crc)
+                f.write(compressore.compress(dati))
+                f.write(compressore.flush())
+                f.seek(0)
+                f.write(INTESTAZIONE.pack(MAGIC_SNAPSHOT, VERSIONE_FORMATO, 0, conteggio, crc,
+                                          identificativo, len(nome_comune)))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp crea il file 0600: restano i permessi dello snapshot precedente
+            try:
+                os.chmod(temporaneo, self.percorso.stat().st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(temporaneo, 0o644)
+            os.replace(temporaneo, self.percorso)
+        except BaseException:
+            Path(temporaneo).unlink(missing_ok=True)
+            raise
+
+        # I delta del vecchio snapshot non servono più (e non verrebbero applicati)
+        self.percorso_delta.unlink(missing_ok=True)
+        logger.info(f"💾 Snapshot cache: {conteggio} cittadini, {self.percorso.stat().st_size // 1024} KB "
+                    f"in {(time.time() - start) * 1000:.0f}ms")
+        return conteggio
+
+    def aggiungi_delta(self, cittadini: List[Dict]) -> int:
+        """Accoda i partner cambiati allo snapshot corrente (nessuna scrittura senza snapshot)"""
+        if not cittadini:
+            return 0
+        try:
+            identificativo = self._intestazione()[2]
+        except SnapshotNonValido:
+            return 0
+
+        compresso = self._accoda_blocco(self.percorso_delta, identificativo, cittadini)
+        logger.info(f"💾 Delta cache: {len(cittadini)} cittadini ({len(compresso)} byte)")
+        return len(cittadini)
+
+    def aggiungi_parziale(self, cittadini: List[Dict]) -> int:
+        """Accoda un batch della lettura completa in corso (vedi concludi_parziale)"""
+        if not cittadini:
+            return 0
+        self._accoda_blocco(self.percorso_parziale, 0.0, cittadini)
+        return len(cittadini)
+
+    def concludi_parziale(self, comune: str) -> int:
+        """Scrive come snapshot i batch accumulati dalla lettura completa e li elimina"""
+        cittadini = {}
+        for _, contenuto, _ in self._blocchi(self.percorso_parziale):
+            for riga in contenuto.decode('utf-8').splitlines():
+                cf, nome, attivo, odoo_id = _record(riga)
+                # Un batch riletto dopo una ripresa sostituisce quello precedente
+                cittadini[cf] = {'codice_fiscale': cf, 'nome': nome, 'attivo': attivo, 'odoo_id': odoo_id}
+        conteggio = self.scrivi(cittadini.values(), comune)
+        self.scarta_parziale()
+        return conteggio
+
+    def scarta_parziale(self):
+        """Elimina i batch di una lettura completa mai conclusa"""
+        self.percorso_parziale.unlink(missing_ok=True)
+
+    def _accoda_blocco(self, percorso: Path, identificativo: float, cittadini: List[Dict]) -> bytes:
+        """Accoda un blocco compresso con checksum; restituisce i byte compressi.
+
+        Troncamento e aggiunta avvengono con il file bloccato (flock): un
+        altro processo che accoda nello stesso momento non vede il blocco a
+        metà e non lo tronca.
+        """
+        contenuto = ''.join(_riga(c) for c in cittadini).encode('utf-8')
+        compresso = zlib.compress(contenuto, 6)
+        with open(percorso, 'ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            # Un blocco lasciato a metà va tolto, altrimenti nasconderebbe quelli nuovi
+            fine = 0
+            for _, _, fine in self._blocchi(percorso):
+                pass
+            if os.fstat(f.fileno()).st_size > fine:
+                f.truncate(fine)
+            f.write(BLOCCO.pack(MAGIC_DELTA, identificativo, len(cittadini), zlib.crc32(contenuto), len(compresso)))
+            f.write(compresso)
+            f.flush()
+            os.fsync(f.fileno())
+        return compresso
+
+    def da_compattare(self) -> bool:
+        """True se i delta accodati pesano più di SOGLIA_COMPATTAZIONE dello snapshot"""
+        try:
+            return self.percorso_delta.stat().st_size > SOGLIA_COMPATTAZIONE * self.percorso.stat().st_size
+        except FileNotFoundError:
+            return False
+
+    def compatta(self, id_validi: Optional[Set[int]] = None) -> int:
+        """Riscrive snapshot + delta come un solo snapshot.
+
+        Con id_validi (riconciliazione) vengono scartati i partner eliminati o
+        usciti dal filtro, di cui i delta non portano traccia.
+        """
+        conteggio, _, _, comune, _ = self._intestazione()
+        cittadini = [
+            c for c in self.leggi()
+            if id_validi is None or c.get('odoo_id') is None or c['odoo_id'] in id_validi
+        ]
+        # Niente da scartare e nessun delta: lo snapshot resta com'è
+        if len(cittadini) == conteggio and not self.percorso_delta.exists():
+            return conteggio
+        return self.scrivi(cittadini, comune)
+
+    # ===== LETTURA =====
+
+    def _intestazione(self) -> Tuple[int, int, float, str, int]:
+        """(numero record, crc32, timestamp, comune, offset dati) dello snapshot"""
+        try:
+            with open(self.percorso, 'rb') as f:
+                dati = f.read(INTESTAZIONE.size)
+                if len(dati) < INTESTAZIONE.size:
+                    raise SnapshotNonValido('intestazione troncata')
+                magic, versione, _, conteggio, crc, identificativo, lunghezza = INTESTAZIONE.unpack(dati)
+                if magic != MAGIC_SNAPSHOT or versione != VERSIONE_FORMATO:
+                    raise SnapshotNonValido(f'formato non supportato ({magic!r} v{versione})')
+                comune = f.read(lunghezza).decode('utf-8')
+        except FileNotFoundError:
+            raise SnapshotNonValido('snapshot assente')
+        return conteggio, crc, identificativo, comune, INTESTAZIONE.size + lunghezza
+
+    def _leggi_snapshot(self, offset: int, conteggio: int, crc_atteso: int) -> Iterator[Tuple]:
+        """Righe dello snapshot decompresse a blocchi; checksum verificato alla fine"""
+        decompressore = zlib.decompressobj()
+        crc = 0
+        letti = 0
+        resto = b''
+        with open(self.percorso, 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(LETTURA_CHUNK)
+                try:
+                    dati = decompressore.decompress(chunk) if chunk else decompressore.flush()
+                    crc = zlib.crc32(dati, crc)
+                    # Decodifica per blocco di righe intere (un carattere UTF-8 può stare a cavallo)
+                    blocco, _, resto = (resto + dati).rpartition(b'\n')
+                    righe = [_record(riga) for riga in blocco.decode('utf-8').split('\n')] if blocco else []
+                except (zlib.error, ValueError) as e:
+                    raise SnapshotNonValido(f'snapshot corrotto: {e}')
+                for riga in righe:
+                    letti += 1
+                    yield riga
+                if not chunk:
+                    break
+        if resto or letti != conteggio or crc != crc_atteso:
+            raise SnapshotNonValido(f'snapshot corrotto ({letti}/{conteggio} record, checksum diverso)')
+
+    def _blocchi(self, percorso: Path) -> Iterator[Tuple[float, bytes, int]]:
+        """(timestamp dello snapshot, contenuto, fine del blocco) dei blocchi integri di un file delta.
+
+        Si ferma al primo blocco troncato o con checksum errato: spegnimento
+        durante un'aggiunta, che _accoda_blocco tronca prima di scrivere.
+        """
+        try:
+            f = open(percorso, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            while True:
+                dati = f.read(BLOCCO.size)
+                if not dati:
+                    return
+                if len(dati) < BLOCCO.size:
+                    break
+                magic, snapshot, _, crc, lunghezza = BLOCCO.unpack(dati)
+                compresso = f.read(lunghezza)
+                if magic != MAGIC_DELTA or len(compresso) < lunghezza:
+                    break
+                try:
+                    contenuto = zlib.decompress(compresso)
+                except zlib.error:
+                    break
+                if zlib.crc32(contenuto) != crc:
+                    break
+                yield snapshot, contenuto, f.tell()
+        logger.warning(f"⚠️ {percorso.name} incompleto: blocchi successivi ignorati")
+
+    def _leggi_delta(self, identificativo: float) -> Dict[str, Tuple]:
+        """Ultima versione di ogni partner nei delta dello snapshot indicato"""
+        ultimi = {}
+        for snapshot, contenuto, _ in self._blocchi(self.percorso_delta):
+            if snapshot != identificativo:
+                continue
+            for riga in contenuto.decode('utf-8').splitlines():
+                record = _record(riga)
+                ultimi[record[0]] = record
+        return ultimi
+
+    def leggi(self) -> Iterator[Dict]:
+        """Cittadini attivi dello snapshot con i delta applicati, man mano che vengono decompressi.
+
+        Raises:
+            SnapshotNonValido: snapshot assente o corrotto (anche a lettura avviata)
+        """
+        conteggio, crc, identificativo, _, offset = self._intestazione()
+        delta = self._leggi_delta(identificativo)
+        nota = f"Sync Odoo {datetime.fromtimestamp(identificativo).strftime('%Y-%m-%d')}"
+
+        def cittadino(record: Tuple) -> Dict:
+            cf, nome, attivo, odoo_id = record
+            return {
+                'codice_fiscale': cf,
+                'nome': nome,
+                'note': nota,
+                'attivo': attivo,
+                'odoo_id': odoo_id,
+                'creato_da': 'ODOO_SYNC',
+                'modificato_da': 'ODOO_SYNC'
+            }
+
+        for record in self._leggi_snapshot(offset, conteggio, crc):
+            record = delta.pop(record[0], record)
+            if record[2]:
+                yield cittadino(record)
+        # Partner comparsi dopo lo snapshot
+        for record in delta.values():
+            if record[2]:
+                yield cittadino(record)
+
+    def info(self) -> Dict:
+        """Stato della cache per diagnostica"""
+        try:
+            conteggio, _, identificativo, comune, _ = self._intestazione()
+        except SnapshotNonValido as e:
+            return {'exists': False, 'errore': str(e), 'size': 0}
+        dimensione_delta = self.percorso_delta.stat().st_size if self.percorso_delta.exists() else 0
+        return {
+            'exists': True,
+            'comune': comune,
+            'count': conteggio,
+            'timestamp': datetime.fromtimestamp(identificativo).isoformat(),
+            'size': self.percorso.stat().st_size + dimensione_delta,
+            'delta_size': dimensione_delta
+        }
@@ -0,0 +1,249 @@
+# File: /opt/access_control/src/external/sync_worker.py
+# Worker di sincronizzazione Odoo: coda di job eseguiti uno alla volta in background
+
+import queue
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVALLO = 12 * 3600
+# Job conclusi consultabili (stato e avanzamento) dopo la fine
+STORICO_JOB = 20
+
+STATI_FINALI = ('completato', 'fallito', 'interrotto')
+
+_STOP = object()
+
+
+class SyncInterrotta(Exception):
+    """Sync fermata fra un batch e l'altro per l'arresto del worker"""
+
+
+class OdooSyncWorker:
+    """Unico esecutore delle sincronizzazioni Odoo del processo.
+
+    Avvio, sync periodica e richieste dalla dashboard accodano un job invece
+    di sincronizzare nel proprio thread: nessun chiamante attende Odoo, e il
+    lettore tessere lavora subito sui dati locali. I job vengono eseguiti in
+    ordine, uno alla volta; una richiesta mentre un altro job è già in coda
+    restituisce quello (al più una sync in attesa dietro quella in corso).
+    Senza richieste per intervallo secondi il worker accoda una sync
+    automatica.
+
+    L'avanzamento arriva dal connettore a ogni batch (progresso) e viene
+    pubblicato sul job: attendi() lo restituisce appena cambia, per gli
+    endpoint in streaming. La ripresa di una sync interrotta (arresto, Odoo
+    caduto a metà) è compito del connettore, che salva un checkpoint per
+    batch: il job successivo riparte da lì. al_termine, se indicato, riceve
+    ogni job concluso (statistiche e log di sicurezza del chiamante).
+    """
+
+    def __init__(self, connector, database_manager, intervallo: float = DEFAULT_INTERVALLO,
+                 al_termine: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.connector = connector
+        self.database = database_manager
+        self.intervallo = intervallo
+        self.al_termine = al_termine
+
+        self._jobs_queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._stop_event = threading.Event()
+        # Protegge i job; notificata a ogni cambiamento di stato o avanzamento
+        self._cambiato = threading.Condition()
+        self._jobs: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._ultimo_id = 0
+
+        self.stats = {'completati': 0, 'falliti': 0, 'interrotti': 0, 'ultimo_successo': None}
+
+    # ===== WORKER =====
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                job = self._jobs_queue.get(timeout=self.intervallo)
+            except queue.Empty:
+                self.submit('automatica')
+                continue
+            if job is _STOP:
+                break
+            self._esegui(job)
+
+        # Arresto: i job rimasti in coda non partono
+        while True:
+            try:
+                job = self._jobs_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not _STOP:
+                self._aggiorna(job, stato='interrotto', terminato=datetime.now().isoformat())
+
+    def _esegui(self, job: Dict[str, Any]):
+        """Esegue un job di sync; errori ed esito finiscono sul job"""
+        start = time.time()
+        self._aggiorna(job, stato='in_corso', avviato=datetime.now().isoformat())
+        logger.info(f"🔄 Sync Odoo #{job['id']} avviata ({job['motivo']})")
+
+        def progresso(avanzamento: Dict[str, Any]):
+            if self._stop_event.is_set():
+                raise SyncInterrotta("worker in arresto")
+            self._aggiorna(job, avanzamento=avanzamento)
+
+        try:
+            successo, risultato = self.connector.sync_to_database(self.database, progresso=progresso)
+            errore = None
+        except Exception as e:
+            successo, risultato, errore = False, {}, str(e)
+
+        if self._stop_event.is_set() and not successo:
+            stato = 'interrotto'
+            self.stats['interrotti'] += 1
+        elif successo:
+            stato = 'completato'
+            self.stats['completati'] += 1
+            self.stats['ultimo_successo'] = datetime.now().isoformat()
+        else:
+            stato = 'fallito'
+            self.stats['falliti'] += 1
+
+        durata = time.time() - start
+        self._aggiorna(job, stato=stato, terminato=datetime.now().isoformat(), durata=round(durata, 2),
+                       risultato=risultato, errore=errore)
+        if successo:
+            logger.info(f"✅ Sync Odoo #{job['id']} completata in {durata:.2f}s")
+        else:
+            logger.warning(f"⚠️ Sync Odoo #{job['id']} {stato} dopo {durata:.2f}s"
+                           f"{f': {errore}' if errore else ''}")
+
+        if self.al_termine:
+            try:
+                self.al_termine(self.job(job['id']))
+            except Exception as e:
+                logger.error(f"❌ Errore notifica fine sync: {e}")
+
+    def _aggiorna(self, job: Dict[str, Any], avanzamento: Dict[str, Any] = None, **campi):
+        """Modifica il job e sveglia chi ne attende l'avanzamento"""
+        with self._cambiato:
+            if avanzamento:
+                job['avanzamento'].update(avanzamento)
+            job.update(campi)
+            job['versione'] += 1
+            self._cambiato.notify_all()
+
+    # ===== API =====
+
+    def start(self):
+        """Avvia il worker (nessuna sync finché non ne viene accodata una)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='odoo-sync', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info(f"🔄 Worker sync Odoo avviato (sync automatica ogni {self.intervallo / 3600:g} ore)")
+
+    def submit(self, motivo: str = 'manuale') -> Dict[str, Any]:
+        """Accoda una sync e restituisce subito il job (quello già in coda, se c'è)"""
+        with self._cambiato:
+            for job in reversed(self._jobs.values()):
+                if job['stato'] == 'in_coda':
+                    return self._copia(job)
+
+            self._ultimo_id += 1
+            job = {
+                'id': self._ultimo_id,
+                'motivo': motivo,
+                'stato': 'in_coda',
+                'accodato': datetime.now().isoformat(),
+                'avviato': None,
+                'terminato': None,
+                'durata': None,
+                'avanzamento': {'fase': 'in_coda', 'letti': 0, 'totale': None, 'batch': 0},
+                'risultato': None,
+                'errore': None,
+                'versione': 0
+            }
+            self._jobs[job['id']] = job
+            # Storico limitato: via i job conclusi più vecchi
+            while len(self._jobs) > STORICO_JOB:
+                primo = next(iter(self._jobs.values()))
+                if primo['stato'] not in STATI_FINALI:
+                    break
+                self._jobs.popitem(last=False)
+
+            if self._stop_event.is_set():
+                job['stato'] = 'interrotto'
+            else:
+                self._jobs_queue.put(job)
+            return self._copia(job)
+
+    def job(self, job_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Copia del job indicato (l'ultimo accodato se None)"""
+        with self._cambiato:
+            if job_id is None:
+                job = next(reversed(self._jobs.values()), None)
+            else:
+                job = self._jobs.get(job_id)
+            return self._copia(job) if job else None
+
+    @staticmethod
+    def _copia(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Copia del job da restituire fuori dal lock"""
+        return {**job, 'avanzamento': dict(job['avanzamento'])}
+
+    def attendi(self, job_id: int, versione: int = -1, timeout: float = 15.0) -> Optional[Dict[str, Any]]:
+        """Il job appena la sua versione supera quella indicata (o allo scadere del timeout)"""
+        with self._cambiato:
+            self._cambiato.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['versione'] > versione
+                or self._jobs[job_id]['stato'] in STATI_FINALI,
+                timeout
+            )
+        return self.job(job_id)
+
+    def stop(self, timeout: float = 10.0):
+        """Ferma il worker: la sync in corso si interrompe al batch successivo e riprenderà dal checkpoint"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._jobs_queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info("🛑 Worker sync Odoo fermato")
+
+    def get_status(self) -> Dict[str, Any]:
+        """Stato worker per diagnostica"""
+        return {
+            'attivo': bool(self._thread and self._thread.is_alive()),
+            'in_coda': self._jobs_queue.qsize(),
+            'intervallo': self.intervallo,
+            'ultimo_job': self.job(),
+            **self.stats
+        }
+
+
+# Singleton per processo
+_sync_worker = None
+_sync_worker_lock = threading.Lock()
+
+
+def get_sync_worker(connector=None, database_manager=None, intervallo: float = DEFAULT_INTERVALLO,
+                    al_termine: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[OdooSyncWorker]:
+    """Restituisce il worker sync del processo (già avviato).
+
+    Il primo chiamante lo crea passando connettore e database; None se non
+    ancora configurato.
+    """
+    global _sync_worker
+    if _sync_worker is None and connector is not None:
+        with _sync_worker_lock:
+            if _sync_worker is None:
+                worker = OdooSyncWorker(connector, database_manager, intervallo, al_termine)
+                worker.start()
+                _sync_worker = worker
+    return _sync_worker
@@ -30,6 +30,7 @@ class CardReader:
         
         # Cache per evitare letture duplicate
         self.last_read_time = 0
+        self.last_read_duration = None  # secondi da tessera rilevata a CF letto
         self.duplicate_threshold = 1.0  # Secondi
         
         self.init_readers()
@@ -126,6 +127,7 @@ class CardReader:
                 
                 if not cardservice:
                     return None
+                card_detected = time.perf_counter()
                 
                 # Connetti con retry
                 connection_success = False
@@ -161,6 +163,7 @@ class CardReader:
                     pass
                 
                 if cf:
+                    self.last_read_duration = time.perf_counter() - card_detected
                     return cf
                 
                 # Se non ha letto CF, retry
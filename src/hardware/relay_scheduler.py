@@ -0,0 +1,194 @@
+# File: /opt/access_control/src/hardware/relay_scheduler.py
+# Scheduler unico (heap) per le azioni relè temporizzate
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledAction:
+    """Azione programmata; cancel() la annulla se non ancora eseguita"""
+
+    __slots__ = ('quando', 'seq', 'canale', 'descrizione', 'azione', 'annullata')
+
+    def __init__(self, quando: float, seq: int, canale: Optional[str],
+                 descrizione: str, azione: Callable[[], None]):
+        self.quando = quando
+        self.seq = seq
+        self.canale = canale
+        self.descrizione = descrizione
+        self.azione = azione
+        self.annullata = False
+
+    def __lt__(self, other: 'ScheduledAction') -> bool:
+        return (self.quando, self.seq) < (other.quando, other.seq)
+
+    def cancel(self):
+        self.annullata = True
+
+
+class RelayScheduler:
+    """Un solo thread esegue tutte le azioni relè temporizzate.
+
+    Sostituisce i threading.Timer e i thread con sleep creati per ogni impulso
+    (auto-spegnimento, beep di accesso negato, riblocco del cancello, azioni di
+    relay_config): le azioni stanno in un heap ordinato per scadenza e il thread
+    dorme fino alla prossima. Ogni azione può appartenere a un canale: con
+    sostituisci=True una nuova azione annulla quelle ancora in attesa sullo
+    stesso canale, così una seconda tessera ridefinisce i tempi della prima.
+    """
+
+    def __init__(self):
+        self._heap: List[ScheduledAction] = []
+        self._per_canale: Dict[str, List[ScheduledAction]] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.stats = {'programmate': 0, 'eseguite': 0, 'annullate': 0, 'errori': 0}
+
+    # ===== PROGRAMMAZIONE =====
+
+    def schedule(self, delay: float, azione: Callable[[], None], canale: str = None,
+                 descrizione: str = None, sostituisci: bool = True) -> ScheduledAction:
+        """Esegue azione tra delay secondi nel thread dello scheduler"""
+        with self._cond:
+            if canale is not None and sostituisci:
+                self._cancel_locked(canale)
+            evento = ScheduledAction(time.monotonic() + max(0.0, delay), next(self._seq),
+                                     canale, descrizione or getattr(azione, '__name__', 'azione'), azione)
+            heapq.heappush(self._heap, evento)
+            if canale is not None:
+                self._per_canale.setdefault(canale, []).append(evento)
+            self.stats['programmate'] += 1
+            # Risveglia il thread solo se la nuova azione è la prossima
+            if self._heap[0] is evento:
+                self._cond.notify()
+        self._ensure_thread()
+        logger.debug(f"⏰ Programmato '{evento.descrizione}' tra {delay:.2f}s")
+        return evento
+
+    def _cancel_locked(self, canale: str) -> int:
+        eventi = self._per_canale.pop(canale, [])
+        annullati = 0
+        for evento in eventi:
+            if not evento.annullata:
+                evento.annullata = True
+                annullati += 1
+        self.stats['annullate'] += annullati
+        return annullati
+
+    def cancel(self, canale: str) -> int:
+        """Annulla le azioni in attesa sul canale"""
+        with self._cond:
+            return self._cancel_locked(canale)
+
+    def cancel_prefix(self, prefisso: str) -> int:
+        """Annulla le azioni di tutti i canali che iniziano con prefisso"""
+        with self._cond:
+            return sum(self._cancel_locked(c) for c in list(self._per_canale) if c.startswith(prefisso))
+
+    def cancel_all(self) -> int:
+        with self._cond:
+            return sum(self._cancel_locked(c) for c in list(self._per_canale))
+
+    # ===== ESECUZIONE =====
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='relay-scheduler', daemon=True)
+            self._thread.start()
+
+    def _next_due(self) -> Optional[ScheduledAction]:
+        """Attende ed estrae la prossima azione scaduta (None all'arresto)"""
+        with self._cond:
+            while self._running:
+                while self._heap and self._heap[0].annullata:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                attesa = self._heap[0].quando - time.monotonic()
+                if attesa > 0:
+                    self._cond.wait(attesa)
+                    continue
+                evento = heapq.heappop(self._heap)
+                if evento.canale is not None:
+                    eventi = self._per_canale.get(evento.canale)
+                    if eventi is not None:
+                        eventi[:] = [e for e in eventi if e is not evento]
+                        if not eventi:
+                            del self._per_canale[evento.canale]
+                return evento
+        return None
+
+    def _run(self):
+        while True:
+            evento = self._next_due()
+            if evento is None:
+                return
+            try:
+                evento.azione()
+                self.stats['eseguite'] += 1
+            except Exception as e:
+                self.stats['errori'] += 1
+                logger.error(f"❌ Errore azione relè programmata '{evento.descrizione}': {e}")
+
+    def stop(self):
+        """Ferma il thread scartando le azioni in attesa"""
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._per_canale.clear()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    # ===== DIAGNOSTICA =====
+
+    def pending(self) -> List[Dict]:
+        """Azioni in attesa, in ordine di scadenza"""
+        now = time.monotonic()
+        with self._cond:
+            eventi = sorted(e for e in self._heap if not e.annullata)
+        return [
+            {
+                'canale': e.canale,
+                'descrizione': e.descrizione,
+                'tra_secondi': round(max(0.0, e.quando - now), 3)
+            }
+            for e in eventi
+        ]
+
+    def get_status(self) -> Dict:
+        return {
+            'attivo': bool(self._thread and self._thread.is_alive()),
+            'in_attesa': self.pending(),
+            **self.stats
+        }
+
+
+# Singleton per processo
+_relay_scheduler = None
+_relay_scheduler_lock = threading.Lock()
+
+
+def get_relay_scheduler() -> RelayScheduler:
+    """Restituisce lo scheduler relè del processo"""
+    global _relay_scheduler
+    if _relay_scheduler is None:
+        with _relay_scheduler_lock:
+            if _relay_scheduler is None:
+                _relay_scheduler = RelayScheduler()
+    return _relay_scheduler
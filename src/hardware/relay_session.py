@@ -0,0 +1,313 @@
+# File: /opt/access_control/src/hardware/relay_session.py
+# Sessione USB-RLY08 persistente per processo con riconnessione automatica
+
+import queue
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from hardware.usb_rly08_controller import USBRLY08Controller, RelayChannel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEVICE_PATH = "/dev/ttyACM0"
+
+_STOP = object()
+
+
+class RelaySessionError(Exception):
+    """Comando non eseguito: modulo non connesso o sessione chiusa"""
+
+
+class RelaySession:
+    """Proprietaria unica della porta seriale USB-RLY08 nel processo.
+
+    La connessione (0.5s di stabilizzazione, handshake versione, tutti i relè
+    spenti) viene aperta una volta sola e riutilizzata da tutte le letture e
+    dagli endpoint di test. I comandi passano da una coda e sono eseguiti in
+    ordine da un unico worker: le modifiche ai relè già in coda vengono unite
+    e scritte con un solo comando 92 (byte di stato). Nei momenti di inattività il worker verifica il
+    modulo con health_check. Se la porta cade, la connessione viene riaperta
+    con backoff esponenziale: nel frattempo i comandi falliscono subito invece
+    di bloccare la lettura tessera.
+    """
+
+    def __init__(self, device_path: str = DEFAULT_DEVICE_PATH, health_interval: float = 30.0,
+                 backoff_min: float = 0.5, backoff_max: float = 30.0):
+        self.controller = USBRLY08Controller(device_path=device_path)
+        self.health_interval = health_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self._commands: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._backoff = backoff_min
+        self._next_attempt = 0.0
+
+        self.stats = {'comandi': 0, 'falliti': 0, 'connessioni': 0, 'cadute': 0}
+
+    # ===== CONNESSIONE =====
+
+    @property
+    def is_connected(self) -> bool:
+        return self.controller.is_connected
+
+    def _connect(self) -> bool:
+        """Apre la connessione se non attiva, rispettando il backoff"""
+        if self.controller.is_connected:
+            return True
+        now = time.monotonic()
+        if now < self._next_attempt:
+            return False
+        if self.controller.connect():
+            self.stats['connessioni'] += 1
+            self._backoff = self.backoff_min
+            self._next_attempt = 0.0
+            return True
+        self._next_attempt = now + self._backoff
+        logger.warning(f"⚠️ USB-RLY08 non disponibile, nuovo tentativo tra {self._backoff:.1f}s")
+        self._backoff = min(self._backoff * 2, self.backoff_max)
+        return False
+
+    def _drop(self):
+        """Chiude la porta dopo un errore senza inviare comandi"""
+        controller = self.controller
+        with controller._lock:
+            if controller.serial_connection is not None:
+                try:
+                    controller.serial_connection.close()
+                except Exception:
+                    pass
+            controller.serial_connection = None
+            controller.is_connected = False
+        self.stats['cadute'] += 1
+        logger.error("❌ Connessione USB-RLY08 persa, riconnessione in corso")
+
+    def _health_check(self):
+        if not self.controller.is_connected:
+            self._connect()
+        elif not self.controller.health_check():
+            self._drop()
+            self._connect()
+
+    # ===== WORKER =====
+
+    def _execute(self, gruppo: List[Tuple]):
+        """Esegue un gruppo di operazioni; le modifiche ai relè escono in una scrittura"""
+        attivi = [(fn, future) for fn, future, _ in gruppo if future.set_running_or_notify_cancel()]
+        if not attivi:
+            return
+        errore = RelaySessionError("USB-RLY08 disconnesso durante il comando")
+        # Un solo nuovo tentativo se la porta cade durante il comando
+        for tentativo in range(2):
+            if not self._connect():
+                errore = RelaySessionError("USB-RLY08 non connesso")
+                break
+            risultati = []
+            try:
+                with self.controller.batch():
+                    for fn, future in attivi:
+                        try:
+                            risultati.append((future, fn(self.controller), None))
+                        except Exception as e:
+                            risultati.append((future, None, e))
+            except Exception as e:
+                errore = e
+                break
+            if self.controller.is_connected:
+                for future, result, exc in risultati:
+                    if exc is None:
+                        self.stats['comandi'] += 1
+                        future.set_result(result)
+                    else:
+                        self.stats['falliti'] += 1
+                        future.set_exception(exc)
+                return
+            self._drop()
+        self.stats['falliti'] += len(attivi)
+        for _, future in attivi:
+            future.set_exception(errore)
+
+    def _run(self):
+        rinviato = None
+        while True:
+            if rinviato is not None:
+                item, rinviato = rinviato, None
+            else:
+                try:
+                    item = self._commands.get(timeout=self.health_interval)
+                except queue.Empty:
+                    try:
+                        self._health_check()
+                    except Exception as e:
+                        logger.error(f"❌ Errore health check USB-RLY08: {e}")
+                    continue
+            if item is _STOP:
+                break
+            gruppo = [item]
+            if item[2]:
+                # Unisci le modifiche ai relè già in coda (stesso tick)
+                while True:
+                    try:
+                        successivo = self._commands.get_nowait()
+                    except queue.Empty:
+                        break
+                    if successivo is not _STOP and successivo[2]:
+                        gruppo.append(successivo)
+                    else:
+                        rinviato = successivo
+                        break
+            self._execute(gruppo)
+
+        # Arresto: rifiuta i comandi rimasti
+        while True:
+            try:
+                item = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[1].set_exception(RelaySessionError("Sessione USB-RLY08 chiusa"))
+
+    # ===== API =====
+
+    def start(self):
+        """Avvia il worker; la prima connessione avviene al primo comando"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='usb-rly08-session', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, fn: Callable[[USBRLY08Controller], Any], raggruppabile: bool = False) -> Future:
+        """Accoda un'operazione sul controller; non attende l'esecuzione.
+
+        raggruppabile=True per le operazioni che modificano solo relè tramite
+        apply_states: vengono unite alle altre in coda in un'unica scrittura.
+        """
+        future = Future()
+        if self._stop_event.is_set():
+            future.set_exception(RelaySessionError("Sessione USB-RLY08 chiusa"))
+        else:
+            self._commands.put((fn, future, raggruppabile))
+        return future
+
+    def call(self, fn: Callable[[USBRLY08Controller], Any], default: Any = None,
+             timeout: float = 5.0) -> Any:
+        """Esegue un'operazione e ne attende il risultato (default se fallisce)"""
+        try:
+            return self.submit(fn).result(timeout)
+        except Exception as e:
+            logger.warning(f"⚠️ Comando USB-RLY08 non eseguito: {e}")
+            return default
+
+    def ensure_connected(self, timeout: float = 5.0) -> bool:
+        """Attende che il modulo sia connesso (o che il tentativo fallisca)"""
+        return bool(self.call(lambda c: c.is_connected, default=False, timeout=timeout))
+
+    def send_command(self, command: int) -> Future:
+        return self.submit(lambda c: c._send_command(command))
+
+    def relay_on(self, relay_num: int, durata: float = None) -> Future:
+        """Accende il relè; con durata lo spegnimento è programmato sullo scheduler"""
+        return self.apply_relays({relay_num: durata})
+
+    def relay_off(self, relay_num: int) -> Future:
+        return self.submit(lambda c: c.apply_states({RelayChannel(relay_num): False}, auto_off=False),
+                           raggruppabile=True)
+
+    def apply_relays(self, accensioni: Dict[int, Optional[float]], verify: bool = False) -> Future:
+        """Accende più relè con una sola scrittura.
+
+        accensioni: {numero_relè: durata in secondi, None per restare acceso}.
+        Gli spegnimenti sostituiscono quelli in attesa sugli stessi relè e, se
+        scadono insieme, escono con un'unica scrittura (vedi stage()).
+        """
+        states = {RelayChannel(relay_num): True for relay_num in accensioni}
+
+        def accendi(c: USBRLY08Controller) -> bool:
+            esito = c.apply_states(states, auto_off=False, verify=verify)
+            # Spegnimenti programmati solo dopo l'accensione: con la coda lenta
+            # l'OFF non può arrivare prima dell'ON e lasciare il relè acceso.
+            # In un batch lo stage() dell'OFF attende il lock fino alla scrittura
+            for relay_num, durata in accensioni.items():
+                channel = RelayChannel(relay_num)
+                canale = c._channel_key(channel)
+                if durata:
+                    c.scheduler.schedule(durata, lambda channel=channel: c.stage(channel, False),
+                                         canale=canale, descrizione=f"Relè {relay_num} OFF")
+                else:
+                    # Acceso senza scadenza: annulla uno spegnimento precedente
+                    c.scheduler.cancel(canale)
+            return esito
+
+        return self.submit(accendi, raggruppabile=True)
+
+    def access_granted(self) -> Future:
+        return self.submit(lambda c: c.access_granted(), raggruppabile=True)
+
+    def access_denied(self) -> Future:
+        return self.submit(lambda c: c.access_denied(), raggruppabile=True)
+
+    def open_gate(self, duration: float = 5.0) -> Future:
+        return self.submit(lambda c: c.open_gate(duration), raggruppabile=True)
+
+    def processing(self, active: bool) -> Future:
+        return self.submit(lambda c: c.processing(active), raggruppabile=True)
+
+    def set_area_lighting(self, state: bool) -> Future:
+        return self.submit(lambda c: c.set_area_lighting(state), raggruppabile=True)
+
+    def emergency_stop(self) -> Future:
+        return self.submit(lambda c: c.emergency_stop())
+
+    def get_relay_states(self) -> Dict[str, bool]:
+        return self.call(lambda c: c.get_relay_states(), default={})
+
+    def health_check(self) -> bool:
+        return bool(self.call(lambda c: c.health_check(), default=False))
+
+    def close(self, timeout: float = 5.0):
+        """Ferma il worker e disconnette (relè spenti)"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._commands.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        self.controller.disconnect()
+
+    # Compatibilità con l'interfaccia di USBRLY08Controller
+    disconnect = close
+
+    def get_status(self) -> Dict:
+        """Stato sessione per diagnostica"""
+        return {
+            'porta': self.controller.port,
+            'connesso': self.controller.is_connected,
+            'in_coda': self._commands.qsize(),
+            'backoff': self._backoff,
+            'azioni_programmate': self.controller.scheduler.pending(),
+            **self.stats
+        }
+
+
+# Singleton per processo
+_relay_session = None
+_relay_session_lock = threading.Lock()
+
+
+def get_relay_session(device_path: str = None) -> RelaySession:
+    """Restituisce la sessione USB-RLY08 del processo (già avviata)"""
+    global _relay_session
+    if _relay_session is None:
+        with _relay_session_lock:
+            if _relay_session is None:
+                session = RelaySession(device_path or DEFAULT_DEVICE_PATH)
+                session.start()
+                _relay_session = session
+    return _relay_session
@@ -5,9 +5,16 @@ import serial
 import time
 import logging
 import threading
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Tuple
 from enum import Enum
 
+# Gestione import sia per esecuzione diretta che come modulo
+try:
+    from .relay_scheduler import get_relay_scheduler
+except ImportError:
+    from relay_scheduler import get_relay_scheduler
+
 logger = logging.getLogger(__name__)
 
 class RelayChannel(Enum):
@@ -32,8 +39,15 @@ class USBRLY08Controller:
         self.is_connected = False
         self.last_state = 0
         
-        # Lock per thread safety
-        self._lock = threading.Lock()
+        # Lock per thread safety (rientrante: batch() lo tiene fino alla scrittura)
+        self._lock = threading.RLock()
+        
+        # Modifiche raccolte da batch() / stage(): {canale: (stato, auto_off)}
+        self._batch: Optional[Dict[RelayChannel, Tuple[bool, bool]]] = None
+        self._batch_verify = False
+        self._staged: Dict[RelayChannel, Tuple[bool, bool]] = {}
+        self.verify_writes = False
+        self.stats = {'scritture': 0, 'verifiche_fallite': 0}
         
         # Configurazione relè
         self.relay_config = {
@@ -45,8 +59,8 @@ class USBRLY08Controller:
             RelayChannel.AREA_LIGHT: {"name": "Illuminazione", "auto_off_delay": None}
         }
         
-        # Timer per auto-spegnimento
-        self.auto_off_timers = {}
+        # Azioni temporizzate (auto-spegnimento, beep, riblocco) sullo scheduler di processo
+        self.scheduler = get_relay_scheduler()
         
         logger.info("🔧 USBRelay08Controller inizializzato")
     
@@ -80,10 +94,10 @@ class USBRLY08Controller:
                     sw_version = response[1]
                     logger.info(f"✅ USB-RLY08 connesso - ID: {module_id}, SW: {sw_version}")
                     
+                    self.is_connected = True
+                    
                     # Spegni tutti i relè all'avvio
                     self._all_relays_off()
-                    
-                    self.is_connected = True
                     return True
                 else:
                     logger.error(f"❌ Risposta modulo inaspettata: {response}")
@@ -106,10 +120,8 @@ class USBRLY08Controller:
                 self.is_connected = False
                 self.serial_connection = None
                 
-                # Cancella timer attivi
-                for timer in self.auto_off_timers.values():
-                    timer.cancel()
-                self.auto_off_timers.clear()
+                # Cancella azioni programmate
+                self.scheduler.cancel_prefix(f"{self.port}:")
                 
                 logger.info("🔌 USB-RLY08 disconnesso")
         except Exception as e:
@@ -117,16 +129,25 @@ class USBRLY08Controller:
     
     def _send_command(self, command: int) -> bool:
         """Invia comando al modulo"""
+        return self._send_bytes(bytes([command]))
+    
+    def _send_bytes(self, data: bytes) -> bool:
+        """Scrive uno o più byte sulla seriale"""
         try:
             if not self.is_connected or not self.serial_connection:
                 logger.warning("⚠️ USB-RLY08 non connesso")
                 return False
             
-            self.serial_connection.write(bytes([command]))
+            self.serial_connection.write(data)
             return True
-            
+
+        except serial.SerialException as e:
+            # Porta persa (cavo scollegato, device riassegnato): va riaperta
+            logger.error(f"❌ Errore invio comando {list(data)}: {e}")
+            self.is_connected = False
+            return False
         except Exception as e:
-            logger.error(f"❌ Errore invio comando {command}: {e}")
+            logger.error(f"❌ Errore invio comando {list(data)}: {e}")
             return False
     
     def _all_relays_off(self):
@@ -135,64 +156,133 @@ class USBRLY08Controller:
         self.last_state = 0
         logger.debug("💡 Tutti i relè spenti")
     
-    def _set_relay_state(self, channel: RelayChannel, state: bool) -> bool:
-        """Imposta stato singolo relè"""
+    # ===== SCRITTURA A MASCHERA DI BIT =====
+    
+    def _read_state(self) -> Optional[int]:
+        """Legge dal modulo il byte di stato dei relè (comando 91)"""
+        if not self._send_command(91):  # 0x5B - Get relay states
+            return None
+        response = self.serial_connection.read(1)
+        return response[0] if len(response) == 1 else None
+    
+    def _write_changes(self, changes: Dict[RelayChannel, Tuple[bool, bool]], verify: bool = False) -> bool:
+        """Applica le modifiche con un'unica scrittura del byte di stato (lock tenuto)"""
+        if not self.is_connected:
+            names = ", ".join(channel.name for channel in changes)
+            logger.warning(f"⚠️ Cannot control {names} - USB-RLY08 not connected")
+            return False
+        
+        new_state = self.last_state
+        for channel, (state, _) in changes.items():
+            bit = 1 << (channel.value - 1)
+            new_state = new_state | bit if state else new_state & ~bit
+        
+        # Comando 92 (0x5C): imposta tutti gli 8 relè dal byte successivo
+        if not self._send_bytes(bytes([92, new_state])):
+            return False
+        self.last_state = new_state
+        self.stats['scritture'] += 1
+        
+        for channel, (state, auto_off) in changes.items():
+            config = self.relay_config.get(channel, {})
+            relay_name = config.get("name", f"Relè {channel.value}")
+            if state:
+                logger.info(f"🔆 {relay_name} ACCESO")
+                # Auto-spegnimento se configurato
+                auto_off_delay = config.get("auto_off_delay")
+                if auto_off and auto_off_delay is not None:
+                    self._schedule_auto_off(channel, auto_off_delay)
+            else:
+                logger.info(f"💡 {relay_name} SPENTO")
+        
+        if verify or self.verify_writes:
+            letto = self._read_state()
+            if letto != new_state:
+                self.stats['verifiche_fallite'] += 1
+                logger.error(f"❌ Stato relè non confermato: atteso {new_state:08b}, letto "
+                             f"{'nessuna risposta' if letto is None else format(letto, '08b')}")
+                if letto is not None:
+                    self.last_state = letto
+                return False
+        return True
+    
+    def apply_states(self, states: Dict[RelayChannel, bool], auto_off: bool = True,
+                     verify: bool = False) -> bool:
+        """Imposta più relè con una sola scrittura (o li aggiunge al batch aperto)"""
         try:
             with self._lock:
-                if not self.is_connected:
-                    logger.warning(f"⚠️ Cannot control {channel.name} - USB-RLY08 not connected")
-                    return False
-                
-                relay_num = channel.value
-                config = self.relay_config.get(channel, {})
-                relay_name = config.get("name", f"Relè {relay_num}")
-                
-                if state:
-                    # Accendi relè (comandi 101-108)
-                    command = 100 + relay_num
-                    self._send_command(command)
-                    
-                    # Aggiorna stato locale
-                    self.last_state |= (1 << (relay_num - 1))
-                    
-                    logger.info(f"🔆 {relay_name} ACCESO")
-                    
-                    # Auto-spegnimento se configurato
-                    auto_off_delay = config.get("auto_off_delay")
-                    if auto_off_delay is not None:
-                        self._schedule_auto_off(channel, auto_off_delay)
-                        
-                else:
-                    # Spegni relè (comandi 111-118)
-                    command = 110 + relay_num
-                    self._send_command(command)
-                    
-                    # Aggiorna stato locale
-                    self.last_state &= ~(1 << (relay_num - 1))
-                    
-                    logger.info(f"💡 {relay_name} SPENTO")
-                    
-                    # Cancella timer auto-off se presente
-                    if channel in self.auto_off_timers:
-                        self.auto_off_timers[channel].cancel()
-                        del self.auto_off_timers[channel]
-                
-                return True
-                
+                changes = {channel: (state, auto_off) for channel, state in states.items()}
+                self._cancel_pending(changes)
+                if self._batch is not None:
+                    self._batch.update(changes)
+                    self._batch_verify = self._batch_verify or verify
+                    return True
+                return self._write_changes(changes, verify)
         except Exception as e:
-            logger.error(f"❌ Errore controllo {channel.name}: {e}")
+            logger.error(f"❌ Errore controllo relè {[c.name for c in states]}: {e}")
             return False
     
+    @contextmanager
+    def batch(self, verify: bool = False):
+        """Raccoglie le modifiche ai relè e le scrive con un solo comando all'uscita"""
+        with self._lock:
+            outer = self._batch is None
+            if outer:
+                self._batch = {}
+            try:
+                yield self
+            finally:
+                if outer:
+                    changes, self._batch = self._batch, None
+                    verify, self._batch_verify = verify or self._batch_verify, False
+                    if changes:
+                        self._write_changes(changes, verify)
+    
+    def stage(self, channel: RelayChannel, state: bool):
+        """Accoda una modifica per il prossimo tick dello scheduler.
+        
+        Le azioni programmate che scadono insieme (auto-off, beep, riblocco)
+        vengono così scritte con un solo comando.
+        """
+        with self._lock:
+            self._staged[channel] = (state, True)
+            self._cancel_pending({channel: (state, True)})
+        # Il flush ha scadenza "adesso": gira dopo le azioni già scadute
+        self.scheduler.schedule(0, self._flush_staged, canale=f"{self.port}:flush",
+                                descrizione="Scrittura stato relè")
+    
+    def _cancel_pending(self, changes: Dict[RelayChannel, Tuple[bool, bool]]):
+        """Annulla auto-off o riattivazione in attesa sui relè che vengono spenti.
+        
+        Va fatto quando la modifica viene richiesta e non quando viene scritta:
+        dentro batch() la scrittura avviene all'uscita, e annullerebbe le azioni
+        programmate nel frattempo (il riblocco di open_gate).
+        """
+        for channel, (state, _) in changes.items():
+            if not state:
+                self.scheduler.cancel(self._channel_key(channel))
+    
+    def _flush_staged(self):
+        with self._lock:
+            changes, self._staged = self._staged, {}
+            if changes:
+                self._write_changes(changes)
+    
+    def _set_relay_state(self, channel: RelayChannel, state: bool) -> bool:
+        """Imposta stato singolo relè"""
+        return self.apply_states({channel: state})
+    
+    def _channel_key(self, channel: RelayChannel, suffix: str = "") -> str:
+        """Canale scheduler del relè (per porta, così più moduli non si annullano)"""
+        return f"{self.port}:{channel.value}{suffix}"
+    
     def _schedule_auto_off(self, channel: RelayChannel, delay: float):
         """Programma spegnimento automatico"""
-        # Cancella timer precedente se esiste
-        if channel in self.auto_off_timers:
-            self.auto_off_timers[channel].cancel()
-        
-        # Programma nuovo timer
-        timer = threading.Timer(delay, lambda: self._set_relay_state(channel, False))
-        timer.start()
-        self.auto_off_timers[channel] = timer
+        # Sostituisce l'eventuale spegnimento già programmato sul canale
+        self.scheduler.schedule(
+            delay, lambda: self.stage(channel, False),
+            canale=self._channel_key(channel), descrizione=f"{channel.name} OFF"
+        )
         
         logger.debug(f"⏰ Auto-off programmato per {channel.name} in {delay}s")
     
@@ -202,53 +292,51 @@ class USBRLY08Controller:
         """Segnala accesso autorizzato"""
         logger.info("✅ ACCESSO AUTORIZZATO")
         
-        # LED Verde ON (auto-off 3s)
-        self._set_relay_state(RelayChannel.LED_GREEN, True)
-        
-        # Buzzer breve (auto-off 500ms)
-        self._set_relay_state(RelayChannel.BUZZER, True)
+        # LED Verde ON (auto-off 3s) + Buzzer breve (auto-off 500ms) in una scrittura
+        self.apply_states({RelayChannel.LED_GREEN: True, RelayChannel.BUZZER: True})
     
     def access_denied(self):
         """Segnala accesso negato"""
         logger.info("❌ ACCESSO NEGATO")
         
-        # LED Rosso ON (auto-off 3s)
-        self._set_relay_state(RelayChannel.LED_RED, True)
+        # LED Rosso ON (auto-off 3s) + primo beep in una scrittura
+        self.apply_states({RelayChannel.LED_RED: True, RelayChannel.BUZZER: True})
         
         # Pattern buzzer: 3 beep
         self._buzzer_pattern_denied()
     
     def _buzzer_pattern_denied(self):
         """Pattern buzzer per accesso negato (3 beep)"""
-        def beep_sequence():
-            for i in range(3):
-                self._set_relay_state(RelayChannel.BUZZER, True)
-                time.sleep(0.2)
-                self._set_relay_state(RelayChannel.BUZZER, False)
-                time.sleep(0.3)
-        
-        # Esegui in thread separato per non bloccare
-        threading.Thread(target=beep_sequence, daemon=True).start()
+        # Sequenza sullo scheduler: un nuovo pattern sostituisce quello in corso
+        canale = self._channel_key(RelayChannel.BUZZER, ":pattern")
+        self.scheduler.cancel(canale)
+        for i in range(3):
+            inizio = i * 0.5
+            if i > 0:  # il primo beep è acceso da access_denied
+                self.scheduler.schedule(inizio, lambda: self.stage(RelayChannel.BUZZER, True),
+                                        canale=canale, descrizione=f"BUZZER beep {i + 1} ON", sostituisci=False)
+            self.scheduler.schedule(inizio + 0.2, lambda: self.stage(RelayChannel.BUZZER, False),
+                                    canale=canale, descrizione=f"BUZZER beep {i + 1} OFF", sostituisci=False)
     
     def open_gate(self, duration: float = 5.0):
         """Apre cancello per durata specificata"""
         logger.info(f"🚪 APERTURA CANCELLO per {duration}s")
         
-        # Disattiva blocco magnetico
-        self._set_relay_state(RelayChannel.MAGNETIC_LOCK, False)
-        
-        # Attiva motore cancello (auto-off dopo duration)
+        # Disattiva blocco magnetico e attiva motore cancello (auto-off dopo
+        # duration) con la stessa scrittura
         config = self.relay_config[RelayChannel.GATE_MOTOR]
         config["auto_off_delay"] = duration
-        self._set_relay_state(RelayChannel.GATE_MOTOR, True)
+        self.apply_states({RelayChannel.MAGNETIC_LOCK: False, RelayChannel.GATE_MOTOR: True})
         
-        # Riattiva blocco dopo apertura + 1s di sicurezza
+        # Riattiva blocco dopo apertura + 1s di sicurezza; una nuova apertura
+        # annulla il riblocco in attesa (vedi _cancel_pending) e lo riprogramma
         def relock():
-            time.sleep(duration + 1.0)
-            self._set_relay_state(RelayChannel.MAGNETIC_LOCK, True)
+            self.stage(RelayChannel.MAGNETIC_LOCK, True)
             logger.info("🔒 Blocco magnetico riattivato")
         
-        threading.Thread(target=relock, daemon=True).start()
+        self.scheduler.schedule(duration + 1.0, relock,
+                                canale=self._channel_key(RelayChannel.MAGNETIC_LOCK),
+                                descrizione="MAGNETIC_LOCK riblocco")
     
     def processing(self, active: bool):
         """Segnala elaborazione in corso"""
@@ -266,10 +354,9 @@ class USBRLY08Controller:
         logger.critical("🚨 EMERGENCY STOP - Spegnimento tutti i relè")
         
         with self._lock:
-            # Cancella tutti i timer
-            for timer in self.auto_off_timers.values():
-                timer.cancel()
-            self.auto_off_timers.clear()
+            # Cancella tutte le azioni programmate
+            self.scheduler.cancel_prefix(f"{self.port}:")
+            self._staged.clear()
             
             # Spegni tutti i relè
             self._all_relays_off()
@@ -288,12 +375,9 @@ class USBRLY08Controller:
                     return {}
                 
                 # Richiedi stato dal modulo
-                self._send_command(91)  # 0x5B - Get relay states
-                time.sleep(0.1)
-                response = self.serial_connection.read(1)
+                current_state = self._read_state()
                 
-                if len(response) == 1:
-                    current_state = response[0]
+                if current_state is not None:
                     self.last_state = current_state
                     
                     # Decodifica stato per ogni canale
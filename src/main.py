@@ -7,7 +7,6 @@ import os
 import time
 import signal
 import logging
-import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -21,8 +20,16 @@ try:
     from card_reader import CardReader
     from database_manager import DatabaseManager
     from odoo_partner_connector import OdooPartnerConnector
-    from usb_rly08_controller import USBRLY08Controller  # NUOVO CONTROLLER REALE
+    from external.sync_worker import get_sync_worker
+    from hardware.relay_session import get_relay_session  # SESSIONE USB-RLY08 PERSISTENTE
     from core.config import get_config_manager
+    from core.access_engine import get_access_engine
+    from core.tap_pipeline import TapPipeline
+    from core.access_schedule import get_schedule_provider
+    from database.monthly_counters import get_monthly_counters
+    from database.log_writer import get_log_writer
+    from database.checkpoint import get_checkpoint_manager
+    from database.log_partitions import get_log_partitions
     from hardware.reader_factory import ReaderFactory
     print("✅ Moduli importati correttamente (incluso USB-RLY08)")
 except ImportError as e:
@@ -30,7 +37,8 @@ except ImportError as e:
 
 # Setup logging ROBUSTO con fallback
 project_root = Path(__file__).parent.parent
-log_dir = project_root / "logs"
+# ACCESS_CONTROL_LOG_DIR per istanze di test/benchmark (come ACCESS_CONTROL_DB)
+log_dir = Path(os.getenv('ACCESS_CONTROL_LOG_DIR', project_root / "logs"))
 
 # Crea directory log se non esiste (con gestione errori)
 try:
@@ -125,7 +133,7 @@ class AccessControlSystem:
     def __init__(self):
         self.running = False
         self.last_sync_time = None
-        self.sync_in_progress = False
+        self.sync_worker = None  # Worker sync Odoo (job in background)
         
         # Statistiche con sicurezza ISOLA RAEE
         self.stats = {
@@ -151,6 +159,8 @@ class AccessControlSystem:
         self.arduino = MockArduino()  # Solo compatibilità
         self.usb_relay_controller = None  # CONTROLLER REALE USB-RLY08
         self.database = None
+        self.access_engine = None
+        self.tap_pipeline = None
         self.odoo_connector = None
         
         # Configurazione Odoo CORRETTA
@@ -254,9 +264,10 @@ class AccessControlSystem:
             else:
                 # Mappatura device_key → porta reale (da implementare se serve)
                 relay_device_path = "/dev/ttyUSB0"
-            self.usb_relay_controller = USBRLY08Controller(device_path=relay_device_path)
+            # Sessione unica per il processo: porta aperta una volta, riconnessione automatica
+            self.usb_relay_controller = get_relay_session(relay_device_path)
             
-            if not self.usb_relay_controller.connect():
+            if not self.usb_relay_controller.ensure_connected():
                 logger.error("❌ USB-RLY08 non connesso")
                 print("⚠️ Impossibile connettersi a USB-RLY08")
                 print("💡 Verifica:")
@@ -270,6 +281,7 @@ class AccessControlSystem:
                     return False
                 
                 print("⚠️ Modalità DEMO attivata - solo mock hardware")
+                self.usb_relay_controller.close()
                 self.usb_relay_controller = None
             else:
                 logger.info("✅ USB-RLY08 Controller inizializzato")
@@ -296,6 +308,15 @@ class AccessControlSystem:
                 logger.error("❌ Database non funzionante")
                 return False
             
+            # Orari compilati e motore decisionale sullo stesso database
+            get_schedule_provider(str(db_path))
+            get_monthly_counters(str(db_path))
+            get_log_writer(str(db_path))
+            get_checkpoint_manager(str(db_path))
+            get_log_partitions(str(db_path))
+            self.access_engine = get_access_engine(str(db_path), terminale_id="RAEE_ISOLA_RENDE_001")
+            self.tap_pipeline = TapPipeline(self.access_engine, self.actuate_access, [self.notify_access])
+            
             logger.info("✅ Database inizializzato")
             
             # Odoo Connector con configurazione CORRETTA
@@ -310,39 +331,16 @@ class AccessControlSystem:
                 sync_interval=self.odoo_config['sync_interval_hours'] * 3600
             )
             
-            # Test connessione
-            success, message = self.odoo_connector.test_connection()
-            if success:
-                logger.info("✅ Connessione Odoo sicura stabilita")
-                security_logger.info(f"ODOO_CONNECTION_SUCCESS - {message}")
-                
-                # SYNC COMPLETA PRIMA DELL'AVVIO
-                print("🔄 Sincronizzazione database ISOLA RAEE...")
-                print("⏳ Attendere completamento sync cittadini Rende...")
-                logger.info("🔄 Esecuzione sync completa OBBLIGATORIA...")
-                
-                sync_success, sync_stats = self.odoo_connector.sync_to_database(self.database)
-                
-                if sync_success:
-                    citizens_added = sync_stats.get('added', 0)
-                    citizens_fetched = sync_stats.get('fetched', 0)
-                    print(f"✅ Sincronizzazione ISOLA RAEE completata!")
-                    print(f"📊 {citizens_fetched} cittadini Rende, {citizens_added} aggiunti")
-                    logger.info(f"✅ Sync iniziale completata: {citizens_added} cittadini")
-                    self.stats['sync_operations'] += 1
-                    self.last_sync_time = datetime.now()
-                else:
-                    print("❌ ERRORE: Sincronizzazione fallita!")
-                    logger.error("❌ Sync iniziale fallita - sistema continuerà con database locale")
-                    print("⚠️ Sistema continuerà con database locale")
-                
-                # Avvia sync automatica periodica
-                self.start_auto_sync()
-                
-            else:
-                logger.warning(f"⚠️ Test Odoo fallito: {message}")
-                security_logger.warning(f"ODOO_CONNECTION_FAILED - {message}")
-                logger.info("🔄 Sistema continuerà con database locale")
+            # Sync in background: il lettore parte subito con il database locale,
+            # una sync interrotta al riavvio riprende dal checkpoint
+            self.sync_worker = get_sync_worker(
+                self.odoo_connector, self.database,
+                intervallo=self.odoo_config['sync_interval_hours'] * 3600,
+                al_termine=self.on_sync_done
+            )
+            job = self.sync_worker.submit('avvio')
+            print(f"🔄 Sincronizzazione cittadini {self.odoo_config['comune']} in background (job #{job['id']})")
+            logger.info("🔄 Sync iniziale accodata - sistema operativo con database locale")
             
             return True
             
@@ -351,60 +349,30 @@ class AccessControlSystem:
             security_logger.error(f"INIT_FAILED - {e}")
             return False
     
-    def start_auto_sync(self):
-        """Avvia sincronizzazione automatica"""
-        def sync_worker():
-            while self.running:
-                try:
-                    sleep_hours = self.odoo_config['sync_interval_hours']
-                    logger.info(f"⏰ Prossima sync automatica in {sleep_hours} ore")
-                    time.sleep(sleep_hours * 3600)
-                    
-                    if self.running:
-                        self.perform_sync()
-                    
-                except Exception as e:
-                    logger.error(f"❌ Errore sync worker: {e}")
-                    time.sleep(3600)
-        
-        sync_thread = threading.Thread(target=sync_worker, daemon=True)
-        sync_thread.start()
-        logger.info("🔄 Auto-sync Odoo avviata")
-    
     def perform_sync(self):
-        """Esegue sincronizzazione sicura"""
-        if self.sync_in_progress:
-            return
-        
-        self.sync_in_progress = True
-        sync_start = datetime.now()
-        
-        try:
-            logger.info("🔄 Inizio sincronizzazione Odoo ISOLA RAEE")
-            security_logger.info("SYNC_START - Odoo synchronization initiated")
-            
-            success, stats = self.odoo_connector.sync_to_database(self.database)
-            
-            if success:
-                self.last_sync_time = datetime.now()
-                self.stats['sync_operations'] += 1
-                
-                duration = (datetime.now() - sync_start).total_seconds()
-                logger.info(f"✅ Sync completata in {duration:.2f}s - Stats: {stats}")
-                
-                security_logger.info(
-                    f"SYNC_SUCCESS - Duration: {duration:.2f}s - "
-                    f"Citizens: {stats['fetched']} - Added: {stats['added']}"
-                )
-            else:
-                self.stats['failed_connections'] += 1
-                logger.warning("⚠️ Sincronizzazione fallita")
-                
-        except Exception as e:
-            logger.error(f"❌ Errore sync: {e}")
-            security_logger.error(f"SYNC_ERROR - {e}")
-        finally:
-            self.sync_in_progress = False
+        """Accoda una sincronizzazione sul worker (non attende l'esecuzione)"""
+        if not self.sync_worker:
+            return None
+        job = self.sync_worker.submit('manuale')
+        security_logger.info(f"SYNC_QUEUED - Odoo synchronization job #{job['id']}")
+        return job
+    
+    def on_sync_done(self, job):
+        """Esito di un job di sync del worker (thread del worker)"""
+        stats = job.get('risultato') or {}
+        if job['stato'] == 'completato':
+            self.last_sync_time = datetime.now()
+            self.stats['sync_operations'] += 1
+            logger.info(f"✅ Sync completata in {job['durata']:.2f}s - Stats: {stats}")
+            security_logger.info(
+                f"SYNC_SUCCESS - Duration: {job['durata']:.2f}s - "
+                f"Citizens: {stats.get('fetched', 0)} - Added: {stats.get('added', 0)}"
+            )
+        elif job['stato'] == 'fallito':
+            self.stats['failed_connections'] += 1
+            logger.warning("⚠️ Sincronizzazione fallita")
+            if job.get('errore'):
+                security_logger.error(f"SYNC_ERROR - {job['errore']}")
     
     def handle_cf(self, codice_fiscale):
         """Gestisce CF ISOLA RAEE con hardware USB-RLY08, debounce e blocco ripetizioni (autorizzati e non)"""
@@ -458,94 +426,17 @@ class AccessControlSystem:
                 print("❌ [MOCK] Accesso bloccato per sicurezza")
             return
         
-        start_time = time.time()
         masked_cf = f"{codice_fiscale[:4]}***{codice_fiscale[-4:]}"
-        
         logger.info(f"🎯 CF ricevuto ISOLA RAEE: {masked_cf}")
         
         # Processing con illuminazione area
         if self.usb_relay_controller:
             self.usb_relay_controller.processing(True)
-        else:
-            print("🟡 [MOCK] Elaborazione in corso...")
-        
-        print(f"\n🟡 ELABORAZIONE ACCESSO ISOLA RAEE...")
-        print(f"🆔 CF: {masked_cf}")
         
         try:
-            # Verifica accesso
-            authorized, user_data = self.database.verify_access(codice_fiscale)
-            
-            # Log accesso RAEE
-            self.log_raee_access(codice_fiscale, authorized, user_data)
-            
-            # Statistiche
-            self.stats['total'] += 1
-            if authorized:
-                self.stats['authorized'] += 1
-                self.stats['raee_sessions'] += 1
-            else:
-                self.stats['denied'] += 1
-            
-            # Log database
-            processing_time = time.time() - start_time
-            self.database.log_access(
-                codice_fiscale=codice_fiscale,
-                authorized=authorized,
-                processing_time=processing_time,
-                user_data=user_data,
-                terminal_id="RAEE_ISOLA_RENDE_001"
-            )
-            
-            # Fine processing
-            if self.usb_relay_controller:
-                self.usb_relay_controller.processing(False)
-            
-            if authorized:
-                # ACCESSO AUTORIZZATO ISOLA RAEE
-                user_name = user_data.get('nome', 'Cittadino') if user_data else 'Cittadino'
-                
-                print(f"\n✅ ACCESSO AUTORIZZATO - ISOLA ECOLOGICA RAEE")
-                print(f"🏘️ Comune: {self.odoo_config['comune']}")
-                print(f"👤 Cittadino: {user_name}")
-                print(f"🆔 CF: {masked_cf}")
-                print(f"📍 Ubicazione: {self.raee_config['location']}")
-                print(f"⏱️ Tempo elaborazione: {processing_time:.2f}s")
-                
-                # Segnalazioni hardware USB-RLY08
-                if self.usb_relay_controller:
-                    self.usb_relay_controller.access_granted()  # LED Verde + Buzzer
-                    gate_duration = self.raee_config['gate_open_duration']
-                    self.usb_relay_controller.open_gate(gate_duration)
-                    print(f"🚪 Cancello aperto per {gate_duration} secondi")
-                else:
-                    print("🟢 [MOCK] LED Verde + Buzzer OK")
-                    print("🚪 [MOCK] Cancello aperto per 8 secondi")
-                
-                print("♻️ Accesso consentito per conferimento RAEE")
-                
-                # Log RAEE specifico
-                raee_logger.info(f"RAEE_ACCESS_GRANTED - User: {user_name} - Gate: {self.raee_config['gate_open_duration']}s")
-                
-            else:
-                # ACCESSO NEGATO
-                print(f"\n❌ ACCESSO NEGATO - ISOLA RAEE")
-                print(f"⚠️ CF non autorizzato: {masked_cf}")
-                print(f"🏘️ Solo cittadini {self.odoo_config['comune']} autorizzati")
-                print("📞 Per informazioni contattare ufficio ambiente")
-                
-                # Segnalazioni hardware USB-RLY08
-                if self.usb_relay_controller:
-                    self.usb_relay_controller.access_denied()  # LED Rosso + Buzzer x3
-                else:
-                    print("🔴 [MOCK] LED Rosso + 3 Buzzer")
-                
-                # Log RAEE negato
-                raee_logger.warning(f"RAEE_ACCESS_DENIED - CF: {masked_cf}")
-            
-            # Statistiche
-            self.print_raee_stats()
-            print("-" * 60)
+            # Decisione e relè subito; log_accessi, audit e statistiche in background
+            durata_lettura = getattr(self.card_reader, 'last_read_duration', None)
+            self.tap_pipeline.process(codice_fiscale, durata_lettura=durata_lettura)
             
         except Exception as e:
             logger.error(f"❌ Errore gestione CF: {e}")
@@ -556,6 +447,69 @@ class AccessControlSystem:
             if self.usb_relay_controller:
                 self.usb_relay_controller.processing(False)
     
+    def actuate_access(self, decision):
+        """Stadio attuazione: segnalazioni e cancello USB-RLY08 appena presa la decisione"""
+        if self.usb_relay_controller:
+            self.usb_relay_controller.processing(False)
+            if decision.authorized:
+                self.usb_relay_controller.access_granted()  # LED Verde + Buzzer
+                self.usb_relay_controller.open_gate(self.raee_config['gate_open_duration'])
+            else:
+                self.usb_relay_controller.access_denied()  # LED Rosso + Buzzer x3
+        elif decision.authorized:
+            print("🟢 [MOCK] LED Verde + Buzzer OK")
+            print("🚪 [MOCK] Cancello aperto per 8 secondi")
+        else:
+            print("🔴 [MOCK] LED Rosso + 3 Buzzer")
+    
+    def notify_access(self, decision, timings):
+        """Stadio notifica: log RAEE, statistiche e console (dopo l'apertura del cancello)"""
+        authorized, user_data = decision.authorized, decision.to_user_data()
+        masked_cf = decision.masked_cf
+        
+        # Log accesso RAEE
+        self.log_raee_access(decision.codice_fiscale, authorized, user_data)
+        
+        # Statistiche
+        self.stats['total'] += 1
+        if authorized:
+            self.stats['authorized'] += 1
+            self.stats['raee_sessions'] += 1
+        else:
+            self.stats['denied'] += 1
+        
+        if authorized:
+            # ACCESSO AUTORIZZATO ISOLA RAEE
+            user_name = user_data.get('nome', 'Cittadino') if user_data else 'Cittadino'
+            
+            print(f"\n✅ ACCESSO AUTORIZZATO - ISOLA ECOLOGICA RAEE")
+            print(f"🏘️ Comune: {self.odoo_config['comune']}")
+            print(f"👤 Cittadino: {user_name}")
+            print(f"🆔 CF: {masked_cf}")
+            print(f"📍 Ubicazione: {self.raee_config['location']}")
+            print(f"⏱️ Tempo al cancello: {timings.fino_al_cancello * 1000:.0f}ms "
+                  f"(decisione {timings.decisione * 1000:.1f}ms, relè {timings.attuazione * 1000:.1f}ms)")
+            if self.usb_relay_controller:
+                print(f"🚪 Cancello aperto per {self.raee_config['gate_open_duration']} secondi")
+            print("♻️ Accesso consentito per conferimento RAEE")
+            
+            # Log RAEE specifico
+            raee_logger.info(f"RAEE_ACCESS_GRANTED - User: {user_name} - Gate: {self.raee_config['gate_open_duration']}s")
+            
+        else:
+            # ACCESSO NEGATO
+            print(f"\n❌ ACCESSO NEGATO - ISOLA RAEE")
+            print(f"⚠️ CF non autorizzato: {masked_cf}")
+            print(f"🏘️ Solo cittadini {self.odoo_config['comune']} autorizzati")
+            print("📞 Per informazioni contattare ufficio ambiente")
+            
+            # Log RAEE negato
+            raee_logger.warning(f"RAEE_ACCESS_DENIED - CF: {masked_cf}")
+        
+        # Statistiche
+        self.print_raee_stats()
+        print("-" * 60)
+    
     def print_raee_stats(self):
         """Stampa statistiche ISOLA RAEE"""
         total = self.stats['total']
@@ -635,9 +589,21 @@ class AccessControlSystem:
             self.usb_relay_controller.emergency_stop()
             self.usb_relay_controller.disconnect()
         
+        # Sync in corso fermata al batch successivo: riprende dal checkpoint al riavvio
+        if self.sync_worker:
+            self.sync_worker.stop()
+        
         if self.odoo_connector:
             self.odoo_connector.disconnect()
         
+        # Completa persistenze/notifiche in corso, poi scrivi i log accessi in coda
+        if self.tap_pipeline:
+            self.tap_pipeline.shutdown()
+        if self.database:
+            get_log_writer(self.database.db_path).stop()
+            get_log_partitions(self.database.db_path).stop()
+            get_checkpoint_manager(self.database.db_path).stop()
+        
         # Statistiche finali
         print(f"\n📊 STATISTICHE FINALI ISOLA RAEE:")
         print(f"   Accessi totali: {self.stats['total']}")